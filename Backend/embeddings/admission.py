@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Admission Control for the Search Service
+
+Search requests may carry a deadline ("deadline_ms", counted from when the
+service reads the request) and a priority ("high", "normal" or "low"). The
+batch queue is bounded (--max_queue) and ordered by priority, then arrival.
+Work that cannot finish in time is refused or dropped instead of being
+computed for a caller that has given up by then:
+
+    queue_full   the queue is full of requests at least as important
+    displaced    a queued request made room for a more important one
+    deadline     the estimated wait already exceeds the request's deadline
+    expired      the deadline ran out while the request was queued
+    abandoned    the caller went away (closed its connection) while queued
+
+Refused requests are answered at once with {"error": ..., "shed": reason,
+"retry_after_ms": ...}, so clients can back off or fail fast.
+"""
+
+import asyncio
+import heapq
+import itertools
+from typing import List, Dict, Any, Optional, Tuple
+
+PRIORITIES = {'high': 0, 'normal': 1, 'low': 2}
+SHED_REASONS = ['queue_full', 'displaced', 'deadline', 'expired', 'abandoned']
+
+
+class Overloaded(Exception):
+    """A request refused or dropped by admission control."""
+
+    def __init__(self, reason: str, message: str, retry_after_ms: Optional[float] = None):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after_ms = retry_after_ms
+
+
+def parse_priority(value: Any) -> int:
+    """Queue rank of a request's "priority" field (lower runs first)."""
+    if value is None:
+        return PRIORITIES['normal']
+    if value not in PRIORITIES:
+        raise ValueError(f"priority must be one of {', '.join(PRIORITIES)}")
+    return PRIORITIES[value]
+
+
+def parse_deadline(deadline_ms: Any, now: float) -> Optional[float]:
+    """Absolute (time.monotonic) deadline of a request's "deadline_ms" field."""
+    if deadline_ms is None:
+        return None
+    try:
+        deadline_ms = float(deadline_ms)
+    except (TypeError, ValueError):
+        raise ValueError("deadline_ms must be a number")
+    if deadline_ms <= 0:
+        raise ValueError("deadline_ms must be positive")
+    return now + deadline_ms / 1000
+
+
+class SharedAdmission:
+    """
+    Priority and deadline of a search shared by coalesced callers.
+
+    The search is queued for the most important of its callers and only
+    dropped once the loosest of their deadlines can no longer be met, so a
+    caller never inherits a stricter caller's refusal. request is the queued
+    search, once there is one.
+    """
+
+    def __init__(self, priority: int, deadline: Optional[float]):
+        self.priority = priority
+        self.deadline = deadline
+        self.request: Any = None
+
+    def join(self, priority: int, deadline: Optional[float]):
+        """Widen the admission for another caller."""
+        self.priority = min(self.priority, priority)
+        if self.deadline is not None:
+            self.deadline = None if deadline is None else max(self.deadline, deadline)
+
+
+class AdmissionQueue:
+    """
+    Bounded priority queue for asyncio.
+
+    Same get/get_nowait/qsize/empty interface as asyncio.Queue; put() never
+    blocks but refuses or displaces when the queue is full.
+    """
+
+    def __init__(self, max_size: int = 0):
+        """
+        Args:
+            max_size: Most requests queued at once; 0 means unbounded
+        """
+        self.max_size = max_size
+        self._heap: List[Tuple[int, int, Any]] = []
+        self._sequence = itertools.count()
+        self._not_empty = asyncio.Event()
+
+    def qsize(self) -> int:
+        return len(self._heap)
+
+    def empty(self) -> bool:
+        return not self._heap
+
+    def ahead_of(self, priority: int) -> int:
+        """Requests that would run before a new one of this priority."""
+        return sum(1 for rank, _, _ in self._heap if rank <= priority)
+
+    def depth_by_priority(self) -> Dict[str, int]:
+        names = {rank: name for name, rank in PRIORITIES.items()}
+        depth = {name: 0 for name in PRIORITIES}
+        for rank, _, _ in self._heap:
+            depth[names[rank]] += 1
+        return depth
+
+    def put(self, item: Any, priority: int) -> Optional[Any]:
+        """
+        Queue an item.
+
+        Returns:
+            The item dropped to make room for this one, if any
+
+        Raises:
+            Overloaded: If the queue is full of items at least as important
+        """
+        displaced = None
+        if self.max_size and len(self._heap) >= self.max_size:
+            # The least important, most recently queued item goes first
+            worst = max(self._heap, key=lambda entry: (entry[0], entry[1]))
+            if worst[0] <= priority:
+                raise Overloaded('queue_full', f"Search queue is full ({self.max_size} requests)")
+            self._heap.remove(worst)
+            heapq.heapify(self._heap)
+            displaced = worst[2]
+        heapq.heappush(self._heap, (priority, next(self._sequence), item))
+        self._not_empty.set()
+        return displaced
+
+    def remove(self, item: Any) -> bool:
+        """Take an item out of the queue; False if it is no longer queued."""
+        for position, entry in enumerate(self._heap):
+            if entry[2] is item:
+                self._heap.pop(position)
+                heapq.heapify(self._heap)
+                return True
+        return False
+
+    def promote(self, item: Any, priority: int) -> bool:
+        """Move a queued item up to a more important priority; False if it is no longer queued."""
+        for position, entry in enumerate(self._heap):
+            if entry[2] is item:
+                if priority < entry[0]:
+                    self._heap[position] = (priority, entry[1], item)
+                    heapq.heapify(self._heap)
+                return True
+        return False
+
+    def get_nowait(self) -> Any:
+        if not self._heap:
+            raise asyncio.QueueEmpty()
+        return heapq.heappop(self._heap)[2]
+
+    async def get(self) -> Any:
+        while not self._heap:
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        return self.get_nowait()
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Answer cache for LLM answer generation.
+
+Answers are stored in a local SQLite database keyed by
+(model, prompt template version, prompt token budget, hash of the chunk
+set, normalized query).
+An optional semantic lookup reuses an answer when a new query's embedding is
+close enough to a cached query's embedding for the same textbook.
+
+Usage:
+    python answer_cache.py --stats
+    python answer_cache.py --clear
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+DEFAULT_CACHE_PATH = Path(__file__).parent / ".answer_cache.sqlite3"
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation."""
+    query = re.sub(r'\s+', ' ', query.strip().lower())
+    return query.rstrip(' ?.!')
+
+
+def hash_chunks(chunks: List[str]) -> str:
+    """Order-independent hash of the chunk texts."""
+    digest = hashlib.sha256()
+    for chunk in sorted(chunk.strip() for chunk in chunks):
+        digest.update(chunk.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def make_key(model: str, prompt_version: int, prompt_budget: int, chunk_hash: str, query: str) -> str:
+    """Exact-match cache key."""
+    raw = f"{model}\0{prompt_version}\0{prompt_budget}\0{chunk_hash}\0{normalize_query(query)}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class AnswerCache:
+    """SQLite-backed answer cache with TTL and size eviction."""
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        ttl: float = 7 * 24 * 3600,
+        max_entries: int = 5000,
+        similarity_threshold: float = 0.95
+    ):
+        """
+        Initialize the answer cache.
+
+        Args:
+            path: SQLite database file
+            ttl: Seconds an answer stays valid
+            max_entries: Entries kept before least recently used ones are evicted
+            similarity_threshold: Minimum cosine similarity for a semantic hit
+        """
+        self.path = Path(path or DEFAULT_CACHE_PATH)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.path), timeout=5)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS answers (
+                key TEXT PRIMARY KEY,
+                textbook TEXT,
+                model TEXT NOT NULL,
+                prompt_version INTEGER NOT NULL,
+                prompt_budget INTEGER,
+                chunk_hash TEXT NOT NULL,
+                query TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                api_used TEXT,
+                embedding BLOB,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(answers)")]
+        if 'prompt_budget' not in columns:
+            # Caches created before the budget was part of the key; their
+            # entries (budget NULL) are never matched again and age out
+            self.conn.execute("ALTER TABLE answers ADD COLUMN prompt_budget INTEGER")
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_answers_textbook ON answers (textbook, prompt_version)"
+        )
+        self.conn.commit()
+
+    @classmethod
+    def from_env(cls) -> Optional['AnswerCache']:
+        """Build a cache from LLM_CACHE_* environment variables, or None if disabled."""
+        if os.getenv('LLM_CACHE', '1') == '0':
+            return None
+        return cls(
+            path=os.getenv('LLM_CACHE_PATH') or None,
+            ttl=float(os.getenv('LLM_CACHE_TTL', str(7 * 24 * 3600))),
+            max_entries=int(os.getenv('LLM_CACHE_MAX_ENTRIES', '5000')),
+            similarity_threshold=float(os.getenv('LLM_CACHE_THRESHOLD', '0.95'))
+        )
+
+    def _touch(self, key: str):
+        self.conn.execute(
+            "UPDATE answers SET last_access = ?, hits = hits + 1 WHERE key = ?",
+            (time.time(), key)
+        )
+        self.conn.commit()
+
+    def get(
+        self,
+        models: List[str],
+        prompt_version: int,
+        prompt_budget: int,
+        chunks: List[str],
+        query: str,
+        textbook: Optional[str] = None,
+        embedding: Optional[np.ndarray] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Look up a cached answer.
+
+        Tries an exact match for each model in order, then (if an embedding
+        is given) the most similar cached query for the same textbook.
+
+        Returns:
+            Dict with answer, api_used, model and match ('exact' or
+            'semantic'), or None on a miss
+        """
+        oldest = time.time() - self.ttl
+        chunk_hash = hash_chunks(chunks)
+
+        for model in models:
+            key = make_key(model, prompt_version, prompt_budget, chunk_hash, query)
+            row = self.conn.execute(
+                "SELECT answer, api_used, model FROM answers WHERE key = ? AND created_at >= ?",
+                (key, oldest)
+            ).fetchone()
+            if row:
+                self._touch(key)
+                return {"answer": row[0], "api_used": row[1], "model": row[2], "match": "exact"}
+
+        if embedding is None or not textbook:
+            return None
+
+        rows = self.conn.execute(
+            "SELECT key, answer, api_used, model, embedding FROM answers "
+            "WHERE textbook = ? AND prompt_version = ? AND prompt_budget = ? AND embedding IS NOT NULL "
+            "AND created_at >= ?",
+            (textbook, prompt_version, prompt_budget, oldest)
+        ).fetchall()
+        rows = [row for row in rows if row[3] in models]
+        if not rows:
+            return None
+
+        matrix = np.vstack([np.frombuffer(row[4], dtype=np.float32) for row in rows])
+        similarities = matrix @ _unit(embedding)
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.similarity_threshold:
+            return None
+
+        key, answer, api_used, model, _ = rows[best]
+        self._touch(key)
+        return {
+            "answer": answer,
+            "api_used": api_used,
+            "model": model,
+            "match": "semantic",
+            "similarity": round(float(similarities[best]), 4)
+        }
+
+    def put(
+        self,
+        model: str,
+        prompt_version: int,
+        prompt_budget: int,
+        chunks: List[str],
+        query: str,
+        answer: str,
+        api_used: str,
+        textbook: Optional[str] = None,
+        embedding: Optional[np.ndarray] = None
+    ):
+        """Store an answer and evict expired or excess entries."""
+        now = time.time()
+        chunk_hash = hash_chunks(chunks)
+        blob = _unit(embedding).tobytes() if embedding is not None else None
+        self.conn.execute(
+            "INSERT OR REPLACE INTO answers "
+            "(key, textbook, model, prompt_version, prompt_budget, chunk_hash, query, answer, api_used, "
+            "embedding, created_at, last_access, hits) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0)",
+            (make_key(model, prompt_version, prompt_budget, chunk_hash, query), textbook, model, prompt_version,
+             prompt_budget, chunk_hash, normalize_query(query), answer, api_used, blob, now, now)
+        )
+        self.evict(now)
+        self.conn.commit()
+
+    def evict(self, now: Optional[float] = None):
+        """Drop expired entries, then least recently used ones over max_entries."""
+        now = now or time.time()
+        self.conn.execute("DELETE FROM answers WHERE created_at < ?", (now - self.ttl,))
+        self.conn.execute(
+            "DELETE FROM answers WHERE key IN ("
+            "SELECT key FROM answers ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        """Entry count, total hits and per-textbook counts."""
+        total, hits = self.conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(hits), 0) FROM answers"
+        ).fetchone()
+        per_textbook = dict(self.conn.execute(
+            "SELECT COALESCE(textbook, 'unknown'), COUNT(*) FROM answers GROUP BY textbook"
+        ).fetchall())
+        return {"entries": total, "hits": hits, "textbooks": per_textbook, "path": str(self.path)}
+
+    def clear(self):
+        """Remove all cached answers."""
+        self.conn.execute("DELETE FROM answers")
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def _unit(vector: np.ndarray) -> np.ndarray:
+    """Flatten to float32 and L2-normalize."""
+    vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or clear the LLM answer cache")
+    parser.add_argument('--path', help='Cache database (default: LLM_CACHE_PATH or .answer_cache.sqlite3)')
+    parser.add_argument('--stats', action='store_true', help='Show cache statistics')
+    parser.add_argument('--clear', action='store_true', help='Remove all cached answers')
+    args = parser.parse_args()
+
+    cache = AnswerCache(path=args.path or os.getenv('LLM_CACHE_PATH') or None)
+    if args.clear:
+        cache.clear()
+    print(json.dumps(cache.stats(), indent=2))
+    cache.close()
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+Ingestion Benchmark for Textbook Chatbot
+
+Runs the ingestion chain (PDF extraction, cleaning, sentence tokenization,
+sliding-window chunking, embedding and FAISS index build) and reports
+per-stage wall time, throughput and peak memory. PDFs go through every
+stage; cleaned .txt files start at tokenization.
+
+With --embed_mode chunk sentence both embedding paths index the same
+chunks and are scored on synthetic queries (sentences taken from chunks,
+see benchmark_search.py). Run it with the model the indices use: the
+recall difference between full-text and pooled vectors depends on the
+encoder.
+
+Usage:
+    python benchmark_ingestion.py
+    python benchmark_ingestion.py --inputs ../pdf_processing/economics.pdf --replicate 4
+    python benchmark_ingestion.py --skip_embed --baseline benchmarks/last_ingest.json
+    python benchmark_ingestion.py --inputs ../pdf_processing/economics_cleaned.txt --embed_mode chunk sentence
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import resource
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+from benchmark_search import build_synthetic_queries, score_retrieval
+from embedding_indexer import load_embedding_model, generate_embeddings, embed_sentence_windows, create_faiss_index
+
+PDF_PROCESSING_DIR = Path(__file__).resolve().parent.parent / "pdf_processing"
+sys.path.insert(0, str(PDF_PROCESSING_DIR))
+
+from chunk_text import (  # noqa: E402
+    ensure_nltk_data, strip_markers, tokenize_sentences_with_locations, create_sliding_window_chunks
+)
+
+DEFAULT_INPUTS = [
+    PDF_PROCESSING_DIR / "economics.pdf",
+    PDF_PROCESSING_DIR / "economics_cleaned.txt",
+    PDF_PROCESSING_DIR / "Intro_to_ml_cleaned.txt",
+    PDF_PROCESSING_DIR / "computer_networks_cleaned.txt"
+]
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+@contextlib.contextmanager
+def stage(stages: List[Dict[str, Any]], name: str, quiet: bool = True):
+    """Time a stage and record its wall time and the peak RSS after it."""
+    record = {"stage": name}
+    output = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output if quiet else sys.stdout):
+        yield record
+    record["seconds"] = round(time.perf_counter() - start, 4)
+    record["peak_rss_mb"] = peak_rss_mb()
+    for key, value in list(record.items()):
+        if key.endswith("_count") and record["seconds"] > 0:
+            unit = key[:-len("_count")]
+            record[f"{unit}_per_sec"] = round(value / record["seconds"], 1)
+    stages.append(record)
+
+
+def count_pdf_pages(pdf_path: str) -> int:
+    """Number of pages in a PDF (not timed)."""
+    import fitz
+    with fitz.open(pdf_path) as doc:
+        return len(doc)
+
+
+def run_pipeline(
+    input_path: Path,
+    replicate: int,
+    window_size: int,
+    step_size: int,
+    method: str,
+    model,
+    batch_size: int,
+    index_type: str,
+    embed_modes: Optional[List[str]] = None,
+    recall_queries: int = 200,
+    ks: Optional[List[int]] = None
+) -> Dict[str, Any]:
+    """
+    Run the ingestion chain on one input.
+
+    Returns:
+        Dict with the input, replicate factor and per-stage records
+    """
+    stages = []
+
+    if input_path.suffix.lower() == '.pdf':
+        from text_extraction import PDFTextExtractor
+        extractor = PDFTextExtractor()
+        pages = count_pdf_pages(str(input_path))
+
+        with stage(stages, "extract") as record:
+            extract = extractor.extract_with_pymupdf if method == 'pymupdf' else extractor.extract_with_pypdf2
+            raw_text = "\n".join(extract(str(input_path)) or "" for _ in range(replicate))
+            record["page_count"] = pages * replicate
+            record["characters"] = len(raw_text)
+        if not raw_text.strip():
+            raise Exception(f"No text extracted from {input_path}")
+
+        with stage(stages, "clean") as record:
+            text = extractor.clean_text(raw_text)
+            record["char_count"] = len(raw_text)
+            record["characters_out"] = len(text)
+    else:
+        with stage(stages, "load") as record:
+            with open(input_path, 'r', encoding='utf-8') as f:
+                text = f.read()
+            text = "\n".join([text] * replicate)
+            record["char_count"] = len(text)
+
+    with stage(stages, "tokenize") as record:
+        text, markers = strip_markers(text)
+        sentences, locations = tokenize_sentences_with_locations(text, markers)
+        record["sentence_count"] = len(sentences)
+
+    with stage(stages, "chunk") as record:
+        chunks = create_sliding_window_chunks(sentences, window_size, step_size, input_path.name, locations)
+        record["chunk_count"] = len(chunks)
+
+    embed_modes = embed_modes or ['chunk']
+    retrieval = None
+    if model is not None and chunks:
+        embeddings = {}
+        for mode in embed_modes:
+            with stage(stages, "embed" if mode == 'chunk' else f"embed_{mode}") as record:
+                if mode == 'chunk':
+                    embeddings[mode] = generate_embeddings(model, chunks, batch_size)
+                    record["encoded_count"] = len(chunks)
+                else:
+                    starts = np.array([c['start_sentence_idx'] for c in chunks], dtype=np.int64)
+                    ends = np.array([c['end_sentence_idx'] for c in chunks], dtype=np.int64)
+                    embeddings[mode] = embed_sentence_windows(model, sentences, starts, ends, batch_size)
+                    record["encoded_count"] = len(sentences)
+                record["embedding_count"] = len(embeddings[mode])
+
+        with stage(stages, "index") as record:
+            index = create_faiss_index(embeddings[embed_modes[0]].copy(), index_type)
+            record["vector_count"] = index.ntotal
+
+        if len(embeddings) > 1:
+            with contextlib.redirect_stdout(io.StringIO()):
+                retrieval = compare_retrieval(model, chunks, embeddings, index_type, recall_queries, ks or [1, 5, 10])
+
+    run = {
+        "input": str(input_path),
+        "replicate": replicate,
+        "total_seconds": round(sum(s["seconds"] for s in stages), 4),
+        "stages": stages
+    }
+    if retrieval:
+        run["retrieval"] = retrieval
+    return run
+
+
+def compare_retrieval(
+    model,
+    chunks: List[Dict[str, Any]],
+    embeddings: Dict[str, np.ndarray],
+    index_type: str,
+    query_count: int,
+    ks: List[int]
+) -> Dict[str, Any]:
+    """
+    recall@k and MRR of each embedding mode on synthetic queries, plus the
+    mean share of top-k results the modes have in common.
+    """
+    metadata = [{"chunk_id": chunk["id"], "text": chunk["text"]} for chunk in chunks]
+    queries = build_synthetic_queries(metadata, query_count)
+    if not queries:
+        return {}
+    query_vectors = np.ascontiguousarray(model.encode([q["query"] for q in queries], batch_size=32), dtype=np.float32)
+    k = max(ks)
+
+    import faiss
+    if index_type == "ip":
+        faiss.normalize_L2(query_vectors)
+
+    result = {"queries": len(queries)}
+    ranked = {}
+    for mode, vectors in embeddings.items():
+        index = create_faiss_index(vectors.copy(), index_type)
+        _, ids = index.search(query_vectors, k)
+        ranked[mode] = [[chunks[i]["id"] for i in row if i >= 0] for row in ids]
+        result[mode] = score_retrieval(queries, ranked[mode], ks)
+
+    modes = list(ranked)
+    if len(modes) == 2:
+        shared = [
+            len(set(a) & set(b)) / k for a, b in zip(ranked[modes[0]], ranked[modes[1]])
+        ]
+        result[f"overlap@{k}"] = round(sum(shared) / len(shared), 4)
+    return result
+
+
+def compare_reports(baseline: Dict[str, Any], current: Dict[str, Any]) -> List[str]:
+    """Per-stage wall time deltas against an earlier run."""
+    previous = {
+        (run["input"], run["replicate"], s["stage"]): s["seconds"]
+        for run in baseline.get("runs", []) for s in run["stages"]
+    }
+    lines = []
+    for run in current.get("runs", []):
+        for s in run["stages"]:
+            old = previous.get((run["input"], run["replicate"], s["stage"]))
+            if old is None:
+                continue
+            change = f" ({(s['seconds'] - old) / old * 100:+.1f}%)" if old else ""
+            lines.append(f"{Path(run['input']).name:<32} {s['stage']:<9} {old:>9.3f}s -> {s['seconds']:.3f}s{change}")
+    return lines
+
+
+def print_run(run: Dict[str, Any]):
+    print(f"📄 {Path(run['input']).name} (x{run['replicate']}): {run['total_seconds']:.2f}s")
+    for s in run["stages"]:
+        rates = ", ".join(f"{v:,} {k.replace('_per_sec', '')}/s" for k, v in s.items() if k.endswith("_per_sec"))
+        print(f"   {s['stage']:<14} {s['seconds']:>8.3f}s  {rates:<32} peak RSS {s['peak_rss_mb']}MB")
+    retrieval = run.get("retrieval")
+    if retrieval:
+        for mode, scores in retrieval.items():
+            if isinstance(scores, dict) and "recall" in scores:
+                recall = ", ".join(f"R{k} {v}" for k, v in scores["recall"].items())
+                print(f"   recall         {mode:<9} {recall}, MRR {scores['mrr']} ({scores['judged_queries']} queries)")
+        overlap = next(((key, value) for key, value in retrieval.items() if key.startswith("overlap@")), None)
+        if overlap:
+            print(f"   {overlap[0]} between modes: {overlap[1]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the PDF-to-index ingestion pipeline",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python benchmark_ingestion.py
+  python benchmark_ingestion.py --inputs ../pdf_processing/economics.pdf --replicate 1 4
+  python benchmark_ingestion.py --skip_embed --baseline benchmarks/ingest_20250101_120000.json
+  python benchmark_ingestion.py --inputs ../pdf_processing/economics_cleaned.txt --embed_mode chunk sentence
+        """
+    )
+
+    parser.add_argument('--inputs', nargs='+', help='PDF or cleaned .txt files (default: bundled economics.pdf and cleaned texts)')
+    parser.add_argument('--replicate', type=int, nargs='+', default=[1],
+                        help='Corpus replication factors to run (default: 1)')
+    parser.add_argument('--method', choices=['pymupdf', 'pypdf2'], default='pymupdf',
+                        help='PDF extraction method (default: pymupdf)')
+    parser.add_argument('--window_size', type=int, default=3, help='Sentences per chunk (default: 3)')
+    parser.add_argument('--step_size', type=int, default=1, help='Sliding window step (default: 1)')
+    parser.add_argument('--skip_embed', action='store_true', help='Stop after chunking')
+    parser.add_argument('--model', default='all-MiniLM-L6-v2', help='Sentence transformer model name')
+    parser.add_argument('--encoder', choices=['torch', 'onnx'], default='torch', help='Encoder backend')
+    parser.add_argument('--onnx_dir', help='Exported ONNX model directory for --encoder onnx')
+    parser.add_argument('--batch_size', type=int, default=32, help='Embedding batch size (default: 32)')
+    parser.add_argument('--index_type', choices=['flat', 'ip'], default='flat', help='FAISS index type (default: flat)')
+    parser.add_argument('--embed_mode', nargs='+', choices=['chunk', 'sentence'], default=['chunk'],
+                        help='Embedding paths to run; two modes also compare recall (default: chunk)')
+    parser.add_argument('--recall_queries', type=int, default=200,
+                        help='Synthetic queries for the mode comparison (default: 200)')
+    parser.add_argument('--output', '-o', help='Result JSON file (default: benchmarks/ingest_<timestamp>.json)')
+    parser.add_argument('--baseline', help='Earlier result JSON to compare against')
+
+    args = parser.parse_args()
+
+    inputs = [Path(p).resolve() for p in args.inputs] if args.inputs else [p for p in DEFAULT_INPUTS if p.exists()]
+    missing = [str(p) for p in inputs if not p.exists()]
+    if missing:
+        print(f"ERROR: Input files not found: {', '.join(missing)}")
+        return 1
+
+    ensure_nltk_data()
+
+    report = {
+        "created_at": datetime.now().isoformat(timespec='seconds'),
+        "config": {
+            "method": args.method,
+            "window_size": args.window_size,
+            "step_size": args.step_size,
+            "model": None if args.skip_embed else args.model,
+            "encoder": None if args.skip_embed else args.encoder,
+            "batch_size": args.batch_size,
+            "index_type": args.index_type,
+            "embed_mode": None if args.skip_embed else args.embed_mode
+        },
+        "runs": []
+    }
+
+    try:
+        model: Optional[Any] = None
+        if not args.skip_embed:
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                model = load_embedding_model(args.model, args.encoder, args.onnx_dir)
+            report["model_load_seconds"] = round(time.perf_counter() - start, 3)
+
+        for replicate in args.replicate:
+            for input_path in inputs:
+                run = run_pipeline(
+                    input_path, replicate, args.window_size, args.step_size,
+                    args.method, model, args.batch_size, args.index_type,
+                    args.embed_mode, args.recall_queries
+                )
+                report["runs"].append(run)
+                print_run(run)
+
+    except Exception as e:
+        print(f"❌ Benchmark failed: {str(e)}")
+        return 1
+
+    report["peak_rss_mb"] = peak_rss_mb()
+
+    output = Path(args.output or f"benchmarks/ingest_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"✅ Peak RSS {report['peak_rss_mb']}MB")
+    print(f"📁 Results saved to: {output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        print(f"\nCompared with {args.baseline}:")
+        for line in compare_reports(baseline, report):
+            print(f"   {line}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
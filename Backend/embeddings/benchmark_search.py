@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+"""
+Retrieval Benchmark for Textbook Chatbot
+
+Replays a query set against the textbook indices and reports cold-start
+time, query latency percentiles, throughput at several concurrency levels,
+recall@k, MRR and peak RSS. Results are written to a JSON file so index
+type and encoder changes can be compared run to run.
+
+Synthetic queries are sentences taken from sampled chunks; every chunk
+containing that sentence (sliding windows overlap) counts as relevant.
+
+Usage:
+    python benchmark_search.py
+    python benchmark_search.py --textbook economics --synthetic 200 --concurrency 1 4 16
+    python benchmark_search.py --encoder onnx --onnx_dir onnx/all-MiniLM-L6-v2 --baseline benchmarks/last.json
+    python benchmark_search.py --service 127.0.0.1:8765
+"""
+
+import argparse
+import json
+import random
+import re
+import resource
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+
+from textbook_catalog import list_textbooks
+
+SENTENCE_SPLIT = re.compile(r'(?<=[.!?])\s+')
+
+DEFAULT_QUERIES = [
+    "What is machine learning?",
+    "Explain supervised and unsupervised learning",
+    "What is the law of demand?",
+    "opportunity cost",
+    "How does TCP congestion control work?",
+    "What is the role of the network layer?"
+]
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def latency_summary(latencies_ms: List[float]) -> Dict[str, float]:
+    """p50/p95/p99/mean/max of latencies in milliseconds."""
+    values = sorted(latencies_ms)
+    if not values:
+        return {}
+    return {
+        "p50": round(percentile(values, 50), 3),
+        "p95": round(percentile(values, 95), 3),
+        "p99": round(percentile(values, 99), 3),
+        "mean": round(sum(values) / len(values), 3),
+        "max": round(values[-1], 3)
+    }
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def build_synthetic_queries(
+    metadata: List[Dict[str, Any]],
+    count: int,
+    seed: int = 42,
+    min_words: int = 8,
+    max_words: int = 40
+) -> List[Dict[str, Any]]:
+    """
+    Build queries from chunk sentences with known relevant chunk IDs.
+
+    Returns:
+        List of {'query', 'source', 'relevant'} dicts
+    """
+    rng = random.Random(seed)
+    order = list(range(len(metadata)))
+    rng.shuffle(order)
+
+    queries = []
+    seen = set()
+    for position in order:
+        if len(queries) >= count:
+            break
+        chunk = metadata[position]
+        sentences = [
+            s.strip() for s in SENTENCE_SPLIT.split(chunk.get('text', ''))
+            if min_words <= len(s.split()) <= max_words
+        ]
+        if not sentences:
+            continue
+        sentence = rng.choice(sentences)
+        if sentence in seen:
+            continue
+        seen.add(sentence)
+
+        relevant = [entry.get('chunk_id') for entry in metadata if sentence in entry.get('text', '')]
+        queries.append({
+            "query": sentence,
+            "source": chunk.get('chunk_id'),
+            "relevant": relevant
+        })
+
+    return queries
+
+
+def load_query_file(file_path: str) -> List[Dict[str, Any]]:
+    """Load queries from JSON: a list of strings or of {'query', 'relevant'} dicts."""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return [item if isinstance(item, dict) else {"query": item, "relevant": []} for item in data]
+
+
+def score_retrieval(queries: List[Dict[str, Any]], ranked_ids: List[List[str]], ks: List[int]) -> Dict[str, Any]:
+    """
+    recall@k (share of queries with a relevant chunk in the top k) and MRR.
+
+    Queries without relevance judgements are skipped.
+    """
+    judged = 0
+    hits = {k: 0 for k in ks}
+    reciprocal_ranks = 0.0
+
+    for query, ids in zip(queries, ranked_ids):
+        relevant = set(query.get('relevant') or [])
+        if not relevant:
+            continue
+        judged += 1
+        first = next((rank for rank, chunk_id in enumerate(ids, 1) if chunk_id in relevant), None)
+        if first is not None:
+            reciprocal_ranks += 1.0 / first
+            for k in ks:
+                if first <= k:
+                    hits[k] += 1
+
+    if not judged:
+        return {"judged_queries": 0}
+    return {
+        "judged_queries": judged,
+        "recall": {f"@{k}": round(hits[k] / judged, 4) for k in ks},
+        "mrr": round(reciprocal_ranks / judged, 4)
+    }
+
+
+class ServiceClient:
+    """Blocking JSON-lines client for search_service.py."""
+
+    def __init__(self, host: str, port: int, timeout: float = 30.0):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.reader = self.sock.makefile('rb')
+
+    def search(self, textbook_id: str, query: str, top_k: int) -> List[str]:
+        request = {"op": "search", "textbook": textbook_id, "query": query, "top_k": top_k}
+        self.sock.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        response = json.loads(self.reader.readline())
+        if 'error' in response:
+            raise Exception(f"Service error: {response['error']}")
+        return [result['chunk_id'] for result in response.get('results', [])]
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+
+def measure_throughput(
+    search_fn,
+    queries: List[str],
+    concurrency: int,
+    total: int
+) -> Dict[str, Any]:
+    """
+    Run `total` searches with `concurrency` workers.
+
+    search_fn(worker_id, query) performs one search; each worker keeps its
+    own state (e.g. a service connection) keyed by worker_id.
+    """
+    latencies = []
+
+    def worker(worker_id: int):
+        for i in range(worker_id, total, concurrency):
+            start = time.perf_counter()
+            search_fn(worker_id, queries[i % len(queries)])
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "qps": round(total / elapsed, 1),
+        "latency_ms": latency_summary(latencies)
+    }
+
+
+def measure_process_cold_start(
+    textbook_id: str,
+    query: str,
+    runs: int,
+    indices_dir: str,
+    encoder: str,
+    onnx_dir: Optional[str]
+) -> Dict[str, Any]:
+    """Wall time of `search_faiss.py --json` per call, as spawned by server.js."""
+    script = Path(__file__).parent / "search_faiss.py"
+    command = [sys.executable, str(script), '--json', '--textbook', textbook_id,
+               '--query', query, '--indices_dir', indices_dir, '--encoder', encoder]
+    if onnx_dir:
+        command += ['--onnx_dir', onnx_dir]
+
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        completed = subprocess.run(command, capture_output=True, text=True)
+        timings.append((time.perf_counter() - start) * 1000)
+        if completed.returncode != 0:
+            raise Exception(f"search_faiss.py failed: {completed.stdout.strip() or completed.stderr.strip()}")
+
+    return {"runs": runs, "latency_ms": latency_summary(timings)}
+
+
+def benchmark_textbook(
+    searcher,
+    queries: List[Dict[str, Any]],
+    ks: List[int],
+    repeats: int,
+    concurrency_levels: List[int],
+    service: Optional[str]
+) -> Dict[str, Any]:
+    """Latency, quality and throughput for one textbook."""
+    top_k = max(ks)
+    texts = [q['query'] for q in queries]
+
+    # Warm up caches and lazily initialized kernels
+    searcher.search(texts[0], top_k)
+
+    latencies = []
+    ranked_ids = []
+    for repeat in range(repeats):
+        for text in texts:
+            start = time.perf_counter()
+            results = searcher.search(text, top_k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            if repeat == 0:
+                ranked_ids.append([metadata.get('chunk_id') for _, metadata in results])
+
+    report = {
+        "chunks": searcher.index.ntotal,
+        "index_type": type(searcher.index).__name__,
+        "queries": len(texts),
+        "latency_ms": latency_summary(latencies),
+        **score_retrieval(queries, ranked_ids, ks)
+    }
+
+    total = max(len(texts), 200)
+    report["throughput"] = [
+        measure_throughput(lambda worker_id, text: searcher.search(text, top_k), texts, level, total)
+        for level in concurrency_levels
+    ]
+
+    if service:
+        host, port = service.rsplit(':', 1)
+        service_throughput = []
+        for level in concurrency_levels:
+            clients = [ServiceClient(host, int(port)) for _ in range(level)]
+            try:
+                service_throughput.append(measure_throughput(
+                    lambda worker_id, text: clients[worker_id].search(searcher.textbook_id, text, top_k),
+                    texts, level, total
+                ))
+            finally:
+                for client in clients:
+                    client.close()
+        report["service_throughput"] = service_throughput
+
+    return report
+
+
+def compare_reports(baseline: Dict[str, Any], current: Dict[str, Any]) -> List[str]:
+    """Human-readable deltas of the headline metrics per textbook."""
+    lines = []
+    for textbook_id, result in current.get("textbooks", {}).items():
+        before = baseline.get("textbooks", {}).get(textbook_id)
+        if not before:
+            continue
+        pairs = [
+            ("p50 ms", before.get("latency_ms", {}).get("p50"), result.get("latency_ms", {}).get("p50")),
+            ("p95 ms", before.get("latency_ms", {}).get("p95"), result.get("latency_ms", {}).get("p95")),
+            ("MRR", before.get("mrr"), result.get("mrr")),
+        ]
+        for k, value in result.get("recall", {}).items():
+            pairs.append((f"recall{k}", before.get("recall", {}).get(k), value))
+        for label, old, new in pairs:
+            if old is None or new is None:
+                continue
+            change = f" ({(new - old) / old * 100:+.1f}%)" if old else ""
+            lines.append(f"{textbook_id:<20} {label:<10} {old:>10} -> {new:<10}{change}")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark retrieval latency, throughput and quality",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python benchmark_search.py
+  python benchmark_search.py --textbook economics intro_ml --synthetic 300
+  python benchmark_search.py --encoder onnx --onnx_dir onnx/all-MiniLM-L6-v2 --baseline benchmarks/last.json
+  python benchmark_search.py --service 127.0.0.1:8765 --concurrency 1 8 32
+        """
+    )
+
+    parser.add_argument('--textbook', '-t', nargs='+', help='Textbook IDs (default: all available)')
+    parser.add_argument('--indices_dir', default='indices', help='Directory containing FAISS indices (default: indices)')
+    parser.add_argument('--model', default='all-MiniLM-L6-v2', help='Sentence transformer model name')
+    parser.add_argument('--encoder', choices=['torch', 'onnx'], default='torch', help='Query encoder backend')
+    parser.add_argument('--onnx_dir', help='Exported ONNX model directory for --encoder onnx')
+    parser.add_argument('--queries', help='JSON file of extra queries (strings or {query, relevant} dicts)')
+    parser.add_argument('--synthetic', type=int, default=100, help='Synthetic queries per textbook (default: 100)')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed for synthetic queries (default: 42)')
+    parser.add_argument('--k', type=int, nargs='+', default=[1, 5, 10], help='Cutoffs for recall@k (default: 1 5 10)')
+    parser.add_argument('--repeats', type=int, default=3, help='Sequential passes for latency (default: 3)')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16],
+                        help='Concurrency levels for throughput (default: 1 4 16)')
+    parser.add_argument('--cold_runs', type=int, default=3,
+                        help='Spawned search_faiss.py runs for per-request cold start (default: 3, 0 to skip)')
+    parser.add_argument('--service', help='Also measure a running search_service.py at HOST:PORT')
+    parser.add_argument('--output', '-o', help='Result JSON file (default: benchmarks/search_<timestamp>.json)')
+    parser.add_argument('--baseline', help='Earlier result JSON to compare against')
+
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    from search_faiss import MultiTextbookSearcher
+
+    textbook_ids = args.textbook or [tb['id'] for tb in list_textbooks(args.indices_dir)]
+    if not textbook_ids:
+        print(f"ERROR: No textbooks found in {args.indices_dir}")
+        return 1
+
+    extra_queries = load_query_file(args.queries) if args.queries else []
+
+    report = {
+        "created_at": datetime.now().isoformat(timespec='seconds'),
+        "config": {
+            "indices_dir": args.indices_dir,
+            "model": args.model,
+            "encoder": args.encoder,
+            "onnx_dir": args.onnx_dir,
+            "k": args.k,
+            "repeats": args.repeats,
+            "concurrency": args.concurrency
+        },
+        "textbooks": {}
+    }
+
+    shared_model = None
+    try:
+        for textbook_id in textbook_ids:
+            print(f"🔄 Benchmarking {textbook_id}...")
+
+            load_start = time.perf_counter()
+            searcher = MultiTextbookSearcher(
+                textbook_id=textbook_id,
+                model_name=args.model,
+                json_mode=True,
+                indices_dir=args.indices_dir,
+                model=shared_model,
+                encoder_backend=args.encoder,
+                onnx_dir=args.onnx_dir
+            )
+            load_ms = (time.perf_counter() - load_start) * 1000
+            shared_model = searcher.model
+
+            queries = build_synthetic_queries(searcher.metadata, args.synthetic, args.seed)
+            queries += [{"query": q, "relevant": []} for q in DEFAULT_QUERIES]
+            queries += extra_queries
+
+            if "cold_start_ms" not in report:
+                searcher.search(queries[0]['query'], max(args.k))
+                report["cold_start_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+            result = {"load_ms": round(load_ms, 1)}
+            result.update(benchmark_textbook(
+                searcher, queries, args.k, args.repeats, args.concurrency, args.service
+            ))
+            if args.cold_runs > 0:
+                result["process_cold_start"] = measure_process_cold_start(
+                    textbook_id, queries[0]['query'], args.cold_runs,
+                    args.indices_dir, args.encoder, args.onnx_dir
+                )
+            report["textbooks"][textbook_id] = result
+
+            recall = ", ".join(f"R{k}={v}" for k, v in result.get("recall", {}).items())
+            print(f"   p50={result['latency_ms']['p50']}ms p95={result['latency_ms']['p95']}ms "
+                  f"MRR={result.get('mrr', '-')} {recall}")
+            for level in result["throughput"]:
+                print(f"   concurrency {level['concurrency']:>3}: {level['qps']} QPS")
+
+    except Exception as e:
+        print(f"❌ Benchmark failed: {str(e)}")
+        return 1
+
+    report["peak_rss_mb"] = peak_rss_mb()
+
+    output = Path(args.output or f"benchmarks/search_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"✅ Cold start {report['cold_start_ms']}ms, peak RSS {report['peak_rss_mb']}MB")
+    print(f"📁 Results saved to: {output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        print(f"\nCompared with {args.baseline}:")
+        for line in compare_reports(baseline, report):
+            print(f"   {line}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
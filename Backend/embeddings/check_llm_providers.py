@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Provider Fallback and Hedging Check
+
+Runs llm_answer.py against two local mock chat-completion endpoints
+(TOGETHER_API_URL / OPENROUTER_API_URL) whose latency and failures are
+scripted per scenario, and checks which provider answered, how long it took
+and what was recorded in the provider statistics:
+
+    primary    both providers healthy: Together.ai answers
+    fallback   Together.ai fails: OpenRouter answers (hedged and sequential)
+    hedge      Together.ai is slower than the hedge deadline: OpenRouter is
+               fired early, answers first and Together.ai is cancelled
+    stream     Together.ai fails while streaming: OpenRouter streams the answer
+    down       both providers fail: a clean error
+
+No API keys or network access are needed; the answer cache is bypassed and
+the statistics go to a temporary file.
+
+Usage:
+    python check_llm_providers.py
+    python check_llm_providers.py --scenario hedge fallback
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import List, Dict, Any
+
+LLM_ANSWER = Path(__file__).parent / "llm_answer.py"
+
+SLOW_SECONDS = 3.0
+HEDGE_DEADLINE = 0.5
+
+
+class MockProvider:
+    """A chat-completion endpoint answering after `delay` seconds, or failing with HTTP 500."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.delay = 0.0
+        self.fail = False
+        self.calls = 0
+        provider = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                provider.calls += 1
+                time.sleep(provider.delay)
+                if provider.fail:
+                    self._send(500, 'application/json', json.dumps({"error": {"message": "mock failure"}}))
+                elif payload.get('stream'):
+                    events = [{"choices": [{"delta": {"content": f"{word} "}}]} for word in (provider.name, "answer")]
+                    body = ''.join(f"data: {json.dumps(event)}\n\n" for event in events) + "data: [DONE]\n\n"
+                    self._send(200, 'text/event-stream', body)
+                else:
+                    answer = {"choices": [{"message": {"content": f"{provider.name} answer"}}]}
+                    self._send(200, 'application/json', json.dumps(answer))
+
+            def _send(self, status: int, content_type: str, body: str):
+                data = body.encode('utf-8')
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', content_type)
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except OSError:
+                    pass  # The caller gave up on this provider
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}/v1/chat/completions"
+
+    def script(self, delay: float = 0.0, fail: bool = False):
+        self.delay, self.fail, self.calls = delay, fail, 0
+
+
+def run_llm_answer(env: Dict[str, str], stream: bool = False) -> Dict[str, Any]:
+    """Run llm_answer.py once; returns its final JSON result and the wall time."""
+    args = [sys.executable, str(LLM_ANSWER)] + (['--stream'] if stream else [])
+    args += ['--no-cache', '--', 'What does the mock say?', 'Mock textbook excerpt.']
+    start = time.monotonic()
+    completed = subprocess.run(args, env=env, capture_output=True, text=True, timeout=60)
+    elapsed = time.monotonic() - start
+    lines = [line for line in completed.stdout.splitlines() if line.strip()]
+    result = json.loads(lines[-1]) if lines else {"error": completed.stderr.strip()}
+    result["_seconds"] = elapsed
+    result["_lines"] = len(lines)
+    return result
+
+
+def check_scenario(scenario: str, together: MockProvider, openrouter: MockProvider,
+                   env: Dict[str, str]) -> List[str]:
+    """Run one scenario; returns the failed expectations (empty when it passes)."""
+    failures = []
+
+    def expect(condition: bool, message: str):
+        if not condition:
+            failures.append(message)
+
+    if scenario == 'primary':
+        together.script(delay=0.1)
+        openrouter.script()
+        result = run_llm_answer(env)
+        expect(result.get('api_used') == 'together.ai', f"expected together.ai, got {result.get('api_used')}")
+        expect(openrouter.calls == 0, f"OpenRouter should not be called, got {openrouter.calls} calls")
+
+    elif scenario == 'fallback':
+        for mode in ('hedged', 'sequential'):
+            together.script(fail=True)
+            openrouter.script()
+            result = run_llm_answer(dict(env, LLM_HEDGE_MODE=mode))
+            expect(result.get('api_used') == 'openrouter', f"{mode}: expected openrouter, got {result.get('api_used')}")
+            expect(together.calls == 1, f"{mode}: Together.ai should be tried once, got {together.calls} calls")
+
+    elif scenario == 'hedge':
+        together.script(delay=SLOW_SECONDS)
+        openrouter.script(delay=0.1)
+        result = run_llm_answer(env)
+        expect(result.get('api_used') == 'openrouter', f"expected openrouter, got {result.get('api_used')}")
+        expect(result["_seconds"] < SLOW_SECONDS,
+               f"hedged answer took {result['_seconds']:.2f}s, not faster than the slow primary")
+        expect(together.calls == 1 and openrouter.calls == 1,
+               f"expected one call each, got {together.calls} and {openrouter.calls}")
+
+    elif scenario == 'stream':
+        together.script(fail=True)
+        openrouter.script()
+        result = run_llm_answer(env, stream=True)
+        expect(result.get('type') == 'done', f"expected a done event, got {result.get('type') or result}")
+        expect(result.get('api_used') == 'openrouter', f"expected openrouter, got {result.get('api_used')}")
+        expect(result["_lines"] >= 3, f"expected start/delta/done events, got {result['_lines']} lines")
+
+    elif scenario == 'down':
+        together.script(fail=True)
+        openrouter.script(fail=True)
+        result = run_llm_answer(env)
+        expect(result.get('error') == 'All LLM APIs failed', f"expected 'All LLM APIs failed', got {result}")
+        expect(len(result.get('details', [])) == 2, f"expected both failures in details, got {result.get('details')}")
+
+    return failures
+
+
+SCENARIOS = ['primary', 'fallback', 'hedge', 'stream', 'down']
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check LLM provider fallback and hedging against local mock endpoints",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python check_llm_providers.py
+  python check_llm_providers.py --scenario hedge fallback
+        """
+    )
+    parser.add_argument('--scenario', nargs='+', choices=SCENARIOS, default=SCENARIOS,
+                        help='Scenarios to run (default: all)')
+    args = parser.parse_args()
+
+    together = MockProvider('together')
+    openrouter = MockProvider('openrouter')
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        stats_path = os.path.join(temp_dir, 'provider_stats.json')
+        env = dict(
+            os.environ,
+            TOGETHER_API_URL=together.url,
+            OPENROUTER_API_URL=openrouter.url,
+            TOGETHER_API_KEY='mock',
+            OPENROUTER_API_KEY='mock',
+            LLM_STATS_PATH=stats_path,
+            LLM_HEDGE_MODE='hedged',
+            LLM_HEDGE_DEADLINE=str(HEDGE_DEADLINE),
+            LLM_CACHE='0',
+            LLM_PROMPT_BUDGET='0'
+        )
+
+        failed = 0
+        for scenario in args.scenario:
+            failures = check_scenario(scenario, together, openrouter, env)
+            if failures:
+                failed += 1
+                print(f"❌ {scenario}")
+                for failure in failures:
+                    print(f"   {failure}")
+            else:
+                print(f"✅ {scenario}")
+
+        from provider_stats import ProviderStats
+        print("\nRecorded provider statistics:")
+        print(json.dumps(ProviderStats(stats_path).summary(), indent=2))
+
+    print(f"\n{len(args.scenario) - failed}/{len(args.scenario)} scenarios passed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    exit(main())
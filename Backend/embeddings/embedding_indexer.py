@@ -8,6 +8,32 @@ and creates a FAISS index for efficient similarity search.
 Usage:
     python embedding_indexer.py
     python embedding_indexer.py --input custom_chunks.json --model all-mpnet-base-v2
+    python embedding_indexer.py --encoder onnx --onnx_dir onnx/all-MiniLM-L6-v2
+    python embedding_indexer.py --profile sample --profile_output indexer.collapsed
+    python embedding_indexer.py --embed_mode sentence --validate_sample 200
+
+Unified library (one index for all books, see library_index.py):
+    python embedding_indexer.py -i economics_chunks.json --library indices --book_id economics
+    python embedding_indexer.py --library indices --import_textbook intro_ml computer_networks
+    python embedding_indexer.py --library indices --remove_book economics
+
+Centroid summaries of library books for routing "all" searches (written
+with every library change; see centroid_router.py), rebuilt with:
+    python embedding_indexer.py --summarize indices
+
+Related passages (each chunk's nearest chunks, see related_chunks.py) are
+precomputed with every index; rebuilt for existing indices with:
+    python embedding_indexer.py --build_related indices --related 8 --threads 4
+
+Query suggestions (frequent phrases and headings for autocomplete, see
+query_suggestions.py) are written with every index; rebuilt with:
+    python embedding_indexer.py --build_suggest indices
+
+Versioned publish (picked up by a running search_service.py):
+    python embedding_indexer.py -i economics_chunks.json --publish indices --book_id economics
+
+A whole directory of PDFs (extraction, chunking and indexing in one run):
+    python ingest_textbooks.py --pdf_dir ../pdf_processing --indices_dir indices
 """
 
 import argparse
@@ -15,15 +41,19 @@ import json
 import pickle
 import os
 import numpy as np
+from datetime import datetime
 from pathlib import Path
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Tuple, Optional
 
-try:
-    from sentence_transformers import SentenceTransformer
-except ImportError:
-    print("Error: sentence-transformers is required. Install it with:")
-    print("pip install sentence-transformers")
-    exit(1)
+from centroid_router import summarize_library_books, update_library_summaries
+from encoders import load_encoder
+from index_manifest import build_manifest, manifest_path_for, write_manifest
+from index_versions import new_version_dir, publish_version, prune_versions
+from library_index import TextbookLibrary, load_or_create_library
+from profiling import add_profile_arguments, start_profile
+from query_suggestions import build_suggestions, library_suggest_path, save_suggestions, suggest_path_for
+from related_chunks import DEFAULT_NEIGHBORS, build_neighbor_graph, graph_path_for, library_graph_path, save_graph
+from textbook_catalog import configured_textbook_ids, is_library_textbook, library_files, load_config, textbook_files
 
 try:
     import faiss
@@ -109,14 +139,14 @@ def validate_chunks(chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     return valid_chunks
 
 
-def load_embedding_model(model_name: str) -> SentenceTransformer:
-    """Load the sentence transformer model."""
-    print(f"🔄 Loading embedding model: {model_name}")
+def load_embedding_model(model_name: str, backend: str = "torch", onnx_dir: Optional[str] = None):
+    """Load the embedding model with the torch or onnx encoder backend."""
+    print(f"🔄 Loading embedding model: {model_name} ({backend} backend)")
     
     try:
-        model = SentenceTransformer(model_name)
+        model = load_encoder(backend, model_name, onnx_dir)
         print(f"✅ Model loaded successfully")
-        print(f"📏 Embedding dimension: {model.get_sentence_embedding_dimension()}")
+        print(f"📏 Embedding dimension: {model.dimension}")
         return model
     
     except Exception as e:
@@ -128,8 +158,20 @@ def load_embedding_model(model_name: str) -> SentenceTransformer:
         raise
 
 
+def encode_texts(model, texts: List[str], batch_size: int = 32) -> np.ndarray:
+    """Encode texts in batches with a progress bar."""
+    embeddings = []
+    
+    for i in tqdm(range(0, len(texts), batch_size), desc="Embedding batches"):
+        batch_texts = texts[i:i + batch_size]
+        batch_embeddings = model.encode(batch_texts, batch_size=batch_size)
+        embeddings.append(batch_embeddings)
+    
+    return np.vstack(embeddings)
+
+
 def generate_embeddings(
-    model: SentenceTransformer, 
+    model, 
     chunks: List[Dict[str, Any]], 
     batch_size: int = 32
 ) -> np.ndarray:
@@ -139,25 +181,139 @@ def generate_embeddings(
     # Extract texts
     texts = [chunk['text'] for chunk in chunks]
     
-    # Generate embeddings with progress bar
-    embeddings = []
-    
-    for i in tqdm(range(0, len(texts), batch_size), desc="Embedding batches"):
-        batch_texts = texts[i:i + batch_size]
-        batch_embeddings = model.encode(
-            batch_texts,
-            convert_to_numpy=True,
-            show_progress_bar=False  # We have our own progress bar
-        )
-        embeddings.append(batch_embeddings)
-    
-    # Concatenate all embeddings
-    all_embeddings = np.vstack(embeddings)
+    all_embeddings = encode_texts(model, texts, batch_size)
     
     print(f"✅ Generated embeddings: {all_embeddings.shape}")
     return all_embeddings
 
 
+def chunk_sentence_spans(chunks: List[Dict[str, Any]]) -> Optional[Tuple[List[str], np.ndarray, np.ndarray]]:
+    """
+    Recover the sentences behind sliding-window chunks from their
+    start/end_sentence_idx and sentence_offsets (written by chunk_text.py).
+    
+    Returns:
+        Distinct sentences in book order, and each chunk's first and last
+        position in that list; None if a chunk lacks the fields
+    """
+    by_key = {}
+    for chunk in chunks:
+        offsets = chunk.get('sentence_offsets')
+        start, end = chunk.get('start_sentence_idx'), chunk.get('end_sentence_idx')
+        if offsets is None or start is None or end is None or len(offsets) != end - start + 1:
+            return None
+        text = chunk['text']
+        bounds = list(offsets) + [len(text) + 1]
+        for j in range(len(offsets)):
+            by_key.setdefault((chunk.get('source_file', ''), start + j), text[bounds[j]:bounds[j + 1] - 1])
+    
+    keys = sorted(by_key)
+    positions = {key: position for position, key in enumerate(keys)}
+    starts = np.array([positions[(c.get('source_file', ''), c['start_sentence_idx'])] for c in chunks], dtype=np.int64)
+    ends = np.array([positions[(c.get('source_file', ''), c['end_sentence_idx'])] for c in chunks], dtype=np.int64)
+    return [by_key[key] for key in keys], starts, ends
+
+
+def pool_window_embeddings(
+    sentence_embeddings: np.ndarray,
+    weights: np.ndarray,
+    starts: np.ndarray,
+    ends: np.ndarray
+) -> np.ndarray:
+    """
+    Weighted mean of the sentence vectors in each window [start, end].
+    
+    Window sums come from prefix sums, so the cost is one pass over the
+    sentences however much the windows overlap. Means are re-normalized if
+    the encoder produces unit vectors.
+    """
+    weighted = sentence_embeddings.astype(np.float64) * weights[:, None]
+    prefix = np.zeros((len(weighted) + 1, weighted.shape[1]), dtype=np.float64)
+    np.cumsum(weighted, axis=0, out=prefix[1:])
+    weight_prefix = np.concatenate(([0.0], np.cumsum(weights, dtype=np.float64)))
+    
+    pooled = prefix[ends + 1] - prefix[starts]
+    pooled /= (weight_prefix[ends + 1] - weight_prefix[starts])[:, None]
+    
+    norms = np.linalg.norm(sentence_embeddings, axis=1)
+    if len(norms) and np.allclose(norms, 1.0, atol=1e-3):
+        pooled /= np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+    return pooled.astype(np.float32)
+
+
+def embed_sentence_windows(
+    model,
+    sentences: List[str],
+    starts: np.ndarray,
+    ends: np.ndarray,
+    batch_size: int = 32
+) -> np.ndarray:
+    """Encode each sentence once and pool the windows [starts[i], ends[i]]."""
+    print(f"🔄 Generating embeddings for {len(sentences)} sentences ({len(starts)} windows)...")
+    sentence_embeddings = encode_texts(model, sentences, batch_size)
+    # Word counts stand in for the token counts the encoder mean-pools over
+    weights = np.array([max(1, len(sentence.split())) for sentence in sentences], dtype=np.float64)
+    embeddings = pool_window_embeddings(sentence_embeddings, weights, starts, ends)
+    
+    encoded_per_window = float(np.sum(ends - starts + 1)) / max(1, len(sentences))
+    print(f"✅ Pooled embeddings: {embeddings.shape} ({encoded_per_window:.1f}x fewer sentence encodings than per-chunk)")
+    return embeddings
+
+
+def generate_pooled_embeddings(
+    model,
+    chunks: List[Dict[str, Any]],
+    batch_size: int = 32
+) -> np.ndarray:
+    """
+    Embeddings for sliding-window chunks pooled from sentence embeddings.
+    Falls back to embedding full chunk texts for chunk files written before
+    chunk_text.py recorded sentence offsets.
+    """
+    spans = chunk_sentence_spans(chunks)
+    if spans is None:
+        print("⚠️  Chunks have no sentence_offsets (re-run chunk_text.py); embedding full chunk texts")
+        return generate_embeddings(model, chunks, batch_size)
+    
+    sentences, starts, ends = spans
+    return embed_sentence_windows(model, sentences, starts, ends, batch_size)
+
+
+def check_pooled_embeddings(
+    model,
+    chunks: List[Dict[str, Any]],
+    embeddings: np.ndarray,
+    sample: int,
+    batch_size: int = 32,
+    seed: int = 42
+) -> Dict[str, Any]:
+    """
+    Re-encode a random sample of chunk texts and compare them with their
+    pooled embeddings.
+    
+    Returns:
+        Dict with 'sample', 'mean_cosine', 'p5_cosine' and 'min_cosine'
+    """
+    rng = np.random.default_rng(seed)
+    picked = np.sort(rng.choice(len(chunks), size=min(sample, len(chunks)), replace=False))
+    print(f"🔄 Re-encoding {len(picked)} sampled chunks to check pooled embeddings...")
+    full = encode_texts(model, [chunks[i]['text'] for i in picked], batch_size)
+    pooled = embeddings[picked]
+    
+    def unit(matrix):
+        return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+    
+    cosines = np.sum(unit(full) * unit(pooled), axis=1)
+    report = {
+        "sample": int(len(picked)),
+        "mean_cosine": round(float(np.mean(cosines)), 4),
+        "p5_cosine": round(float(np.percentile(cosines, 5)), 4),
+        "min_cosine": round(float(np.min(cosines)), 4)
+    }
+    print(f"✅ Pooled vs full-text cosine: mean {report['mean_cosine']}, p5 {report['p5_cosine']}, min {report['min_cosine']}")
+    return report
+
+
 def create_faiss_index(embeddings: np.ndarray, index_type: str = "flat") -> faiss.Index:
     """Create and populate FAISS index."""
     print(f"🔄 Creating FAISS index ({index_type})...")
@@ -196,7 +352,8 @@ def create_metadata_mapping(chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]
         }
         
         # Include additional fields if they exist
-        for field in ['index', 'source_file', 'method', 'sentence_count']:
+        for field in ['index', 'source_file', 'method', 'sentence_count',
+                      'page_start', 'page_end', 'chapter', 'section']:
             if field in chunk:
                 metadata[field] = chunk[field]
         
@@ -224,6 +381,247 @@ def save_metadata_mapping(mapping: List[Dict[str, Any]], file_path: str):
         raise Exception(f"Error saving metadata mapping to {file_path}: {str(e)}")
 
 
+def import_textbooks_to_library(indices_dir: str, textbook_ids: List[str]) -> TextbookLibrary:
+    """
+    Copy existing per-book indices into the unified library of the same
+    directory without re-embedding (vectors are read back from each index)
+    and save the library.
+
+    A per-book config takes precedence over the library entry, so once the
+    library is saved each book's config is renamed to
+    <id>_config.json.imported and the book is served from the library. The
+    per-book index and metadata files are left in place.
+    """
+    library = None
+    
+    for textbook_id in textbook_ids:
+        prefix = Path(indices_dir) / textbook_id
+        try:
+            index = faiss.read_index(f"{prefix}_index.faiss")
+            with open(f"{prefix}_metadata.pkl", 'rb') as file:
+                metadata = pickle.load(file)
+            with open(f"{prefix}_config.json", 'r', encoding='utf-8') as file:
+                config = json.load(file)
+        except Exception as e:
+            raise Exception(f"Error reading textbook {textbook_id} from {indices_dir}: {str(e)}")
+        
+        index_type = "ip" if index.metric_type == faiss.METRIC_INNER_PRODUCT else "flat"
+        model_name = config.get('model_name', 'all-MiniLM-L6-v2')
+        if library is None:
+            library = load_or_create_library(indices_dir, index.d, index_type, model_name)
+        elif config.get('model_name', library.manifest["model_name"]) != library.manifest["model_name"]:
+            raise ValueError(f"Textbook {textbook_id} was indexed with {model_name}, library uses {library.manifest['model_name']}")
+        
+        embeddings = index.reconstruct_n(0, index.ntotal)
+        info = {key: value for key, value in config.items() if key not in ('total_chunks', 'created_at', 'id_base')}
+        library.add_book(textbook_id, embeddings, metadata, info)
+        print(f"✅ Imported {textbook_id}: {len(metadata)} chunks")
+    
+    library.save()
+    for textbook_id in textbook_ids:
+        config_path = Path(indices_dir) / f"{textbook_id}_config.json"
+        config_path.rename(config_path.with_name(f"{config_path.name}.imported"))
+    return library
+
+
+def summarize_indices(indices_dir: str) -> int:
+    """
+    Write centroid summaries for every book of the unified library in a
+    directory from its stored vectors (per-book indices are not routed).
+    
+    Returns:
+        Number of books summarized
+    """
+    if not library_files(indices_dir)["manifest"].exists():
+        raise FileNotFoundError(f"No unified library in {indices_dir}; only library books are summarized")
+    library = TextbookLibrary(indices_dir).load()
+    update_library_summaries(indices_dir, add=summarize_library_books(library, list(library.books)))
+    print(f"✅ Summarized {len(library.books)} library books")
+    return len(library.books)
+
+
+def write_related(path: Path, index: faiss.Index, vectors: np.ndarray, neighbors: int, threads: int = 0,
+                  id_base: Optional[int] = None):
+    """Build a book's neighbor graph with an all-chunks search and save it."""
+    start = datetime.now()
+    save_graph(path, build_neighbor_graph(index, vectors, neighbors, threads=threads, id_base=id_base))
+    seconds = (datetime.now() - start).total_seconds()
+    print(f"✅ Related passages ({neighbors} per chunk, {len(vectors)} chunks, {seconds:.1f}s) saved to: {path}")
+
+
+def write_library_related(library: TextbookLibrary, book_ids: List[str], neighbors: int, threads: int = 0):
+    """Neighbor graphs of library books, each restricted to the book's own chunks."""
+    for book_id in book_ids:
+        write_related(
+            library_graph_path(str(library.indices_dir), book_id), library.index, library.book_vectors(book_id),
+            neighbors, threads, id_base=library.id_range(book_id)[0]
+        )
+
+
+def build_related_indices(indices_dir: str, neighbors: int, threads: int = 0) -> int:
+    """
+    Write neighbor graphs for every per-book index and library book of a
+    directory.
+    
+    Returns:
+        Number of books processed
+    """
+    built = 0
+    for textbook_id in configured_textbook_ids(indices_dir):
+        if is_library_textbook(indices_dir, textbook_id):
+            continue
+        index_path = textbook_files(indices_dir, textbook_id)["index"]
+        try:
+            index = faiss.read_index(str(index_path))
+            vectors = index.reconstruct_n(0, index.ntotal)
+        except Exception as e:
+            raise Exception(f"Error reading textbook {textbook_id} from {indices_dir}: {str(e)}")
+        write_related(graph_path_for(index_path), index, vectors, neighbors, threads)
+        built += 1
+    
+    if library_files(indices_dir)["manifest"].exists():
+        library = TextbookLibrary(indices_dir).load()
+        write_library_related(library, list(library.books), neighbors, threads)
+        built += len(library.books)
+    
+    return built
+
+
+def write_suggestions(path: Path, metadata: List[Dict[str, Any]]):
+    """Count a book's suggestion terms and save them."""
+    suggestions = build_suggestions(metadata)
+    save_suggestions(path, suggestions)
+    print(f"✅ Query suggestions ({len(suggestions['terms'])} terms, {len(suggestions['headings'])} headings) saved to: {path}")
+
+
+def build_suggest_indices(indices_dir: str) -> int:
+    """
+    Write query suggestions for every per-book index and library book of a
+    directory from their stored metadata.
+    
+    Returns:
+        Number of books processed
+    """
+    built = 0
+    for textbook_id in configured_textbook_ids(indices_dir):
+        if is_library_textbook(indices_dir, textbook_id):
+            continue
+        files = textbook_files(indices_dir, textbook_id)
+        try:
+            with open(files["metadata"], 'rb') as f:
+                metadata = pickle.load(f)
+        except Exception as e:
+            raise Exception(f"Error reading textbook {textbook_id} from {indices_dir}: {str(e)}")
+        write_suggestions(suggest_path_for(files["index"]), metadata)
+        built += 1
+    
+    if library_files(indices_dir)["manifest"].exists():
+        library = TextbookLibrary(indices_dir).load()
+        for book_id in library.books:
+            write_suggestions(library_suggest_path(indices_dir, book_id), library.metadata[book_id])
+        built += len(library.books)
+    
+    return built
+
+
+def build_config(
+    indices_dir: str,
+    book_id: str,
+    total_chunks: int,
+    model_name: str,
+    index_type: str,
+    textbook_name: Optional[str] = None,
+    description: Optional[str] = None
+) -> Dict[str, Any]:
+    """Config for a new version, keeping name and description of the current one."""
+    config = load_config(indices_dir, book_id) or {}
+    config.update({
+        "textbook_name": textbook_name or config.get("textbook_name", book_id),
+        "description": description or config.get("description", "No description available"),
+        "total_chunks": total_chunks,
+        "created_at": datetime.now().isoformat(timespec='seconds'),
+        "model_name": model_name,
+        "index_type": index_type
+    })
+    return config
+
+
+def save_book_index(
+    output_prefix: str,
+    embeddings: np.ndarray,
+    metadata_mapping: List[Dict[str, Any]],
+    model_name: str,
+    index_type: str = "flat",
+    related: int = DEFAULT_NEIGHBORS,
+    threads: int = 0
+) -> Dict[str, str]:
+    """
+    Write a book's FAISS index, metadata, integrity manifest, related
+    passages (unless related is 0) and query suggestions.
+    
+    Returns:
+        Path of each file written, by kind
+    """
+    index = create_faiss_index(embeddings, index_type)
+    files = {
+        "index": f"{output_prefix}_index.faiss",
+        "metadata": f"{output_prefix}_metadata.pkl",
+        "metadata_json": f"{output_prefix}_metadata.json"
+    }
+    
+    save_faiss_index(index, files["index"])
+    save_metadata_mapping(metadata_mapping, files["metadata"])
+    save_metadata_json(metadata_mapping, files["metadata_json"])
+    index_path = Path(files["index"])
+    
+    files["manifest"] = str(manifest_path_for(index_path))
+    write_manifest(files["manifest"], build_manifest(files["index"], files["metadata"], len(metadata_mapping), model_name))
+    print(f"✅ Integrity manifest saved to: {files['manifest']}")
+    
+    if related:
+        files["related"] = str(graph_path_for(index_path))
+        write_related(files["related"], index, index.reconstruct_n(0, index.ntotal), related, threads)
+    
+    files["suggestions"] = str(suggest_path_for(index_path))
+    write_suggestions(files["suggestions"], metadata_mapping)
+    return files
+
+
+def publish_book_index(
+    indices_dir: str,
+    book_id: str,
+    embeddings: np.ndarray,
+    metadata_mapping: List[Dict[str, Any]],
+    model_name: str,
+    index_type: str = "flat",
+    textbook_name: Optional[str] = None,
+    description: Optional[str] = None,
+    keep_versions: int = 3,
+    related: int = DEFAULT_NEIGHBORS,
+    threads: int = 0
+) -> Dict[str, str]:
+    """
+    Write a new version of a book (see save_book_index) with its config and
+    publish it atomically.
+    
+    Returns:
+        Path of each file written, by kind
+    """
+    version_dir = new_version_dir(indices_dir, book_id)
+    output_prefix = str(version_dir / book_id)
+    files = save_book_index(output_prefix, embeddings, metadata_mapping, model_name, index_type, related, threads)
+    
+    config = build_config(indices_dir, book_id, len(metadata_mapping), model_name, index_type, textbook_name, description)
+    files["config"] = f"{output_prefix}_config.json"
+    with open(files["config"], 'w', encoding='utf-8') as file:
+        json.dump(config, file, indent=2)
+    # Everything is on disk; switching the pointer makes it live
+    publish_version(indices_dir, book_id, version_dir.name)
+    removed = prune_versions(indices_dir, book_id, keep_versions)
+    print(f"✅ Published {book_id} version {version_dir.name}" + (f" (pruned {len(removed)})" if removed else ""))
+    return files
+
+
 def save_metadata_json(mapping: List[Dict[str, Any]], file_path: str):
     """Save metadata mapping to JSON file (for human readability)."""
     try:
@@ -243,6 +641,10 @@ Examples:
   python embedding_indexer.py
   python embedding_indexer.py --input custom_chunks.json
   python embedding_indexer.py --model all-mpnet-base-v2 --index_type ip
+  python embedding_indexer.py --embed_mode sentence --validate_sample 200
+  python embedding_indexer.py --summarize indices
+  python embedding_indexer.py --build_related indices --related 10
+  python embedding_indexer.py --build_suggest indices
         """
     )
     
@@ -258,6 +660,18 @@ Examples:
         help='Sentence transformer model name (default: all-MiniLM-L6-v2)'
     )
     
+    parser.add_argument(
+        '--encoder',
+        choices=['torch', 'onnx'],
+        default='torch',
+        help='Encoder backend (default: torch)'
+    )
+    
+    parser.add_argument(
+        '--onnx_dir',
+        help='Exported ONNX model directory for --encoder onnx (see encoders.py export)'
+    )
+    
     parser.add_argument(
         '--index_type',
         choices=['flat', 'ip'],
@@ -272,15 +686,152 @@ Examples:
         help='Batch size for embedding generation (default: 32)'
     )
     
+    parser.add_argument(
+        '--embed_mode',
+        choices=['chunk', 'sentence'],
+        default='chunk',
+        help='chunk: encode every chunk text; sentence: encode each sentence once and pool '
+             'sliding windows from sentence vectors; check its recall with '
+             'benchmark_ingestion.py --embed_mode chunk sentence before using it (default: chunk)'
+    )
+    
+    parser.add_argument(
+        '--validate_sample',
+        type=int,
+        default=0,
+        help='With --embed_mode sentence, re-encode this many random chunks and report '
+             'cosine similarity to their pooled embeddings (default: 0)'
+    )
+    
     parser.add_argument(
         '--output_prefix',
         default='intro_ml',
         help='Output file prefix (default: intro_ml)'
     )
     
+    parser.add_argument(
+        '--library',
+        metavar='INDICES_DIR',
+        help='Add the book to the unified library in this directory instead of writing separate files'
+    )
+    
+    parser.add_argument(
+        '--publish',
+        metavar='INDICES_DIR',
+        help='Write a new version of the book into this directory and publish it atomically'
+    )
+    
+    parser.add_argument(
+        '--keep_versions',
+        type=int,
+        default=3,
+        help='Versions kept per book after --publish (default: 3)'
+    )
+    
+    parser.add_argument(
+        '--book_id',
+        help='Textbook ID for --library/--publish (default: last part of --output_prefix)'
+    )
+    
+    parser.add_argument('--textbook_name', help='Display name for --library/--publish (default: book ID)')
+    parser.add_argument('--description', help='Description for --library/--publish')
+    
+    parser.add_argument(
+        '--import_textbook',
+        nargs='+',
+        metavar='ID',
+        help='Import existing per-book indices from the --library directory into the library'
+    )
+    
+    parser.add_argument(
+        '--remove_book',
+        metavar='ID',
+        help='Remove a book from the --library directory'
+    )
+    
+    parser.add_argument(
+        '--summarize',
+        metavar='INDICES_DIR',
+        help='Rebuild the centroid summaries of every library book in this directory and exit'
+    )
+    
+    parser.add_argument(
+        '--related',
+        type=int,
+        default=DEFAULT_NEIGHBORS,
+        help=f'Related passages precomputed per chunk; 0 skips the all-chunks search (default: {DEFAULT_NEIGHBORS})'
+    )
+    
+    parser.add_argument(
+        '--build_related',
+        metavar='INDICES_DIR',
+        help='Rebuild the related passages of every book in this directory and exit'
+    )
+    
+    parser.add_argument(
+        '--threads',
+        type=int,
+        default=0,
+        help='FAISS threads for the related passages search (default: one per core)'
+    )
+    
+    parser.add_argument(
+        '--build_suggest',
+        metavar='INDICES_DIR',
+        help='Rebuild the query suggestions of every book in this directory and exit'
+    )
+    
+    add_profile_arguments(parser)
+    
     args = parser.parse_args()
     
+    if (args.import_textbook or args.remove_book) and not args.library:
+        parser.error("--import_textbook and --remove_book require --library")
+    if args.library and args.publish:
+        parser.error("--library and --publish cannot be combined")
+    if args.related < 0:
+        parser.error("--related cannot be negative")
+    if args.build_related and args.related == 0:
+        parser.error("--build_related requires --related > 0")
+    
+    profile = start_profile(args, __file__)
+    
     try:
+        if args.summarize:
+            summarized = summarize_indices(args.summarize)
+            print(f"✅ Centroid summaries written for {summarized} books in {args.summarize}")
+            return 0
+        
+        if args.build_related:
+            built = build_related_indices(args.build_related, args.related, args.threads)
+            print(f"✅ Related passages written for {built} books in {args.build_related}")
+            return 0
+        
+        if args.build_suggest:
+            built = build_suggest_indices(args.build_suggest)
+            print(f"✅ Query suggestions written for {built} books in {args.build_suggest}")
+            return 0
+        
+        if args.remove_book:
+            library = TextbookLibrary(args.library).load()
+            removed = library.remove_book(args.remove_book)
+            library.save()
+            update_library_summaries(args.library, remove=[args.remove_book])
+            library_graph_path(args.library, args.remove_book).unlink(missing_ok=True)
+            library_suggest_path(args.library, args.remove_book).unlink(missing_ok=True)
+            print(f"✅ Removed {args.remove_book} ({removed} vectors) from {args.library}")
+            return 0
+        
+        if args.import_textbook:
+            library = import_textbooks_to_library(args.library, args.import_textbook)
+            update_library_summaries(args.library, add=summarize_library_books(library, args.import_textbook))
+            if args.related:
+                write_library_related(library, args.import_textbook, args.related, args.threads)
+            for book_id in args.import_textbook:
+                write_suggestions(library_suggest_path(args.library, book_id), library.metadata[book_id])
+            print(f"✅ Library saved to {args.library}: {len(library.books)} books, {library.index.ntotal} vectors")
+            return 0
+        
         # Load and validate chunks
         print("=" * 50)
         print("🚀 Starting FAISS Index Creation")
@@ -294,26 +845,44 @@ Examples:
             return 1
         
         # Load embedding model
-        model = load_embedding_model(args.model)
+        model = load_embedding_model(args.model, args.encoder, args.onnx_dir)
         
         # Generate embeddings
-        embeddings = generate_embeddings(model, valid_chunks, args.batch_size)
-        
-        # Create FAISS index
-        index = create_faiss_index(embeddings, args.index_type)
+        if args.embed_mode == 'sentence':
+            embeddings = generate_pooled_embeddings(model, valid_chunks, args.batch_size)
+            if args.validate_sample > 0:
+                check_pooled_embeddings(model, valid_chunks, embeddings, args.validate_sample, args.batch_size)
+        else:
+            embeddings = generate_embeddings(model, valid_chunks, args.batch_size)
         
         # Create metadata mapping
         metadata_mapping = create_metadata_mapping(valid_chunks)
         
-        # Generate output filenames
-        index_file = f"{args.output_prefix}_index.faiss"
-        metadata_pickle = f"{args.output_prefix}_metadata.pkl"
-        metadata_json = f"{args.output_prefix}_metadata.json"
+        if args.library:
+            book_id = args.book_id or Path(args.output_prefix).name
+            info = {"textbook_name": args.textbook_name or book_id}
+            if args.description:
+                info["description"] = args.description
+            library = load_or_create_library(args.library, embeddings.shape[1], args.index_type, args.model)
+            library.add_book(book_id, embeddings, metadata_mapping, info)
+            library.save()
+            update_library_summaries(args.library, add=summarize_library_books(library, [book_id]))
+            if args.related:
+                write_library_related(library, [book_id], args.related, args.threads)
+            write_suggestions(library_suggest_path(args.library, book_id), library.metadata[book_id])
+            print(f"✅ Added {book_id} to library {args.library}: {len(library.books)} books, {library.index.ntotal} vectors")
+            return 0
         
-        # Save files
-        save_faiss_index(index, index_file)
-        save_metadata_mapping(metadata_mapping, metadata_pickle)
-        save_metadata_json(metadata_mapping, metadata_json)
+        if args.publish:
+            book_id = args.book_id or Path(args.output_prefix).name
+            files = publish_book_index(
+                args.publish, book_id, embeddings, metadata_mapping, args.model, args.index_type,
+                args.textbook_name, args.description, args.keep_versions, args.related, args.threads
+            )
+        else:
+            files = save_book_index(
+                args.output_prefix, embeddings, metadata_mapping, args.model, args.index_type, args.related, args.threads
+            )
         
         # Print summary
         print("\n" + "=" * 50)
@@ -324,15 +893,22 @@ Examples:
         print(f"🔍 Index type: {args.index_type.upper()}")
         print(f"🤖 Model: {args.model}")
         print("\n📁 Output files:")
-        print(f"   • FAISS index: {index_file}")
-        print(f"   • Metadata (pickle): {metadata_pickle}")
-        print(f"   • Metadata (JSON): {metadata_json}")
+        print(f"   • FAISS index: {files['index']}")
+        print(f"   • Metadata (pickle): {files['metadata']}")
+        print(f"   • Metadata (JSON): {files['metadata_json']}")
+        print(f"   • Manifest: {files['manifest']}")
+        if 'related' in files:
+            print(f"   • Related passages: {files['related']}")
+        print(f"   • Query suggestions: {files['suggestions']}")
         
         return 0
     
     except Exception as e:
         print(f"\n❌ Error: {str(e)}")
         return 1
+    
+    finally:
+        profile.stop()
 
 
 if __name__ == "__main__":
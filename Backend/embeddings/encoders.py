@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+"""
+Pluggable Query/Chunk Encoders for Textbook Chatbot
+
+Two interchangeable backends produce the same embeddings:
+    torch - sentence-transformers on PyTorch (default)
+    onnx  - an exported copy of the model run with onnxruntime, optionally
+            int8-quantized; avoids importing torch at all
+
+Usage:
+    python encoders.py export --model all-MiniLM-L6-v2 --output onnx/all-MiniLM-L6-v2
+    python encoders.py export --model all-MiniLM-L6-v2 --output onnx/all-MiniLM-L6-v2-int8 --quantize
+    python encoders.py parity --onnx_dir onnx/all-MiniLM-L6-v2 --chunks economics_chunks.json
+    python encoders.py benchmark --encoder onnx --onnx_dir onnx/all-MiniLM-L6-v2
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+ENCODER_CONFIG_FILE = "encoder_config.json"
+ONNX_MODEL_FILE = "model.onnx"
+ONNX_QUANTIZED_FILE = "model_int8.onnx"
+
+DEFAULT_SAMPLE_QUERIES = [
+    "What is machine learning?",
+    "Explain the difference between supervised and unsupervised learning",
+    "How does TCP congestion control work?",
+    "What is the law of demand?",
+    "backpropagation",
+    "Describe the role of the network layer in routing packets between hosts",
+    "opportunity cost",
+    "What are the advantages of decision trees over linear models?"
+]
+
+
+class TorchEncoder:
+    """sentence-transformers encoder running on PyTorch."""
+
+    backend = "torch"
+
+    def __init__(self, model_name: str):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise ImportError("sentence-transformers is required. Install it with: pip install sentence-transformers")
+
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name)
+        self.dimension = self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        """Encode texts into a float32 matrix of shape (len(texts), dimension)."""
+        embeddings = self.model.encode(
+            texts,
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            show_progress_bar=False
+        )
+        return np.asarray(embeddings, dtype=np.float32)
+
+    def set_threads(self, threads: int):
+        """Limit torch intra-op threads (e.g. one per pre-forked worker)."""
+        # sentence-transformers has imported torch; importing it here in a
+        # forked worker would give the worker a private copy of the library
+        torch = sys.modules.get('torch')
+        if torch is not None:
+            torch.set_num_threads(threads)
+
+
+class OnnxEncoder:
+    """
+    Exported sentence-transformers model run with onnxruntime.
+
+    Reproduces the sentence-transformers pipeline (tokenize, transformer,
+    pooling, optional L2 normalization) from the settings saved at export.
+    """
+
+    backend = "onnx"
+
+    def __init__(self, onnx_dir: str, quantized: Optional[bool] = None, threads: int = 0):
+        """
+        Load an exported encoder.
+
+        Args:
+            onnx_dir: Directory written by export_onnx()
+            quantized: Use the int8 model (default: whatever export produced)
+            threads: onnxruntime intra-op threads (0 = runtime default)
+        """
+        try:
+            import onnxruntime as ort
+            from tokenizers import Tokenizer
+        except ImportError:
+            raise ImportError("onnxruntime and tokenizers are required. Install them with: pip install onnxruntime tokenizers")
+
+        self.onnx_dir = Path(onnx_dir)
+        config_path = self.onnx_dir / ENCODER_CONFIG_FILE
+        if not config_path.exists():
+            raise FileNotFoundError(f"Encoder config not found: {config_path} (run: python encoders.py export)")
+
+        with open(config_path, 'r', encoding='utf-8') as f:
+            self.config = json.load(f)
+
+        self.model_name = self.config['model_name']
+        self.dimension = self.config['dimension']
+        self.pooling = self.config['pooling']
+        self.normalize = self.config['normalize']
+
+        if quantized is None:
+            quantized = self.config.get('quantized', False)
+        model_file = ONNX_QUANTIZED_FILE if quantized else ONNX_MODEL_FILE
+        self.quantized = quantized
+
+        self._ort = ort
+        self.model_path = self.onnx_dir / model_file
+        self.threads = threads
+        self.session = self._create_session(threads)
+        self._session_pid = os.getpid()
+        self.input_names = {node.name for node in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(str(self.onnx_dir / "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.config['max_seq_length'])
+        self.tokenizer.enable_padding(pad_id=self.config['pad_token_id'], pad_token=self.config['pad_token'])
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        """Encode texts into a float32 matrix of shape (len(texts), dimension)."""
+        if isinstance(texts, str):
+            texts = [texts]
+
+        batches = []
+        for start in range(0, len(texts), batch_size):
+            encodings = self.tokenizer.encode_batch(list(texts[start:start + batch_size]))
+            input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+            attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+
+            inputs = {'input_ids': input_ids, 'attention_mask': attention_mask}
+            if 'token_type_ids' in self.input_names:
+                inputs['token_type_ids'] = np.zeros_like(input_ids)
+
+            token_embeddings = self.session.run(None, inputs)[0]
+            batches.append(self._pool(token_embeddings, attention_mask))
+
+        if not batches:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        return np.vstack(batches).astype(np.float32)
+
+    def _create_session(self, threads: int = 0):
+        ort = self._ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        return ort.InferenceSession(str(self.model_path), sess_options=options, providers=['CPUExecutionProvider'])
+
+    def set_threads(self, threads: int):
+        """
+        Recreate the session with the given number of intra-op threads.
+
+        A no-op when the count is unchanged and the session still works in
+        this process: one created here, or a single-threaded one, which
+        has no thread pool to lose in fork(). Sizing the session before
+        forking therefore lets workers share it copy-on-write; a session
+        with a pool is rebuilt after fork(), since the pool's threads are
+        not copied into the child.
+        """
+        if threads == self.threads and (threads == 1 or self._session_pid == os.getpid()):
+            return
+        self.session = self._create_session(threads)
+        self.threads = threads
+        self._session_pid = os.getpid()
+
+    def _pool(self, token_embeddings: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        mask = attention_mask[..., None].astype(np.float32)
+        if self.pooling == 'cls':
+            pooled = token_embeddings[:, 0]
+        elif self.pooling == 'max':
+            pooled = np.where(mask > 0, token_embeddings, -1e9).max(axis=1)
+        else:
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+        if self.normalize:
+            norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+            pooled = pooled / np.clip(norms, 1e-12, None)
+        return pooled
+
+
+def load_encoder(backend: str = "torch", model_name: str = "all-MiniLM-L6-v2", onnx_dir: Optional[str] = None):
+    """
+    Create an encoder for the given backend.
+
+    Args:
+        backend: 'torch' or 'onnx'
+        model_name: sentence-transformers model (torch backend)
+        onnx_dir: Exported model directory (onnx backend)
+    """
+    if backend == "torch":
+        return TorchEncoder(model_name)
+
+    if backend == "onnx":
+        if not onnx_dir:
+            raise ValueError("onnx_dir is required for the onnx encoder backend")
+        encoder = OnnxEncoder(onnx_dir)
+        if encoder.model_name != model_name:
+            raise ValueError(
+                f"ONNX export in {onnx_dir} is for '{encoder.model_name}', but the index was built with '{model_name}'"
+            )
+        return encoder
+
+    raise ValueError(f"Unsupported encoder backend: {backend}")
+
+
+def export_onnx(model_name: str, output_dir: str, quantize: bool = False, opset: int = 14) -> Dict[str, Any]:
+    """
+    Export a sentence-transformers model to ONNX.
+
+    Writes model.onnx (and model_int8.onnx if quantize), tokenizer.json and
+    encoder_config.json with the pooling settings needed to reproduce the
+    sentence-transformers embeddings.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer, models
+
+    output_path = Path(output_dir)
+    output_path.mkdir(parents=True, exist_ok=True)
+
+    st_model = SentenceTransformer(model_name, device='cpu')
+    transformer = st_model[0]
+    pooling = next((m for m in st_model if isinstance(m, models.Pooling)), None)
+    normalize = any(isinstance(m, models.Normalize) for m in st_model)
+
+    pooling_mode = 'mean'
+    if pooling is not None:
+        pooling_config = pooling.get_config_dict()
+        if pooling_config.get('pooling_mode_cls_token'):
+            pooling_mode = 'cls'
+        elif pooling_config.get('pooling_mode_max_tokens'):
+            pooling_mode = 'max'
+
+    tokenizer = transformer.tokenizer
+    auto_model = transformer.auto_model.eval()
+
+    sample = tokenizer(["export sample"], return_tensors='pt')
+    input_names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in sample]
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+    dynamic_axes['last_hidden_state'] = {0: 'batch', 1: 'sequence'}
+
+    class HiddenStates(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *args):
+            return self.model(**dict(zip(input_names, args)))[0]
+
+    with torch.no_grad():
+        torch.onnx.export(
+            HiddenStates(auto_model),
+            tuple(sample[name] for name in input_names),
+            str(output_path / ONNX_MODEL_FILE),
+            input_names=input_names,
+            output_names=['last_hidden_state'],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset
+        )
+
+    tokenizer.save_pretrained(str(output_path))
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantize_dynamic(
+            str(output_path / ONNX_MODEL_FILE),
+            str(output_path / ONNX_QUANTIZED_FILE),
+            weight_type=QuantType.QInt8
+        )
+
+    config = {
+        "model_name": model_name,
+        "dimension": st_model.get_sentence_embedding_dimension(),
+        "max_seq_length": st_model.max_seq_length,
+        "pooling": pooling_mode,
+        "normalize": normalize,
+        "pad_token": tokenizer.pad_token,
+        "pad_token_id": tokenizer.pad_token_id,
+        "quantized": quantize,
+        "opset": opset
+    }
+    with open(output_path / ENCODER_CONFIG_FILE, 'w', encoding='utf-8') as f:
+        json.dump(config, f, indent=2)
+
+    return config
+
+
+def parity_check(
+    model_name: str,
+    onnx_dir: str,
+    texts: List[str],
+    quantized: Optional[bool] = None,
+    tolerance: float = 1e-3
+) -> Dict[str, Any]:
+    """
+    Compare ONNX embeddings with the torch path on the same texts.
+
+    Existing indices stay valid if every embedding's cosine similarity to
+    its torch counterpart is at least 1 - tolerance.
+    """
+    torch_embeddings = TorchEncoder(model_name).encode(texts)
+    onnx_embeddings = OnnxEncoder(onnx_dir, quantized=quantized).encode(texts)
+
+    def unit(matrix):
+        return matrix / np.clip(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12, None)
+
+    cosine = (unit(torch_embeddings) * unit(onnx_embeddings)).sum(axis=1)
+    max_abs = np.abs(torch_embeddings - onnx_embeddings).max(axis=1)
+
+    return {
+        "model_name": model_name,
+        "onnx_dir": str(onnx_dir),
+        "quantized": bool(quantized),
+        "texts": len(texts),
+        "min_cosine": round(float(cosine.min()), 6),
+        "mean_cosine": round(float(cosine.mean()), 6),
+        "max_abs_diff": round(float(max_abs.max()), 6),
+        "tolerance": tolerance,
+        "passed": bool(cosine.min() >= 1 - tolerance)
+    }
+
+
+def benchmark_encoder(encoder, queries: List[str], repeats: int = 20) -> Dict[str, Any]:
+    """Per-query encode latency (one query per call, as in search)."""
+    encoder.encode(queries[:1])  # warm up
+
+    latencies = []
+    for _ in range(repeats):
+        for query in queries:
+            start = time.perf_counter()
+            encoder.encode([query])
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    latencies.sort()
+    return {
+        "backend": encoder.backend,
+        "quantized": getattr(encoder, 'quantized', False),
+        "calls": len(latencies),
+        "p50_ms": round(latencies[len(latencies) // 2], 3),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95)], 3),
+        "mean_ms": round(sum(latencies) / len(latencies), 3)
+    }
+
+
+def load_sample_texts(chunks_file: Optional[str], samples: int) -> List[str]:
+    """Sample chunk texts from a chunks JSON file, or use built-in queries."""
+    if not chunks_file:
+        return list(DEFAULT_SAMPLE_QUERIES)
+    with open(chunks_file, 'r', encoding='utf-8') as f:
+        chunks = json.load(f)
+    step = max(1, len(chunks) // samples)
+    return [chunk['text'] for chunk in chunks[::step][:samples]] + list(DEFAULT_SAMPLE_QUERIES)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export, verify and benchmark embedding encoders",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python encoders.py export --model all-MiniLM-L6-v2 --output onnx/all-MiniLM-L6-v2 --quantize
+  python encoders.py parity --onnx_dir onnx/all-MiniLM-L6-v2 --chunks economics_chunks.json
+  python encoders.py parity --onnx_dir onnx/all-MiniLM-L6-v2 --quantized --tolerance 0.02
+  python encoders.py benchmark --encoder onnx --onnx_dir onnx/all-MiniLM-L6-v2
+        """
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help='Export a model to ONNX')
+    export_parser.add_argument('--model', '-m', default='all-MiniLM-L6-v2', help='Sentence transformer model name')
+    export_parser.add_argument('--output', '-o', required=True, help='Output directory')
+    export_parser.add_argument('--quantize', action='store_true', help='Also write an int8-quantized model')
+
+    parity_parser = subparsers.add_parser('parity', help='Compare ONNX and torch embeddings')
+    parity_parser.add_argument('--model', '-m', default='all-MiniLM-L6-v2', help='Sentence transformer model name')
+    parity_parser.add_argument('--onnx_dir', required=True, help='Exported model directory')
+    parity_parser.add_argument('--quantized', action='store_true', help='Check the int8 model')
+    parity_parser.add_argument('--chunks', help='Chunks JSON file to sample texts from')
+    parity_parser.add_argument('--samples', type=int, default=200, help='Number of chunk texts (default: 200)')
+    parity_parser.add_argument('--tolerance', type=float, default=1e-3,
+                               help='Allowed 1 - cosine similarity (default: 0.001)')
+
+    bench_parser = subparsers.add_parser('benchmark', help='Measure per-query encode latency')
+    bench_parser.add_argument('--encoder', choices=['torch', 'onnx'], default='torch', help='Encoder backend')
+    bench_parser.add_argument('--model', '-m', default='all-MiniLM-L6-v2', help='Sentence transformer model name')
+    bench_parser.add_argument('--onnx_dir', help='Exported model directory (onnx backend)')
+    bench_parser.add_argument('--quantized', action='store_true', help='Use the int8 model (onnx backend)')
+    bench_parser.add_argument('--repeats', type=int, default=20, help='Passes over the query set (default: 20)')
+
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'export':
+            config = export_onnx(args.model, args.output, args.quantize)
+            print(json.dumps({"status": "exported", "output": args.output, **config}, indent=2))
+            return 0
+
+        if args.command == 'parity':
+            texts = load_sample_texts(args.chunks, args.samples)
+            report = parity_check(args.model, args.onnx_dir, texts, args.quantized or None, args.tolerance)
+            print(json.dumps(report, indent=2))
+            return 0 if report["passed"] else 1
+
+        if args.command == 'benchmark':
+            start = time.perf_counter()
+            if args.encoder == 'onnx':
+                encoder = OnnxEncoder(args.onnx_dir, quantized=args.quantized or None)
+            else:
+                encoder = TorchEncoder(args.model)
+            load_ms = (time.perf_counter() - start) * 1000
+            report = benchmark_encoder(encoder, DEFAULT_SAMPLE_QUERIES, args.repeats)
+            report["load_ms"] = round(load_ms, 1)
+            print(json.dumps(report, indent=2))
+            return 0
+
+    except Exception as e:
+        print(json.dumps({"error": str(e)}))
+        return 1
+
+
+if __name__ == "__main__":
+    exit(main())
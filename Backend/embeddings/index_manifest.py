@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Integrity Manifests for Textbook Indices
+
+embedding_indexer.py writes <id>_manifest.json next to every index it
+builds (the unified library keeps the same fields under "integrity" in
+library.json):
+
+    {
+      "vector_count": 2732, "dimension": 384, "metric": "l2",
+      "model_name": "all-MiniLM-L6-v2", "metadata_count": 2732,
+      "files": {
+        "index":    {"name": ..., "size": ..., "fingerprint": ..., "sha256": ...},
+        "metadata": {...}
+      }
+    }
+
+A quick check reads only the fixed-size FAISS header (fourcc, dimension,
+vector count, metric) and a fingerprint hash of each file's size, first and
+last 64 KB, so its cost does not grow with the index. A deep check also
+recomputes the full SHA-256 of both files. Only the standard library is
+used, so the catalog can validate without importing faiss or numpy.
+
+Usage:
+    python index_manifest.py indices/economics_index.faiss
+    python textbook_catalog.py --validate --deep
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import struct
+from datetime import datetime
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+
+MANIFEST_SUFFIX = "_manifest.json"
+
+# Bytes hashed from each end of a file by file_fingerprint()
+FINGERPRINT_BLOCK = 64 * 1024
+
+# Header written by faiss::write_index for every index type: fourcc, then
+# d (int32), ntotal (int64), two unused int64s, is_trained (uint8) and
+# metric_type (int32)
+INDEX_HEADER = struct.Struct('<4siqqqBi')
+
+# faiss.METRIC_INNER_PRODUCT and faiss.METRIC_L2
+METRIC_NAMES = {0: "ip", 1: "l2"}
+
+# embedding_indexer.py --index_type to FAISS metric
+INDEX_TYPE_METRICS = {"flat": "l2", "ip": "ip"}
+
+
+def read_index_header(path: Path) -> Dict[str, Any]:
+    """
+    Read dimension, vector count and metric from a FAISS index file
+    without deserializing it.
+
+    Raises:
+        ValueError: If the file is too short to hold a header
+    """
+    with open(path, 'rb') as f:
+        data = f.read(INDEX_HEADER.size)
+    if len(data) < INDEX_HEADER.size:
+        raise ValueError(f"Truncated FAISS header in {Path(path).name}")
+
+    fourcc, dimension, vector_count, _, _, _, metric = INDEX_HEADER.unpack(data)
+    return {
+        "fourcc": fourcc.decode('latin-1'),
+        "dimension": dimension,
+        "vector_count": vector_count,
+        "metric": METRIC_NAMES.get(metric, str(metric))
+    }
+
+
+def file_fingerprint(path: Path) -> str:
+    """SHA-256 of a file's size plus its first and last FINGERPRINT_BLOCK bytes."""
+    digest = hashlib.sha256()
+    size = os.path.getsize(path)
+    digest.update(str(size).encode('ascii'))
+    with open(path, 'rb') as f:
+        digest.update(f.read(FINGERPRINT_BLOCK))
+        if size > FINGERPRINT_BLOCK:
+            f.seek(max(FINGERPRINT_BLOCK, size - FINGERPRINT_BLOCK))
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def file_sha256(path: Path) -> str:
+    """Full SHA-256 of a file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def describe_file(path: Path) -> Dict[str, Any]:
+    """Manifest entry for one file."""
+    path = Path(path)
+    return {
+        "name": path.name,
+        "size": path.stat().st_size,
+        "fingerprint": file_fingerprint(path),
+        "sha256": file_sha256(path)
+    }
+
+
+def build_manifest(
+    index_path: Path,
+    metadata_path: Path,
+    metadata_count: int,
+    model_name: str
+) -> Dict[str, Any]:
+    """Manifest for an index and metadata pickle that have just been written."""
+    header = read_index_header(index_path)
+    return {
+        "vector_count": header["vector_count"],
+        "dimension": header["dimension"],
+        "metric": header["metric"],
+        "model_name": model_name,
+        "metadata_count": metadata_count,
+        "files": {
+            "index": describe_file(index_path),
+            "metadata": describe_file(metadata_path)
+        },
+        "created_at": datetime.now().isoformat(timespec='seconds')
+    }
+
+
+def manifest_path_for(index_path: Path) -> Path:
+    """<prefix>_manifest.json for <prefix>_index.faiss."""
+    index_path = Path(index_path)
+    return index_path.with_name(index_path.name[:-len("_index.faiss")] + MANIFEST_SUFFIX)
+
+
+def write_manifest(path: Path, manifest: Dict[str, Any]):
+    """Write a manifest atomically."""
+    path = Path(path)
+    temp_path = path.with_name(path.name + f".{os.getpid()}.tmp")
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temp_path, path)
+
+
+def load_manifest(path: Path) -> Optional[Dict[str, Any]]:
+    """Load a manifest, or None if missing or invalid."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        return manifest if isinstance(manifest, dict) and isinstance(manifest.get("files"), dict) else None
+    except (OSError, ValueError):
+        return None
+
+
+def check_files(
+    manifest: Dict[str, Any],
+    index_path: Path,
+    metadata_path: Path,
+    deep: bool = False
+) -> List[str]:
+    """
+    Check an index and metadata pickle against their manifest.
+
+    Args:
+        manifest: Manifest (or library "integrity" section)
+        index_path: FAISS index file
+        metadata_path: Metadata pickle
+        deep: Also compare the full SHA-256 of both files
+
+    Returns:
+        Error messages; empty if the files match
+    """
+    errors = []
+
+    for kind, path in (("index", Path(index_path)), ("metadata", Path(metadata_path))):
+        expected = manifest["files"].get(kind)
+        if not expected:
+            errors.append(f"Manifest has no entry for the {kind} file")
+            continue
+        if not path.exists():
+            continue  # Reported as missing by the caller
+        size = path.stat().st_size
+        if size != expected.get("size"):
+            errors.append(f"{path.name} is {size} bytes, manifest says {expected.get('size')}")
+        elif file_fingerprint(path) != expected.get("fingerprint"):
+            errors.append(f"{path.name} content does not match manifest fingerprint")
+        elif deep and file_sha256(path) != expected.get("sha256"):
+            errors.append(f"{path.name} content does not match manifest SHA-256")
+
+    if Path(index_path).exists():
+        try:
+            header = read_index_header(index_path)
+        except (OSError, ValueError) as e:
+            return errors + [str(e)]
+        for key in ("vector_count", "dimension", "metric"):
+            if key in manifest and header[key] != manifest[key]:
+                errors.append(f"Index {key} is {header[key]}, manifest says {manifest[key]}")
+
+    if "metadata_count" in manifest and manifest["metadata_count"] != manifest.get("vector_count"):
+        errors.append(
+            f"Manifest lists {manifest['metadata_count']} metadata entries for {manifest.get('vector_count')} vectors"
+        )
+
+    return errors
+
+
+def check_config(config: Dict[str, Any], vector_count: int, manifest: Optional[Dict[str, Any]] = None) -> List[str]:
+    """Check a textbook config against the index it describes."""
+    errors = []
+    total_chunks = config.get("total_chunks")
+    if isinstance(total_chunks, int) and total_chunks != vector_count:
+        errors.append(f"Config total_chunks is {total_chunks}, index holds {vector_count} vectors")
+
+    if manifest:
+        model_name = config.get("model_name")
+        if model_name and manifest.get("model_name") and model_name != manifest["model_name"]:
+            errors.append(f"Config model_name is {model_name}, index was built with {manifest['model_name']}")
+        metric = INDEX_TYPE_METRICS.get(config.get("index_type"))
+        if metric and manifest.get("metric") and metric != manifest["metric"]:
+            errors.append(f"Config index_type is {config['index_type']}, index metric is {manifest['metric']}")
+
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Write or check the integrity manifest of a FAISS index",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python index_manifest.py indices/economics_index.faiss
+  python index_manifest.py indices/economics_index.faiss --deep
+  python index_manifest.py indices/economics_index.faiss --write --model all-MiniLM-L6-v2
+        """
+    )
+
+    parser.add_argument('index', help='FAISS index file (<prefix>_index.faiss)')
+    parser.add_argument('--deep', action='store_true', help='Also compare full SHA-256 hashes')
+    parser.add_argument('--write', action='store_true', help='Write a manifest for an existing index and metadata pickle')
+    parser.add_argument('--model', default='all-MiniLM-L6-v2', help='Model name recorded by --write (default: all-MiniLM-L6-v2)')
+
+    args = parser.parse_args()
+
+    index_path = Path(args.index)
+    metadata_path = index_path.with_name(index_path.name[:-len("_index.faiss")] + "_metadata.pkl")
+    manifest_path = manifest_path_for(index_path)
+
+    try:
+        if args.write:
+            import pickle
+            with open(metadata_path, 'rb') as f:
+                metadata_count = len(pickle.load(f))
+            write_manifest(manifest_path, build_manifest(index_path, metadata_path, metadata_count, args.model))
+            print(f"Manifest written to: {manifest_path}")
+            return 0
+
+        manifest = load_manifest(manifest_path)
+        if manifest is None:
+            print(f"No manifest: {manifest_path}")
+            return 1
+        errors = check_files(manifest, index_path, metadata_path, args.deep)
+        for error in errors:
+            print(f"error: {error}")
+        print("OK" if not errors else "INVALID")
+        return 0 if not errors else 1
+
+    except Exception as e:
+        print(f"ERROR: {str(e)}")
+        return 1
+
+
+if __name__ == "__main__":
+    exit(main())
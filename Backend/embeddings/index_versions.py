@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Versioned Index Publishing for Textbook Chatbot
+
+Each published build of a textbook index lives in its own directory and a
+small pointer file names the version being served:
+
+    indices/economics.versions/20250101-120000-000000/economics_index.faiss
+                                                     /economics_metadata.pkl
+                                                     /economics_config.json
+                                                     /economics_manifest.json
+    indices/economics_current.json   {"version": "...", "path": "economics.versions/..."}
+
+A version is written completely before the pointer is replaced with an
+atomic rename, so readers see either the old or the new version, never a
+mix. The search service polls the pointers and swaps new versions in
+without a restart (search_service.py --reload_interval).
+
+Usage:
+    python embedding_indexer.py -i economics_chunks.json --publish indices --book_id economics
+    python index_versions.py --list economics
+    python index_versions.py --rollback economics 20250101-120000-000000
+    python index_versions.py --prune economics --keep 2
+"""
+
+import argparse
+import json
+import os
+import shutil
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
+
+from index_manifest import check_files, load_manifest, manifest_path_for
+from textbook_catalog import VERSIONS_SUFFIX, current_version, version_pointer_path
+
+
+def versions_root(indices_dir: str, textbook_id: str) -> Path:
+    """Directory holding every version of a textbook."""
+    return Path(indices_dir) / f"{textbook_id}{VERSIONS_SUFFIX}"
+
+
+def new_version_dir(indices_dir: str, textbook_id: str) -> Path:
+    """Create an empty directory for a new, unpublished version."""
+    version = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    path = versions_root(indices_dir, textbook_id) / version
+    path.mkdir(parents=True)
+    return path
+
+
+def list_versions(indices_dir: str, textbook_id: str) -> List[str]:
+    """Versions of a textbook, oldest first."""
+    root = versions_root(indices_dir, textbook_id)
+    if not root.exists():
+        return []
+    return sorted(path.name for path in root.iterdir() if path.is_dir())
+
+
+def publish_version(indices_dir: str, textbook_id: str, version: str):
+    """Point a textbook at an existing, intact version with an atomic rename."""
+    version_dir = versions_root(indices_dir, textbook_id) / version
+    index_path = version_dir / f"{textbook_id}_index.faiss"
+    if not index_path.exists():
+        raise FileNotFoundError(f"No index for {textbook_id} in version {version}")
+
+    manifest = load_manifest(manifest_path_for(index_path))
+    errors = check_files(manifest, index_path, version_dir / f"{textbook_id}_metadata.pkl") if manifest else []
+    if errors:
+        raise ValueError(f"Version {version} of {textbook_id} failed integrity check: {'; '.join(errors)}")
+
+    pointer_path = version_pointer_path(indices_dir, textbook_id)
+    temp_path = pointer_path.with_name(pointer_path.name + f".{os.getpid()}.tmp")
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            "version": version,
+            "path": str(version_dir.relative_to(indices_dir)),
+            "published_at": datetime.now().isoformat(timespec='seconds')
+        }, f, indent=2)
+    os.replace(temp_path, pointer_path)
+
+
+def prune_versions(indices_dir: str, textbook_id: str, keep: int = 3) -> List[str]:
+    """
+    Delete old versions, keeping the newest `keep` and the published one.
+
+    Returns:
+        Removed version names
+    """
+    pointer = current_version(indices_dir, textbook_id)
+    published: Optional[str] = pointer['version'] if pointer else None
+    versions = list_versions(indices_dir, textbook_id)
+
+    removed = []
+    for version in versions[:max(0, len(versions) - keep)]:
+        if version == published:
+            continue
+        shutil.rmtree(versions_root(indices_dir, textbook_id) / version, ignore_errors=True)
+        removed.append(version)
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="List, roll back and prune published textbook index versions",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python index_versions.py --list economics
+  python index_versions.py --rollback economics 20250101-120000-000000
+  python index_versions.py --prune economics --keep 2
+        """
+    )
+
+    parser.add_argument('--list', metavar='ID', help='List versions of a textbook')
+    parser.add_argument('--rollback', nargs=2, metavar=('ID', 'VERSION'), help='Publish an earlier version')
+    parser.add_argument('--prune', metavar='ID', help='Delete old unpublished versions')
+    parser.add_argument('--keep', type=int, default=3, help='Versions kept by --prune (default: 3)')
+    parser.add_argument(
+        '--indices_dir',
+        default='indices',
+        help='Directory containing FAISS indices and metadata (default: indices)'
+    )
+
+    args = parser.parse_args()
+
+    try:
+        if args.rollback:
+            textbook_id, version = args.rollback
+            publish_version(args.indices_dir, textbook_id, version)
+            print(f"Published {textbook_id} version {version}")
+        elif args.prune:
+            removed = prune_versions(args.indices_dir, args.prune, args.keep)
+            print(f"Removed {len(removed)} version(s) of {args.prune}")
+        elif args.list:
+            pointer = current_version(args.indices_dir, args.list)
+            for version in list_versions(args.indices_dir, args.list):
+                marker = "*" if pointer and pointer['version'] == version else " "
+                print(f"{marker} {version}")
+        else:
+            parser.print_help()
+        return 0
+
+    except Exception as e:
+        print(f"ERROR: {str(e)}")
+        return 1
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+Batch Ingestion of a Directory of PDF Textbooks
+
+Runs the whole pipeline for every PDF in a directory, replacing the manual
+text_extraction.py -> chunk_text.py -> embedding_indexer.py steps and the
+hand-written config:
+
+    extract + chunk   <book>_cleaned.txt, <book>_chunks_sliding.json   worker processes,
+                      and <book>_ingest.log in --work_dir               --workers books at once
+    embed + index     index, metadata, config and sidecars              this process, one model
+                      in --indices_dir
+
+Extraction and chunking are CPU-bound Python, so books are prepared in a
+process pool. Embedding stays in this process with the model loaded once;
+it takes each book as soon as it is prepared while the pool works on the
+rest. A book that fails (or crashes its worker) is reported and skipped,
+and the others are still indexed.
+
+The book ID is the PDF name in lowercase with runs of other characters than
+letters and digits replaced by '_' ("Intro to ML.pdf" -> intro_to_ml).
+
+Usage:
+    python ingest_textbooks.py --pdf_dir ../pdf_processing
+    python ingest_textbooks.py --pdf_dir pdfs --workers 4 --publish
+    python ingest_textbooks.py --pdf_dir pdfs --skip_existing --related 0
+"""
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+
+# The extraction and chunking scripts live in ../pdf_processing
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "pdf_processing"))
+from chunk_text import (  # noqa: E402
+    create_sliding_window_chunks, ensure_nltk_data, save_chunks_json, strip_markers, tokenize_sentences_with_locations
+)
+from text_extraction import PDFTextExtractor  # noqa: E402
+
+from embedding_indexer import (  # noqa: E402
+    build_config, create_metadata_mapping, generate_embeddings, generate_pooled_embeddings, load_chunks_json,
+    load_embedding_model, publish_book_index, save_book_index, validate_chunks
+)
+from profiling import add_profile_arguments, start_profile  # noqa: E402
+from related_chunks import DEFAULT_NEIGHBORS  # noqa: E402
+from textbook_catalog import current_version, load_config  # noqa: E402
+
+
+def book_id_for(pdf_path: Path) -> str:
+    """Textbook ID from a PDF file name."""
+    return re.sub(r'[^a-z0-9]+', '_', pdf_path.stem.lower()).strip('_')
+
+
+def prepare_book(
+    pdf_path: str,
+    book_id: str,
+    work_dir: str,
+    method: str = 'both',
+    window_size: int = 3,
+    step_size: int = 1
+) -> Dict[str, Any]:
+    """
+    Extract and chunk one PDF; runs in a worker process.
+
+    The scripts' progress output goes to <book_id>_ingest.log in work_dir.
+
+    Returns:
+        {"chunks_path": ..., "chunks": chunk count, "seconds": ...}
+    """
+    start = time.perf_counter()
+    work_path = Path(work_dir)
+    text_path = work_path / f"{book_id}_cleaned.txt"
+    chunks_path = work_path / f"{book_id}_chunks_sliding.json"
+
+    with open(work_path / f"{book_id}_ingest.log", 'w', encoding='utf-8') as log, contextlib.redirect_stdout(log):
+        text = PDFTextExtractor().extract_and_clean(pdf_path, str(text_path), method)
+
+        ensure_nltk_data()
+        text, markers = strip_markers(text)
+        sentences, locations = tokenize_sentences_with_locations(text, markers)
+        if not sentences:
+            raise ValueError("No sentences found in the extracted text")
+
+        chunks = create_sliding_window_chunks(sentences, window_size, step_size, text_path.name, locations)
+        if not chunks:
+            raise ValueError("No chunks were created")
+        save_chunks_json(chunks, str(chunks_path))
+
+    return {"chunks_path": str(chunks_path), "chunks": len(chunks), "seconds": time.perf_counter() - start}
+
+
+class BookIndexer:
+    """Embeds and indexes prepared books with one shared model."""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.model = None
+
+    def index_book(self, book_id: str, pdf_path: Path, chunks_path: str) -> Dict[str, Any]:
+        """
+        Embed a prepared book and write its index, metadata and config.
+
+        Returns:
+            {"chunks": indexed chunk count, "seconds": ...}
+        """
+        args = self.args
+        start = time.perf_counter()
+        valid_chunks = validate_chunks(load_chunks_json(chunks_path))
+        if not valid_chunks:
+            raise ValueError("No valid chunks to index")
+
+        # Loaded on the first book that gets this far
+        if self.model is None:
+            self.model = load_embedding_model(args.model, args.encoder, args.onnx_dir)
+        if args.embed_mode == 'sentence':
+            embeddings = generate_pooled_embeddings(self.model, valid_chunks, args.batch_size)
+        else:
+            embeddings = generate_embeddings(self.model, valid_chunks, args.batch_size)
+        metadata_mapping = create_metadata_mapping(valid_chunks)
+
+        # Re-ingesting a book keeps the name and description it was given
+        existing = load_config(args.indices_dir, book_id) or {}
+        textbook_name = existing.get("textbook_name") or pdf_path.stem.replace('_', ' ')
+
+        if args.publish:
+            publish_book_index(
+                args.indices_dir, book_id, embeddings, metadata_mapping, args.model, args.index_type,
+                textbook_name, None, args.keep_versions, args.related, args.threads
+            )
+        else:
+            save_book_index(
+                str(Path(args.indices_dir) / book_id), embeddings, metadata_mapping, args.model, args.index_type,
+                args.related, args.threads
+            )
+            config = build_config(
+                args.indices_dir, book_id, len(metadata_mapping), args.model, args.index_type, textbook_name
+            )
+            config_path = Path(args.indices_dir) / f"{book_id}_config.json"
+            with open(config_path, 'w', encoding='utf-8') as file:
+                json.dump(config, file, indent=2)
+            print(f"✅ Config saved to: {config_path}")
+
+        return {"chunks": len(metadata_mapping), "seconds": time.perf_counter() - start}
+
+
+def find_pdfs(pdf_dir: str) -> Dict[str, Path]:
+    """PDFs of a directory by book ID, in name order."""
+    books: Dict[str, Path] = {}
+    for pdf_path in sorted(Path(pdf_dir).iterdir()):
+        if pdf_path.suffix.lower() != '.pdf' or not pdf_path.is_file():
+            continue
+        book_id = book_id_for(pdf_path)
+        if not book_id:
+            print(f"⚠️  Skipping {pdf_path.name}: no usable textbook ID in its name")
+        elif book_id in books:
+            print(f"⚠️  Skipping {pdf_path.name}: textbook ID {book_id} already taken by {books[book_id].name}")
+        else:
+            books[book_id] = pdf_path
+    return books
+
+
+def ingest(args: argparse.Namespace, books: Dict[str, Path]) -> Dict[str, Dict[str, Any]]:
+    """
+    Prepare books in a process pool and index each as it finishes.
+
+    Returns:
+        Per book ID: {"status": "indexed"|"failed", "stage": ..., "error": ...,
+        "chunks": ..., "prepare_seconds": ..., "index_seconds": ...}
+    """
+    indexer = BookIndexer(args)
+    results: Dict[str, Dict[str, Any]] = {}
+    total = len(books)
+    # Spawned workers do not inherit the state of an already loaded model
+    context = multiprocessing.get_context('spawn')
+
+    def finish(book_id: str, prepared: Optional[Dict[str, Any]], error: Optional[BaseException]):
+        done = len(results) + 1
+        if error is not None:
+            results[book_id] = {"status": "failed", "stage": "prepare", "error": str(error) or type(error).__name__}
+            print(f"❌ [{done}/{total}] {book_id}: extraction/chunking failed: {results[book_id]['error']}")
+            return
+        print(f"🔄 [{done}/{total}] {book_id}: {prepared['chunks']} chunks prepared in {prepared['seconds']:.1f}s, indexing")
+        result = {"prepare_seconds": round(prepared["seconds"], 1)}
+        try:
+            indexed = indexer.index_book(book_id, books[book_id], prepared["chunks_path"])
+        except Exception as e:
+            results[book_id] = {**result, "status": "failed", "stage": "index", "error": str(e)}
+            print(f"❌ [{done}/{total}] {book_id}: indexing failed: {str(e)}")
+            return
+        results[book_id] = {
+            **result, "status": "indexed", "chunks": indexed["chunks"], "index_seconds": round(indexed["seconds"], 1)
+        }
+        print(f"✅ [{done}/{total}] {book_id}: indexed {indexed['chunks']} chunks in {indexed['seconds']:.1f}s")
+
+    def submit(pool: ProcessPoolExecutor, book_id: str):
+        return pool.submit(
+            prepare_book, str(books[book_id]), book_id, args.work_dir, args.method, args.window_size, args.step_size
+        )
+
+    crashed: List[str] = []
+    with ProcessPoolExecutor(max_workers=min(args.workers, total), mp_context=context) as pool:
+        futures = {submit(pool, book_id): book_id for book_id in books}
+        for future in as_completed(futures):
+            book_id = futures[future]
+            try:
+                prepared = future.result()
+            except BrokenProcessPool:
+                crashed.append(book_id)
+                continue
+            except Exception as e:
+                finish(book_id, None, e)
+                continue
+            finish(book_id, prepared, None)
+
+    # A worker that died (e.g. in the PDF library) takes the pool's pending
+    # books with it; retry each alone so only the culprit fails
+    for book_id in crashed:
+        print(f"⚠️  {book_id}: worker pool broke, retrying in its own process")
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            try:
+                prepared = submit(pool, book_id).result()
+            except BrokenProcessPool:
+                finish(book_id, None, RuntimeError("the worker process crashed"))
+                continue
+            except Exception as e:
+                finish(book_id, None, e)
+                continue
+        finish(book_id, prepared, None)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Extract, chunk, embed and index every PDF textbook in a directory",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python ingest_textbooks.py --pdf_dir ../pdf_processing
+  python ingest_textbooks.py --pdf_dir pdfs --workers 4 --publish
+  python ingest_textbooks.py --pdf_dir pdfs --skip_existing --related 0
+  python ingest_textbooks.py --pdf_dir pdfs --work_dir processed --report ingest_report.json
+        """
+    )
+
+    parser.add_argument('--pdf_dir', required=True, help='Directory containing the PDF textbooks')
+    parser.add_argument(
+        '--indices_dir',
+        default='indices',
+        help='Directory the indices, metadata and configs are written to (default: indices)'
+    )
+    parser.add_argument(
+        '--work_dir',
+        help='Directory for cleaned text, chunks and per-book logs (default: --pdf_dir)'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=os.cpu_count() or 1,
+        help='Books extracted and chunked at once (default: one per core)'
+    )
+    parser.add_argument(
+        '--skip_existing',
+        action='store_true',
+        help='Skip books that already have a config in --indices_dir'
+    )
+    parser.add_argument(
+        '--publish',
+        action='store_true',
+        help='Publish each book as a new version (picked up by a running search_service.py)'
+    )
+    parser.add_argument('--keep_versions', type=int, default=3, help='Versions kept per book with --publish (default: 3)')
+    parser.add_argument('--report', help='Also write the per-book results to this JSON file')
+
+    parser.add_argument('--method', choices=['pypdf2', 'pymupdf', 'both'], default='both', help='Extraction method (default: both)')
+    parser.add_argument('--window_size', '-w', type=int, default=3, help='Number of sentences per chunk (default: 3)')
+    parser.add_argument('--step_size', '-s', type=int, default=1, help='Step size for sliding window (default: 1)')
+
+    parser.add_argument('--model', '-m', default='all-MiniLM-L6-v2', help='Sentence transformer model name (default: all-MiniLM-L6-v2)')
+    parser.add_argument('--encoder', choices=['torch', 'onnx'], default='torch', help='Encoder backend (default: torch)')
+    parser.add_argument('--onnx_dir', help='Exported ONNX model directory for --encoder onnx (see encoders.py export)')
+    parser.add_argument(
+        '--index_type',
+        choices=['flat', 'ip'],
+        default='flat',
+        help='FAISS index type: flat (L2) or ip (inner product/cosine) (default: flat)'
+    )
+    parser.add_argument('--batch_size', type=int, default=32, help='Batch size for embedding generation (default: 32)')
+    parser.add_argument(
+        '--embed_mode',
+        choices=['chunk', 'sentence'],
+        default='chunk',
+        help='chunk: encode every chunk text; sentence: pool sliding windows from sentence vectors (default: chunk)'
+    )
+    parser.add_argument(
+        '--related',
+        type=int,
+        default=DEFAULT_NEIGHBORS,
+        help=f'Related passages precomputed per chunk; 0 skips the all-chunks search (default: {DEFAULT_NEIGHBORS})'
+    )
+    parser.add_argument('--threads', type=int, default=0, help='FAISS threads for the related passages search (default: one per core)')
+
+    add_profile_arguments(parser)
+
+    args = parser.parse_args()
+
+    if args.workers <= 0:
+        parser.error("--workers must be positive")
+    if args.window_size <= 0 or args.step_size <= 0:
+        parser.error("--window_size and --step_size must be positive")
+    if args.related < 0:
+        parser.error("--related cannot be negative")
+    if not Path(args.pdf_dir).is_dir():
+        parser.error(f"--pdf_dir is not a directory: {args.pdf_dir}")
+    args.work_dir = args.work_dir or args.pdf_dir
+
+    profile = start_profile(args, __file__)
+
+    try:
+        Path(args.indices_dir).mkdir(parents=True, exist_ok=True)
+        Path(args.work_dir).mkdir(parents=True, exist_ok=True)
+
+        books = find_pdfs(args.pdf_dir)
+        if not books:
+            print(f"❌ No PDFs found in {args.pdf_dir}")
+            return 1
+        if args.skip_existing:
+            existing = [book_id for book_id in books if load_config(args.indices_dir, book_id) is not None]
+            for book_id in existing:
+                print(f"⏭️  Skipping {book_id}: already in {args.indices_dir}")
+                del books[book_id]
+            if not books:
+                print(f"✅ Every textbook in {args.pdf_dir} is already ingested")
+                return 0
+
+        # Plain files of a versioned book would be hidden by its published version
+        versioned = [book_id for book_id in books if current_version(args.indices_dir, book_id)]
+        if versioned and not args.publish:
+            print(f"❌ Published as versions in {args.indices_dir}, ingest with --publish: {', '.join(versioned)}")
+            return 1
+
+        print("=" * 50)
+        print(f"🚀 Ingesting {len(books)} textbooks with {min(args.workers, len(books))} workers")
+        print("=" * 50)
+
+        start = time.perf_counter()
+        results = ingest(args, books)
+        seconds = time.perf_counter() - start
+
+        failed = {book_id: result for book_id, result in results.items() if result["status"] == "failed"}
+        indexed = len(results) - len(failed)
+
+        print("\n" + "=" * 50)
+        print(f"{'✅' if not failed else '⚠️ '} INGESTED {indexed} of {len(results)} TEXTBOOKS in {seconds:.1f}s")
+        print("=" * 50)
+        for book_id, result in sorted(results.items()):
+            if result["status"] == "indexed":
+                print(f"   • {book_id}: {result['chunks']} chunks")
+            else:
+                print(f"   • {book_id}: FAILED ({result['stage']}): {result['error']}")
+        if failed:
+            print(f"\n💡 Logs of failed books are in {args.work_dir}/<book>_ingest.log")
+
+        if args.report:
+            with open(args.report, 'w', encoding='utf-8') as file:
+                json.dump({"seconds": round(seconds, 1), "books": results}, file, indent=2)
+            print(f"📄 Report saved to: {args.report}")
+
+        return 1 if failed else 0
+
+    except Exception as e:
+        print(f"\n❌ Error: {str(e)}")
+        return 1
+
+    finally:
+        profile.stop()
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Unified Multi-Book Index for Textbook Chatbot
+
+Stores every textbook in one FAISS index instead of one index per book:
+
+    library.json   manifest: model, dimension, index type and, per book,
+                   its config fields plus the ID range it occupies; under
+                   "integrity", the header fields and hashes of the other
+                   two files (see index_manifest.py)
+    library.faiss  IndexIDMap2 holding all chunk vectors
+    library.pkl    chunk store: per book, the metadata list in local order,
+                   each entry tagged with its 'textbook_id'
+
+A book with N chunks occupies the contiguous IDs [id_base, id_base + N), so
+searching one book is a FAISS search with an IDSelectorRange and searching
+all books is a single unfiltered call. Books are added at the end of the ID
+space and removed with remove_ids, so adding or removing one book never
+touches the vectors of the others.
+
+Books are managed with embedding_indexer.py:
+    python embedding_indexer.py -i economics_chunks.json --library indices --book_id economics
+    python embedding_indexer.py --library indices --import_textbook intro_ml
+    python embedding_indexer.py --library indices --remove_book economics
+"""
+
+import json
+import os
+import pickle
+from datetime import datetime
+from pathlib import Path
+from typing import List, Dict, Any, Tuple, Optional
+
+import faiss
+import numpy as np
+
+from index_manifest import build_manifest, check_files
+from textbook_catalog import library_files, load_library_manifest
+
+
+class TextbookLibrary:
+    """One FAISS index and chunk store shared by many textbooks."""
+
+    def __init__(self, indices_dir: str = "indices"):
+        self.indices_dir = Path(indices_dir)
+        self.files = library_files(indices_dir)
+        self.manifest: Optional[Dict[str, Any]] = None
+        self.index: Optional[faiss.Index] = None
+        self.metadata: Dict[str, List[Dict[str, Any]]] = {}
+
+    def exists(self) -> bool:
+        return all(path.exists() for path in self.files.values())
+
+    @property
+    def books(self) -> Dict[str, Dict[str, Any]]:
+        return self.manifest["books"] if self.manifest else {}
+
+    def create(self, dimension: int, index_type: str = "flat", model_name: str = "all-MiniLM-L6-v2"):
+        """Start an empty library."""
+        if index_type == "flat":
+            base_index = faiss.IndexFlatL2(dimension)
+        elif index_type == "ip":
+            base_index = faiss.IndexFlatIP(dimension)
+        else:
+            raise ValueError(f"Unsupported index type: {index_type}")
+
+        self.index = faiss.IndexIDMap2(base_index)
+        self.metadata = {}
+        self.manifest = {
+            "model_name": model_name,
+            "index_type": index_type,
+            "dimension": dimension,
+            "next_id": 0,
+            "books": {}
+        }
+        return self
+
+    def load(self) -> 'TextbookLibrary':
+        """Load the manifest, index and chunk store from indices_dir."""
+        self.manifest = load_library_manifest(str(self.indices_dir))
+        if self.manifest is None:
+            raise FileNotFoundError(f"Library manifest not found or invalid: {self.files['manifest']}")
+
+        # Libraries saved before integrity manifests existed skip the check
+        integrity = self.manifest.get("integrity")
+        errors = check_files(integrity, self.files["index"], self.files["metadata"]) if integrity else []
+        if errors:
+            raise ValueError(f"Library in {self.indices_dir} failed integrity check: {'; '.join(errors)}")
+
+        try:
+            self.index = faiss.read_index(str(self.files["index"]))
+            with open(self.files["metadata"], 'rb') as file:
+                self.metadata = pickle.load(file)
+        except Exception as e:
+            raise Exception(f"Error loading library from {self.indices_dir}: {str(e)}")
+
+        chunk_count = sum(len(entries) for entries in self.metadata.values())
+        if chunk_count != self.index.ntotal:
+            raise ValueError(f"Library holds {self.index.ntotal} vectors but {chunk_count} metadata entries")
+
+        return self
+
+    def id_range(self, book_id: str) -> Tuple[int, int]:
+        """First ID and chunk count of a book."""
+        if book_id not in self.books:
+            raise KeyError(f"Textbook not in library: {book_id}")
+        book = self.books[book_id]
+        return book["id_base"], book["total_chunks"]
+
+    def book_vectors(self, book_id: str) -> np.ndarray:
+        """A book's stored vectors in local order (normalized for "ip" libraries)."""
+        id_base, count = self.id_range(book_id)
+        ids = faiss.vector_to_array(self.index.id_map)
+        positions = np.flatnonzero((ids >= id_base) & (ids < id_base + count))
+        positions = positions[np.argsort(ids[positions])]
+        return self.index.index.reconstruct_batch(positions)
+
+    def add_book(
+        self,
+        book_id: str,
+        embeddings: np.ndarray,
+        metadata: List[Dict[str, Any]],
+        info: Optional[Dict[str, Any]] = None
+    ):
+        """
+        Add a book, replacing it if already present.
+
+        Args:
+            book_id: Textbook ID
+            embeddings: One vector per metadata entry
+            metadata: Metadata mapping from create_metadata_mapping()
+            info: Config fields (textbook_name, description, ...) for the manifest
+        """
+        if len(embeddings) != len(metadata):
+            raise ValueError(f"{len(embeddings)} embeddings for {len(metadata)} metadata entries")
+        if embeddings.shape[1] != self.manifest["dimension"]:
+            raise ValueError(
+                f"Embedding dimension {embeddings.shape[1]} does not match library dimension {self.manifest['dimension']}"
+            )
+
+        if book_id in self.books:
+            self.remove_book(book_id)
+
+        vectors = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if self.manifest["index_type"] == "ip":
+            faiss.normalize_L2(vectors)
+
+        id_base = self.manifest["next_id"]
+        self.index.add_with_ids(vectors, np.arange(id_base, id_base + len(vectors), dtype=np.int64))
+        self.metadata[book_id] = [{**entry, 'textbook_id': book_id} for entry in metadata]
+
+        self.manifest["books"][book_id] = {
+            "textbook_name": book_id,
+            "description": "No description available",
+            **(info or {}),
+            "model_name": self.manifest["model_name"],
+            "total_chunks": len(metadata),
+            "id_base": id_base,
+            "created_at": datetime.now().isoformat(timespec='seconds')
+        }
+        self.manifest["next_id"] = id_base + len(vectors)
+
+    def remove_book(self, book_id: str) -> int:
+        """Remove a book's vectors and metadata; returns the number removed."""
+        id_base, count = self.id_range(book_id)
+        removed = self.index.remove_ids(faiss.IDSelectorRange(id_base, id_base + count))
+        del self.metadata[book_id]
+        del self.manifest["books"][book_id]
+        return int(removed)
+
+    def save(self):
+        """Write index and chunk store, then the manifest with their hashes, each atomically."""
+        self.indices_dir.mkdir(parents=True, exist_ok=True)
+
+        index_temp = self._temp_path(self.files["index"])
+        faiss.write_index(self.index, str(index_temp))
+        os.replace(index_temp, self.files["index"])
+
+        metadata_temp = self._temp_path(self.files["metadata"])
+        with open(metadata_temp, 'wb') as file:
+            pickle.dump(self.metadata, file)
+        os.replace(metadata_temp, self.files["metadata"])
+
+        chunk_count = sum(len(entries) for entries in self.metadata.values())
+        self.manifest["integrity"] = build_manifest(
+            self.files["index"], self.files["metadata"], chunk_count, self.manifest["model_name"]
+        )
+
+        manifest_temp = self._temp_path(self.files["manifest"])
+        with open(manifest_temp, 'w', encoding='utf-8') as file:
+            json.dump(self.manifest, file, indent=2)
+        os.replace(manifest_temp, self.files["manifest"])
+
+    @staticmethod
+    def _temp_path(path: Path) -> Path:
+        return path.with_name(path.name + f".{os.getpid()}.tmp")
+
+
+def load_or_create_library(
+    indices_dir: str,
+    dimension: int,
+    index_type: str = "flat",
+    model_name: str = "all-MiniLM-L6-v2"
+) -> TextbookLibrary:
+    """
+    Load the library in indices_dir for updating, or start a new one.
+
+    Raises:
+        ValueError: If an existing library uses another model, dimension or index type
+    """
+    library = TextbookLibrary(indices_dir)
+    if not library.exists():
+        return library.create(dimension, index_type, model_name)
+
+    library.load()
+    expected = {"model_name": model_name, "dimension": dimension, "index_type": index_type}
+    for key, value in expected.items():
+        if library.manifest[key] != value:
+            raise ValueError(f"Library {key} is {library.manifest[key]}, not {value}")
+    return library
+
+
+_open_libraries: Dict[str, TextbookLibrary] = {}
+
+
+def open_library(indices_dir: str = "indices") -> TextbookLibrary:
+    """Load a library once per process; searchers for its books share it."""
+    key = str(Path(indices_dir).resolve())
+    if key not in _open_libraries:
+        _open_libraries[key] = TextbookLibrary(indices_dir).load()
+    return _open_libraries[key]
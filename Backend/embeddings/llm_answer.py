@@ -2,12 +2,57 @@
 """
 LLM Answer Generation Script
 Usage: python llm_answer.py "user query" "chunk1" "chunk2" "chunk3" "chunk4" "chunk5"
+       python llm_answer.py --stream "user query" "chunk1" "chunk2" ...
+       python llm_answer.py --textbook intro_ml -- "user query" "chunk1" ...
+
+Options (must come before the query):
+    --stream          Emit JSON lines while the answer is generated
+    --textbook ID     Textbook the chunks came from (scopes semantic cache hits)
+    --no-cache        Bypass the answer cache
+    --                End of options: everything after it is the query and
+                      chunks, even a query that looks like an option
+
+With --stream the answer is emitted as JSON lines while it is generated:
+    {"type": "start", "api_used": ..., "model_used": ...}
+    {"type": "delta", "content": "..."}            (repeated)
+    {"type": "done", "answer": ..., "status": "success", ...}
+or a single {"type": "error", ...} line if no provider could answer.
+
+Environment:
+    LLM_HEDGE_MODE        'hedged' (default) or 'sequential'
+    LLM_HEDGE_PERCENTILE  Primary latency percentile after which the secondary
+                          provider is fired (default: 95)
+    LLM_HEDGE_DEADLINE    Maximum seconds to wait before hedging (default: 8)
+    TOGETHER_API_URL      Override the Together.ai endpoint (e.g. a local mock)
+    OPENROUTER_API_URL    Override the OpenRouter endpoint (e.g. a local mock)
+    LLM_PROMPT_BUDGET     Token budget for textbook excerpts in the prompt;
+                          '0' disables budgeting (default: 2000)
+    LLM_TOKENIZER_PATH    Local tokenizer.json used to count prompt tokens
+    LLM_CACHE             '0' disables the answer cache (default: enabled)
+    LLM_CACHE_PATH        SQLite file for cached answers
+    LLM_CACHE_TTL         Seconds a cached answer stays valid (default: 7 days)
+    LLM_CACHE_MAX_ENTRIES Entries kept before LRU eviction (default: 5000)
+    LLM_CACHE_SEMANTIC    '1' enables embedding-based lookup (default: disabled);
+                          needs --textbook and the search service, which
+                          embeds the query with the textbook's encoder
+    LLM_CACHE_THRESHOLD   Minimum cosine similarity for a semantic hit (default: 0.95)
+    SEARCH_SERVICE_HOST   Search service host (default: 127.0.0.1)
+    SEARCH_SERVICE_PORT   Search service port (set by server.js's environment)
+
+check_llm_providers.py runs this script against local mock endpoints to check
+fallback and hedging; provider_stats.py shows the recorded latency statistics.
 """
 
 import sys
+import base64
 import json
+import queue
+import socket
+import threading
+import time
+import numpy as np
 import requests
-from typing import List
+from typing import List, Dict, Any, Tuple, Optional, Iterator
 
 import os
 from dotenv import load_dotenv
@@ -16,14 +61,39 @@ load_dotenv()  # Load environment variables from .env
 TOGETHER_API_KEY = os.getenv('TOGETHER_API_KEY')
 OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY')
 
+TOGETHER_API_URL = os.getenv('TOGETHER_API_URL', 'https://api.together.xyz/v1/chat/completions')
+OPENROUTER_API_URL = os.getenv('OPENROUTER_API_URL', 'https://openrouter.ai/api/v1/chat/completions')
+
+TOGETHER_MODEL = 'mistralai/Mistral-7B-Instruct-v0.1'
+OPENROUTER_MODEL = 'mistralai/mistral-7b-instruct'
+
+HEDGE_MODE = os.getenv('LLM_HEDGE_MODE', 'hedged')
+HEDGE_PERCENTILE = float(os.getenv('LLM_HEDGE_PERCENTILE', '95'))
+HEDGE_DEADLINE = float(os.getenv('LLM_HEDGE_DEADLINE', '8'))
+
+# Bump whenever a prompt template changes so cached answers are not reused
+PROMPT_VERSION = 2
+
+# Part of the answer cache key too: another budget fits other excerpts
+PROMPT_BUDGET = int(os.getenv('LLM_PROMPT_BUDGET', '2000'))
+
+CACHE_SEMANTIC = os.getenv('LLM_CACHE_SEMANTIC', '0') == '1'
+SEARCH_SERVICE_HOST = os.getenv('SEARCH_SERVICE_HOST', '127.0.0.1')
+SEARCH_SERVICE_PORT = os.getenv('SEARCH_SERVICE_PORT')
+# Seconds to wait for the search service to embed the query
+EMBED_TIMEOUT = 2.0
+
+from provider_stats import ProviderStats
+from answer_cache import AnswerCache
+from token_budget import TokenCounter, fit_excerpts
+
 from dotenv import load_dotenv
 load_dotenv()  # Load environment variables from .env
-def call_together_ai(chunks: List[str], user_query: str) -> str:
-    """Call Together.ai API for answer generation"""
-    try:
-        excerpts = '\n\n'.join([f"{i+1}. \"{chunk}\"" for i, chunk in enumerate(chunks)])
+def build_together_request(chunks: List[str], user_query: str) -> Tuple[str, Dict[str, str], Dict[str, Any]]:
+    """Build the Together.ai (url, headers, payload) for a chat completion"""
+    excerpts = '\n\n'.join([f"{i+1}. \"{chunk}\"" for i, chunk in enumerate(chunks)])
 
-        prompt = f"""Based ONLY on the following textbook excerpts, answer the user's question in a clear, comprehensive way. Provide detailed explanations and examples when relevant. Do not add any external information.
+    prompt = f"""Based ONLY on the following textbook excerpts, answer the user's question in a clear, comprehensive way. Provide detailed explanations and examples when relevant. Do not add any external information.
 
 Textbook Excerpts:
 {excerpts}
@@ -32,26 +102,33 @@ Question: {user_query}
 
 Please provide a thorough answer based solely on the information provided above."""
 
-        headers = {
-            'Authorization': f'Bearer {TOGETHER_API_KEY}',
-            'Content-Type': 'application/json'
-        }
+    headers = {
+        'Authorization': f'Bearer {TOGETHER_API_KEY}',
+        'Content-Type': 'application/json'
+    }
+
+    payload = {
+        'model': TOGETHER_MODEL,
+        'messages': [
+            {'role': 'user', 'content': prompt}
+        ],
+        'max_tokens': 800,
+        'temperature': 0.3,
+        'top_p': 0.9
+    }
+
+    return TOGETHER_API_URL, headers, payload
 
-        payload = {
-            'model': 'mistralai/Mistral-7B-Instruct-v0.1',
-            'messages': [
-                {'role': 'user', 'content': prompt}
-            ],
-            'max_tokens': 800,
-            'temperature': 0.3,
-            'top_p': 0.9
-        }
 
+def call_together_ai(chunks: List[str], user_query: str, timeout: float = 60) -> str:
+    """Call Together.ai API for answer generation"""
+    try:
+        url, headers, payload = build_together_request(chunks, user_query)
         response = requests.post(
-            'https://api.together.xyz/v1/chat/completions',
+            url,
             headers=headers,
             json=payload,
-            timeout=60
+            timeout=timeout
         )
         response.raise_for_status()
         data = response.json()
@@ -61,12 +138,11 @@ Please provide a thorough answer based solely on the information provided above.
         raise Exception(f"Together.ai API error: {str(e)}")
 
 
-def call_openrouter(chunks: List[str], user_query: str) -> str:
-    """Call OpenRouter API for answer generation"""
-    try:
-        excerpts = '\n\n'.join([f"{i+1}. \"{chunk}\"" for i, chunk in enumerate(chunks)])
+def build_openrouter_request(chunks: List[str], user_query: str) -> Tuple[str, Dict[str, str], Dict[str, Any]]:
+    """Build the OpenRouter (url, headers, payload) for a chat completion"""
+    excerpts = '\n\n'.join([f"{i+1}. \"{chunk}\"" for i, chunk in enumerate(chunks)])
 
-        prompt = f"""You are an expert tutor helping students understand concepts directly from their textbooks.
+    prompt = f"""You are an expert tutor helping students understand concepts directly from their textbooks.
 
 Instructions: Based only on the following textbook excerpts, answer the user's question in a clear, structured, and detailed manner.
 
@@ -86,28 +162,35 @@ User Question:
 
 Answer:"""
 
-        headers = {
-            'Authorization': f'Bearer {OPENROUTER_API_KEY}',
-            'Content-Type': 'application/json',
-            'HTTP-Referer': 'http://localhost:3000',
-            'X-Title': 'Textbook Search Assistant'
-        }
+    headers = {
+        'Authorization': f'Bearer {OPENROUTER_API_KEY}',
+        'Content-Type': 'application/json',
+        'HTTP-Referer': 'http://localhost:3000',
+        'X-Title': 'Textbook Search Assistant'
+    }
 
-        payload = {
-            'model': 'mistralai/mistral-7b-instruct',
-            'messages': [
-                {'role': 'user', 'content': prompt}
-            ],
-            'max_tokens': 800,
-            'temperature': 0.3,
-            'top_p': 0.9
-        }
+    payload = {
+        'model': OPENROUTER_MODEL,
+        'messages': [
+            {'role': 'user', 'content': prompt}
+        ],
+        'max_tokens': 800,
+        'temperature': 0.3,
+        'top_p': 0.9
+    }
+
+    return OPENROUTER_API_URL, headers, payload
 
+
+def call_openrouter(chunks: List[str], user_query: str, timeout: float = 60) -> str:
+    """Call OpenRouter API for answer generation"""
+    try:
+        url, headers, payload = build_openrouter_request(chunks, user_query)
         response = requests.post(
-            'https://openrouter.ai/api/v1/chat/completions',
+            url,
             headers=headers,
             json=payload,
-            timeout=60
+            timeout=timeout
         )
         response.raise_for_status()
         data = response.json()
@@ -117,8 +200,289 @@ Answer:"""
         raise Exception(f"OpenRouter API error: {str(e)}")
 
 
+def stream_chat_completion(
+    url: str,
+    headers: Dict[str, str],
+    payload: Dict[str, Any],
+    timeout: float = 60
+) -> Iterator[str]:
+    """
+    Stream a chat completion over server-sent events.
+
+    Yields content deltas as they arrive. Both Together.ai and OpenRouter use
+    the OpenAI-compatible SSE format ("data: {...}" lines ending in
+    "data: [DONE]"); OpenRouter also sends ": comment" keep-alive lines.
+    """
+    payload = dict(payload, stream=True)
+    with requests.post(url, headers=headers, json=payload, timeout=timeout, stream=True) as response:
+        response.raise_for_status()
+        # chunk_size=None yields each transfer chunk as it arrives instead of
+        # waiting to fill a 512-byte buffer
+        for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+            if not line or not line.startswith('data:'):
+                continue
+            data = line[len('data:'):].strip()
+            if data == '[DONE]':
+                break
+            event = json.loads(data)
+            if 'error' in event:
+                raise Exception(event['error'].get('message', str(event['error'])))
+            choices = event.get('choices') or [{}]
+            content = (choices[0].get('delta') or {}).get('content')
+            if content:
+                yield content
+
+
+def stream_together_ai(chunks: List[str], user_query: str, timeout: float = 60) -> Iterator[str]:
+    """Stream an answer from Together.ai"""
+    try:
+        url, headers, payload = build_together_request(chunks, user_query)
+        yield from stream_chat_completion(url, headers, payload, timeout)
+    except Exception as e:
+        raise Exception(f"Together.ai API error: {str(e)}")
+
+
+def stream_openrouter(chunks: List[str], user_query: str, timeout: float = 60) -> Iterator[str]:
+    """Stream an answer from OpenRouter"""
+    try:
+        url, headers, payload = build_openrouter_request(chunks, user_query)
+        yield from stream_chat_completion(url, headers, payload, timeout)
+    except Exception as e:
+        raise Exception(f"OpenRouter API error: {str(e)}")
+
+
+# (api_used name, label for error details, call function) in priority order
+PROVIDERS = [
+    ('together.ai', 'Together.ai', call_together_ai),
+    ('openrouter', 'OpenRouter', call_openrouter)
+]
+
+PROVIDER_MODELS = {
+    'together.ai': TOGETHER_MODEL,
+    'openrouter': OPENROUTER_MODEL
+}
+
+STREAM_PROVIDERS = [
+    ('together.ai', 'Together.ai', stream_together_ai),
+    ('openrouter', 'OpenRouter', stream_openrouter)
+]
+
+
+def call_sequential(
+    chunks: List[str],
+    user_query: str,
+    stats: ProviderStats
+) -> Tuple[Optional[str], Optional[str], List[str]]:
+    """Try each provider in order, moving on only when one fails."""
+    error_details = []
+
+    for name, label, call in PROVIDERS:
+        start = time.monotonic()
+        try:
+            answer = call(chunks, user_query)
+            stats.record_success(name, time.monotonic() - start)
+            return answer, name, error_details
+        except Exception as e:
+            stats.record_error(name)
+            error_details.append(f"{label} failed: {str(e)}")
+
+    return None, None, error_details
+
+
+def call_hedged(
+    chunks: List[str],
+    user_query: str,
+    stats: ProviderStats
+) -> Tuple[Optional[str], Optional[str], List[str]]:
+    """
+    Race providers, firing the next one when the current one is slow or fails.
+
+    The next provider is started once the most recently started one has run
+    longer than its recorded latency percentile (capped at the hedge deadline),
+    or immediately when it fails. The first successful answer wins; providers
+    still in flight are abandoned and recorded as cancelled.
+
+    Returns:
+        Tuple of (answer, api_used, error_details)
+    """
+    results = queue.Queue()
+    in_flight = {}
+    error_details = []
+    next_provider = 0
+
+    def run(name, label, call):
+        start = time.monotonic()
+        try:
+            answer = call(chunks, user_query)
+            results.put((name, label, answer, None, time.monotonic() - start))
+        except Exception as e:
+            results.put((name, label, None, str(e), time.monotonic() - start))
+
+    def launch():
+        nonlocal next_provider
+        name, label, call = PROVIDERS[next_provider]
+        next_provider += 1
+        hedge_at = time.monotonic() + stats.hedge_delay(name, HEDGE_PERCENTILE, HEDGE_DEADLINE)
+        in_flight[name] = hedge_at
+        # Daemon threads so an abandoned request never delays process exit
+        threading.Thread(target=run, args=(name, label, call), daemon=True).start()
+
+    launch()
+
+    while in_flight:
+        wait = None
+        if next_provider < len(PROVIDERS):
+            wait = max(0.0, min(in_flight.values()) - time.monotonic())
+
+        try:
+            name, label, answer, error, latency = results.get(timeout=wait)
+        except queue.Empty:
+            launch()
+            continue
+
+        del in_flight[name]
+
+        if answer:
+            stats.record_success(name, latency)
+            for loser in in_flight:
+                stats.record_cancelled(loser)
+            return answer, name, error_details
+
+        stats.record_error(name)
+        error_details.append(f"{label} failed: {error or 'empty answer'}")
+        if next_provider < len(PROVIDERS):
+            launch()
+
+    return None, None, error_details
+
+
+def emit(event: Dict[str, Any]):
+    """Write one JSON line and flush so the caller sees it immediately."""
+    print(json.dumps(event), flush=True)
+
+
+def stream_answer(
+    chunks: List[str],
+    user_query: str,
+    stats: ProviderStats,
+    prompt_report: Optional[Dict[str, Any]] = None
+) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Stream an answer as JSON lines, falling back to the next provider only
+    if the current one fails before producing any content.
+
+    Returns:
+        Tuple of (answer, api_used), both None if no answer was streamed
+    """
+    error_details = []
+
+    for name, label, stream in STREAM_PROVIDERS:
+        start = time.monotonic()
+        parts = []
+        try:
+            for delta in stream(chunks, user_query):
+                if not parts:
+                    emit({"type": "start", "api_used": name, "model_used": PROVIDER_MODELS[name]})
+                parts.append(delta)
+                emit({"type": "delta", "content": delta})
+        except Exception as e:
+            stats.record_error(name)
+            error_details.append(f"{label} failed: {str(e)}")
+            if parts:
+                # Content already reached the client; switching providers
+                # mid-answer would produce a garbled response.
+                break
+            continue
+
+        if not parts:
+            stats.record_error(name)
+            error_details.append(f"{label} failed: empty answer")
+            continue
+
+        stats.record_success(name, time.monotonic() - start)
+        answer = ''.join(parts).strip()
+        emit({
+            "type": "done",
+            "answer": answer,
+            "api_used": name,
+            "model_used": PROVIDER_MODELS[name],
+            "chunks_processed": (prompt_report or {}).get("excerpts_in", len(chunks)),
+            "query": user_query,
+            "status": "success",
+            "cached": False,
+            "prompt": prompt_report
+        })
+        return answer, name
+
+    emit({
+        "type": "error",
+        "error": "All LLM APIs failed",
+        "details": error_details,
+        "query": user_query,
+        "chunks_provided": len(chunks)
+    })
+    return None, None
+
+
+def embed_query(user_query: str, textbook: Optional[str]) -> Optional[np.ndarray]:
+    """
+    Embed the query for semantic cache lookup, or None if unavailable.
+
+    The resident search service already holds the textbook's encoder, so it
+    is asked for the embedding (op "encode") rather than loading a model in
+    every llm_answer.py run. Without the service only exact cache hits apply.
+    """
+    if not CACHE_SEMANTIC or not textbook or not SEARCH_SERVICE_PORT:
+        return None
+    try:
+        request = {"op": "encode", "textbook": textbook, "text": user_query.strip()}
+        with socket.create_connection((SEARCH_SERVICE_HOST, int(SEARCH_SERVICE_PORT)), timeout=EMBED_TIMEOUT) as sock:
+            sock.sendall((json.dumps(request) + '\n').encode('utf-8'))
+            response = json.loads(sock.makefile('r', encoding='utf-8').readline())
+        return np.frombuffer(base64.b64decode(response['vector']), dtype='<f4')
+    except Exception:
+        return None
+
+
+def open_cache() -> Optional[AnswerCache]:
+    """Open the answer cache; a broken cache must never block answering."""
+    try:
+        return AnswerCache.from_env()
+    except Exception:
+        return None
+
+
+def parse_options(argv: List[str]) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    Split leading --options from the query and chunk arguments.
+
+    Options end at '--' or at the first argument that is not one; callers
+    passing user text put '--' before it, so a query that reads like an
+    option ("--stream") stays the query.
+    """
+    options = {"stream": False, "textbook": None, "cache": True}
+    args = list(argv)
+    while args and args[0].startswith('--'):
+        option = args.pop(0)
+        if option == '--':
+            break
+        if option == '--stream':
+            options["stream"] = True
+        elif option == '--no-cache':
+            options["cache"] = False
+        elif option == '--textbook' and args:
+            options["textbook"] = args.pop(0)
+        else:
+            args.insert(0, option)
+            break
+    return options, args
+
+
 def main():
     try:
+        options, args = parse_options(sys.argv[1:])
+        sys.argv[1:] = args
+
         if len(sys.argv) < 3:
             result = {
                 "error": "Insufficient arguments",
@@ -141,24 +505,71 @@ def main():
             print(json.dumps(result))
             sys.exit(1)
 
-        answer = None
-        api_used = None
-        error_details = []
+        textbook = options["textbook"]
+        cache = open_cache() if options["cache"] else None
+        embedding = embed_query(user_query, textbook) if cache else None
 
-        # Try Together.ai first
-        try:
-            answer = call_together_ai(chunks, user_query)
-            api_used = 'together.ai'
-        except Exception as e:
-            error_details.append(f"Together.ai failed: {str(e)}")
-
-        # If Together.ai fails, try OpenRouter
-        if not answer:
+        cached = None
+        if cache:
+            try:
+                cached = cache.get(
+                    [TOGETHER_MODEL, OPENROUTER_MODEL], PROMPT_VERSION, PROMPT_BUDGET,
+                    chunks, user_query, textbook, embedding
+                )
+            except Exception:
+                cached = None
+
+        if cached:
+            result = {
+                "answer": cached["answer"],
+                "api_used": cached["api_used"],
+                "model_used": cached["model"],
+                "chunks_processed": len(chunks),
+                "query": user_query,
+                "status": "success",
+                "cached": True,
+                "cache_match": cached["match"]
+            }
+            if options["stream"]:
+                emit({"type": "start", "api_used": cached["api_used"], "model_used": cached["model"]})
+                emit({"type": "delta", "content": cached["answer"]})
+                emit({"type": "done", **result})
+            else:
+                print(json.dumps(result))
+            return
+
+        raw_chunks = chunks
+        # Without a budget nothing is counted, so no tokenizer is loaded
+        prompt_report = {"budget": None}
+        if PROMPT_BUDGET > 0:
+            counter = TokenCounter(TOGETHER_MODEL)
+            fitted = fit_excerpts(chunks, PROMPT_BUDGET, counter)
+            chunks = fitted["chunks"]
+            prompt_report = fitted["report"]
+            prompt_text = build_together_request(chunks, user_query)[2]['messages'][0]['content']
+            prompt_report["prompt_tokens"] = counter.count(prompt_text)
+
+        stats = ProviderStats()
+        if options["stream"]:
+            answer, api_used = stream_answer(chunks, user_query, stats, prompt_report)
+            error_details = []
+        elif HEDGE_MODE == 'sequential':
+            answer, api_used, error_details = call_sequential(chunks, user_query, stats)
+        else:
+            answer, api_used, error_details = call_hedged(chunks, user_query, stats)
+        stats.save()
+
+        if answer and cache:
             try:
-                answer = call_openrouter(chunks, user_query)
-                api_used = 'openrouter'
-            except Exception as e:
-                error_details.append(f"OpenRouter failed: {str(e)}")
+                cache.put(
+                    PROVIDER_MODELS[api_used], PROMPT_VERSION, PROMPT_BUDGET, raw_chunks, user_query,
+                    answer, api_used, textbook, embedding
+                )
+            except Exception:
+                pass
+
+        if options["stream"]:
+            sys.exit(0 if answer else 1)
 
         if not answer:
             result = {
@@ -174,10 +585,12 @@ def main():
         result = {
             "answer": answer,
             "api_used": api_used,
-            "model_used": "mistralai/mistral-7b-instruct" if api_used == 'openrouter' else "mistralai/Mistral-7B-Instruct-v0.1",
-            "chunks_processed": len(chunks),
+            "model_used": PROVIDER_MODELS.get(api_used),
+            "chunks_processed": len(raw_chunks),
             "query": user_query,
-            "status": "success"
+            "status": "success",
+            "cached": False,
+            "prompt": prompt_report
         }
 
         print(json.dumps(result))
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Stage timing metrics for textbook search.
+
+MultiTextbookSearcher and the search service report per-stage timings
+(load_config, verify, load_index, load_metadata, load_model, encode,
+filter, faiss_search, hydrate, format, evict for textbooks dropped by
+search_service.py --lazy, and scatter/merge in shard_coordinator.py) to a
+pluggable metrics hook. Batched query encoding in search_service.py is
+shared by the textbooks of a batch and recorded under the textbook label
+"_encoder". The hook is chosen with the SEARCH_METRICS environment variable:
+
+    SEARCH_METRICS=prometheus:/var/lib/node_exporter/textbook_search.prom
+    SEARCH_METRICS=statsd                  (127.0.0.1:8125)
+    SEARCH_METRICS=statsd:10.0.0.5:8125
+
+The Prometheus exporter writes a text-format file for the node_exporter
+textfile collector. Counts are merged across processes, so one-shot
+search_faiss.py runs spawned by server.js accumulate into the same file.
+
+An invalid SEARCH_METRICS only prints a warning; searches then run
+without metrics.
+
+Usage:
+    python metrics.py --show
+"""
+
+import argparse
+import atexit
+import json
+import os
+import socket
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+# Histogram buckets in seconds
+BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+METRIC_NAME = "textbook_search_stage_seconds"
+
+# Textbook label of the encode stage when one encoder call serves several books
+ENCODER_LABEL = "_encoder"
+
+
+class StageMetrics:
+    """Metrics hook interface; the base class discards everything."""
+
+    def observe(self, textbook_id: str, timings: Dict[str, float]):
+        """Record stage timings in milliseconds for one textbook."""
+
+    def flush(self):
+        """Write out anything buffered."""
+
+
+class PrometheusFileMetrics(StageMetrics):
+    """
+    Histogram of stage timings written in Prometheus text format.
+
+    Observations are buffered and merged into a JSON state file next to the
+    .prom file (under a file lock) at most every flush_interval seconds and
+    at exit, then the .prom file is rewritten atomically.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 5.0):
+        self.path = Path(path)
+        self.state_path = self.path.with_name(self.path.name + ".state.json")
+        self.lock_path = self.path.with_name(self.path.name + ".lock")
+        self.flush_interval = flush_interval
+        self.pending: Dict[str, Dict[str, list]] = {}
+        self.last_flush = time.monotonic()
+        atexit.register(self.flush)
+
+    def observe(self, textbook_id: str, timings: Dict[str, float]):
+        for stage, ms in timings.items():
+            series = self.pending.setdefault(f"{textbook_id}\0{stage}", {"values": []})
+            series["values"].append(ms / 1000.0)
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, {}
+        self.last_flush = time.monotonic()
+
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.lock_path, 'w') as lock:
+                _lock_file(lock)
+                state = self._load_state()
+                for key, series in pending.items():
+                    entry = state.setdefault(key, {"buckets": [0] * len(BUCKETS), "count": 0, "sum": 0.0})
+                    for value in series["values"]:
+                        entry["count"] += 1
+                        entry["sum"] += value
+                        for i, bound in enumerate(BUCKETS):
+                            if value <= bound:
+                                entry["buckets"][i] += 1
+                self._write(self.state_path, json.dumps(state))
+                self._write(self.path, render_prometheus(state))
+        except OSError:
+            pass  # Metrics must never break a search
+
+    def _load_state(self) -> Dict[str, Dict]:
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _write(path: Path, content: str):
+        temp_path = path.with_name(path.name + f".{os.getpid()}.tmp")
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(temp_path, path)
+
+
+class StatsdMetrics(StageMetrics):
+    """Sends each stage timing to StatsD over UDP as <prefix>.<textbook>.<stage>:<ms>|ms."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8125, prefix: str = "textbook_search"):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+
+    def observe(self, textbook_id: str, timings: Dict[str, float]):
+        lines = [f"{self.prefix}.{textbook_id}.{stage}:{ms:.3f}|ms" for stage, ms in timings.items()]
+        try:
+            self.sock.sendto("\n".join(lines).encode('utf-8'), self.address)
+        except OSError:
+            pass
+
+
+def render_prometheus(state: Dict[str, Dict]) -> str:
+    """Render merged histogram state in Prometheus text format."""
+    lines = [
+        f"# HELP {METRIC_NAME} Time spent in each textbook search stage.",
+        f"# TYPE {METRIC_NAME} histogram"
+    ]
+    for key in sorted(state):
+        textbook_id, stage = key.split("\0", 1)
+        entry = state[key]
+        labels = f'textbook="{textbook_id}",stage="{stage}"'
+        for bound, count in zip(BUCKETS, entry["buckets"]):
+            lines.append(f'{METRIC_NAME}_bucket{{{labels},le="{bound}"}} {count}')
+        lines.append(f'{METRIC_NAME}_bucket{{{labels},le="+Inf"}} {entry["count"]}')
+        lines.append(f'{METRIC_NAME}_sum{{{labels}}} {entry["sum"]:.6f}')
+        lines.append(f'{METRIC_NAME}_count{{{labels}}} {entry["count"]}')
+    return "\n".join(lines) + "\n"
+
+
+def _lock_file(handle):
+    try:
+        import fcntl
+        fcntl.flock(handle, fcntl.LOCK_EX)
+    except ImportError:
+        pass  # No advisory locks on this platform
+
+
+def metrics_from_env() -> StageMetrics:
+    """
+    Build the metrics hook described by SEARCH_METRICS.
+
+    Metrics must never break a search: a malformed value is reported on
+    stderr and the no-op hook is used instead.
+    """
+    spec = os.getenv('SEARCH_METRICS', '').strip()
+    if not spec:
+        return StageMetrics()
+    try:
+        return _metrics_from_spec(spec)
+    except Exception as e:
+        print(f"WARNING: Metrics disabled, invalid SEARCH_METRICS={spec!r}: {str(e)}", file=sys.stderr)
+        return StageMetrics()
+
+
+def _metrics_from_spec(spec: str) -> StageMetrics:
+    kind, _, target = spec.partition(':')
+    if kind == 'prometheus':
+        if not target:
+            raise ValueError("SEARCH_METRICS=prometheus requires a file path, e.g. prometheus:/tmp/search.prom")
+        return PrometheusFileMetrics(target, float(os.getenv('SEARCH_METRICS_FLUSH', '5')))
+    if kind == 'statsd':
+        host, _, port = target.partition(':')
+        return StatsdMetrics(host or '127.0.0.1', int(port or 8125))
+    raise ValueError(f"Unsupported SEARCH_METRICS backend: {kind}")
+
+
+_hook: Optional[StageMetrics] = None
+
+
+def get_metrics_hook() -> StageMetrics:
+    """Process-wide metrics hook, created from the environment on first use."""
+    global _hook
+    if _hook is None:
+        _hook = metrics_from_env()
+    return _hook
+
+
+def set_metrics_hook(hook: StageMetrics):
+    """Replace the process-wide metrics hook (e.g. with a custom exporter)."""
+    global _hook
+    _hook = hook
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show search stage metrics from a Prometheus state file")
+    parser.add_argument('--show', action='store_true', help='Print mean and count per textbook and stage')
+    parser.add_argument('--path', help='Prometheus file (default: path from SEARCH_METRICS)')
+    args = parser.parse_args()
+
+    path = args.path
+    if not path:
+        kind, _, target = os.getenv('SEARCH_METRICS', '').partition(':')
+        path = target if kind == 'prometheus' else None
+    if not path:
+        print("No Prometheus metrics file configured (set SEARCH_METRICS=prometheus:<path> or pass --path)")
+        return 1
+
+    state = PrometheusFileMetrics(path)._load_state()
+    summary = {}
+    for key, entry in sorted(state.items()):
+        textbook_id, stage = key.split("\0", 1)
+        summary.setdefault(textbook_id, {})[stage] = {
+            "count": entry["count"],
+            "mean_ms": round(entry["sum"] / max(1, entry["count"]) * 1000, 3)
+        }
+    print(json.dumps(summary, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Pre-fork Worker Supervisor for the Search Service
+
+search_service.py --workers N loads the encoder, FAISS indices and chunk
+store once, binds the listening socket and then forks N workers. Workers
+inherit everything copy-on-write: FAISS vectors and model weights are
+never written after loading, so their pages stay shared, and gc.freeze()
+keeps the garbage collector from dirtying the pages of the loaded Python
+objects. The kernel spreads new connections over the workers accepting on
+the shared socket.
+
+A worker that reaches its request limit or memory limit stops accepting,
+finishes the requests in flight and exits; the supervisor forks a fresh
+copy from the parent's untouched state. The parent never encodes or
+searches, so no OpenMP thread pool exists when it forks; it sizes the
+encoders for --worker_threads beforehand, so with one thread per worker
+an onnxruntime session has no pool either and is shared as it is.
+
+Usage:
+    python search_service.py --workers 4 --max_requests 20000 --max_rss_mb 300
+    python prefork.py 12345 12346 12347      (memory of running processes)
+"""
+
+import argparse
+import gc
+import os
+import resource
+import signal
+import sys
+import time
+import traceback
+from typing import Dict, Callable, Optional, Tuple
+
+# A worker that dies sooner than this after starting is respawned after a
+# pause instead of at once, so a crashing worker cannot fork-loop
+RESPAWN_BACKOFF = 1.0
+
+
+def memory_usage(pid: Optional[int] = None) -> Dict[str, float]:
+    """
+    Memory of a process in MB.
+
+    rss counts shared pages in full; pss divides them among the processes
+    sharing them, so the pss of all workers adds up to their real total;
+    private is what the process alone holds. pss and private need
+    /proc/<pid>/smaps_rollup (Linux); elsewhere only this process's peak
+    RSS is available.
+    """
+    fields = {"Rss": "rss_mb", "Pss": "pss_mb", "Private_Clean": "private_mb", "Private_Dirty": "private_mb"}
+    usage: Dict[str, float] = {}
+    try:
+        with open(f"/proc/{pid or 'self'}/smaps_rollup", 'r') as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                if name in fields:
+                    key = fields[name]
+                    usage[key] = usage.get(key, 0.0) + int(value.split()[0]) / 1024
+    except OSError:
+        if pid is None or pid == os.getpid():
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            usage["rss_mb"] = peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    return {key: round(value, 1) for key, value in usage.items()}
+
+
+class PreforkSupervisor:
+    """
+    Forks and supervises worker processes.
+
+    run_worker(slot) runs in the child and returns its exit code. SIGTERM
+    or SIGINT stops all workers; SIGHUP recycles them (each is replaced as
+    soon as it has drained).
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        run_worker: Callable[[int], int],
+        tick: Optional[Callable[[], None]] = None,
+        tick_interval: float = 5.0,
+        stop_timeout: float = 10.0
+    ):
+        if workers <= 0:
+            raise ValueError("workers must be positive")
+        self.workers = workers
+        self.run_worker = run_worker
+        self.tick = tick
+        self.tick_interval = tick_interval
+        self.stop_timeout = stop_timeout
+        self.children: Dict[int, Tuple[int, float]] = {}
+        self.respawn_at: Dict[int, float] = {}
+        self.restarts = 0
+        self._stopping = False
+
+    def serve(self) -> int:
+        """Fork the workers and keep them running until SIGTERM/SIGINT."""
+        # Move everything loaded so far out of the collector's reach, so
+        # collections in the workers do not write to the shared pages
+        gc.freeze()
+
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+        signal.signal(signal.SIGHUP, lambda signum, frame: self.recycle())
+
+        for slot in range(self.workers):
+            self._spawn(slot)
+
+        next_tick = time.monotonic() + self.tick_interval
+        try:
+            while not self._stopping:
+                self._reap()
+                now = time.monotonic()
+                for slot, when in list(self.respawn_at.items()):
+                    if now >= when:
+                        del self.respawn_at[slot]
+                        self._spawn(slot)
+                if self.tick and now >= next_tick:
+                    self.tick()
+                    next_tick = time.monotonic() + self.tick_interval
+                time.sleep(0.1)
+        finally:
+            self._shutdown()
+        return 0
+
+    def recycle(self):
+        """Replace every worker; each drains its requests in flight first."""
+        # Also freeze whatever the parent loaded since (e.g. a reloaded index)
+        gc.freeze()
+        for pid in list(self.children):
+            self._signal(pid, signal.SIGTERM)
+
+    def _request_stop(self, signum, frame):
+        self._stopping = True
+
+    def _spawn(self, slot: int):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGHUP, signal.SIG_DFL)
+            # Ctrl-C reaches the whole process group; let the parent stop
+            # the workers gracefully instead
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            code = 1
+            try:
+                code = self.run_worker(slot)
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code or 0)
+        self.children[pid] = (slot, time.monotonic())
+
+    def _reap(self):
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            slot, started = self.children.pop(pid, (None, 0.0))
+            if slot is None:
+                continue
+            code = os.waitstatus_to_exitcode(status)
+            if self._stopping:
+                continue
+            self.restarts += 1
+            if code != 0:
+                print(f"WARNING: Worker {pid} (slot {slot}) exited with code {code}", file=sys.stderr)
+            if code != 0 and time.monotonic() - started < RESPAWN_BACKOFF:
+                self.respawn_at[slot] = time.monotonic() + RESPAWN_BACKOFF
+            else:
+                self._spawn(slot)
+
+    def _shutdown(self):
+        for pid in list(self.children):
+            self._signal(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.stop_timeout
+        while self.children and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.05)
+        for pid in list(self.children):
+            self._signal(pid, signal.SIGKILL)
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        self.children.clear()
+
+    @staticmethod
+    def _signal(pid: int, signum: int):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show RSS, PSS and private memory of processes")
+    parser.add_argument('pids', type=int, nargs='+', help='Process IDs (e.g. the service parent and its workers)')
+    args = parser.parse_args()
+
+    total = {}
+    for pid in args.pids:
+        usage = memory_usage(pid)
+        print(f"{pid:>8}  " + "  ".join(f"{key} {value:>8.1f}" for key, value in usage.items()))
+        for key, value in usage.items():
+            total[key] = total.get(key, 0.0) + value
+    print(f"{'total':>8}  " + "  ".join(f"{key} {value:>8.1f}" for key, value in total.items()))
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Profiling hooks for the search and ingestion scripts.
+
+Two profilers are available:
+    cprofile - deterministic cProfile; writes a pstats file
+    sample   - stack sampler built on sys._current_frames(); writes
+               collapsed stacks ("a;b;c 42" per line), the input format of
+               flamegraph.pl, speedscope and inferno
+
+Scripts expose them through --profile/--profile_output/--profile_interval.
+The search service uses RequestProfiler to profile only a sampled fraction
+of batches, so profiling can stay on in staging.
+
+Usage:
+    python search_faiss.py -t intro_ml -q "overfitting" --json --profile sample
+    python profiling.py search_faiss.collapsed --top 20
+    python profiling.py search_faiss.prof --top 20
+"""
+
+import argparse
+import cProfile
+import collections
+import pstats
+import random
+import sys
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Optional, Callable, Any
+
+PROFILE_MODES = ['cprofile', 'sample']
+
+
+class SamplingProfiler:
+    """
+    Samples one thread's Python stack at a fixed interval.
+
+    Stacks are aggregated as collapsed strings, root first, so the overhead
+    on the profiled thread is just the GIL handoffs of the sampler.
+    """
+
+    def __init__(self, interval_ms: float = 5.0, thread_id: Optional[int] = None):
+        self.interval = interval_ms / 1000.0
+        self.thread_id = thread_id
+        self.counts: Dict[str, int] = collections.Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.thread_id is None:
+            self.thread_id = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.counts[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def merge(self, other: 'SamplingProfiler'):
+        self.counts.update(other.counts)
+        self.samples += other.samples
+
+    def write_collapsed(self, path: str):
+        """Write collapsed stacks for flamegraph tools."""
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in sorted(self.counts.items()):
+                f.write(f"{stack} {count}\n")
+
+
+def default_output(script_name: str, mode: str) -> str:
+    """Default profile file name, e.g. search_faiss.prof or search_faiss.collapsed."""
+    return f"{Path(script_name).stem}.{'prof' if mode == 'cprofile' else 'collapsed'}"
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser):
+    """Add --profile, --profile_output and --profile_interval to a script's parser."""
+    parser.add_argument(
+        '--profile',
+        nargs='?',
+        const='cprofile',
+        choices=PROFILE_MODES,
+        help='Profile the run: cprofile (pstats file) or sample (collapsed stacks) (default: cprofile)'
+    )
+    parser.add_argument(
+        '--profile_output',
+        help='Profile output file (default: <script>.prof or <script>.collapsed)'
+    )
+    parser.add_argument(
+        '--profile_interval',
+        type=float,
+        default=5.0,
+        help='Sampling interval in ms for --profile sample (default: 5)'
+    )
+
+
+class ProfileSession:
+    """
+    One profiled run of a script, started and stopped explicitly.
+
+    A session with mode None does nothing, so scripts can start one
+    unconditionally and stop it in a finally block.
+    """
+
+    def __init__(self, mode: Optional[str], output: str, interval_ms: float = 5.0, quiet: bool = False):
+        if mode and mode not in PROFILE_MODES:
+            raise ValueError(f"Unsupported profile mode: {mode}")
+        self.mode = mode
+        self.output = output
+        self.quiet = quiet
+        self._profiler = None
+        if mode == 'cprofile':
+            self._profiler = cProfile.Profile()
+        elif mode == 'sample':
+            self._profiler = SamplingProfiler(interval_ms)
+
+    def start(self) -> 'ProfileSession':
+        if self.mode == 'cprofile':
+            self._profiler.enable()
+        elif self.mode == 'sample':
+            self._profiler.start()
+        return self
+
+    def stop(self):
+        if not self.mode:
+            return
+        if self.mode == 'cprofile':
+            self._profiler.disable()
+            self._profiler.dump_stats(self.output)
+        else:
+            self._profiler.stop()
+            self._profiler.write_collapsed(self.output)
+        if not self.quiet:
+            print(f"Profile written to: {self.output}", file=sys.stderr)
+
+
+def start_profile(args: argparse.Namespace, script_name: str, quiet: bool = False) -> ProfileSession:
+    """Start a profile session from the --profile* arguments of a script."""
+    output = args.profile_output or default_output(script_name, args.profile or 'cprofile')
+    return ProfileSession(args.profile, output, args.profile_interval, quiet).start()
+
+
+@contextmanager
+def profiled(mode: Optional[str], output: str, interval_ms: float = 5.0, quiet: bool = False):
+    """Profile the enclosed block and write the result to output."""
+    session = ProfileSession(mode, output, interval_ms, quiet).start()
+    try:
+        yield session
+    finally:
+        session.stop()
+
+
+class RequestProfiler:
+    """
+    Profiles a random fraction of calls and accumulates the results.
+
+    Unsampled calls run untouched. Accumulated stats are written every
+    dump_every profiled calls and on close().
+    """
+
+    def __init__(
+        self,
+        mode: str,
+        output: str,
+        rate: float = 0.01,
+        interval_ms: float = 5.0,
+        dump_every: int = 50
+    ):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unsupported profile mode: {mode}")
+        self.mode = mode
+        self.output = output
+        self.rate = rate
+        self.interval_ms = interval_ms
+        self.dump_every = dump_every
+        self.profiled_calls = 0
+        self.total_calls = 0
+        self._stats: Optional[pstats.Stats] = None
+        self._samples = SamplingProfiler(interval_ms)
+        self._lock = threading.Lock()
+
+    def call(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run fn, profiling it if this call is sampled."""
+        self.total_calls += 1
+        if random.random() >= self.rate:
+            return fn(*args, **kwargs)
+
+        if self.mode == 'cprofile':
+            profiler = cProfile.Profile()
+            try:
+                return profiler.runcall(fn, *args, **kwargs)
+            finally:
+                with self._lock:
+                    if self._stats is None:
+                        self._stats = pstats.Stats(profiler)
+                    else:
+                        self._stats.add(profiler)
+                    self._after_profiled_call()
+
+        sampler = SamplingProfiler(self.interval_ms)
+        sampler.start()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            sampler.stop()
+            with self._lock:
+                self._samples.merge(sampler)
+                self._after_profiled_call()
+
+    def _after_profiled_call(self):
+        self.profiled_calls += 1
+        if self.profiled_calls % self.dump_every == 0:
+            self._dump()
+
+    def _dump(self):
+        if self.mode == 'cprofile':
+            if self._stats is not None:
+                self._stats.dump_stats(self.output)
+        elif self._samples.samples:
+            self._samples.write_collapsed(self.output)
+
+    def close(self):
+        with self._lock:
+            self._dump()
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "rate": self.rate,
+            "output": self.output,
+            "profiled_calls": self.profiled_calls,
+            "total_calls": self.total_calls
+        }
+
+
+def print_top(path: str, top: int = 20):
+    """Print the hottest functions from a pstats or collapsed-stack file."""
+    if path.endswith('.collapsed'):
+        self_counts = collections.Counter()
+        total = 0
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                stack, _, count = line.rstrip('\n').rpartition(' ')
+                self_counts[stack.split(';')[-1]] += int(count)
+                total += int(count)
+        print(f"{total} samples; hottest frames (self):")
+        for frame, count in self_counts.most_common(top):
+            print(f"{count / max(1, total) * 100:6.1f}%  {count:>7}  {frame}")
+    else:
+        pstats.Stats(path).sort_stats('cumulative').print_stats(top)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize a profile written with --profile")
+    parser.add_argument('path', help='.prof (pstats) or .collapsed file')
+    parser.add_argument('--top', type=int, default=20, help='Number of entries to show (default: 20)')
+    args = parser.parse_args()
+
+    print_top(args.path, args.top)
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Per-provider latency and error statistics for LLM answer generation.
+
+llm_answer.py runs once per request, so the statistics are persisted to a small
+JSON file between runs. The hedged call path uses them to decide how long to
+wait on the primary provider before firing the secondary one.
+
+Concurrent runs each add their own outcomes to the file under a file lock,
+so no run overwrites another's. Show the current statistics with:
+
+    python provider_stats.py
+    python provider_stats.py --path /tmp/stats.json
+"""
+
+import argparse
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+DEFAULT_STATS_PATH = Path(__file__).parent / ".llm_provider_stats.json"
+
+# Number of recent successful latencies kept per provider
+MAX_SAMPLES = 200
+
+# Below this many samples the percentile estimate is not trusted
+MIN_SAMPLES = 5
+
+
+class ProviderStats:
+    """Rolling latency samples and outcome counters for each LLM provider."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = Path(path or os.getenv('LLM_STATS_PATH', DEFAULT_STATS_PATH))
+        self.lock_path = self.path.with_name(self.path.name + '.lock')
+        self.providers: Dict[str, Dict[str, Any]] = self._load()
+        # Outcomes recorded by this process since the last save
+        self.pending: Dict[str, Dict[str, Any]] = {}
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        """Statistics on disk, empty if missing or corrupt."""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                return data.get('providers', {})
+        except (OSError, ValueError):
+            pass
+        return {}
+
+    @staticmethod
+    def _entry_in(providers: Dict[str, Dict[str, Any]], provider: str) -> Dict[str, Any]:
+        return providers.setdefault(provider, {
+            'latencies': [],
+            'success': 0,
+            'error': 0,
+            'cancelled': 0
+        })
+
+    def _entry(self, provider: str) -> Dict[str, Any]:
+        return self._entry_in(self.providers, provider)
+
+    def _record(self, provider: str, outcome: str, latency: Optional[float] = None):
+        for providers in (self.providers, self.pending):
+            entry = self._entry_in(providers, provider)
+            entry[outcome] += 1
+            if latency is not None:
+                entry['latencies'].append(round(latency, 4))
+                del entry['latencies'][:-MAX_SAMPLES]
+
+    def record_success(self, provider: str, latency: float):
+        """Record a successful call and its latency in seconds."""
+        self._record(provider, 'success', latency)
+
+    def record_error(self, provider: str):
+        """Record a failed call."""
+        self._record(provider, 'error')
+
+    def record_cancelled(self, provider: str):
+        """Record a call abandoned because another provider answered first."""
+        self._record(provider, 'cancelled')
+
+    def percentile(self, provider: str, pct: float) -> Optional[float]:
+        """Latency percentile in seconds, or None if there are too few samples."""
+        latencies: List[float] = sorted(self._entry(provider)['latencies'])
+        if len(latencies) < MIN_SAMPLES:
+            return None
+        rank = min(len(latencies) - 1, max(0, int(round(pct / 100.0 * (len(latencies) - 1)))))
+        return latencies[rank]
+
+    def error_rate(self, provider: str) -> float:
+        """Fraction of completed calls that failed."""
+        entry = self._entry(provider)
+        total = entry['success'] + entry['error']
+        return entry['error'] / total if total else 0.0
+
+    def hedge_delay(self, provider: str, pct: float, deadline: float) -> float:
+        """
+        Seconds to wait on a provider before hedging to the next one.
+
+        Uses the provider's latency percentile, capped by the deadline. A
+        provider that fails more often than it succeeds is hedged immediately.
+        """
+        if self.error_rate(provider) > 0.5:
+            return 0.0
+        latency = self.percentile(provider, pct)
+        if latency is None:
+            return deadline
+        return min(latency, deadline)
+
+    def summary(self) -> Dict[str, Any]:
+        """Compact per-provider summary for JSON output."""
+        summary = {}
+        for provider in self.providers:
+            entry = self._entry(provider)
+            summary[provider] = {
+                'samples': len(entry['latencies']),
+                'p50': self.percentile(provider, 50),
+                'p95': self.percentile(provider, 95),
+                'error_rate': round(self.error_rate(provider), 4),
+                'cancelled': entry['cancelled']
+            }
+        return summary
+
+    def save(self):
+        """
+        Add this process's outcomes to the statistics on disk.
+
+        The file is re-read under a lock and the pending outcomes merged in,
+        so concurrent runs never overwrite each other. Failures are ignored.
+        """
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, {}
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.lock_path, 'w') as lock:
+                _lock_file(lock)
+                providers = self._load()
+                for provider, added in pending.items():
+                    entry = self._entry_in(providers, provider)
+                    for outcome in ('success', 'error', 'cancelled'):
+                        entry[outcome] += added[outcome]
+                    entry['latencies'] = (entry['latencies'] + added['latencies'])[-MAX_SAMPLES:]
+                fd, tmp_path = tempfile.mkstemp(dir=str(self.path.parent), suffix='.tmp')
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump({'providers': providers}, f)
+                os.replace(tmp_path, self.path)
+            self.providers = providers
+        except OSError:
+            pass
+
+
+def _lock_file(handle):
+    try:
+        import fcntl
+        fcntl.flock(handle, fcntl.LOCK_EX)
+    except ImportError:
+        pass  # No advisory locks on this platform
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Show per-provider LLM latency and error statistics')
+    parser.add_argument('--path', help='Statistics file (default: LLM_STATS_PATH or .llm_provider_stats.json)')
+    args = parser.parse_args()
+
+    print(json.dumps(ProviderStats(args.path).summary(), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Query Autocomplete from Chunk Vocabulary
+
+embedding_indexer.py counts the frequent 1-3 word phrases of a book's chunk
+texts (phrases starting or ending with a stopword or a single letter are
+skipped) plus its detected section headings (weighted by the chunks under
+them), and stores the top terms sorted alphabetically with their weights:
+
+    indices/economics_suggest.json          per-book index (and published versions)
+    indices/library_suggest/economics.json  a book of the unified library
+
+Completing a prefix is a binary search for its range of the sorted terms;
+the best terms of every prefix of up to PRECOMPUTED_PREFIX chars (the
+widest ranges) are collected once at load, so those are a dict lookup. No
+encoder or FAISS call is involved, so the search service can answer every
+keystroke:
+
+    python search_faiss.py --textbook economics --suggest "what is opportunity c"
+    {"op": "suggest", "textbook": "economics", "text": "what is opportunity c", "limit": 5}
+
+Build suggestions for books indexed before they existed with:
+
+    python embedding_indexer.py --build_suggest indices
+"""
+
+import heapq
+import json
+import os
+import re
+import sys
+from bisect import bisect_left
+from collections import Counter
+from pathlib import Path
+from typing import List, Dict, Any, Iterable, Optional, Tuple
+
+SUGGEST_SUFFIX = "_suggest.json"
+LIBRARY_SUGGEST_DIR = "library_suggest"
+
+MAX_NGRAM = 3
+MIN_COUNT = 2
+MAX_TERMS = 50000
+# A heading counts this much per chunk under it
+HEADING_WEIGHT = 10
+
+PRECOMPUTED_PREFIX = 3
+TOP_PER_PREFIX = 16
+DEFAULT_LIMIT = 8
+
+WORD_PATTERN = re.compile(r"[a-z][a-z0-9'\-]*[a-z0-9]|[a-z]")
+SECTION_NUMBER = re.compile(r'^\s*[\dIVXLC]+(?:\.\d+)*\.?\s+')
+
+STOPWORDS = frozenset("""
+a about above after again against all also am an and any are as at be because been before being below
+between both but by can could did do does doing down during each few for from further had has have
+having he her here hers herself him himself his how i if in into is it its itself just me more most my
+myself no nor not now of off on once only or other our ours ourselves out over own same she should so
+some such than that the their theirs them themselves then there these they this those through to too
+under until up very was we were what when where which while who whom why will with would you your yours
+yourself yourselves may might must shall us one two three e g ie eg etc
+""".split())
+
+
+def heading_text(section: str) -> str:
+    """Section heading without its number: '1.6 Price Elasticity' -> 'price elasticity'."""
+    return ' '.join(WORD_PATTERN.findall(SECTION_NUMBER.sub('', section).lower()))
+
+
+def build_suggestions(
+    metadata: List[Dict[str, Any]],
+    max_ngram: int = MAX_NGRAM,
+    min_count: int = MIN_COUNT,
+    max_terms: int = MAX_TERMS
+) -> Dict[str, Any]:
+    """
+    Suggestion terms of one book.
+
+    Args:
+        metadata: The book's chunk metadata (text and, if chunked with
+            heading markers, section)
+        max_ngram: Longest phrase in words
+        min_count: Occurrences a phrase needs to be suggested
+        max_terms: Most terms kept (by weight)
+
+    Returns:
+        {"terms": sorted terms, "weights": weight per term, "headings":
+         terms that are section headings, "chunks": chunk count}
+    """
+    counts: Counter = Counter()
+    headings: Counter = Counter()
+    for entry in metadata:
+        words = WORD_PATTERN.findall(entry.get('text', '').lower())
+        for n in range(1, max_ngram + 1):
+            for start in range(len(words) - n + 1):
+                first, last = words[start], words[start + n - 1]
+                # Single letters are mostly variables of formulas
+                if first in STOPWORDS or last in STOPWORDS or min(len(first), len(last)) < (3 if n == 1 else 2):
+                    continue
+                gram = words[start:start + n]
+                if n > 1 and max(len(word) for word in gram) < 3:
+                    continue
+                counts[' '.join(gram)] += 1
+        if entry.get('section'):
+            heading = heading_text(entry['section'])
+            if heading:
+                headings[heading] += 1
+
+    weights = {term: count for term, count in counts.items() if count >= min_count}
+    for heading, chunks in headings.items():
+        weights[heading] = weights.get(heading, 0) + HEADING_WEIGHT * chunks
+    kept = sorted(heapq.nlargest(max_terms, weights, key=weights.get))
+
+    return {
+        "terms": kept,
+        "weights": [weights[term] for term in kept],
+        "headings": sorted(heading for heading in headings if heading in weights),
+        "chunks": len(metadata)
+    }
+
+
+def suggest_path_for(index_path: Path) -> Path:
+    """<prefix>_suggest.json for <prefix>_index.faiss."""
+    index_path = Path(index_path)
+    return index_path.with_name(index_path.name[:-len("_index.faiss")] + SUGGEST_SUFFIX)
+
+
+def library_suggest_path(indices_dir: str, book_id: str) -> Path:
+    return Path(indices_dir) / LIBRARY_SUGGEST_DIR / f"{book_id}.json"
+
+
+def save_suggestions(path: Path, suggestions: Dict[str, Any]):
+    """Write suggestion terms atomically."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(f".{path.name}.tmp")
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(suggestions, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(temp_path, path)
+    except Exception as e:
+        temp_path.unlink(missing_ok=True)
+        raise Exception(f"Error saving suggestions to {path}: {str(e)}")
+
+
+def load_suggestions(path: Path) -> Optional[Dict[str, Any]]:
+    """Saved suggestion terms, or None if there are none."""
+    path = Path(path)
+    if not path.exists():
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class SuggestionIndex:
+    """Sorted terms with weights, completed by prefix."""
+
+    def __init__(self, terms: List[str], weights: List[int], headings: Iterable[str] = ()):
+        order = sorted(range(len(terms)), key=terms.__getitem__)
+        self.terms = [terms[i] for i in order]
+        self.weights = [weights[i] for i in order]
+        self.headings = set(headings)
+
+        # Best terms of each short prefix, whose ranges are too wide to scan
+        self._top: Dict[str, List[int]] = {}
+        for position in sorted(range(len(self.terms)), key=lambda p: -self.weights[p]):
+            term = self.terms[position]
+            for length in range(1, min(len(term), PRECOMPUTED_PREFIX) + 1):
+                top = self._top.setdefault(term[:length], [])
+                if len(top) < TOP_PER_PREFIX:
+                    top.append(position)
+
+    @classmethod
+    def from_saved(cls, saved: Dict[str, Any]) -> 'SuggestionIndex':
+        return cls(saved["terms"], saved["weights"], saved.get("headings", ()))
+
+    @classmethod
+    def merge(cls, saved: List[Dict[str, Any]]) -> 'SuggestionIndex':
+        """One index over several books; weights of shared terms add up."""
+        weights: Counter = Counter()
+        headings = set()
+        for book in saved:
+            weights.update(dict(zip(book["terms"], book["weights"])))
+            headings.update(book.get("headings", ()))
+        terms = list(weights)
+        return cls(terms, [weights[term] for term in terms], headings)
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory held by the terms, weights and prefix table."""
+        strings = sum(sys.getsizeof(term) for term in self.terms)
+        return strings + 36 * len(self.terms) + sum(64 + 8 * len(top) for top in self._top.values())
+
+    def complete(self, prefix: str, limit: int = DEFAULT_LIMIT) -> List[Tuple[str, int]]:
+        """Heaviest terms starting with prefix (lowercase), heaviest first."""
+        if len(prefix) <= PRECOMPUTED_PREFIX and limit <= TOP_PER_PREFIX:
+            positions = self._top.get(prefix, [])[:limit]
+        else:
+            start = bisect_left(self.terms, prefix)
+            end = bisect_left(self.terms, prefix + '\uffff', start)
+            positions = heapq.nlargest(limit, range(start, end), key=self.weights.__getitem__)
+        return [(self.terms[p], self.weights[p]) for p in positions]
+
+    def suggest(self, text: str, limit: int = DEFAULT_LIMIT) -> List[Dict[str, Any]]:
+        """
+        Completions of a partly typed question.
+
+        The longest tail of up to MAX_NGRAM words that some term starts
+        with is completed; "what is opportunity c" gives "what is
+        opportunity cost".
+
+        Returns:
+            [{"text": completed question, "completion": term, "weight": ...,
+              "heading": True for section headings}, ...]
+        """
+        typed = re.sub(r'\s+', ' ', text.lstrip())
+        lowered = typed.lower()
+        words = lowered.split(' ')
+        for n in range(min(MAX_NGRAM, len(words)), 0, -1):
+            tail = ' '.join(words[-n:])
+            if not tail.strip():
+                continue
+            matches = [(term, weight) for term, weight in self.complete(tail, limit + 1) if term != tail]
+            if matches:
+                head = typed[:len(typed) - len(tail)]
+                return [
+                    {"text": head + term, "completion": term, "weight": weight, "heading": term in self.headings}
+                    for term, weight in matches[:limit]
+                ]
+        return []
+
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Related Passages: Precomputed Chunk Neighbor Graph
+
+embedding_indexer.py searches the index once with every chunk's own vector
+and stores each chunk's top-m neighbors (excluding itself), so the UI can
+show passages related to any search result without another encode or
+FAISS search:
+
+    indices/economics_neighbors.npz          per-book index (and published versions)
+    indices/library_neighbors/economics.npz  a book of the unified library
+
+Each file holds "neighbors", an int32 matrix of local chunk positions (-1
+where a book has fewer than m other chunks), and "distances", float16
+distances under the index metric. Neighbors of a library book are taken
+from the same book only.
+
+The searcher loads the graph with the index and looks chunks up by
+chunk_id:
+
+    python search_faiss.py --textbook economics --related chunk_0042 --json
+    {"op": "related", "textbook": "economics", "chunk_id": "chunk_0042", "top_k": 5}
+"""
+
+import os
+from pathlib import Path
+from typing import Dict, Any, Optional, Tuple
+
+import numpy as np
+
+GRAPH_SUFFIX = "_neighbors.npz"
+LIBRARY_GRAPH_DIR = "library_neighbors"
+
+DEFAULT_NEIGHBORS = 8
+
+# Chunks searched per FAISS call; bounds the memory of the all-chunks search
+GRAPH_BATCH_SIZE = 4096
+
+
+def build_neighbor_graph(
+    index: Any,
+    vectors: np.ndarray,
+    neighbors: int = DEFAULT_NEIGHBORS,
+    batch_size: int = GRAPH_BATCH_SIZE,
+    threads: int = 0,
+    id_base: Optional[int] = None
+) -> Dict[str, np.ndarray]:
+    """
+    Top neighbors of every chunk of a book.
+
+    Args:
+        index: FAISS index holding the book's vectors
+        vectors: The book's vectors in local order (as stored in the index)
+        neighbors: Neighbors kept per chunk
+        batch_size: Chunks searched per FAISS call
+        threads: FAISS (OpenMP) threads; 0 keeps the default of one per core
+        id_base: For a library index, the book's first ID; neighbors are
+            restricted to the book and returned as local positions
+
+    Returns:
+        {"neighbors": int32 (n_chunks, neighbors), "distances": float16
+         (n_chunks, neighbors)}, plus "id_base" for a library book
+    """
+    import faiss
+
+    if threads > 0:
+        faiss.omp_set_num_threads(threads)
+
+    count = len(vectors)
+    params = None
+    if id_base is not None:
+        selector = faiss.IDSelectorRange(id_base, id_base + count)
+        params = faiss.SearchParameters(sel=selector)
+        params.selector = selector
+
+    # One extra result for the chunk itself, which is dropped below
+    k = min(neighbors + 1, count)
+    graph = np.full((count, neighbors), -1, dtype=np.int32)
+    distances = np.full((count, neighbors), np.inf, dtype=np.float16)
+    for start in range(0, count, batch_size):
+        batch = np.ascontiguousarray(vectors[start:start + batch_size], dtype=np.float32)
+        batch_distances, batch_ids = index.search(batch, k, params=params)
+        if id_base is not None:
+            batch_ids = np.where(batch_ids >= 0, batch_ids - id_base, -1)
+
+        # Move each chunk's own entry to the end (it is not always first
+        # when chunks repeat) and cut it off
+        rows = np.arange(start, start + len(batch))[:, None]
+        order = np.argsort(batch_ids == rows, axis=1, kind='stable')
+        batch_ids = np.take_along_axis(batch_ids, order, axis=1)[:, :k - 1]
+        batch_distances = np.take_along_axis(batch_distances, order, axis=1)[:, :k - 1]
+
+        graph[start:start + len(batch), :k - 1] = batch_ids
+        distances[start:start + len(batch), :k - 1] = batch_distances
+
+    graph = {"neighbors": graph, "distances": distances}
+    if id_base is not None:
+        # Re-adding a book moves it to a new id_base, which marks this graph stale
+        graph["id_base"] = np.array(id_base, dtype=np.int64)
+    return graph
+
+
+def graph_path_for(index_path: Path) -> Path:
+    """<prefix>_neighbors.npz for <prefix>_index.faiss."""
+    index_path = Path(index_path)
+    return index_path.with_name(index_path.name[:-len("_index.faiss")] + GRAPH_SUFFIX)
+
+
+def library_graph_path(indices_dir: str, book_id: str) -> Path:
+    return Path(indices_dir) / LIBRARY_GRAPH_DIR / f"{book_id}.npz"
+
+
+def save_graph(path: Path, graph: Dict[str, np.ndarray]):
+    """Write a neighbor graph atomically."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(f".{path.name}.tmp")
+    try:
+        with open(temp_path, 'wb') as f:
+            np.savez(f, **graph)
+        os.replace(temp_path, path)
+    except Exception as e:
+        temp_path.unlink(missing_ok=True)
+        raise Exception(f"Error saving neighbor graph to {path}: {str(e)}")
+
+
+def load_graph(path: Path) -> Optional[Dict[str, np.ndarray]]:
+    """A saved neighbor graph, or None if there is none."""
+    path = Path(path)
+    if not path.exists():
+        return None
+    with np.load(path) as data:
+        return {key: data[key] for key in data.files}
+
+
+def graph_rows(graph: Dict[str, np.ndarray], position: int, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Distances and positions of a chunk's first top_k neighbors (without the -1 padding)."""
+    positions = graph["neighbors"][position, :top_k]
+    valid = positions >= 0
+    return graph["distances"][position, :top_k][valid].astype(np.float32), positions[valid]
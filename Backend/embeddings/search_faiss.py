@@ -11,29 +11,92 @@ Usage:
     python search_faiss.py --textbook intro_ml --query "neural networks" --top_k 3
     python search_faiss.py --textbook intro_ml --interactive
     python search_faiss.py --list-textbooks
+    python search_faiss.py --textbook intro_ml --query "overfitting" --json --timings
+    python search_faiss.py --textbook intro_ml --query "overfitting" --profile sample
+    python search_faiss.py --textbook economics --query "break-even" --chapter 1 --page_max 40
+    python search_faiss.py --textbook all --query "interest rate"     (unified library only)
+    python search_faiss.py --textbook all --query "interest rate" --route_books 2
+    python search_faiss.py --textbook economics --related chunk_0042 --json
+    python search_faiss.py --textbook economics --suggest "what is opportunity c" --json
 """
 
+from __future__ import annotations
+
 import argparse
 import pickle
 import sys
 import os
 import json
+import time
+from contextlib import contextmanager
 from pathlib import Path
 from typing import List, Dict, Any, Tuple, Optional
 
-try:
-    import faiss
-except ImportError:
-    print(json.dumps({"error": "faiss is required. Install it with: pip install faiss-cpu"}))
-    sys.exit(1)
+from metrics import get_metrics_hook
+from profiling import add_profile_arguments, start_profile
+from index_manifest import check_config, check_files, load_manifest, manifest_path_for
+from textbook_catalog import (
+    VERSIONS_SUFFIX, list_textbooks, load_config, load_library_manifest, is_library_textbook, textbook_files
+)
+
+# Heavy dependencies are imported on first use so that catalog commands
+# (--list-textbooks) do not pay for importing numpy, faiss and torch. The
+# encoder backend (and torch, for the default backend) is imported by
+# _load_model via encoders.py.
+np = None
+faiss = None
 
-try:
-    from sentence_transformers import SentenceTransformer
-except ImportError:
-    print(json.dumps({"error": "sentence-transformers is required. Install it with: pip install sentence-transformers"}))
-    sys.exit(1)
+# Metadata filters accepted by search(); chunks only carry the fields if
+# they were chunked from text with page/heading markers
+FILTER_KEYS = ('chapter', 'section', 'source_file', 'page_min', 'page_max')
+FILTER_CACHE_SIZE = 128
 
-import numpy as np
+# Pseudo textbook ID that searches every book of the unified library
+ALL_TEXTBOOKS = "all"
+
+
+def normalize_filters(filters: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Validate search filters and drop empty ones.
+    
+    Args:
+        filters: Mapping of filter name (see FILTER_KEYS) to value
+        
+    Returns:
+        Filters with string values for chapter/section/source_file and int
+        values for page_min/page_max
+    """
+    normalized = {}
+    for key, value in (filters or {}).items():
+        if key not in FILTER_KEYS:
+            raise ValueError(f"Unknown filter: {key} (expected one of {', '.join(FILTER_KEYS)})")
+        if value is None or value == '':
+            continue
+        if key in ('page_min', 'page_max'):
+            try:
+                normalized[key] = int(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"{key} must be an integer")
+        else:
+            normalized[key] = str(value).strip()
+    return normalized
+
+
+def import_search_dependencies():
+    """Import numpy and faiss if not yet loaded."""
+    global np, faiss
+
+    if np is None:
+        import numpy
+        np = numpy
+
+    if faiss is None:
+        try:
+            import faiss as faiss_module
+        except ImportError:
+            print(json.dumps({"error": "faiss is required. Install it with: pip install faiss-cpu"}))
+            sys.exit(1)
+        faiss = faiss_module
 
 
 class MultiTextbookSearcher:
@@ -44,49 +107,127 @@ class MultiTextbookSearcher:
         textbook_id: str,
         model_name: str = "all-MiniLM-L6-v2",
         json_mode: bool = False,
-        indices_dir: str = "indices"
+        indices_dir: str = "indices",
+        model: Optional[Any] = None,
+        encoder_backend: str = "torch",
+        onnx_dir: Optional[str] = None,
+        route_books: Optional[int] = None,
+        load_model: bool = True
     ):
         """
         Initialize the multi-textbook searcher.
         
         Args:
-            textbook_id: ID of the textbook to search (e.g., 'intro_ml', 'deep_learning')
+            textbook_id: ID of the textbook to search (e.g., 'intro_ml', 'deep_learning'),
+                or 'all' for every book of the unified library
             model_name: Sentence transformer model name
             json_mode: If True, suppress all non-JSON output
             indices_dir: Directory containing FAISS indices and metadata
+            model: Already loaded encoder to share between searchers (optional)
+            encoder_backend: Query encoder backend, 'torch' or 'onnx'
+            onnx_dir: Exported ONNX model directory (onnx backend only)
+            route_books: With 'all', search only the chunks of this many books
+                picked by centroid_router.py per query (faster, not
+                exhaustive); 0 searches every book (default: SEARCH_ROUTE_BOOKS
+                or 0)
+            load_model: False to skip loading the encoder, for a searcher
+                only used for related() and suggest() lookups
         """
         self.textbook_id = textbook_id
         self.model_name = model_name
         self.json_mode = json_mode
         self.indices_dir = Path(indices_dir)
+        self.encoder_backend = encoder_backend
+        self.onnx_dir = onnx_dir
+        self.route_books = route_books
+        
+        # File paths for this textbook (of its published version, if versioned)
+        files = textbook_files(indices_dir, textbook_id)
+        version_dir = files["index"].parent
+        self.version = version_dir.name if version_dir.parent.name.endswith(VERSIONS_SUFFIX) else None
+        self.index_path = files["index"]
+        self.metadata_path = files["metadata"]
+        self.config_path = files["config"]
+        
+        # Books without their own files are served from the unified library
+        # (library_index.py), whose index is shared by all of its books
+        self.library = None
+        self.library_mode = textbook_id == ALL_TEXTBOOKS or is_library_textbook(indices_dir, textbook_id)
+        self._library_ranges = None
+        self._library_params = None
+        self._book_names: Dict[str, str] = {}
+        self.router = None
         
-        # File paths for this textbook
-        self.index_path = self.indices_dir / f"{textbook_id}_index.faiss"
-        self.metadata_path = self.indices_dir / f"{textbook_id}_metadata.pkl"
-        self.config_path = self.indices_dir / f"{textbook_id}_config.json"
+        # Precomputed neighbors for related() (see related_chunks.py)
+        self.related_graph: Optional[Dict[str, Any]] = None
+        self._chunk_positions: Dict[str, int] = {}
+        
+        # Autocomplete terms for suggest() (see query_suggestions.py)
+        self.suggestions = None
         
         self.index = None
         self.metadata = None
         self.config = None
-        self.model = None
+        self.model = model
+        self.metrics_hook = get_metrics_hook()
+        
+        # Metadata columns and FAISS selectors for filtered search, built on
+        # first use
+        self._filter_columns: Optional[Dict[str, Any]] = None
+        self._filter_cache: Dict[Tuple, Tuple[int, Any]] = {}
+        
+        # Stage timings in milliseconds: load_* from __init__, the rest
+        # from the most recent search
+        self.load_timings: Dict[str, float] = {}
+        self.last_timings: Dict[str, float] = {}
+        
+        import_search_dependencies()
         
         # Load components
-        self._load_config()
-        self._load_index()
-        self._load_metadata()
-        self._load_model()
+        with self._timed(self.load_timings, 'load_config'):
+            self._load_config()
+        with self._timed(self.load_timings, 'verify'):
+            self._verify_files()
+        with self._timed(self.load_timings, 'load_index'):
+            self._load_index()
+        with self._timed(self.load_timings, 'load_metadata'):
+            self._load_metadata()
+        with self._timed(self.load_timings, 'load_related'):
+            self._load_related()
+        with self._timed(self.load_timings, 'load_suggestions'):
+            self._load_suggestions()
+        if self.model is None and load_model:
+            with self._timed(self.load_timings, 'load_model'):
+                self._load_model()
+        else:
+            self.model_name = self.config.get('model_name', self.model_name)
+        self.metrics_hook.observe(self.textbook_id, self.load_timings)
         
         if not self.json_mode:
             textbook_name = self.config.get('textbook_name', textbook_id)
-            print(f"SUCCESS: Searcher initialized for '{textbook_name}' with {self.index.ntotal} chunks")
+            print(f"SUCCESS: Searcher initialized for '{textbook_name}' with {len(self.metadata)} chunks")
     
     def _log(self, message: str):
         """Log message only if not in JSON mode."""
         if not self.json_mode:
             print(message)
     
+    @staticmethod
+    @contextmanager
+    def _timed(timings: Dict[str, float], stage: str):
+        """Record the monotonic wall time of a block in milliseconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            timings[stage] = round((time.perf_counter() - start) * 1000, 3)
+    
     def _load_config(self):
         """Load textbook configuration."""
+        if self.library_mode:
+            self._load_library_config()
+            return
+        
         try:
             if not self.config_path.exists():
                 error_msg = f"Config file not found: {self.config_path}"
@@ -110,8 +251,35 @@ class MultiTextbookSearcher:
                 print(f"ERROR: {error_msg}")
             sys.exit(1)
     
+    def _verify_files(self):
+        """
+        Check the index and metadata against their integrity manifest before
+        deserializing either. Indices built before manifests existed are
+        loaded unchecked (textbook_catalog.py --validate warns about them).
+        """
+        if self.library_mode:
+            return  # TextbookLibrary.load checks the library's own manifest
+        
+        manifest = load_manifest(manifest_path_for(self.index_path))
+        if manifest is None:
+            return
+        
+        errors = check_files(manifest, self.index_path, self.metadata_path)
+        errors += check_config(self.config, manifest.get('vector_count'), manifest)
+        if errors:
+            error_msg = f"Integrity check failed for {self.textbook_id}: {'; '.join(errors)}"
+            if self.json_mode:
+                print(json.dumps({"error": error_msg}))
+            else:
+                print(f"ERROR: {error_msg}")
+            sys.exit(1)
+    
     def _load_index(self):
         """Load FAISS index from file."""
+        if self.library_mode:
+            self._load_library()
+            return
+        
         try:
             if not self.index_path.exists():
                 error_msg = f"FAISS index not found: {self.index_path}"
@@ -135,6 +303,9 @@ class MultiTextbookSearcher:
     
     def _load_metadata(self):
         """Load metadata mapping from pickle file."""
+        if self.library_mode:
+            return  # Loaded with the library index
+        
         try:
             if not self.metadata_path.exists():
                 error_msg = f"Metadata file not found: {self.metadata_path}"
@@ -150,6 +321,12 @@ class MultiTextbookSearcher:
             
             if not isinstance(self.metadata, list):
                 error_msg = "Metadata must be a list"
+            elif len(self.metadata) != self.index.ntotal:
+                error_msg = f"Metadata has {len(self.metadata)} entries for {self.index.ntotal} index vectors"
+            else:
+                error_msg = None
+            
+            if error_msg:
                 if self.json_mode:
                     print(json.dumps({"error": error_msg}))
                 else:
@@ -166,8 +343,161 @@ class MultiTextbookSearcher:
                 print(f"ERROR: {error_msg}")
             sys.exit(1)
     
+    def _load_library_config(self):
+        """Take the config from the unified library manifest."""
+        if self.textbook_id == ALL_TEXTBOOKS:
+            manifest = load_library_manifest(str(self.indices_dir))
+            self.config = {
+                "textbook_name": "All textbooks",
+                "model_name": manifest["model_name"]
+            } if manifest else None
+        else:
+            self.config = load_config(str(self.indices_dir), self.textbook_id)
+        
+        if self.config is None:
+            error_msg = f"Textbook not found in library: {self.indices_dir}"
+            if self.json_mode:
+                print(json.dumps({"error": error_msg, "available_textbooks": self.list_available_textbooks()}))
+            else:
+                print(f"ERROR: {error_msg}")
+                self._show_available_textbooks()
+            sys.exit(1)
+        
+        self._log(f"SUCCESS: Loaded library config for {self.config.get('textbook_name', self.textbook_id)}")
+    
+    def _load_library(self):
+        """Attach to the shared library index and this book's chunk store."""
+        try:
+            from library_index import open_library
+            self.library = open_library(str(self.indices_dir))
+            self.index = self.library.index
+            
+            book_ids = sorted(self.library.books) if self.textbook_id == ALL_TEXTBOOKS else [self.textbook_id]
+            book_ids.sort(key=lambda book_id: self.library.books[book_id]["id_base"])
+            
+            # Chunks of all selected books in ID order; local position i maps
+            # to library ID id_bases[b] + (i - local_starts[b]) for its book b
+            self.metadata = []
+            id_bases, local_starts = [], []
+            for book_id in book_ids:
+                id_base, _ = self.library.id_range(book_id)
+                id_bases.append(id_base)
+                local_starts.append(len(self.metadata))
+                self.metadata.extend(self.library.metadata[book_id])
+                self._book_names[book_id] = self.library.books[book_id].get('textbook_name', book_id)
+            self._library_ranges = (np.array(id_bases, dtype=np.int64), np.array(local_starts, dtype=np.int64))
+            
+            if self.textbook_id != ALL_TEXTBOOKS:
+                id_base, count = self.library.id_range(self.textbook_id)
+                selector = faiss.IDSelectorRange(id_base, id_base + count)
+                self._library_params = faiss.SearchParameters(sel=selector)
+                self._library_params.selector = selector
+            else:
+                self._load_router(book_ids)
+            
+            self._log(f"SUCCESS: Loaded library index: {len(self.metadata)} of {self.index.ntotal} chunks")
+            
+        except Exception as e:
+            error_msg = f"Loading library failed: {str(e)}"
+            if self.json_mode:
+                print(json.dumps({"error": error_msg}))
+            else:
+                print(f"ERROR: {error_msg}")
+            sys.exit(1)
+    
+    def _load_router(self, book_ids: List[str]):
+        """Route 'all' searches by the library's centroid summaries, if it has any."""
+        from centroid_router import DEFAULT_MAX_BOOKS, CentroidRouter, library_summary_path, load_summaries
+        
+        if self.route_books is None:
+            self.route_books = DEFAULT_MAX_BOOKS
+        if self.route_books <= 0 or not hasattr(faiss, 'IDSelectorBitmap'):
+            return
+        try:
+            summaries = load_summaries(library_summary_path(self.indices_dir))
+        except Exception as e:
+            self._log(f"WARNING: Not routing by centroids, reading summaries failed: {str(e)}")
+            return
+        # Summaries of books re-added since they were written are stale
+        books = self.library.books
+        summaries = {
+            book_id: summary for book_id, summary in summaries.items()
+            if book_id in books and int(summary.get('id_base', -1)) == books[book_id]['id_base']
+        }
+        router = CentroidRouter(
+            summaries, {book_id: books[book_id]['total_chunks'] for book_id in book_ids}, max_books=self.route_books
+        )
+        if router.active:
+            self.router = router
+            self._log(f"SUCCESS: Routing by centroids of {len(router.book_ids)} of {len(book_ids)} books")
+    
+    def _load_related(self):
+        """Load the book's neighbor graph, if the indexer built one."""
+        if self.textbook_id == ALL_TEXTBOOKS:
+            return  # Looked up per book
+        from related_chunks import graph_path_for, library_graph_path, load_graph
+        
+        path = library_graph_path(self.indices_dir, self.textbook_id) if self.library_mode else graph_path_for(self.index_path)
+        try:
+            graph = load_graph(path)
+        except Exception as e:
+            self._log(f"WARNING: Related passages unavailable, reading {path} failed: {str(e)}")
+            return
+        if graph is None:
+            return
+        
+        stale = len(graph["neighbors"]) != len(self.metadata)
+        if self.library_mode:
+            stale = stale or int(graph.get("id_base", -1)) != self.library.id_range(self.textbook_id)[0]
+        if stale:
+            self._log(f"WARNING: Ignoring stale neighbor graph {path}")
+            return
+        
+        self.related_graph = graph
+        self._chunk_positions = {str(metadata.get('chunk_id')): position for position, metadata in enumerate(self.metadata)}
+    
+    def _load_suggestions(self):
+        """Load the book's autocomplete terms (merged over the library for 'all'), if built."""
+        from query_suggestions import SuggestionIndex, library_suggest_path, load_suggestions, suggest_path_for
+        
+        if self.library_mode:
+            book_ids = list(self._book_names)
+            paths = {book_id: library_suggest_path(self.indices_dir, book_id) for book_id in book_ids}
+            chunks = {book_id: self.library.id_range(book_id)[1] for book_id in book_ids}
+        else:
+            paths = {self.textbook_id: suggest_path_for(self.index_path)}
+            chunks = {self.textbook_id: len(self.metadata)}
+        
+        saved = []
+        for book_id, path in paths.items():
+            try:
+                book = load_suggestions(path)
+            except Exception as e:
+                self._log(f"WARNING: Ignoring suggestions of {book_id}, reading {path} failed: {str(e)}")
+                continue
+            if book is None:
+                continue
+            if book.get("chunks") != chunks[book_id]:
+                self._log(f"WARNING: Ignoring stale suggestions {path}")
+                continue
+            saved.append(book)
+        if saved:
+            self.suggestions = SuggestionIndex.from_saved(saved[0]) if len(saved) == 1 else SuggestionIndex.merge(saved)
+    
+    def _global_ids(self, positions: np.ndarray) -> np.ndarray:
+        """Library IDs of local metadata positions."""
+        id_bases, local_starts = self._library_ranges
+        book = np.searchsorted(local_starts, positions, side='right') - 1
+        return id_bases[book] + (positions - local_starts[book])
+    
+    def _local_positions(self, ids: np.ndarray) -> np.ndarray:
+        """Local metadata positions of library IDs (-1 stays -1)."""
+        id_bases, local_starts = self._library_ranges
+        book = np.maximum(np.searchsorted(id_bases, ids, side='right') - 1, 0)
+        return np.where(ids >= 0, local_starts[book] + (ids - id_bases[book]), -1)
+    
     def _load_model(self):
-        """Load sentence transformer model."""
+        """Load the query encoder (sentence transformer or ONNX export)."""
         try:
             # Check if config specifies a different model
             model_from_config = self.config.get('model_name', self.model_name)
@@ -175,8 +505,9 @@ class MultiTextbookSearcher:
                 self._log(f"INFO: Using model from config: {model_from_config}")
                 self.model_name = model_from_config
             
-            self._log(f"INFO: Loading model: {self.model_name}")
-            self.model = SentenceTransformer(self.model_name)
+            self._log(f"INFO: Loading model: {self.model_name} ({self.encoder_backend} backend)")
+            from encoders import load_encoder
+            self.model = load_encoder(self.encoder_backend, self.model_name, self.onnx_dir)
             self._log(f"SUCCESS: Model loaded successfully")
             
         except Exception as e:
@@ -190,35 +521,7 @@ class MultiTextbookSearcher:
     
     def list_available_textbooks(self) -> List[Dict[str, Any]]:
         """List all available textbooks with their metadata."""
-        textbooks = []
-        
-        if not self.indices_dir.exists():
-            return textbooks
-        
-        # Find all config files
-        for config_file in self.indices_dir.glob("*_config.json"):
-            try:
-                textbook_id = config_file.stem.replace("_config", "")
-                
-                with open(config_file, 'r', encoding='utf-8') as f:
-                    config = json.load(f)
-                
-                # Check if corresponding index and metadata files exist
-                index_file = self.indices_dir / f"{textbook_id}_index.faiss"
-                metadata_file = self.indices_dir / f"{textbook_id}_metadata.pkl"
-                
-                if index_file.exists() and metadata_file.exists():
-                    textbooks.append({
-                        "id": textbook_id,
-                        "name": config.get('textbook_name', textbook_id),
-                        "description": config.get('description', 'No description available'),
-                        "chunks": config.get('total_chunks', 'Unknown'),
-                        "created": config.get('created_at', 'Unknown')
-                    })
-            except Exception:
-                continue  # Skip invalid config files
-        
-        return sorted(textbooks, key=lambda x: x['name'])
+        return list_textbooks(str(self.indices_dir))
     
     def _show_available_textbooks(self):
         """Display available textbooks to the user."""
@@ -238,55 +541,304 @@ class MultiTextbookSearcher:
             print(f"Description: {tb['description']}")
             print("-" * 30)
     
-    def search(self, query: str, top_k: int = 5) -> List[Tuple[float, Dict[str, Any]]]:
+    def search(
+        self,
+        query: str,
+        top_k: int = 5,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> List[Tuple[float, Dict[str, Any]]]:
         """
         Search for similar chunks using semantic similarity.
         
         Args:
             query: Search query string
             top_k: Number of top results to return
+            filters: Restrict results by chapter, section, source_file,
+                page_min and/or page_max (optional)
             
         Returns:
             List of (distance, metadata) tuples sorted by similarity
         """
-        if not query.strip():
-            raise ValueError("Query cannot be empty")
+        return self.search_batch([query], top_k, filters)[0]
+    
+    def search_batch(
+        self,
+        queries: List[str],
+        top_k: int = 5,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> List[List[Tuple[float, Dict[str, Any]]]]:
+        """
+        Search several queries with one encode call and one FAISS search.
+        
+        Args:
+            queries: Search query strings
+            top_k: Number of top results to return per query
+            filters: Metadata filters applied to every query (optional)
+            
+        Returns:
+            One list of (distance, metadata) tuples per query
+        """
+        for query in queries:
+            if not query.strip():
+                raise ValueError("Query cannot be empty")
         
         if top_k <= 0:
             raise ValueError("top_k must be positive")
         
-        # Limit top_k to available chunks
-        top_k = min(top_k, len(self.metadata))
+        filters = normalize_filters(filters)
         
         try:
-            # Encode the query
-            query_embedding = self.model.encode([query.strip()])
+            timings: Dict[str, float] = {}
+            with self._timed(timings, 'encode'):
+                query_embeddings = self.encode_queries(queries)
+            batch_results = self.search_embeddings(query_embeddings, top_k, filters)
+            timings.update(self.last_timings)
+            self.last_timings = timings
+            self.metrics_hook.observe(self.textbook_id, timings)
+            return batch_results
             
-            # Search FAISS index
-            distances, indices = self.index.search(
-                query_embedding.astype(np.float32), 
-                top_k
+        except Exception as e:
+            raise Exception(f"Search failed: {str(e)}")
+    
+    def related(self, chunk_id: Any, top_k: int = 5) -> List[Tuple[float, Dict[str, Any]]]:
+        """
+        Chunks most similar to a chunk of this book, from the precomputed
+        neighbor graph (no encoding or FAISS search).
+        
+        Args:
+            chunk_id: chunk_id of a search result
+            top_k: Number of related chunks to return (at most the number
+                the graph was built with)
+            
+        Returns:
+            List of (distance, metadata) tuples sorted by similarity
+        """
+        if top_k <= 0:
+            raise ValueError("top_k must be positive")
+        if self.textbook_id == ALL_TEXTBOOKS:
+            raise ValueError("Related passages are looked up in the chunk's own textbook")
+        if self.related_graph is None:
+            raise ValueError(
+                f"No related passages for {self.textbook_id}; build them with embedding_indexer.py --build_related"
             )
+        position = self._chunk_positions.get(str(chunk_id))
+        if position is None:
+            raise ValueError(f"Unknown chunk: {chunk_id}")
+        
+        from related_chunks import graph_rows
+        distances, positions = graph_rows(self.related_graph, position, top_k)
+        return [self._result(float(distance), int(idx)) for distance, idx in zip(distances, positions)]
+    
+    def suggest(self, text: str, limit: int = 8) -> List[Dict[str, Any]]:
+        """
+        Completions of a partly typed question from the book's frequent
+        phrases and section headings (no encoding or FAISS search).
+        
+        Args:
+            text: What the user has typed so far
+            limit: Most suggestions returned
             
-            # Prepare results
-            results = []
-            for distance, idx in zip(distances[0], indices[0]):
-                if idx < len(self.metadata):  # Valid index
-                    metadata = self.metadata[idx].copy()
-                    # Add textbook information to metadata
-                    metadata['textbook_id'] = self.textbook_id
-                    metadata['textbook_name'] = self.config.get('textbook_name', self.textbook_id)
-                    results.append((float(distance), metadata))
+        Returns:
+            List of {"text", "completion", "weight", "heading"} dicts, best first
+        """
+        if limit <= 0:
+            raise ValueError("limit must be positive")
+        if self.suggestions is None:
+            raise ValueError(
+                f"No query suggestions for {self.textbook_id}; build them with embedding_indexer.py --build_suggest"
+            )
+        return self.suggestions.suggest(text, limit)
+    
+    def encode_queries(self, queries: List[str]) -> np.ndarray:
+        """Encode query strings into a float32 embedding matrix."""
+        embeddings = self.model.encode([query.strip() for query in queries])
+        return np.asarray(embeddings, dtype=np.float32)
+    
+    def search_embeddings(
+        self,
+        query_embeddings: np.ndarray,
+        top_k: int = 5,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> List[List[Tuple[float, Dict[str, Any]]]]:
+        """
+        Search the FAISS index with already encoded queries.
+        
+        Filters are applied inside the FAISS search through an ID selector,
+        so each query still gets up to top_k matching chunks. Unfiltered
+        'all' searches are restricted the same way to the books the centroid
+        router picks for each query.
+        
+        Args:
+            query_embeddings: Matrix of shape (n_queries, dimension)
+            top_k: Number of top results to return per query
+            filters: Metadata filters applied to every query (optional)
             
-            return results
+        Returns:
+            One list of (distance, metadata) tuples per query
+        """
+        timings: Dict[str, float] = {}
+        filters = normalize_filters(filters)
+        
+        # Limit top_k to available (matching) chunks
+        available, params = len(self.metadata), self._library_params
+        if filters:
+            with self._timed(timings, 'filter'):
+                available, params = self._filter_selector(filters)
+        top_k = min(top_k, available)
+        
+        if top_k == 0:
+            self.last_timings = timings
+            return [[] for _ in range(len(query_embeddings))]
+        
+        query_embeddings = np.ascontiguousarray(query_embeddings, dtype=np.float32)
+        routes = None
+        if self.router is not None and not filters:
+            with self._timed(timings, 'route'):
+                routes = self.router.route(query_embeddings)
+        
+        with self._timed(timings, 'faiss_search'):
+            if routes is None:
+                distances, indices = self.index.search(query_embeddings, top_k, params=params)
+            else:
+                distances, indices = self._search_routed(query_embeddings, top_k, routes)
+            if self.library_mode:
+                indices = self._local_positions(indices)
+        
+        with self._timed(timings, 'hydrate'):
+            batch_results = []
+            for row_distances, row_indices in zip(distances, indices):
+                results = []
+                for distance, idx in zip(row_distances, row_indices):
+                    if 0 <= idx < len(self.metadata):  # Valid index
+                        results.append(self._result(float(distance), idx))
+                batch_results.append(results)
+        
+        self.last_timings = timings
+        return batch_results
+    
+    def _result(self, distance: float, position: int) -> Tuple[float, Dict[str, Any]]:
+        """(distance, metadata) result for the chunk at a local position."""
+        metadata = self.metadata[position].copy()
+        # Add textbook information to metadata (library chunks carry their
+        # own textbook_id)
+        metadata.setdefault('textbook_id', self.textbook_id)
+        metadata['textbook_name'] = self._book_names.get(
+            metadata['textbook_id'], self.config.get('textbook_name', self.textbook_id)
+        )
+        return distance, metadata
+    
+    def _search_routed(
+        self,
+        query_embeddings: np.ndarray,
+        top_k: int,
+        routes: List[Optional[List[str]]]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """One FAISS search per distinct route; rows short of top_k are padded with -1."""
+        groups: Dict[Optional[Tuple[str, ...]], List[int]] = {}
+        for row, route in enumerate(routes):
+            groups.setdefault(tuple(sorted(route)) if route is not None else None, []).append(row)
+        
+        distances = np.full((len(query_embeddings), top_k), np.inf, dtype=np.float32)
+        indices = np.full((len(query_embeddings), top_k), -1, dtype=np.int64)
+        for books, rows in groups.items():
+            available, params = self._books_selector(books) if books is not None else (top_k, None)
+            k = min(top_k, available)
+            distances[rows, :k], indices[rows, :k] = self.index.search(query_embeddings[rows], k, params=params)
+        return distances, indices
+    
+    def _books_selector(self, books: Tuple[str, ...]) -> Tuple[int, Any]:
+        """Number of chunks and FAISS search parameters admitting only these library books."""
+        key = ('books',) + books
+        if key in self._filter_cache:
+            return self._filter_cache[key]
+        
+        library_mask = np.zeros(self.library.manifest["next_id"], dtype=bool)
+        for book_id in books:
+            id_base, count = self.library.id_range(book_id)
+            library_mask[id_base:id_base + count] = True
+        
+        if len(self._filter_cache) >= FILTER_CACHE_SIZE:
+            self._filter_cache.pop(next(iter(self._filter_cache)))
+        self._filter_cache[key] = (int(library_mask.sum()), self._bitmap_params(library_mask))
+        return self._filter_cache[key]
+    
+    @staticmethod
+    def _bitmap_params(mask: np.ndarray) -> Any:
+        """faiss.SearchParameters with an IDSelectorBitmap admitting the IDs set in mask."""
+        bitmap = np.packbits(mask, bitorder='little')
+        selector = faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(bitmap))
+        params = faiss.SearchParameters(sel=selector)
+        # SWIG does not hold references: keep the selector and the bitmap it
+        # points into alive as long as params
+        params.selector = selector
+        params.bitmap = bitmap
+        return params
+    
+    def _filter_selector(self, filters: Dict[str, Any]) -> Tuple[int, Any]:
+        """
+        FAISS search parameters that only admit chunks matching filters.
+        
+        Returns:
+            Number of matching chunks and faiss.SearchParameters (cached per
+            distinct filter set)
+        """
+        key = tuple(sorted(filters.items()))
+        if key in self._filter_cache:
+            return self._filter_cache[key]
+        
+        if not hasattr(faiss, 'IDSelectorBitmap'):
+            raise Exception("Filtered search requires faiss >= 1.7.3")
+        
+        mask = self._filter_mask(filters)
+        if self.library_mode:
+            # The selector sees library IDs, not local positions
+            library_mask = np.zeros(self.library.manifest["next_id"], dtype=bool)
+            library_mask[self._global_ids(np.flatnonzero(mask))] = True
+            params = self._bitmap_params(library_mask)
+        else:
+            params = self._bitmap_params(mask)
+        
+        if len(self._filter_cache) >= FILTER_CACHE_SIZE:
+            self._filter_cache.pop(next(iter(self._filter_cache)))
+        self._filter_cache[key] = (int(mask.sum()), params)
+        return self._filter_cache[key]
+    
+    def _filter_mask(self, filters: Dict[str, Any]) -> np.ndarray:
+        """Boolean mask over FAISS ids of chunks matching all filters."""
+        if self._filter_columns is None:
+            def column(field, missing):
+                return np.array([m.get(field, missing) for m in self.metadata], dtype=object)
             
-        except Exception as e:
-            raise Exception(f"Search failed: {str(e)}")
+            self._filter_columns = {
+                'chapter': column('chapter', None),
+                'section': column('section', None),
+                'source_file': column('source_file', None),
+                'page_start': np.array([m.get('page_start', -1) for m in self.metadata], dtype=np.int64),
+                'page_end': np.array([m.get('page_end', -1) for m in self.metadata], dtype=np.int64)
+            }
+        columns = self._filter_columns
+        
+        mask = np.ones(len(self.metadata), dtype=bool)
+        for key, value in filters.items():
+            if key in ('chapter', 'source_file'):
+                mask &= columns[key] == value
+            elif key == 'section':
+                # "1.6" matches section "1.6 Title" and subsections "1.6.2 ..."
+                mask &= np.array([
+                    s is not None and (s == value or s.startswith(value + ' ') or s.startswith(value + '.'))
+                    for s in columns['section']
+                ], dtype=bool)
+            elif key == 'page_min':
+                mask &= columns['page_end'] >= value
+            elif key == 'page_max':
+                mask &= (columns['page_start'] >= 0) & (columns['page_start'] <= value)
+        return mask
     
     def format_results_json(
         self, 
         results: List[Tuple[float, Dict[str, Any]]], 
-        query: str
+        query: str,
+        timings: Optional[Dict[str, float]] = None
     ) -> Dict[str, Any]:
         """
         Format search results as JSON for API responses.
@@ -294,10 +846,25 @@ class MultiTextbookSearcher:
         Args:
             results: List of (distance, metadata) tuples
             query: Original query string
+            timings: Stage timings to include under a 'timings' key (optional)
             
         Returns:
             JSON-serializable dictionary
         """
+        start = time.perf_counter()
+        response = self._format_results_json(results, query)
+        format_ms = round((time.perf_counter() - start) * 1000, 3)
+        self.metrics_hook.observe(self.textbook_id, {'format': format_ms})
+        
+        if timings is not None:
+            response['timings'] = {**timings, 'format': format_ms}
+        return response
+    
+    def _format_results_json(
+        self,
+        results: List[Tuple[float, Dict[str, Any]]],
+        query: str
+    ) -> Dict[str, Any]:
         if not results:
             return {
                 "query": query,
@@ -323,11 +890,10 @@ class MultiTextbookSearcher:
                 "textbook_name": metadata.get('textbook_name', self.textbook_id)
             }
             
-            # Add chapter/section info if available
-            if 'chapter' in metadata:
-                result_item['chapter'] = metadata['chapter']
-            if 'section' in metadata:
-                result_item['section'] = metadata['section']
+            # Add chapter/section/page info if available
+            for field in ('chapter', 'section', 'page_start', 'page_end'):
+                if field in metadata:
+                    result_item[field] = metadata[field]
             
             formatted_results.append(result_item)
         
@@ -341,6 +907,13 @@ class MultiTextbookSearcher:
             "results": formatted_results
         }
     
+    def format_related_json(self, chunk_id: Any, results: List[Tuple[float, Dict[str, Any]]]) -> Dict[str, Any]:
+        """Format related() results like search results, keyed by the source chunk."""
+        response = self._format_results_json(results, '')
+        del response['query']
+        response.pop('message', None)
+        return {"chunk_id": chunk_id, **response}
+    
     def format_results(
         self, 
         results: List[Tuple[float, Dict[str, Any]]], 
@@ -382,16 +955,22 @@ class MultiTextbookSearcher:
             chunk_id = metadata.get('chunk_id', 'Unknown')
             word_count = metadata.get('word_count', 'Unknown')
             output.append(f"ID: {chunk_id} | WORDS: {word_count}")
+            if self.textbook_id == ALL_TEXTBOOKS:
+                output.append(f"BOOK: {metadata.get('textbook_name', metadata.get('textbook_id'))}")
             
             # Show chapter/section if available
             chapter = metadata.get('chapter')
             section = metadata.get('section')
-            if chapter or section:
+            page_start = metadata.get('page_start')
+            if chapter or section or page_start:
                 location = []
                 if chapter:
                     location.append(f"Chapter: {chapter}")
                 if section:
                     location.append(f"Section: {section}")
+                if page_start:
+                    page_end = metadata.get('page_end', page_start)
+                    location.append(f"Pages: {page_start}" + (f"-{page_end}" if page_end != page_start else ""))
                 output.append(f"LOCATION: {' | '.join(location)}")
             
             # Show chunk text with proper formatting
@@ -410,7 +989,11 @@ class MultiTextbookSearcher:
         return "\n".join(output)
 
 
-def interactive_search(searcher: MultiTextbookSearcher, default_top_k: int = 5):
+def interactive_search(
+    searcher: MultiTextbookSearcher,
+    default_top_k: int = 5,
+    filters: Optional[Dict[str, Any]] = None
+):
     """Run interactive search mode."""
     textbook_name = searcher.config.get('textbook_name', searcher.textbook_id)
     
@@ -445,7 +1028,7 @@ def interactive_search(searcher: MultiTextbookSearcher, default_top_k: int = 5):
             
             # Perform search
             print("SEARCHING...")
-            results = searcher.search(query, default_top_k)
+            results = searcher.search(query, default_top_k, filters)
             
             # Display results
             formatted_results = searcher.format_results(results, query, show_distances=True)
@@ -459,15 +1042,8 @@ def interactive_search(searcher: MultiTextbookSearcher, default_top_k: int = 5):
 
 
 def list_textbooks_command(indices_dir: str = "indices", json_output: bool = False):
-    """List all available textbooks."""
-    # Create a temporary searcher just to list textbooks
-    searcher = MultiTextbookSearcher(
-        textbook_id="dummy",
-        json_mode=json_output,
-        indices_dir=indices_dir
-    )
-    
-    textbooks = searcher.list_available_textbooks()
+    """List all available textbooks (metadata scan only, no model or index load)."""
+    textbooks = list_textbooks(indices_dir)
     
     if json_output:
         print(json.dumps({"textbooks": textbooks}, indent=2))
@@ -498,12 +1074,14 @@ Examples:
   python search_faiss.py --textbook deep_learning --query "backpropagation" --top_k 3
   python search_faiss.py --textbook intro_ml --interactive --top_k 10
   python search_faiss.py --textbook intro_ml --query "test" --json
+  python search_faiss.py --textbook economics --query "interest" --section 3.3 --page_min 30 --page_max 60
+  python search_faiss.py --textbook economics --related chunk_0042 --top_k 3
         """
     )
     
     parser.add_argument(
         '--textbook', '-t',
-        help='ID of the textbook to search (e.g., intro_ml, deep_learning)'
+        help='ID of the textbook to search (e.g., intro_ml, deep_learning), or "all" to search every library book'
     )
     
     parser.add_argument(
@@ -554,6 +1132,51 @@ Examples:
         help='Sentence transformer model name (default: all-MiniLM-L6-v2)'
     )
     
+    parser.add_argument(
+        '--encoder',
+        choices=['torch', 'onnx'],
+        default='torch',
+        help='Query encoder backend (default: torch)'
+    )
+    
+    parser.add_argument(
+        '--timings',
+        action='store_true',
+        help='Include per-stage timings (ms) in JSON output'
+    )
+    
+    parser.add_argument(
+        '--onnx_dir',
+        help='Exported ONNX model directory for --encoder onnx (see encoders.py export)'
+    )
+    
+    parser.add_argument('--chapter', help='Only return chunks from this chapter')
+    parser.add_argument('--section', help='Only return chunks from this section or its subsections (e.g. 3.3)')
+    parser.add_argument('--source_file', help='Only return chunks from this source file')
+    parser.add_argument('--page_min', type=int, help='Only return chunks ending on or after this page')
+    parser.add_argument('--page_max', type=int, help='Only return chunks starting on or before this page')
+    
+    parser.add_argument(
+        '--related',
+        metavar='CHUNK_ID',
+        help='Show the chunks most related to this chunk (precomputed by embedding_indexer.py)'
+    )
+    
+    parser.add_argument(
+        '--suggest',
+        metavar='TEXT',
+        help='Complete a partly typed question (up to --top_k suggestions)'
+    )
+    
+    parser.add_argument(
+        '--route_books',
+        type=int,
+        help='With --textbook all, search only this many books picked by their centroids; '
+             '0 searches every book (default: SEARCH_ROUTE_BOOKS or 0)'
+    )
+    
+    add_profile_arguments(parser)
+    
     args = parser.parse_args()
     
     # Handle list textbooks command
@@ -577,19 +1200,43 @@ Examples:
             parser.error("ERROR: top_k must be positive")
         return 1
     
+    filters = {key: getattr(args, key) for key in FILTER_KEYS if getattr(args, key) is not None}
+    
+    profile = start_profile(args, __file__, quiet=args.json)
+    
     try:
         # Initialize searcher with JSON mode flag
         searcher = MultiTextbookSearcher(
             textbook_id=args.textbook,
             model_name=args.model,
             json_mode=args.json,
-            indices_dir=args.indices_dir
+            indices_dir=args.indices_dir,
+            encoder_backend=args.encoder,
+            onnx_dir=args.onnx_dir,
+            route_books=args.route_books,
+            # Related chunks and suggestions are looked up, not searched
+            load_model=not (args.related or args.suggest)
         )
         
         # Run appropriate mode
-        if args.interactive:
+        if args.suggest:
+            suggestions = searcher.suggest(args.suggest, args.top_k)
+            if args.json:
+                print(json.dumps({"text": args.suggest, "suggestions": suggestions}, indent=2, ensure_ascii=False))
+            else:
+                for suggestion in suggestions:
+                    print(f"{suggestion['text']}  ({suggestion['weight']}{', heading' if suggestion['heading'] else ''})")
+        
+        elif args.related:
+            results = searcher.related(args.related, args.top_k)
+            if args.json:
+                print(json.dumps(searcher.format_related_json(args.related, results), indent=2, ensure_ascii=False))
+            else:
+                print(searcher.format_results(results, f"related to {args.related}", args.show_distances))
+        
+        elif args.interactive:
             # Interactive mode (never JSON)
-            interactive_search(searcher, args.top_k)
+            interactive_search(searcher, args.top_k, filters)
         
         elif args.query:
             # Single query mode
@@ -597,11 +1244,12 @@ Examples:
                 textbook_name = searcher.config.get('textbook_name', args.textbook)
                 print(f"INFO: Searching '{textbook_name}' for: \"{args.query}\"")
             
-            results = searcher.search(args.query, args.top_k)
+            results = searcher.search(args.query, args.top_k, filters)
             
             if args.json:
                 # JSON output for API - ONLY output JSON
-                json_results = searcher.format_results_json(results, args.query)
+                timings = {**searcher.load_timings, **searcher.last_timings} if args.timings else None
+                json_results = searcher.format_results_json(results, args.query, timings)
                 print(json.dumps(json_results, indent=2, ensure_ascii=False))
             else:
                 # Human-readable output
@@ -626,7 +1274,7 @@ Examples:
                 return 1
             
             print(f"INFO: Searching '{textbook_name}' for: \"{query}\"")
-            results = searcher.search(query, args.top_k)
+            results = searcher.search(query, args.top_k, filters)
             formatted_results = searcher.format_results(
                 results, 
                 query, 
@@ -642,6 +1290,9 @@ Examples:
         else:
             print(f"ERROR: {str(e)}")
         return 1
+    
+    finally:
+        profile.stop()
 
 
 if __name__ == "__main__":
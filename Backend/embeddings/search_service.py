@@ -0,0 +1,1403 @@
+#!/usr/bin/env python3
+"""
+Resident Search Service for Textbook Chatbot
+
+Keeps the encoder and FAISS indices loaded and answers search requests over a
+local TCP socket, one JSON object per line. Concurrent queries are collected
+by a micro-batching scheduler so that each batch costs one encode call plus
+one FAISS search per textbook.
+
+Usage:
+    python search_service.py
+    python search_service.py --port 8765 --textbooks intro_ml economics
+    python search_service.py --max_wait_ms 5 --max_batch_size 32
+    python search_service.py --profile sample --profile_rate 0.02
+    python search_service.py --reload_interval 2
+    python search_service.py --workers 4 --max_requests 20000 --max_rss_mb 300
+    python search_service.py --lazy --preload computer_networks intro_ml economics --memory_budget_mb 512
+
+Protocol (newline-delimited JSON):
+    {"id": 1, "op": "search", "textbook": "intro_ml", "query": "...", "top_k": 5, "timings": true,
+     "filters": {"chapter": "3", "page_min": 40}, "deadline_ms": 2000, "priority": "high"}
+    {"id": 2, "op": "stats"}
+    {"id": 3, "op": "ping"}
+    {"id": 4, "op": "info"}
+    {"id": 5, "op": "search_vectors", "textbook": "intro_ml", "vectors": "<base64 float32>", "dimension": 384,
+     "top_k": 5}
+    {"id": 6, "op": "related", "textbook": "intro_ml", "chunk_id": "chunk_0042", "top_k": 5}
+    {"id": 7, "op": "suggest", "textbook": "intro_ml", "text": "what is gradient d", "limit": 8}
+    {"id": 8, "op": "encode", "textbook": "intro_ml", "text": "what is gradient descent"}
+Each request gets one response line echoing its "id". info and
+search_vectors let a shard coordinator (shard_coordinator.py) encode
+queries once and search them on several services. related returns the
+chunks precomputed as most similar to a chunk (related_chunks.py) and
+suggest completes a partly typed question from the book's frequent phrases
+and headings (query_suggestions.py), both without queueing, encoding or
+searching. encode returns the query embedding of a text
+({"vector": "<base64 float32>", "dimension": ..., "model": ...}) so that
+llm_answer.py's semantic answer cache does not load an encoder of its own.
+
+Searches wait in a bounded priority queue (--max_queue). A search that
+cannot finish within its deadline_ms, or finds the queue full, is answered
+at once with {"error": ..., "shed": reason, "retry_after_ms": ...}; queued
+searches of a client that closes its connection are dropped (see
+admission.py).
+
+Textbooks published as versions (embedding_indexer.py --publish) are
+reloaded in the background when their version pointer changes; the new
+version is swapped in between batches and the old one is released once the
+batch still using it has finished.
+
+With --workers N the service pre-forks (see prefork.py): the parent loads
+the encoder and indices once and N worker processes share them
+copy-on-write, each running its own micro-batching scheduler. The parent
+also watches the version pointers; after loading a new version it
+recycles the workers so they fork from the new state.
+
+With --lazy only the --preload textbooks (and the encoder) are loaded at
+startup; the others are loaded on their first request and evicted again
+when the loaded books exceed --memory_budget_mb (see textbook_cache.py).
+
+Identical searches (same textbook, normalized query, top_k and filters)
+that arrive while one is in flight share its result instead of being
+encoded and searched again (see singleflight.py); their responses carry
+"coalesced": true. The shared search is queued at the highest priority and
+kept until the loosest deadline among its callers. --no_coalesce turns this
+off.
+"""
+
+import argparse
+import asyncio
+import base64
+import functools
+import json
+import os
+import signal
+import socket
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Iterable, Tuple, Optional
+
+import numpy as np
+
+from admission import (
+    AdmissionQueue, Overloaded, PRIORITIES, SHED_REASONS, SharedAdmission, parse_deadline, parse_priority
+)
+from index_manifest import METRIC_NAMES
+from metrics import ENCODER_LABEL, get_metrics_hook
+from prefork import PreforkSupervisor, memory_usage
+from profiling import RequestProfiler, add_profile_arguments, default_output
+from search_faiss import MultiTextbookSearcher, ALL_TEXTBOOKS, normalize_filters
+from singleflight import SingleFlight, search_key
+from textbook_cache import TextbookCache, EVICTION_POLICIES
+from textbook_catalog import list_textbooks, load_config, load_library_manifest, current_version
+
+# Longest request or response line; a batch of search_vectors exceeds
+# asyncio's 64 KB default
+MAX_LINE_BYTES = 64 * 1024 * 1024
+
+
+class SearchRequest:
+    """A queued search waiting to be batched."""
+
+    __slots__ = (
+        'textbook_id', 'query', 'top_k', 'future', 'enqueued_at', 'timings', 'info', 'filters', 'filter_key',
+        'priority', 'deadline'
+    )
+
+    def __init__(
+        self,
+        textbook_id: str,
+        query: str,
+        top_k: int,
+        future: asyncio.Future,
+        timings: Optional[Dict[str, float]] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        info: Optional[Dict[str, Any]] = None,
+        priority: int = PRIORITIES['normal'],
+        deadline: Optional[float] = None
+    ):
+        self.textbook_id = textbook_id
+        self.query = query.strip()
+        self.top_k = top_k
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        self.timings = timings
+        self.info = info
+        self.filters = filters or {}
+        self.filter_key = tuple(sorted(self.filters.items()))
+        self.priority = priority
+        self.deadline = deadline
+
+
+class BatchScheduler:
+    """
+    Micro-batching scheduler in front of MultiTextbookSearcher.
+
+    Requests are collected until max_batch_size items are queued or the oldest
+    one has waited max_wait_ms. The batch is then encoded once per encoder and
+    searched once per textbook in a worker thread, and each caller's future is
+    resolved with its own results. While a batch runs, new requests queue up
+    and form the next batch, so batch size adapts to load; the max_wait window
+    only applies once concurrent requests have been seen.
+
+    The queue holds at most max_queue requests, most important first, and
+    sheds requests that cannot meet their deadline (see admission.py).
+    """
+
+    def __init__(
+        self,
+        searchers: Dict[str, MultiTextbookSearcher],
+        max_wait_ms: float = 5.0,
+        max_batch_size: int = 32,
+        profiler: Optional[RequestProfiler] = None,
+        max_queue: int = 0
+    ):
+        self.searchers = searchers
+        self.profiler = profiler
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self.max_queue = max_queue
+        self.queue: Optional[AdmissionQueue] = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='search-batch')
+        self.metrics_hook = get_metrics_hook()
+        self._task = None
+        # Moving average of batch run time (seconds) and start of the batch
+        # running now, for estimating how long a new request will wait
+        self.batch_seconds: Optional[float] = None
+        self._batch_started: Optional[float] = None
+
+        self.counters = {
+            'requests': 0,
+            'batches': 0,
+            'errors': 0,
+            'max_queue_depth': 0,
+            'max_batch_size_seen': 0,
+            'total_queue_wait_ms': 0.0,
+            'total_batch_ms': 0.0,
+            'last_batch_size': 0,
+            'last_batch_ms': 0.0,
+            'reloads': 0,
+            'reload_errors': 0,
+            'shed': {reason: 0 for reason in SHED_REASONS}
+        }
+
+    def start(self):
+        """Start the batching loop on the running event loop."""
+        self.queue = AdmissionQueue(self.max_queue)
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stop the batching loop and the worker thread."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self.executor.shutdown(wait=True)
+        if self.profiler:
+            self.profiler.close()
+
+    async def search(
+        self,
+        textbook_id: str,
+        query: str,
+        top_k: int = 5,
+        timings: Optional[Dict[str, float]] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        info: Optional[Dict[str, Any]] = None,
+        priority: int = PRIORITIES['normal'],
+        deadline: Optional[float] = None,
+        admission: Optional[SharedAdmission] = None
+    ) -> List[Tuple[float, Dict[str, Any]]]:
+        """
+        Queue a search and wait for its batched result.
+
+        If a timings dict is given it is filled with the request's queue wait
+        and the stage timings of the batch it ran in. Requests with the same
+        textbook and filters share one filtered FAISS search. A searcher
+        that describes its last search in last_info (e.g. shards that did
+        not answer) has that copied into the info dict, if given.
+
+        A search shared by coalesced callers passes their admission instead
+        of priority and deadline; see widen().
+
+        Raises:
+            Overloaded: If the request is refused or dropped (queue full,
+                deadline cannot be met)
+        """
+        if textbook_id not in self.searchers:
+            raise ValueError(f"Unknown textbook: {textbook_id}")
+        if not query.strip():
+            raise ValueError("Query cannot be empty")
+        if top_k <= 0:
+            raise ValueError("top_k must be positive")
+        filters = normalize_filters(filters)
+        if admission is not None:
+            priority, deadline = admission.priority, admission.deadline
+
+        future = asyncio.get_running_loop().create_future()
+        request = SearchRequest(textbook_id, query, top_k, future, timings, filters, info, priority, deadline)
+
+        if deadline is not None:
+            wait = self.estimated_wait(priority)
+            if time.monotonic() + wait > deadline:
+                self.counters['shed']['deadline'] += 1
+                raise Overloaded(
+                    'deadline', f"Estimated wait of {wait * 1000:.0f} ms exceeds the deadline", round(wait * 1000)
+                )
+        try:
+            displaced = self.queue.put(request, priority)
+        except Overloaded as e:
+            self.counters['shed']['queue_full'] += 1
+            e.retry_after_ms = round(self.estimated_wait(priority) * 1000)
+            raise
+        if displaced is not None:
+            self._shed(displaced, 'displaced', "Dropped from the full search queue for a more important request")
+        self.counters['max_queue_depth'] = max(self.counters['max_queue_depth'], self.queue.qsize())
+        if admission is not None:
+            admission.request = request
+
+        try:
+            return await future
+        except asyncio.CancelledError:
+            # The caller went away; nobody needs this search any more
+            if self.queue.remove(request):
+                self.counters['shed']['abandoned'] += 1
+            raise
+
+    def widen(self, admission: SharedAdmission, priority: int, deadline: Optional[float]):
+        """
+        Admit a shared search for one more caller: its queued request moves
+        up to the caller's priority and keeps its place until the loosest
+        deadline among the callers.
+        """
+        admission.join(priority, deadline)
+        request = admission.request
+        if request is None:
+            # Not queued yet; search() reads the widened admission
+            return
+        request.deadline = admission.deadline
+        if admission.priority < request.priority and self.queue.promote(request, admission.priority):
+            request.priority = admission.priority
+
+    def estimated_wait(self, priority: int = PRIORITIES['normal']) -> float:
+        """
+        Seconds until a request queued now would have its results: the rest
+        of the running batch, then one batch per max_batch_size requests
+        ahead of it, then its own.
+        """
+        if self.batch_seconds is None:
+            return 0.0
+        running = 0.0
+        if self._batch_started is not None:
+            running = max(0.0, self.batch_seconds - (time.monotonic() - self._batch_started))
+        batches = self.queue.ahead_of(priority) // self.max_batch_size + 1
+        return running + batches * self.batch_seconds
+
+    def _shed(self, request: SearchRequest, reason: str, message: str):
+        self.counters['shed'][reason] += 1
+        if not request.future.done():
+            request.future.set_exception(
+                Overloaded(reason, message, round(self.estimated_wait(request.priority) * 1000))
+            )
+
+    def _admit(self, batch: List[SearchRequest]) -> List[SearchRequest]:
+        """Drop requests nobody waits for or that would finish past their deadline."""
+        now = time.monotonic()
+        expected = self.batch_seconds or 0.0
+        admitted = []
+        for request in batch:
+            # Callers that gave up no longer need a result
+            if request.future.done():
+                continue
+            if request.deadline is not None and now + expected > request.deadline:
+                self._shed(request, 'expired', "Deadline ran out while the search was queued")
+                continue
+            admitted.append(request)
+        return admitted
+
+    async def _collect(self, batch: List[SearchRequest]):
+        """Wait for the next batch of requests and add them to batch."""
+        batch.append(await self.queue.get())
+        deadline = batch[0].enqueued_at + self.max_wait
+
+        # Under light load (the previous batch was a single query) waiting for
+        # company only adds latency; under load, batches also fill up while
+        # the previous one is executing.
+        if self.counters['last_batch_size'] <= 1:
+            deadline = time.monotonic()
+
+        while len(batch) < self.max_batch_size:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+
+    async def _run(self):
+        batch: List[SearchRequest] = []
+        try:
+            while True:
+                batch = []
+                try:
+                    # Filled in place, so requests taken off the queue are
+                    # known even if collecting is interrupted
+                    await self._collect(batch)
+                    batch = self._admit(batch)
+                    if batch:
+                        await self._run_batch(batch)
+                except Exception as e:
+                    # The loop must outlive a failed batch, and its callers
+                    # must get an answer rather than wait forever
+                    print(f"ERROR: Search batch failed: {type(e).__name__}: {str(e)}", file=sys.stderr)
+                    self._fail(batch, e)
+        finally:
+            # Stopped (or cancelled mid-batch): nothing will run these searches
+            stopped = RuntimeError("Search service stopped")
+            self._fail(batch, stopped)
+            while self.queue is not None and not self.queue.empty():
+                self._fail([self.queue.get_nowait()], stopped)
+
+    def _fail(self, requests: List[SearchRequest], error: BaseException):
+        """Resolve the still pending requests with an error."""
+        for request in requests:
+            if not request.future.done():
+                self.counters['errors'] += 1
+                request.future.set_exception(error)
+
+    async def _run_batch(self, batch: List[SearchRequest]):
+        """Execute one admitted batch in the worker thread and resolve its futures."""
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        self._batch_started = started
+        for request in batch:
+            if request.timings is not None:
+                request.timings['queue_wait'] = round((started - request.enqueued_at) * 1000, 3)
+        execute = self._execute_batch
+        if self.profiler:
+            # Only a sampled fraction of batches is actually profiled
+            execute = functools.partial(self.profiler.call, self._execute_batch)
+        try:
+            outcomes = await loop.run_in_executor(self.executor, execute, batch)
+        finally:
+            self._batch_started = None
+        elapsed = time.monotonic() - started
+        elapsed_ms = elapsed * 1000
+        self.batch_seconds = elapsed if self.batch_seconds is None else 0.8 * self.batch_seconds + 0.2 * elapsed
+
+        for request, outcome in zip(batch, outcomes):
+            if request.future.done():
+                continue
+            if isinstance(outcome, Exception):
+                self.counters['errors'] += 1
+                request.future.set_exception(outcome)
+            else:
+                request.future.set_result(outcome)
+
+        self.counters['requests'] += len(batch)
+        self.counters['batches'] += 1
+        self.counters['max_batch_size_seen'] = max(self.counters['max_batch_size_seen'], len(batch))
+        self.counters['total_queue_wait_ms'] += sum(
+            (started - request.enqueued_at) * 1000 for request in batch
+        )
+        self.counters['total_batch_ms'] += elapsed_ms
+        self.counters['last_batch_size'] = len(batch)
+        self.counters['last_batch_ms'] = round(elapsed_ms, 3)
+
+    def _execute_batch(self, batch: List[SearchRequest]) -> List[Any]:
+        """
+        Run one batch in the worker thread.
+
+        Queries are encoded once per distinct encoder (textbooks indexed with
+        the same model share it), then each textbook's index is searched once
+        per distinct filter set with all of its queries.
+
+        Returns:
+            Results list or Exception for each request, in batch order
+        """
+        outcomes: List[Any] = [None] * len(batch)
+        # The whole batch uses the searchers current when it started, even
+        # if a reload swaps in a new version meanwhile
+        searchers = self.searchers
+
+        # Group request positions by encoder, then by textbook and filters
+        by_encoder: Dict[int, Dict[Tuple[str, Tuple], List[int]]] = {}
+        for position, request in enumerate(batch):
+            searcher = searchers[request.textbook_id]
+            group_key = (request.textbook_id, request.filter_key)
+            by_encoder.setdefault(id(searcher.model), {}).setdefault(group_key, []).append(position)
+
+        for by_textbook in by_encoder.values():
+            positions = [p for group in by_textbook.values() for p in group]
+            encoder = searchers[batch[positions[0]].textbook_id]
+
+            try:
+                unique_queries = list(dict.fromkeys(batch[p].query for p in positions))
+                encode_start = time.perf_counter()
+                embeddings = encoder.encode_queries(unique_queries)
+                encode_ms = round((time.perf_counter() - encode_start) * 1000, 3)
+                row_of = {query: row for row, query in enumerate(unique_queries)}
+                # Textbooks sharing an encoder share its cost; record it once,
+                # under a fixed label so label values stay bounded
+                self.metrics_hook.observe(ENCODER_LABEL, {'encode': encode_ms})
+            except Exception as e:
+                for p in positions:
+                    outcomes[p] = Exception(f"Search failed: {str(e)}")
+                continue
+
+            for (textbook_id, _), group in by_textbook.items():
+                searcher = searchers[textbook_id]
+                try:
+                    rows = [row_of[batch[p].query] for p in group]
+                    top_k = max(batch[p].top_k for p in group)
+                    results = searcher.search_embeddings(embeddings[rows], top_k, batch[group[0]].filters)
+                    self.metrics_hook.observe(textbook_id, searcher.last_timings)
+                    info = getattr(searcher, 'last_info', None)
+                    for p, result in zip(group, results):
+                        outcomes[p] = result[:batch[p].top_k]
+                        if batch[p].timings is not None:
+                            batch[p].timings.update(encode=encode_ms, **searcher.last_timings)
+                        if info and batch[p].info is not None:
+                            batch[p].info.update(info)
+                except Exception as e:
+                    for p in group:
+                        outcomes[p] = Exception(f"Search failed: {str(e)}")
+
+        return outcomes
+
+    async def search_vectors(
+        self,
+        textbook_id: str,
+        embeddings: np.ndarray,
+        top_k: int = 5,
+        filters: Optional[Dict[str, Any]] = None,
+        deadline: Optional[float] = None
+    ) -> Tuple[List[List[Tuple[float, Dict[str, Any]]]], Dict[str, float]]:
+        """
+        Search queries a coordinator has already encoded (and batched).
+
+        They run in the batch thread between batches, so a searcher is
+        never used by two threads at once. If the deadline has passed by
+        the time the thread is free, they are dropped unsearched.
+
+        Returns:
+            Results per query and the stage timings, including the wait
+            for the batch thread as queue_wait
+        """
+        if textbook_id not in self.searchers:
+            raise ValueError(f"Unknown textbook: {textbook_id}")
+        if top_k <= 0:
+            raise ValueError("top_k must be positive")
+        filters = normalize_filters(filters)
+        searcher = self.searchers[textbook_id]
+        submitted = time.monotonic()
+
+        def execute():
+            started = time.monotonic()
+            if deadline is not None and started > deadline:
+                raise Overloaded('expired', "Deadline ran out while the search was queued")
+            results = searcher.search_embeddings(embeddings, top_k, filters)
+            return results, dict(searcher.last_timings), started
+
+        try:
+            results, timings, started = await asyncio.get_running_loop().run_in_executor(self.executor, execute)
+        except Overloaded as e:
+            self.counters['shed'][e.reason] += 1
+            raise
+        self.metrics_hook.observe(textbook_id, timings)
+        timings['queue_wait'] = round((started - submitted) * 1000, 3)
+
+        self.counters['requests'] += len(embeddings)
+        self.counters['batches'] += 1
+        self.counters['total_queue_wait_ms'] += (started - submitted) * 1000 * len(embeddings)
+        self.counters['total_batch_ms'] += (time.monotonic() - started) * 1000
+        return results, timings
+
+    def metrics(self) -> Dict[str, Any]:
+        """Queue depth and batching statistics."""
+        counters = dict(self.counters)
+        batches = max(1, counters['batches'])
+        requests = max(1, counters['requests'])
+        counters['queue_depth'] = self.queue.qsize() if self.queue else 0
+        counters['queue_depth_by_priority'] = self.queue.depth_by_priority() if self.queue else {}
+        counters['max_queue'] = self.max_queue
+        counters['shed'] = dict(counters['shed'])
+        counters['estimated_wait_ms'] = round(self.estimated_wait() * 1000, 3) if self.queue else 0.0
+        counters['avg_batch_size'] = round(counters['requests'] / batches, 3)
+        counters['avg_batch_ms'] = round(counters.pop('total_batch_ms') / batches, 3)
+        counters['avg_queue_wait_ms'] = round(counters.pop('total_queue_wait_ms') / requests, 3)
+        counters['max_wait_ms'] = self.max_wait * 1000
+        counters['max_batch_size'] = self.max_batch_size
+        if self.profiler:
+            counters['profile'] = self.profiler.summary()
+        counters['versions'] = {
+            textbook_id: searcher.version
+            for textbook_id, searcher in self.searchers.items() if searcher.version
+        }
+        return counters
+
+    def replace_searcher(self, textbook_id: str, searcher: MultiTextbookSearcher):
+        """Swap in a searcher; batches already running keep the old one."""
+        self.searchers = {**self.searchers, textbook_id: searcher}
+
+    def remove_searcher(self, textbook_id: str):
+        """Drop a searcher; batches already running keep it until they finish."""
+        self.searchers = {key: value for key, value in self.searchers.items() if key != textbook_id}
+
+    async def drain(self):
+        """Wait until the batch running now (if any) has finished."""
+        await asyncio.get_running_loop().run_in_executor(self.executor, lambda: None)
+
+
+class IndexReloader:
+    """
+    Polls the version pointers of loaded textbooks and hot-swaps new versions.
+
+    A new version is loaded in a background thread while the old one keeps
+    serving, then swapped in atomically. A version that fails to load is
+    not retried until another version is published.
+    """
+
+    def __init__(
+        self,
+        scheduler: BatchScheduler,
+        indices_dir: str,
+        interval: float = 5.0,
+        encoder_backend: str = "torch",
+        onnx_dir: Optional[str] = None,
+        skip: Optional[List[str]] = None
+    ):
+        self.scheduler = scheduler
+        self.indices_dir = indices_dir
+        self.interval = interval
+        self.encoder_backend = encoder_backend
+        self.onnx_dir = onnx_dir
+        # Textbooks another reloader takes care of
+        self.skip = set(skip or [])
+        self.failed: Dict[str, str] = {}
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            for textbook_id, searcher, version in self.changed():
+                await self.reload(textbook_id, searcher, version)
+
+    def changed(self) -> List[Tuple[str, MultiTextbookSearcher, str]]:
+        """Loaded textbooks whose published version differs, minus known failures."""
+        pending = []
+        for textbook_id, searcher in list(self.scheduler.searchers.items()):
+            if textbook_id in self.skip:
+                continue
+            pointer = current_version(self.indices_dir, textbook_id)
+            if pointer is None or pointer['version'] == searcher.version:
+                continue
+            if self.failed.get(textbook_id) == pointer['version']:
+                continue
+            pending.append((textbook_id, searcher, pointer['version']))
+        return pending
+
+    def load_version(
+        self,
+        textbook_id: str,
+        old: MultiTextbookSearcher,
+        version: str
+    ) -> Optional[MultiTextbookSearcher]:
+        """Load a textbook's published version; None (and logged) if it fails."""
+        config_model = (load_config(self.indices_dir, textbook_id) or {}).get('model_name', old.model_name)
+        try:
+            return MultiTextbookSearcher(
+                textbook_id=textbook_id,
+                model_name=config_model,
+                json_mode=True,
+                indices_dir=self.indices_dir,
+                # Reuse the loaded encoder unless the new version changed model
+                model=old.model if config_model == old.model_name else None,
+                encoder_backend=self.encoder_backend,
+                onnx_dir=self.onnx_dir
+            )
+        except (Exception, SystemExit) as e:
+            # The searcher reports load errors as JSON before exiting
+            reason = "see error above" if isinstance(e, SystemExit) else str(e)
+            self.failed[textbook_id] = version
+            self.scheduler.counters['reload_errors'] += 1
+            print(f"WARNING: Reloading '{textbook_id}' version {version} failed ({reason}); keeping {old.version}",
+                  file=sys.stderr)
+            return None
+
+    async def reload(self, textbook_id: str, old: MultiTextbookSearcher, version: str):
+        """Load a textbook's published version and swap it in."""
+        load = functools.partial(self.load_version, textbook_id, old, version)
+        searcher = await asyncio.get_running_loop().run_in_executor(None, load)
+        if searcher is None or textbook_id not in self.scheduler.searchers:
+            return  # Failed, or evicted (see TextbookCache) while loading
+
+        self.scheduler.replace_searcher(textbook_id, searcher)
+        # A batch started before the swap may still use the old index; once
+        # it has finished nothing references the old version and it is freed
+        await self.scheduler.drain()
+        self.scheduler.counters['reloads'] += 1
+        print(f"SUCCESS: Reloaded '{textbook_id}' version {searcher.version}", file=sys.stderr)
+
+    def reload_now(self) -> int:
+        """
+        Check and reload in the calling thread, for the pre-fork parent,
+        which serves no batches itself.
+
+        Returns:
+            Number of textbooks swapped
+        """
+        swapped = 0
+        for textbook_id, old, version in self.changed():
+            searcher = self.load_version(textbook_id, old, version)
+            if searcher is None:
+                continue
+            self.scheduler.replace_searcher(textbook_id, searcher)
+            self.scheduler.counters['reloads'] += 1
+            swapped += 1
+            print(f"SUCCESS: Reloaded '{textbook_id}' version {searcher.version}", file=sys.stderr)
+        return swapped
+
+
+def parse_count(value: Any, name: str, default: int) -> int:
+    """A request's "top_k" or "limit" field, which must be a positive integer."""
+    if value is None:
+        return default
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValueError(f"{name} must be a positive integer")
+    try:
+        count = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a positive integer")
+    if count <= 0:
+        raise ValueError(f"{name} must be a positive integer")
+    return count
+
+
+class SearchService:
+    """JSON-lines TCP front end for the batch scheduler."""
+
+    def __init__(
+        self,
+        scheduler: BatchScheduler,
+        worker: Optional[Dict[str, Any]] = None,
+        cache: Optional[TextbookCache] = None,
+        coalesce: bool = True
+    ):
+        self.scheduler = scheduler
+        self.worker = worker
+        self.cache = cache
+        self.coalescer = SingleFlight() if coalesce else None
+        # Admission of each search in flight, widened by the callers joining it
+        self.admissions: Dict[Tuple, SharedAdmission] = {}
+        self.started_at = time.time()
+        self.inflight = 0
+        self.connections = 0
+        # Set when a pre-forked worker retires: connections are closed once
+        # their pending requests are answered
+        self.draining = False
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Serve one client; requests on a connection may be pipelined."""
+        write_lock = asyncio.Lock()
+        tasks = set()
+
+        async def respond(line: bytes):
+            response = await self.handle_line(line)
+            async with write_lock:
+                writer.write((json.dumps(response, ensure_ascii=False) + '\n').encode('utf-8'))
+                await writer.drain()
+                if self.draining and len(tasks) <= 1:
+                    writer.close()
+
+        self.connections += 1
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                task = asyncio.ensure_future(respond(line))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            # The client closed the connection: requests still queued or
+            # running for it are abandoned (finally below)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.connections -= 1
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    async def handle_line(self, line: bytes) -> Dict[str, Any]:
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            return {"error": f"Invalid JSON request: {str(e)}"}
+
+        self.inflight += 1
+        try:
+            response = await self.handle_request(request)
+        finally:
+            self.inflight -= 1
+        if 'id' in request:
+            response['id'] = request['id']
+        return response
+
+    async def handle_request(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        op = request.get('op', 'search')
+        try:
+            if op == 'search':
+                return await self.search(request)
+            if op == 'stats':
+                stats = {"stats": self.scheduler.metrics(), "uptime": round(time.time() - self.started_at, 1)}
+                if self.worker:
+                    stats["worker"] = {**self.worker, "memory": memory_usage()}
+                if self.cache:
+                    stats["cache"] = self.cache.metrics()
+                if self.coalescer:
+                    stats["coalescing"] = self.coalescer.metrics()
+                routed = self.scheduler.searchers.get(ALL_TEXTBOOKS)
+                if routed is not None and routed.router is not None:
+                    stats["routing"] = routed.router.metrics()
+                return stats
+            if op == 'ping':
+                textbooks = self.cache.available if self.cache else self.scheduler.searchers
+                return {"status": "ok", "textbooks": sorted(textbooks)}
+            if op == 'info':
+                return {"textbooks": self.textbook_info()}
+            if op == 'search_vectors':
+                return await self.search_vectors(request)
+            if op == 'related':
+                return await self.related(request)
+            if op == 'suggest':
+                return await self.suggest(request)
+            if op == 'encode':
+                return await self.encode(request)
+            return {"error": f"Unknown op: {op}"}
+        except Overloaded as e:
+            return {"error": str(e), "shed": e.reason, "retry_after_ms": e.retry_after_ms}
+        except Exception as e:
+            return {"error": str(e)}
+
+    async def search(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        textbook_id = request.get('textbook')
+        query = request.get('query') or ''
+        top_k = parse_count(request.get('top_k'), 'top_k', 5)
+        timings = {} if request.get('timings') else None
+        filters = request.get('filters')
+        if filters is not None and not isinstance(filters, dict):
+            raise ValueError("filters must be an object")
+        priority = parse_priority(request.get('priority'))
+        deadline = parse_deadline(request.get('deadline_ms'), time.monotonic())
+
+        if self.coalescer is None:
+            return await self._search(textbook_id, query, top_k, timings, filters, priority, deadline)
+
+        key = search_key(textbook_id, query, top_k, filters, timings is not None)
+        admission = self.admissions.get(key)
+        if admission is not None and key in self.coalescer.flights:
+            # Joining: nobody is refused for another caller's stricter limits
+            self.scheduler.widen(admission, priority, deadline)
+        else:
+            admission = self.admissions[key] = SharedAdmission(priority, deadline)
+        try:
+            response, shared = await self.coalescer.do(
+                key, lambda: self._search(textbook_id, query, top_k, timings, filters, priority, deadline, admission)
+            )
+        finally:
+            if key not in self.coalescer.flights and self.admissions.get(key) is admission:
+                del self.admissions[key]
+        # The response is shared by every caller of the flight; each gets
+        # its own copy (handle_line adds the request id to it)
+        response = dict(response)
+        if shared:
+            response['query'] = query
+            response['coalesced'] = True
+        return response
+
+    async def _search(
+        self,
+        textbook_id: str,
+        query: str,
+        top_k: int,
+        timings: Optional[Dict[str, float]],
+        filters: Optional[Dict[str, Any]],
+        priority: int,
+        deadline: Optional[float],
+        admission: Optional[SharedAdmission] = None
+    ) -> Dict[str, Any]:
+        info = {}
+        if self.cache is None:
+            results = await self.scheduler.search(
+                textbook_id, query, top_k, timings, filters, info, priority, deadline, admission
+            )
+            return {**self.scheduler.searchers[textbook_id].format_results_json(results, query, timings), **info}
+
+        # Held until formatted, so the book cannot be evicted meanwhile
+        await self.cache.acquire(textbook_id, timings)
+        try:
+            results = await self.scheduler.search(
+                textbook_id, query, top_k, timings, filters, info, priority, deadline, admission
+            )
+            return {**self.scheduler.searchers[textbook_id].format_results_json(results, query, timings), **info}
+        finally:
+            self.cache.release(textbook_id)
+
+    async def search_vectors(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        textbook_id = request.get('textbook')
+        dimension = int(request.get('dimension', 0))
+        filters = request.get('filters')
+        if filters is not None and not isinstance(filters, dict):
+            raise ValueError("filters must be an object")
+        if dimension <= 0:
+            raise ValueError("dimension must be positive")
+        deadline = parse_deadline(request.get('deadline_ms'), time.monotonic())
+        embeddings = np.frombuffer(base64.b64decode(request.get('vectors') or ''), dtype='<f4').reshape(-1, dimension)
+
+        if self.cache:
+            await self.cache.acquire(textbook_id)
+        try:
+            results, timings = await self.scheduler.search_vectors(
+                textbook_id, embeddings, parse_count(request.get('top_k'), 'top_k', 5), filters, deadline
+            )
+        finally:
+            if self.cache:
+                self.cache.release(textbook_id)
+        return {
+            "results": [[[distance, metadata] for distance, metadata in rows] for rows in results],
+            "timings": timings
+        }
+
+    async def related(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Precomputed related chunks of a chunk; a lookup, so it skips the batch queue."""
+        textbook_id = request.get('textbook')
+        chunk_id = request.get('chunk_id')
+        top_k = parse_count(request.get('top_k'), 'top_k', 5)
+        if chunk_id is None:
+            raise ValueError("chunk_id is required")
+
+        if self.cache:
+            await self.cache.acquire(textbook_id)
+        try:
+            searcher = self.scheduler.searchers.get(textbook_id)
+            if searcher is None:
+                raise ValueError(f"Unknown textbook: {textbook_id}")
+            return searcher.format_related_json(chunk_id, searcher.related(chunk_id, top_k))
+        finally:
+            if self.cache:
+                self.cache.release(textbook_id)
+
+    async def suggest(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Autocomplete a partly typed question; a lookup, so it skips the batch queue."""
+        textbook_id = request.get('textbook')
+        text = request.get('text') or ''
+        limit = parse_count(request.get('limit'), 'limit', 8)
+
+        if self.cache:
+            await self.cache.acquire(textbook_id)
+        try:
+            searcher = self.scheduler.searchers.get(textbook_id)
+            if searcher is None:
+                raise ValueError(f"Unknown textbook: {textbook_id}")
+            start = time.perf_counter()
+            suggestions = searcher.suggest(text, limit)
+            lookup_us = round((time.perf_counter() - start) * 1e6, 1)
+            return {"text": text, "suggestions": suggestions, "lookup_us": lookup_us}
+        finally:
+            if self.cache:
+                self.cache.release(textbook_id)
+
+    async def encode(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Query embedding of a text with the textbook's encoder."""
+        textbook_id = request.get('textbook')
+        text = (request.get('text') or '').strip()
+        if not text:
+            raise ValueError("text is required")
+
+        if self.cache:
+            await self.cache.acquire(textbook_id)
+        try:
+            searcher = self.scheduler.searchers.get(textbook_id)
+            if searcher is None:
+                raise ValueError(f"Unknown textbook: {textbook_id}")
+            # On the batch thread, which owns the encoders
+            embeddings = await asyncio.get_running_loop().run_in_executor(
+                self.scheduler.executor, searcher.encode_queries, [text]
+            )
+        finally:
+            if self.cache:
+                self.cache.release(textbook_id)
+        vector = np.ascontiguousarray(embeddings[0], dtype='<f4')
+        return {
+            "vector": base64.b64encode(vector.tobytes()).decode('ascii'),
+            "dimension": int(vector.shape[0]),
+            "model": searcher.model_name
+        }
+
+    def textbook_info(self) -> Dict[str, Dict[str, Any]]:
+        """Name, model, metric, size and version of every textbook served."""
+        info = {}
+        textbook_ids = self.cache.available if self.cache else self.scheduler.searchers
+        for textbook_id in sorted(textbook_ids):
+            searcher = self.scheduler.searchers.get(textbook_id)
+            if searcher is not None:
+                info[textbook_id] = {
+                    "name": searcher.config.get('textbook_name', textbook_id),
+                    "model_name": searcher.model_name,
+                    "metric": METRIC_NAMES.get(searcher.index.metric_type, str(searcher.index.metric_type)),
+                    "dimension": searcher.index.d,
+                    "chunks": len(searcher.metadata),
+                    "version": searcher.version
+                }
+                continue
+            # Not loaded yet (--lazy)
+            info[textbook_id] = self.cache.describe(textbook_id)
+        return info
+
+
+def load_searchers(
+    textbook_ids: List[str],
+    indices_dir: str = "indices",
+    model_name: str = "all-MiniLM-L6-v2",
+    encoder_backend: str = "torch",
+    onnx_dir: Optional[str] = None
+) -> Dict[str, MultiTextbookSearcher]:
+    """Load a searcher per textbook, sharing one encoder per model name."""
+    searchers = {}
+    models = {}
+
+    for textbook_id in textbook_ids:
+        searcher = load_searcher(textbook_id, indices_dir, model_name, encoder_backend, onnx_dir, models)
+        if searcher is not None:
+            searchers[textbook_id] = searcher
+            print(f"SUCCESS: Loaded '{textbook_id}' ({len(searcher.metadata)} vectors)", file=sys.stderr)
+
+    return searchers
+
+
+def load_searcher(
+    textbook_id: str,
+    indices_dir: str,
+    model_name: str,
+    encoder_backend: str,
+    onnx_dir: Optional[str],
+    models: Dict[str, Any]
+) -> Optional[MultiTextbookSearcher]:
+    """
+    Load one textbook's searcher, or None if it fails.
+
+    models maps model names to loaded encoders; the searcher reuses the one
+    for its config's model and a newly loaded encoder is added.
+    """
+    config_model = (load_config(indices_dir, textbook_id) or {}).get('model_name', model_name)
+
+    try:
+        searcher = MultiTextbookSearcher(
+            textbook_id=textbook_id,
+            model_name=model_name,
+            json_mode=True,
+            indices_dir=indices_dir,
+            model=models.get(config_model),
+            encoder_backend=encoder_backend,
+            onnx_dir=onnx_dir
+        )
+    except SystemExit:
+        print(f"WARNING: Skipping textbook '{textbook_id}' (failed to load)", file=sys.stderr)
+        return None
+
+    models.setdefault(searcher.model_name, searcher.model)
+    return searcher
+
+
+def load_service_searchers(args) -> Tuple[Dict[str, MultiTextbookSearcher], List[str]]:
+    """
+    Searchers loaded at startup, and the IDs of every textbook served.
+
+    Textbooks are --textbooks, or every available one plus 'all' for a
+    library. With --lazy only the --preload ones are loaded here.
+    """
+    textbook_ids = args.textbooks or [tb['id'] for tb in list_textbooks(args.indices_dir)]
+    if not args.textbooks and load_library_manifest(args.indices_dir):
+        # Cross-book search over the unified library; shares its index
+        textbook_ids.append(ALL_TEXTBOOKS)
+
+    if args.lazy:
+        unknown = sorted(set(args.preload or []) - set(textbook_ids))
+        if unknown:
+            print(f"WARNING: Not preloading unknown textbooks: {', '.join(unknown)}", file=sys.stderr)
+        preload = [textbook_id for textbook_id in textbook_ids if textbook_id in set(args.preload or [])]
+    else:
+        preload = textbook_ids
+
+    searchers = load_searchers(preload, args.indices_dir, args.model, args.encoder, args.onnx_dir)
+    if not searchers and not (args.lazy and textbook_ids):
+        print(json.dumps({"error": "No textbooks could be loaded", "indices_dir": args.indices_dir}))
+    return searchers, textbook_ids
+
+
+def create_cache(args, scheduler: BatchScheduler, textbook_ids: List[str]) -> Optional[TextbookCache]:
+    """
+    TextbookCache for --lazy (None otherwise). The preloaded books are
+    pinned; encoders the other books need are loaded now, so first requests
+    only load their index and pre-forked workers share the encoders.
+    """
+    if not args.lazy:
+        return None
+
+    models = {searcher.model_name: searcher.model for searcher in scheduler.searchers.values()}
+    model_names = {
+        (load_config(args.indices_dir, textbook_id) or {}).get('model_name', args.model)
+        for textbook_id in textbook_ids
+    }
+    for model_name in sorted(model_names - set(models)):
+        try:
+            from encoders import load_encoder
+            models[model_name] = load_encoder(args.encoder, model_name, args.onnx_dir)
+        except Exception as e:
+            # The first book using it loads it instead
+            print(f"WARNING: Could not preload encoder {model_name}: {str(e)}", file=sys.stderr)
+    if args.workers > 1:
+        set_worker_threads(models.values(), args.worker_threads)
+
+    load = functools.partial(
+        load_searcher,
+        indices_dir=args.indices_dir,
+        model_name=args.model,
+        encoder_backend=args.encoder,
+        onnx_dir=args.onnx_dir,
+        models=models
+    )
+    return TextbookCache(
+        scheduler, textbook_ids, load, args.indices_dir, args.memory_budget_mb, args.eviction,
+        pinned=sorted(scheduler.searchers)
+    )
+
+
+def create_profiler(args, worker: bool = False) -> Optional[RequestProfiler]:
+    """Request profiler from the --profile* arguments; workers write one file each."""
+    if not args.profile:
+        return None
+    profile_output = args.profile_output or default_output(__file__, args.profile)
+    if worker:
+        stem, dot, suffix = profile_output.rpartition('.')
+        profile_output = f"{stem}.{os.getpid()}.{suffix}" if dot else f"{profile_output}.{os.getpid()}"
+    return RequestProfiler(args.profile, profile_output, args.profile_rate, args.profile_interval)
+
+
+async def serve(args) -> int:
+    searchers, textbook_ids = load_service_searchers(args)
+    if not searchers and not args.lazy:
+        return 1
+
+    scheduler = BatchScheduler(
+        searchers, args.max_wait_ms, args.max_batch_size, create_profiler(args), max_queue=args.max_queue
+    )
+    cache = create_cache(args, scheduler, textbook_ids)
+    scheduler.start()
+    service = SearchService(scheduler, cache=cache, coalesce=not args.no_coalesce)
+
+    reload_task = None
+    if args.reload_interval > 0:
+        reloader = IndexReloader(scheduler, args.indices_dir, args.reload_interval, args.encoder, args.onnx_dir)
+        reload_task = asyncio.get_running_loop().create_task(reloader.run())
+
+    server = await asyncio.start_server(service.handle_connection, args.host, args.port, limit=MAX_LINE_BYTES)
+    # Shut down cleanly on SIGTERM so buffered profiles and metrics are written
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    print(json.dumps({
+        "status": "listening",
+        "host": args.host,
+        "port": args.port,
+        "textbooks": sorted(textbook_ids if cache else searchers),
+        **({"preloaded": sorted(searchers)} if cache else {})
+    }), flush=True)
+
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        if reload_task:
+            reload_task.cancel()
+        await scheduler.stop()
+        if cache:
+            cache.close()
+    return 0
+
+
+def set_worker_threads(encoders: Iterable[Any], threads: int):
+    """
+    Size the FAISS and encoder thread pools for a worker. Called in the
+    parent before forking, so workers inherit encoders already sized for
+    them, and again in each worker, where unchanged encoders are kept.
+    """
+    import faiss
+    faiss.omp_set_num_threads(threads)
+    for encoder in {id(encoder): encoder for encoder in encoders}.values():
+        if hasattr(encoder, 'set_threads'):
+            encoder.set_threads(threads)
+
+
+def searcher_encoders(searchers: Dict[str, MultiTextbookSearcher]) -> List[Any]:
+    return [searcher.model for searcher in searchers.values()]
+
+
+async def serve_worker(
+    args,
+    parent: BatchScheduler,
+    cache: Optional[TextbookCache],
+    listen_socket: socket.socket,
+    slot: int
+) -> int:
+    """
+    Run one pre-forked worker on the inherited searchers and socket until
+    SIGTERM or a recycling limit, then drain and exit.
+    """
+    set_worker_threads(searcher_encoders(parent.searchers), args.worker_threads)
+
+    scheduler = BatchScheduler(
+        parent.searchers, args.max_wait_ms, args.max_batch_size, create_profiler(args, True), max_queue=args.max_queue
+    )
+    scheduler.counters.update(reloads=parent.counters['reloads'], reload_errors=parent.counters['reload_errors'])
+    scheduler.start()
+    reload_task = None
+    if cache:
+        # Each worker loads and evicts the non-preloaded books on its own
+        # and reloads them itself; the parent reloads the preloaded ones
+        cache.scheduler = scheduler
+        if args.reload_interval > 0:
+            reloader = IndexReloader(
+                scheduler, args.indices_dir, args.reload_interval, args.encoder, args.onnx_dir, skip=cache.pinned
+            )
+            reload_task = asyncio.get_running_loop().create_task(reloader.run())
+    service = SearchService(
+        scheduler, worker={"pid": os.getpid(), "slot": slot}, cache=cache, coalesce=not args.no_coalesce
+    )
+    server = await asyncio.start_server(service.handle_connection, sock=listen_socket, limit=MAX_LINE_BYTES)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGHUP):
+        loop.add_signal_handler(signum, stop.set)
+
+    async def watch_limits():
+        while True:
+            await asyncio.sleep(1.0)
+            if args.max_requests and scheduler.counters['requests'] >= args.max_requests:
+                stop.set()
+                return
+            if args.max_rss_mb:
+                usage = memory_usage()
+                if usage.get('private_mb', usage.get('rss_mb', 0)) > args.max_rss_mb:
+                    stop.set()
+                    return
+
+    watcher = loop.create_task(watch_limits())
+    try:
+        await stop.wait()
+        # Stop accepting; the parent and the other workers keep the socket
+        # open, so new connections wait in the backlog for them. Connections
+        # already accepted get their answers first (idle ones are dropped
+        # after the timeout).
+        server.close()
+        service.draining = True
+        deadline = time.monotonic() + 10.0
+        while time.monotonic() < deadline:
+            # Sleep first: connections accepted just before close() have
+            # not started their handlers yet
+            await asyncio.sleep(0.05)
+            if not (service.connections or service.inflight):
+                break
+    finally:
+        watcher.cancel()
+        if reload_task:
+            reload_task.cancel()
+        await scheduler.stop()
+        if cache:
+            cache.close()
+        get_metrics_hook().flush()
+    return 0
+
+
+def serve_prefork(args) -> int:
+    """Load everything once, then fork and supervise --workers processes."""
+    searchers, textbook_ids = load_service_searchers(args)
+    if not searchers and not args.lazy:
+        return 1
+
+    set_worker_threads(searcher_encoders(searchers), args.worker_threads)
+
+    listen_socket = socket.create_server((args.host, args.port), backlog=1024)
+    listen_socket.setblocking(False)
+
+    # Holds the searchers the next workers fork with; it never runs batches
+    parent = BatchScheduler(searchers, args.max_wait_ms, args.max_batch_size)
+    cache = create_cache(args, parent, textbook_ids)
+
+    def run_worker(slot: int) -> int:
+        return asyncio.run(serve_worker(args, parent, cache, listen_socket, slot))
+
+    reloader = None
+    if args.reload_interval > 0:
+        reloader = IndexReloader(parent, args.indices_dir, args.reload_interval, args.encoder, args.onnx_dir)
+
+    def check_versions():
+        # Workers fork from the parent's searchers, so recycling them is
+        # what brings a new version into service
+        if reloader.reload_now():
+            supervisor.recycle()
+
+    supervisor = PreforkSupervisor(
+        args.workers, run_worker, check_versions if reloader else None, args.reload_interval
+    )
+
+    print(json.dumps({
+        "status": "listening",
+        "host": args.host,
+        "port": args.port,
+        "textbooks": sorted(textbook_ids if cache else searchers),
+        **({"preloaded": sorted(searchers)} if cache else {}),
+        "workers": args.workers,
+        "pid": os.getpid()
+    }), flush=True)
+
+    try:
+        return supervisor.serve()
+    finally:
+        listen_socket.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Resident textbook search service with micro-batching",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python search_service.py
+  python search_service.py --port 8765 --textbooks intro_ml economics
+  python search_service.py --max_wait_ms 2 --max_batch_size 64
+  python search_service.py --workers 4 --max_requests 20000 --max_rss_mb 300
+  python search_service.py --lazy --preload intro_ml --memory_budget_mb 512 --eviction lfu
+        """
+    )
+
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8765, help='Port to listen on (default: 8765)')
+    parser.add_argument(
+        '--textbooks', nargs='+',
+        help='Textbook IDs to load (default: every complete index in indices_dir)'
+    )
+    parser.add_argument(
+        '--indices_dir', default='indices',
+        help='Directory containing FAISS indices and metadata (default: indices)'
+    )
+    parser.add_argument(
+        '--model', default='all-MiniLM-L6-v2',
+        help='Sentence transformer model name (default: all-MiniLM-L6-v2)'
+    )
+    parser.add_argument(
+        '--encoder', choices=['torch', 'onnx'], default='torch',
+        help='Query encoder backend (default: torch)'
+    )
+    parser.add_argument(
+        '--onnx_dir',
+        help='Exported ONNX model directory for --encoder onnx (see encoders.py export)'
+    )
+    parser.add_argument(
+        '--max_wait_ms', type=float, default=5.0,
+        help='Longest a query waits for a batch to fill (default: 5)'
+    )
+    parser.add_argument(
+        '--max_batch_size', type=int, default=32,
+        help='Maximum queries per batch (default: 32)'
+    )
+    parser.add_argument(
+        '--max_queue', type=int, default=512,
+        help='Most searches queued at once; more are refused (shed); 0 means unbounded (default: 512)'
+    )
+    parser.add_argument(
+        '--no_coalesce', action='store_true',
+        help='Search identical concurrent queries separately instead of sharing one search'
+    )
+    parser.add_argument(
+        '--reload_interval', type=float, default=5.0,
+        help='Seconds between checks for newly published index versions; 0 disables (default: 5)'
+    )
+    parser.add_argument(
+        '--workers', type=int, default=1,
+        help='Worker processes forked after loading; they share model and index memory (default: 1, no fork)'
+    )
+    parser.add_argument(
+        '--worker_threads', type=int, default=1,
+        help='Encoder and FAISS threads per worker with --workers (default: 1)'
+    )
+    parser.add_argument(
+        '--max_requests', type=int, default=0,
+        help='Restart a worker after this many requests; 0 disables (default: 0)'
+    )
+    parser.add_argument(
+        '--max_rss_mb', type=float, default=0,
+        help='Restart a worker whose private (unshared) memory exceeds this many MB; '
+             'RSS where /proc is unavailable; 0 disables (default: 0)'
+    )
+    parser.add_argument(
+        '--lazy', action='store_true',
+        help='Load textbooks on their first request instead of at startup'
+    )
+    parser.add_argument(
+        '--preload', nargs='+',
+        help='With --lazy, textbooks loaded at startup and never evicted'
+    )
+    parser.add_argument(
+        '--memory_budget_mb', type=float, default=0,
+        help='With --lazy, evict textbooks when the loaded ones exceed this many MB; 0 disables (default: 0)'
+    )
+    parser.add_argument(
+        '--eviction', choices=EVICTION_POLICIES, default='lru',
+        help='Which textbooks --memory_budget_mb evicts first: least recently or least frequently used (default: lru)'
+    )
+    add_profile_arguments(parser)
+    parser.add_argument(
+        '--profile_rate', type=float, default=0.01,
+        help='Fraction of batches to profile with --profile (default: 0.01)'
+    )
+
+    args = parser.parse_args()
+
+    if args.max_batch_size <= 0:
+        parser.error("max_batch_size must be positive")
+    if args.max_wait_ms < 0:
+        parser.error("max_wait_ms cannot be negative")
+    if args.max_queue < 0:
+        parser.error("max_queue cannot be negative")
+    if not 0 <= args.profile_rate <= 1:
+        parser.error("profile_rate must be between 0 and 1")
+    if args.workers <= 0 or args.worker_threads <= 0:
+        parser.error("workers and worker_threads must be positive")
+    if args.workers > 1 and not hasattr(os, 'fork'):
+        parser.error("--workers requires a platform with fork()")
+    if (args.preload or args.memory_budget_mb) and not args.lazy:
+        parser.error("--preload and --memory_budget_mb require --lazy")
+    if args.memory_budget_mb < 0:
+        parser.error("memory_budget_mb cannot be negative")
+
+    if args.workers > 1:
+        return serve_prefork(args)
+
+    try:
+        return asyncio.run(serve(args))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        return 0
+
+
+if __name__ == "__main__":
+    exit(main())
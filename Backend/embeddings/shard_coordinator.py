@@ -0,0 +1,549 @@
+#!/usr/bin/env python3
+"""
+Scatter-Gather Coordinator for Sharded Textbook Search
+
+Textbooks can be spread over several search_service.py processes (shards)
+on one host or many, behind a coordinator that speaks the same JSON-lines
+protocol, so server.js only needs SEARCH_SERVICE_PORT pointed at it:
+
+    by textbook   each shard loads some of the books (--textbooks ...)
+    by chunks     shard_index.py splits one book's index into parts and
+                  each shard serves one part under the book's ID
+
+At startup the coordinator asks every shard what it serves (op "info") and
+loads only the encoders. Queries are micro-batched and encoded once; the
+vectors go in parallel to every shard holding the textbook (op
+"search_vectors"), each shard returns its own top-k and the coordinator
+merges them by distance. A shard that fails or misses --shard_timeout_ms is
+left out: the response is then marked "partial": true and lists it under
+"missing_shards".
+
+'all' searches every textbook on every shard (those indexed with the most
+common model), unless shards serve an 'all' of their own (unified library).
+
+Related-passage lookups (op "related") go to every shard of the textbook and
+the shard holding the chunk answers; for a book split by chunks, its
+related chunks come from that shard's part. Suggestions (op "suggest") are
+asked of every shard of the textbook and merged by weight, keeping those
+that complete the most of the typed text.
+
+Usage:
+    python search_service.py --indices_dir shards/0 --port 8801
+    python search_service.py --indices_dir shards/1 --port 8802
+    python shard_coordinator.py --shards 127.0.0.1:8801 127.0.0.1:8802 --port 8765
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import signal
+import sys
+import time
+from collections import Counter
+from typing import List, Dict, Any, Tuple, Optional
+
+import numpy as np
+
+from metrics import get_metrics_hook
+from search_faiss import MultiTextbookSearcher, ALL_TEXTBOOKS, import_search_dependencies
+from search_service import BatchScheduler, SearchService, MAX_LINE_BYTES, parse_count
+
+
+class ShardClient:
+    """Pipelined connection to one shard; requests are matched to responses by id."""
+
+    def __init__(self, address: str):
+        host, _, port = address.rpartition(':')
+        self.address = address
+        self.host = host or '127.0.0.1'
+        self.port = int(port)
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.pending: Dict[int, asyncio.Future] = {}
+        self.next_id = 0
+        self._lock: Optional[asyncio.Lock] = None
+
+        self.counters = {
+            'requests': 0,
+            'timeouts': 0,
+            'errors': 0,
+            'total_ms': 0.0
+        }
+
+    async def request(self, payload: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        """
+        Send one request and wait at most timeout seconds for its response.
+
+        Raises:
+            asyncio.TimeoutError: If the shard does not answer in time
+            ConnectionError: If the connection fails or closes
+        """
+        started = time.monotonic()
+        self.counters['requests'] += 1
+        try:
+            return await asyncio.wait_for(self._request(payload), timeout)
+        except asyncio.TimeoutError:
+            self.counters['timeouts'] += 1
+            raise
+        except (OSError, ValueError):
+            self.counters['errors'] += 1
+            raise
+        finally:
+            self.counters['total_ms'] += (time.monotonic() - started) * 1000
+
+    async def _request(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        writer = await self._connect()
+        self.next_id += 1
+        request_id = self.next_id
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        try:
+            writer.write((json.dumps({**payload, "id": request_id}) + '\n').encode('utf-8'))
+            await writer.drain()
+            # A response that arrives after a timeout finds no future and is dropped
+            return await future
+        finally:
+            self.pending.pop(request_id, None)
+
+    async def _connect(self) -> asyncio.StreamWriter:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self.writer is None or self.writer.is_closing():
+                self.reader, self.writer = await asyncio.open_connection(self.host, self.port, limit=MAX_LINE_BYTES)
+                asyncio.get_running_loop().create_task(self._read_responses(self.reader, self.writer))
+        return self.writer
+
+    async def _read_responses(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = json.loads(line)
+                future = self.pending.get(response.get('id'))
+                if future is not None and not future.done():
+                    future.set_result(response)
+        except (OSError, ValueError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            writer.close()
+            if self.writer is writer:
+                self.writer = None
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError(f"Shard {self.address} closed the connection"))
+
+    def metrics(self) -> Dict[str, Any]:
+        counters = dict(self.counters)
+        counters['avg_ms'] = round(counters.pop('total_ms') / max(1, counters['requests']), 3)
+        counters['connected'] = self.writer is not None and not self.writer.is_closing()
+        return counters
+
+
+class ShardedSearcher(MultiTextbookSearcher):
+    """
+    A textbook whose index lives on shards; only its encoder is local.
+
+    Stands in for MultiTextbookSearcher in the BatchScheduler: encoding and
+    result formatting are inherited, search_embeddings scatters to the
+    shards and merges their top-k lists.
+    """
+
+    def __init__(
+        self,
+        textbook_id: str,
+        targets: List[Tuple[ShardClient, str]],
+        info: Dict[str, Any],
+        model: Any,
+        loop: asyncio.AbstractEventLoop,
+        timeout: float
+    ):
+        """
+        Args:
+            textbook_id: Textbook ID served by the coordinator
+            targets: (shard, textbook ID on that shard) pairs searched for it
+            info: The shards' description of the textbook (name, model, metric)
+            model: Loaded query encoder
+            loop: Event loop running the shard connections
+            timeout: Seconds each shard gets to answer
+        """
+        import_search_dependencies()
+        self.textbook_id = textbook_id
+        self.targets = targets
+        self.model = model
+        self.model_name = info['model_name']
+        self.metric = info['metric']
+        self.dimension = info['dimension']
+        self.chunks = info.get('chunks')
+        self.config = {"textbook_name": info['name'], "model_name": info['model_name']}
+        self.version = None
+        self.library_mode = False
+        self.router = None
+        self.json_mode = True
+        self.loop = loop
+        self.timeout = timeout
+        self.metrics_hook = get_metrics_hook()
+        self.last_timings: Dict[str, float] = {}
+        self.last_info: Dict[str, Any] = {}
+
+    def search_embeddings(
+        self,
+        query_embeddings: np.ndarray,
+        top_k: int = 5,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> List[List[Tuple[float, Dict[str, Any]]]]:
+        """
+        Search every shard holding the textbook and merge their results.
+
+        Called from the scheduler's worker thread; the requests themselves
+        run on the event loop.
+
+        Returns:
+            One list of (distance, metadata) tuples per query
+        """
+        timings: Dict[str, float] = {}
+        with self._timed(timings, 'scatter'):
+            outcomes = asyncio.run_coroutine_threadsafe(
+                self._scatter(query_embeddings, top_k, filters), self.loop
+            ).result()
+
+        with self._timed(timings, 'merge'):
+            merged: List[Dict[Tuple, Tuple[float, Dict[str, Any]]]] = [{} for _ in range(len(query_embeddings))]
+            missing = []
+            for (client, textbook_id), outcome in zip(self.targets, outcomes):
+                if isinstance(outcome, BaseException):
+                    reason = "timeout" if isinstance(outcome, asyncio.TimeoutError) else str(outcome)
+                    missing.append({"shard": client.address, "textbook": textbook_id, "error": reason})
+                    continue
+                for row, results in zip(merged, outcome['results']):
+                    for distance, metadata in results:
+                        # Replicas of a chunk on several shards count once
+                        key = (metadata.get('textbook_id'), metadata.get('chunk_id', len(row)))
+                        if key not in row or self._better(distance, row[key][0]):
+                            row[key] = (float(distance), metadata)
+
+            if len(missing) == len(self.targets):
+                raise Exception(f"No shard answered for {self.textbook_id}: {missing[0]['error']}")
+
+            reverse = self.metric == 'ip'
+            batch_results = [
+                sorted(row.values(), key=lambda result: result[0], reverse=reverse)[:top_k] for row in merged
+            ]
+
+        self.last_timings = timings
+        self.last_info = {"partial": True, "missing_shards": missing} if missing else {}
+        return batch_results
+
+    def _better(self, distance: float, other: float) -> bool:
+        return distance > other if self.metric == 'ip' else distance < other
+
+    async def _scatter(
+        self,
+        query_embeddings: np.ndarray,
+        top_k: int,
+        filters: Optional[Dict[str, Any]]
+    ) -> List[Any]:
+        vectors = np.ascontiguousarray(query_embeddings, dtype='<f4')
+        payload = {
+            "op": "search_vectors",
+            "vectors": base64.b64encode(vectors.tobytes()).decode('ascii'),
+            "dimension": vectors.shape[1],
+            "top_k": top_k,
+            "filters": filters or None,
+            # Shards drop the search if it would only start after we gave up
+            "deadline_ms": self.timeout * 1000
+        }
+
+        async def search_shard(client: ShardClient, textbook_id: str) -> Dict[str, Any]:
+            response = await client.request({**payload, "textbook": textbook_id}, self.timeout)
+            if 'error' in response:
+                raise Exception(response['error'])
+            return response
+
+        return await asyncio.gather(
+            *[search_shard(client, textbook_id) for client, textbook_id in self.targets],
+            return_exceptions=True
+        )
+
+
+class CoordinatorService(SearchService):
+    """SearchService whose stats and info also cover the shards."""
+
+    def __init__(self, scheduler: BatchScheduler, clients: List[ShardClient], coalesce: bool = True):
+        super().__init__(scheduler, coalesce=coalesce)
+        self.clients = clients
+
+    async def handle_request(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        response = await super().handle_request(request)
+        if request.get('op') == 'stats' and 'stats' in response:
+            response['shards'] = {client.address: client.metrics() for client in self.clients}
+        return response
+
+    async def related(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Ask every shard of the textbook; the one holding the chunk answers
+        with related chunks from its own part of the book.
+        """
+        textbook_id = request.get('textbook')
+        searcher = self.scheduler.searchers.get(textbook_id)
+        if searcher is None:
+            raise ValueError(f"Unknown textbook: {textbook_id}")
+        if textbook_id == ALL_TEXTBOOKS:
+            raise ValueError("Related passages are looked up in the chunk's own textbook")
+
+        responses = await asyncio.gather(
+            *[client.request({**request, "textbook": shard_textbook}, searcher.timeout)
+              for client, shard_textbook in searcher.targets],
+            return_exceptions=True
+        )
+        errors = []
+        for response in responses:
+            if isinstance(response, BaseException):
+                errors.append(str(response) or type(response).__name__)
+            elif 'error' in response:
+                errors.append(response['error'])
+            else:
+                response.pop('id', None)
+                response['textbook'] = {"id": textbook_id, "name": searcher.config['textbook_name']}
+                return response
+        raise ValueError('; '.join(dict.fromkeys(errors)))
+
+    async def suggest(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Suggestions of every shard of the textbook, merged by weight."""
+        textbook_id = request.get('textbook')
+        text = request.get('text') or ''
+        limit = parse_count(request.get('limit'), 'limit', 8)
+        searcher = self.scheduler.searchers.get(textbook_id)
+        if searcher is None:
+            raise ValueError(f"Unknown textbook: {textbook_id}")
+
+        start = time.perf_counter()
+        # Extra candidates per shard, since a term's weight is split between shards
+        payload = {**request, "limit": 2 * limit}
+        responses = await asyncio.gather(
+            *[client.request({**payload, "textbook": shard_textbook}, searcher.timeout)
+              for client, shard_textbook in searcher.targets],
+            return_exceptions=True
+        )
+        merged: Dict[str, Dict[str, Any]] = {}
+        errors = []
+        for response in responses:
+            if isinstance(response, BaseException):
+                errors.append(str(response) or type(response).__name__)
+            elif 'error' in response:
+                errors.append(response['error'])
+            else:
+                for suggestion in response['suggestions']:
+                    known = merged.setdefault(suggestion['text'], dict(suggestion, weight=0))
+                    known['weight'] += suggestion['weight']
+                    known['heading'] = known['heading'] or suggestion['heading']
+        if errors and len(errors) == len(responses):
+            raise ValueError('; '.join(dict.fromkeys(errors)))
+
+        # A shard without a phrase for the whole typed tail completes a
+        # shorter one; like a single index, keep only the longest tail
+        def head(suggestion):
+            return len(suggestion['text']) - len(suggestion['completion'])
+        shortest = min(map(head, merged.values()), default=0)
+        suggestions = sorted(
+            (suggestion for suggestion in merged.values() if head(suggestion) == shortest),
+            key=lambda suggestion: -suggestion['weight']
+        )[:limit]
+        lookup_us = round((time.perf_counter() - start) * 1e6, 1)
+        return {"text": text, "suggestions": suggestions, "lookup_us": lookup_us}
+
+    def textbook_info(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            textbook_id: {
+                "name": searcher.config['textbook_name'],
+                "model_name": searcher.model_name,
+                "metric": searcher.metric,
+                "dimension": searcher.dimension,
+                "chunks": searcher.chunks,
+                "version": None,
+                "shards": list(dict.fromkeys(client.address for client, _ in searcher.targets))
+            }
+            for textbook_id, searcher in sorted(self.scheduler.searchers.items())
+        }
+
+
+async def discover_shards(clients: List[ShardClient], timeout: float) -> Optional[List[Dict[str, Any]]]:
+    """
+    Ask every shard which textbooks it serves, retrying while shards start.
+
+    Returns:
+        The "textbooks" info of each shard, or None if one never answers
+    """
+    deadline = time.monotonic() + timeout
+    shard_infos = []
+    for client in clients:
+        while True:
+            try:
+                response = await client.request({"op": "info"}, max(0.1, deadline - time.monotonic()))
+                shard_infos.append(response['textbooks'])
+                break
+            except (OSError, ValueError, KeyError, asyncio.TimeoutError) as e:
+                if time.monotonic() >= deadline:
+                    print(json.dumps({"error": f"Shard {client.address} did not answer: {str(e) or 'timeout'}"}))
+                    return None
+                await asyncio.sleep(0.5)
+    return shard_infos
+
+
+def build_searchers(
+    clients: List[ShardClient],
+    shard_infos: List[Dict[str, Any]],
+    args,
+    loop: asyncio.AbstractEventLoop
+) -> Dict[str, ShardedSearcher]:
+    """One ShardedSearcher per textbook, plus a cross-shard 'all' when no shard serves one."""
+    targets: Dict[str, List[Tuple[ShardClient, str]]] = {}
+    details: Dict[str, Dict[str, Any]] = {}
+
+    def signature(info: Dict[str, Any]) -> Tuple:
+        return (info.get('model_name') or args.model, info.get('metric'), info.get('dimension'))
+
+    for client, textbooks in zip(clients, shard_infos):
+        for textbook_id, info in textbooks.items():
+            if textbook_id in details and signature(details[textbook_id]) != signature(info):
+                print(f"WARNING: Ignoring '{textbook_id}' on {client.address}: indexed differently "
+                      f"than on {targets[textbook_id][0][0].address}", file=sys.stderr)
+                continue
+            if textbook_id in details:
+                details[textbook_id]['chunks'] = (details[textbook_id].get('chunks') or 0) + (info.get('chunks') or 0)
+            details.setdefault(textbook_id, dict(info))
+            targets.setdefault(textbook_id, []).append((client, textbook_id))
+
+    if ALL_TEXTBOOKS not in targets and len(targets) > 1:
+        # Distances are only comparable between books encoded the same way
+        common = Counter(signature(info) for info in details.values()).most_common(1)[0][0]
+        included = [textbook_id for textbook_id in sorted(targets) if signature(details[textbook_id]) == common]
+        targets[ALL_TEXTBOOKS] = [target for textbook_id in included for target in targets[textbook_id]]
+        details[ALL_TEXTBOOKS] = {
+            "name": "All textbooks", "model_name": common[0], "metric": common[1], "dimension": common[2],
+            "chunks": sum(details[textbook_id].get('chunks') or 0 for textbook_id in included)
+        }
+
+    from encoders import load_encoder
+    models = {}
+    searchers = {}
+    for textbook_id in sorted(targets):
+        info = {**details[textbook_id], "model_name": signature(details[textbook_id])[0]}
+        if info['model_name'] not in models:
+            models[info['model_name']] = load_encoder(args.encoder, info['model_name'], args.onnx_dir)
+        searchers[textbook_id] = ShardedSearcher(
+            textbook_id, targets[textbook_id], info, models[info['model_name']], loop, args.shard_timeout_ms / 1000
+        )
+        shards = ", ".join(client.address for client, _ in targets[textbook_id])
+        print(f"SUCCESS: Routing '{textbook_id}' to {shards}", file=sys.stderr)
+    return searchers
+
+
+async def coordinate(args) -> int:
+    clients = [ShardClient(address) for address in args.shards]
+    shard_infos = await discover_shards(clients, args.connect_timeout)
+    if shard_infos is None:
+        return 1
+
+    try:
+        searchers = build_searchers(clients, shard_infos, args, asyncio.get_running_loop())
+    except Exception as e:
+        print(json.dumps({"error": f"Loading encoder failed: {str(e)}"}))
+        return 1
+    if not searchers:
+        print(json.dumps({"error": "The shards serve no textbooks", "shards": args.shards}))
+        return 1
+
+    scheduler = BatchScheduler(searchers, args.max_wait_ms, args.max_batch_size, max_queue=args.max_queue)
+    scheduler.start()
+    service = CoordinatorService(scheduler, clients, coalesce=not args.no_coalesce)
+
+    server = await asyncio.start_server(service.handle_connection, args.host, args.port, limit=MAX_LINE_BYTES)
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    print(json.dumps({
+        "status": "listening",
+        "host": args.host,
+        "port": args.port,
+        "textbooks": sorted(searchers),
+        "shards": args.shards
+    }), flush=True)
+
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await scheduler.stop()
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve textbook search from several search service shards",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python shard_coordinator.py --shards 127.0.0.1:8801 127.0.0.1:8802
+  python shard_coordinator.py --shards 10.0.0.5:8765 10.0.0.6:8765 --port 8765 --shard_timeout_ms 200
+        """
+    )
+
+    parser.add_argument('--shards', nargs='+', required=True, help='Shard addresses (host:port of search_service.py)')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8765, help='Port to listen on (default: 8765)')
+    parser.add_argument(
+        '--shard_timeout_ms', type=float, default=1000,
+        help='Time each shard gets to answer before results are returned without it (default: 1000)'
+    )
+    parser.add_argument(
+        '--connect_timeout', type=float, default=60,
+        help='Seconds to wait at startup for every shard to answer (default: 60)'
+    )
+    parser.add_argument(
+        '--model', default='all-MiniLM-L6-v2',
+        help='Encoder for textbooks whose shards report no model (default: all-MiniLM-L6-v2)'
+    )
+    parser.add_argument(
+        '--encoder', choices=['torch', 'onnx'], default='torch',
+        help='Query encoder backend (default: torch)'
+    )
+    parser.add_argument(
+        '--onnx_dir',
+        help='Exported ONNX model directory for --encoder onnx (see encoders.py export)'
+    )
+    parser.add_argument(
+        '--max_wait_ms', type=float, default=5.0,
+        help='Longest a query waits for a batch to fill (default: 5)'
+    )
+    parser.add_argument(
+        '--max_batch_size', type=int, default=32,
+        help='Maximum queries per batch (default: 32)'
+    )
+    parser.add_argument(
+        '--max_queue', type=int, default=512,
+        help='Most queries queued at once; more are refused (shed); 0 means unbounded (default: 512)'
+    )
+    parser.add_argument(
+        '--no_coalesce', action='store_true',
+        help='Search identical concurrent queries separately instead of sharing one search'
+    )
+
+    args = parser.parse_args()
+
+    if args.shard_timeout_ms <= 0:
+        parser.error("shard_timeout_ms must be positive")
+    if args.max_batch_size <= 0:
+        parser.error("max_batch_size must be positive")
+    for address in args.shards:
+        if not address.rpartition(':')[2].isdigit():
+            parser.error(f"Shard address must be host:port: {address}")
+
+    try:
+        return asyncio.run(coordinate(args))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        return 0
+
+
+if __name__ == "__main__":
+    exit(main())
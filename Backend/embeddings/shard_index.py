@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Split a Textbook Index into Shards
+
+Writes one indices directory per shard, each holding a contiguous part of a
+textbook's chunks under the same textbook ID, so every part can be served
+by its own search_service.py behind shard_coordinator.py:
+
+    shards/0/economics_index.faiss   economics_metadata.pkl
+             economics_config.json   economics_manifest.json
+             economics_neighbors.npz economics_suggest.json
+    shards/1/...
+
+Vectors are copied out of the index unchanged, so distances from the parts
+are comparable and the coordinator's merged top-k equals the top-k of the
+whole index. Each part gets its own neighbor graph (related passages from
+within the part, as the coordinator serves them) and suggestion terms
+counted over its chunks, which the coordinator adds up again.
+
+Usage:
+    python shard_index.py --textbook economics --shards 2 --output_dir shards
+    python search_service.py --indices_dir shards/0 --port 8801
+"""
+
+import argparse
+import json
+import pickle
+from pathlib import Path
+from typing import List, Optional
+
+from index_manifest import build_manifest, manifest_path_for, write_manifest
+from query_suggestions import build_suggestions, save_suggestions, suggest_path_for
+from related_chunks import DEFAULT_NEIGHBORS, build_neighbor_graph, graph_path_for, load_graph, save_graph
+from textbook_catalog import is_library_textbook, load_config, textbook_files
+
+
+def split_textbook(
+    indices_dir: str,
+    textbook_id: str,
+    shards: int,
+    output_dir: str,
+    neighbors: Optional[int] = None
+) -> List[Path]:
+    """
+    Split a textbook's index and metadata into contiguous parts, each with
+    its own neighbor graph and suggestion terms.
+
+    Args:
+        indices_dir: Directory containing the textbook's index
+        textbook_id: Textbook to split
+        shards: Number of parts
+        output_dir: Directory receiving one subdirectory per part
+        neighbors: Related chunks kept per chunk (default: as many as the
+            book's own graph, or DEFAULT_NEIGHBORS; 0 builds none)
+
+    Returns:
+        The shard directories
+    """
+    import faiss
+    import numpy as np
+
+    if is_library_textbook(indices_dir, textbook_id):
+        raise ValueError(f"{textbook_id} is part of the unified library; split books with their own index files")
+
+    files = textbook_files(indices_dir, textbook_id)
+    config = load_config(indices_dir, textbook_id)
+    if config is None:
+        raise FileNotFoundError(f"Config file not found: {files['config']}")
+
+    index = faiss.read_index(str(files["index"]))
+    with open(files["metadata"], 'rb') as f:
+        metadata = pickle.load(f)
+    if len(metadata) != index.ntotal:
+        raise ValueError(f"Metadata has {len(metadata)} entries for {index.ntotal} index vectors")
+    if not 0 < shards <= index.ntotal:
+        raise ValueError(f"Cannot split {index.ntotal} chunks into {shards} shards")
+
+    try:
+        vectors = index.reconstruct_n(0, index.ntotal)
+    except RuntimeError:
+        # IVF indices can only return stored vectors with a direct map
+        faiss.extract_index_ivf(index).make_direct_map()
+        vectors = index.reconstruct_n(0, index.ntotal)
+
+    if neighbors is None:
+        graph = load_graph(graph_path_for(files["index"]))
+        neighbors = graph["neighbors"].shape[1] if graph is not None else DEFAULT_NEIGHBORS
+
+    shard_dirs = []
+    for shard, positions in enumerate(np.array_split(np.arange(index.ntotal), shards)):
+        start, end = int(positions[0]), int(positions[-1]) + 1
+        shard_dir = Path(output_dir) / str(shard)
+        shard_dir.mkdir(parents=True, exist_ok=True)
+
+        # Same index type and training as the original, holding this part only
+        part = faiss.clone_index(index)
+        part.reset()
+        part.add(vectors[start:end])
+
+        index_path = shard_dir / f"{textbook_id}_index.faiss"
+        metadata_path = shard_dir / f"{textbook_id}_metadata.pkl"
+        faiss.write_index(part, str(index_path))
+        with open(metadata_path, 'wb') as f:
+            pickle.dump(metadata[start:end], f)
+
+        shard_config = {
+            **config,
+            "total_chunks": end - start,
+            "shard": {"index": shard, "count": shards, "first_chunk": start}
+        }
+        with open(shard_dir / f"{textbook_id}_config.json", 'w', encoding='utf-8') as f:
+            json.dump(shard_config, f, indent=2)
+
+        # Related passages and suggestions are looked up per part, so they
+        # are rebuilt from the part's own vectors and chunks
+        if neighbors > 0:
+            save_graph(graph_path_for(index_path), build_neighbor_graph(part, vectors[start:end], neighbors))
+        save_suggestions(suggest_path_for(index_path), build_suggestions(metadata[start:end]))
+
+        write_manifest(
+            manifest_path_for(index_path),
+            build_manifest(index_path, metadata_path, end - start, config.get('model_name', 'all-MiniLM-L6-v2'))
+        )
+        shard_dirs.append(shard_dir)
+
+    return shard_dirs
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Split a textbook index into parts for sharded search",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python shard_index.py --textbook economics --shards 2
+  python shard_index.py --textbook intro_ml --shards 4 --output_dir /srv/shards
+        """
+    )
+
+    parser.add_argument('--textbook', '-t', required=True, help='Textbook ID to split')
+    parser.add_argument('--shards', '-n', type=int, required=True, help='Number of shards')
+    parser.add_argument('--output_dir', '-o', default='shards', help='Directory for the shard directories (default: shards)')
+    parser.add_argument(
+        '--related', type=int,
+        help='Related chunks kept per chunk in each part; 0 skips them '
+             '(default: as many as the book\'s own graph, or 8)'
+    )
+    parser.add_argument(
+        '--indices_dir',
+        default='indices',
+        help='Directory containing FAISS indices and metadata (default: indices)'
+    )
+
+    args = parser.parse_args()
+
+    try:
+        shard_dirs = split_textbook(args.indices_dir, args.textbook, args.shards, args.output_dir, args.related)
+        for shard_dir in shard_dirs:
+            print(f"Shard written to: {shard_dir}")
+        return 0
+
+    except Exception as e:
+        print(f"ERROR: {str(e)}")
+        return 1
+
+
+if __name__ == "__main__":
+    exit(main())
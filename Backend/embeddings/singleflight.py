@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Request Coalescing (Singleflight) for the Search Service
+
+When many students ask the same question at once, only the first request
+runs the encode + FAISS search; identical requests arriving while it is in
+flight wait for it and receive the same result. Nothing is kept after the
+computation finishes, so unlike a cache this never serves stale results.
+
+Requests are identical when their normalized key matches: textbook, query
+normalized like the answer cache does (case, whitespace, trailing
+punctuation), top_k and filters.
+
+The LLM answer itself is coalesced by server.js, which owns the
+llm_answer.py processes.
+"""
+
+import asyncio
+import json
+from typing import Dict, Any, Awaitable, Callable, Hashable, Optional, Tuple
+
+from answer_cache import normalize_query
+from search_faiss import normalize_filters
+
+
+def search_key(
+    textbook_id: str,
+    query: str,
+    top_k: int,
+    filters: Optional[Dict[str, Any]] = None,
+    timings: bool = False
+) -> Tuple:
+    """Coalescing key of a search request."""
+    return (
+        textbook_id,
+        normalize_query(query),
+        top_k,
+        json.dumps(normalize_filters(filters), sort_keys=True),
+        timings
+    )
+
+
+class SingleFlight:
+    """
+    Runs at most one computation per key at a time.
+
+    The computation runs as its own task, so a caller that goes away (e.g.
+    its client disconnected) does not cancel it for the others waiting; it
+    is cancelled once every caller has gone.
+    """
+
+    def __init__(self):
+        self.flights: Dict[Hashable, asyncio.Future] = {}
+        self.counters = {
+            'executed': 0,
+            'coalesced': 0,
+            'max_waiters': 0
+        }
+        self._waiters: Dict[Hashable, int] = {}
+
+    async def do(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Run compute() for key, or join the run already in flight.
+
+        Args:
+            key: Coalescing key (see search_key)
+            compute: Coroutine function producing the result
+
+        Returns:
+            (result, shared) where shared is True for callers that joined
+            another caller's computation. The result object is the same for
+            all callers; copy it before modifying it.
+        """
+        flight = self.flights.get(key)
+        shared = flight is not None
+        if shared:
+            self.counters['coalesced'] += 1
+            self._waiters[key] += 1
+            self.counters['max_waiters'] = max(self.counters['max_waiters'], self._waiters[key])
+        else:
+            self.counters['executed'] += 1
+            flight = asyncio.ensure_future(compute())
+            self.flights[key] = flight
+            self._waiters[key] = 1
+            flight.add_done_callback(lambda done: self._finish(key, done))
+        try:
+            return await asyncio.shield(flight), shared
+        except asyncio.CancelledError:
+            self._leave(key, flight)
+            raise
+
+    def _leave(self, key: Hashable, flight: asyncio.Future):
+        if self.flights.get(key) is not flight:
+            return
+        self._waiters[key] -= 1
+        if self._waiters[key] == 0:
+            # Callers arriving from now on start a new flight
+            del self.flights[key]
+            del self._waiters[key]
+            flight.cancel()
+
+    def _finish(self, key: Hashable, flight: asyncio.Future):
+        if self.flights.get(key) is flight:
+            del self.flights[key]
+            del self._waiters[key]
+        # Retrieve the exception so a flight whose callers all went away
+        # does not log "exception was never retrieved"
+        if not flight.cancelled():
+            flight.exception()
+
+    def metrics(self) -> Dict[str, Any]:
+        counters = dict(self.counters)
+        counters['in_flight'] = len(self.flights)
+        counters['saved_ratio'] = round(
+            counters['coalesced'] / max(1, counters['executed'] + counters['coalesced']), 4
+        )
+        return counters
@@ -0,0 +1,71 @@
+"""Shared helpers for the embeddings tests: a small hashing encoder and tiny textbook indices."""
+
+import contextlib
+import hashlib
+import io
+import json
+import sys
+from pathlib import Path
+from typing import List
+
+import numpy as np
+import pytest
+
+# The scripts import each other as top-level modules
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+DIMENSION = 64
+
+
+class HashingEncoder:
+    """Deterministic bag-of-words encoder standing in for the sentence transformer."""
+
+    dimension = DIMENSION
+
+    def encode(self, texts, batch_size: int = 32, **kwargs) -> np.ndarray:
+        if isinstance(texts, str):
+            texts = [texts]
+        vectors = np.zeros((len(texts), DIMENSION), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                vectors[row, int(hashlib.md5(word.encode()).hexdigest(), 16) % DIMENSION] += 1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms > 0, norms, 1.0)
+
+
+@pytest.fixture
+def encoder() -> HashingEncoder:
+    return HashingEncoder()
+
+
+def book_texts(count: int) -> List[str]:
+    """Chunk texts sharing a few phrases, so suggestions and neighbors exist."""
+    topics = ["opportunity cost", "supply and demand", "marginal utility", "price elasticity"]
+    return [
+        f"Chunk {i} explains {topics[i % len(topics)]} with example {i // len(topics)} of {topics[(i + 1) % len(topics)]}."
+        for i in range(count)
+    ]
+
+
+def write_textbook(indices_dir: Path, textbook_id: str, texts: List[str], related: int = 4) -> Path:
+    """Index texts as a per-book textbook (index, metadata, config, graph, suggestions)."""
+    from embedding_indexer import save_book_index
+
+    indices_dir.mkdir(parents=True, exist_ok=True)
+    metadata = [
+        {"chunk_id": f"chunk_{i:04d}", "text": text, "source_file": f"{textbook_id}.pdf", "page": i // 4 + 1}
+        for i, text in enumerate(texts)
+    ]
+    with contextlib.redirect_stdout(io.StringIO()):
+        save_book_index(
+            str(indices_dir / textbook_id), HashingEncoder().encode(texts), metadata, MODEL_NAME, related=related
+        )
+    with open(indices_dir / f"{textbook_id}_config.json", 'w', encoding='utf-8') as f:
+        json.dump({
+            "textbook_name": textbook_id.title(),
+            "model_name": MODEL_NAME,
+            "total_chunks": len(texts),
+            "index_type": "flat"
+        }, f)
+    return indices_dir
@@ -0,0 +1,40 @@
+"""Answer cache keys."""
+
+import sqlite3
+
+import numpy as np
+
+from answer_cache import AnswerCache
+
+CHUNKS = ["Opportunity cost is the value of the next best alternative."]
+QUERY = "What is opportunity cost?"
+
+
+def test_prompt_budget_is_part_of_the_key(tmp_path):
+    cache = AnswerCache(str(tmp_path / "answers.sqlite3"))
+    embedding = np.ones(8, dtype=np.float32)
+    cache.put("model", 2, 2000, CHUNKS, QUERY, "answer", "together.ai", "economics", embedding)
+
+    assert cache.get(["model"], 2, 2000, CHUNKS, QUERY)["match"] == "exact"
+    assert cache.get(["model"], 2, 500, CHUNKS, QUERY) is None
+    assert cache.get(["model"], 2, 500, CHUNKS, "Opportunity cost?", "economics", embedding) is None
+    assert cache.get(["model"], 2, 2000, CHUNKS, "Opportunity cost?", "economics", embedding)["match"] == "semantic"
+    cache.close()
+
+
+def test_cache_without_budget_column_is_upgraded(tmp_path):
+    path = tmp_path / "answers.sqlite3"
+    conn = sqlite3.connect(str(path))
+    conn.execute(
+        "CREATE TABLE answers (key TEXT PRIMARY KEY, textbook TEXT, model TEXT NOT NULL, "
+        "prompt_version INTEGER NOT NULL, chunk_hash TEXT NOT NULL, query TEXT NOT NULL, answer TEXT NOT NULL, "
+        "api_used TEXT, embedding BLOB, created_at REAL NOT NULL, last_access REAL NOT NULL, "
+        "hits INTEGER NOT NULL DEFAULT 0)"
+    )
+    conn.commit()
+    conn.close()
+
+    cache = AnswerCache(str(path))
+    cache.put("model", 2, 2000, CHUNKS, QUERY, "answer", "together.ai")
+    assert cache.get(["model"], 2, 2000, CHUNKS, QUERY)["answer"] == "answer"
+    cache.close()
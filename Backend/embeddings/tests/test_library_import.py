@@ -0,0 +1,29 @@
+"""Importing per-book indices into the unified library."""
+
+import contextlib
+import io
+
+from conftest import HashingEncoder, book_texts, write_textbook
+
+
+def test_imported_book_resolves_to_the_library(tmp_path):
+    from embedding_indexer import import_textbooks_to_library
+    from search_faiss import MultiTextbookSearcher
+    from textbook_catalog import is_library_textbook, list_textbooks
+
+    indices_dir = write_textbook(tmp_path / "indices", "economics", book_texts(12))
+    with contextlib.redirect_stdout(io.StringIO()):
+        import_textbooks_to_library(str(indices_dir), ["economics"])
+
+    assert is_library_textbook(str(indices_dir), "economics")
+    assert not (indices_dir / "economics_config.json").exists()
+    assert (indices_dir / "economics_config.json.imported").exists()
+    assert [book["id"] for book in list_textbooks(str(indices_dir))] == ["economics"]
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        searcher = MultiTextbookSearcher(
+            "economics", json_mode=True, indices_dir=str(indices_dir), model=HashingEncoder()
+        )
+    assert searcher.library_mode
+    results = searcher.search("opportunity cost", top_k=3)
+    assert len(results) == 3
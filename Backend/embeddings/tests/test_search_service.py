@@ -0,0 +1,108 @@
+"""Search service request handling: coalesced searches and their admission."""
+
+import asyncio
+import contextlib
+import io
+import time
+
+from conftest import HashingEncoder, book_texts, write_textbook
+
+TEXTBOOK = "economics"
+SLOW_SECONDS = 0.3
+
+
+class SlowEncoder(HashingEncoder):
+    """Takes SLOW_SECONDS for batches containing a "slow" query, to keep the batch worker busy."""
+
+    def encode(self, texts, batch_size: int = 32, **kwargs):
+        if any("slow" in text for text in ([texts] if isinstance(texts, str) else texts)):
+            time.sleep(SLOW_SECONDS)
+        return super().encode(texts, batch_size, **kwargs)
+
+
+@contextlib.asynccontextmanager
+async def search_service(tmp_path):
+    from search_faiss import MultiTextbookSearcher
+    from search_service import BatchScheduler, SearchService
+
+    write_textbook(tmp_path / "indices", TEXTBOOK, book_texts(12))
+    with contextlib.redirect_stdout(io.StringIO()):
+        searcher = MultiTextbookSearcher(
+            TEXTBOOK, json_mode=True, indices_dir=str(tmp_path / "indices"), model=SlowEncoder()
+        )
+    scheduler = BatchScheduler({TEXTBOOK: searcher})
+    scheduler.start()
+    try:
+        yield SearchService(scheduler)
+    finally:
+        await scheduler.stop()
+
+
+def search(query: str, **fields):
+    return {"op": "search", "textbook": TEXTBOOK, "query": query, **fields}
+
+
+def test_coalesced_callers_keep_their_own_deadline(tmp_path):
+    """A follower with a loose deadline is not refused for the leader's tight one."""
+
+    async def run():
+        async with search_service(tmp_path) as service:
+            # Estimated wait of a new search: about one slow batch
+            service.scheduler.batch_seconds = SLOW_SECONDS
+            return await asyncio.gather(
+                service.handle_request(search("what is opportunity cost", deadline_ms=50)),
+                service.handle_request(search("What is opportunity cost?", deadline_ms=5000))
+            )
+
+    leader, follower = asyncio.run(run())
+    assert "error" not in follower, follower
+    assert follower["coalesced"] is True
+    assert "error" not in leader, leader
+
+
+def test_coalesced_search_is_kept_until_the_loosest_deadline(tmp_path):
+    """A queued shared search is not dropped when only the leader's deadline has run out."""
+
+    async def run():
+        async with search_service(tmp_path) as service:
+            blocker = asyncio.ensure_future(service.handle_request(search("slow question")))
+            await asyncio.sleep(0.05)
+            leader = asyncio.ensure_future(
+                service.handle_request(search("what is opportunity cost", deadline_ms=100, priority="low"))
+            )
+            await asyncio.sleep(0.01)
+            follower = asyncio.ensure_future(
+                service.handle_request(search("what is opportunity cost", deadline_ms=5000, priority="high"))
+            )
+            await asyncio.sleep(0.01)
+            queued = [
+                admission.request for admission in service.admissions.values()
+                if admission.request.query != "slow question"
+            ][0]
+            widened = (queued.priority, queued.deadline - time.monotonic())
+            return widened, await asyncio.gather(blocker, leader, follower)
+
+    (priority, remaining), (_, leader, follower) = asyncio.run(run())
+    assert priority == 0
+    assert remaining > 1.0
+    assert "error" not in follower, follower
+    assert "error" not in leader, leader
+
+
+def test_counts_must_be_positive_integers(tmp_path):
+    async def run():
+        async with search_service(tmp_path) as service:
+            return await asyncio.gather(
+                service.handle_request(search("opportunity cost", top_k="five")),
+                service.handle_request(search("opportunity cost", top_k=0)),
+                service.handle_request({"op": "related", "textbook": TEXTBOOK, "chunk_id": "chunk_0001", "top_k": 2.5}),
+                service.handle_request({"op": "suggest", "textbook": TEXTBOOK, "text": "opp", "limit": None}),
+                service.handle_request(search("opportunity cost", top_k="3"))
+            )
+
+    words, zero, fraction, default_limit, numeric_string = asyncio.run(run())
+    assert words == {"error": "top_k must be a positive integer"}
+    assert zero == {"error": "top_k must be a positive integer"}
+    assert fraction == {"error": "top_k must be a positive integer"}
+    assert "error" not in default_limit, default_limit
+    assert len(numeric_string["results"]) == 3
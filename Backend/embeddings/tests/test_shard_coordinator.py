@@ -0,0 +1,106 @@
+"""Coordinator lookups (suggest, related) on a textbook split into chunk shards."""
+
+import asyncio
+import contextlib
+import io
+
+from conftest import HashingEncoder, book_texts, write_textbook
+
+TEXTBOOK = "economics"
+
+
+def split_book(tmp_path, shards: int = 2):
+    from shard_index import split_textbook
+
+    write_textbook(tmp_path / "indices", TEXTBOOK, book_texts(40))
+    return split_textbook(str(tmp_path / "indices"), TEXTBOOK, shards, str(tmp_path / "shards"))
+
+
+@contextlib.asynccontextmanager
+async def coordinator(shard_dirs):
+    """A CoordinatorService over one in-process search service per shard directory."""
+    from search_faiss import MultiTextbookSearcher
+    from search_service import BatchScheduler, SearchService
+    from shard_coordinator import CoordinatorService, ShardClient, ShardedSearcher, discover_shards
+
+    encoder = HashingEncoder()
+    schedulers, servers = [], []
+    for shard_dir in shard_dirs:
+        with contextlib.redirect_stdout(io.StringIO()):
+            searcher = MultiTextbookSearcher(TEXTBOOK, json_mode=True, indices_dir=str(shard_dir), model=encoder)
+        scheduler = BatchScheduler({TEXTBOOK: searcher})
+        scheduler.start()
+        server = await asyncio.start_server(SearchService(scheduler).handle_connection, '127.0.0.1', 0)
+        schedulers.append(scheduler)
+        servers.append(server)
+
+    clients = [ShardClient(f"127.0.0.1:{server.sockets[0].getsockname()[1]}") for server in servers]
+    infos = await discover_shards(clients, 5.0)
+    sharded = ShardedSearcher(
+        TEXTBOOK, [(client, TEXTBOOK) for client in clients], infos[0][TEXTBOOK], encoder,
+        asyncio.get_running_loop(), 5.0
+    )
+    scheduler = BatchScheduler({TEXTBOOK: sharded})
+    scheduler.start()
+    try:
+        yield CoordinatorService(scheduler, clients)
+    finally:
+        await scheduler.stop()
+        for server in servers:
+            server.close()
+        for shard_scheduler in schedulers:
+            await shard_scheduler.stop()
+
+
+def test_split_parts_have_suggestions(tmp_path):
+    from query_suggestions import load_suggestions, suggest_path_for
+
+    for shard_dir in split_book(tmp_path):
+        saved = load_suggestions(suggest_path_for(shard_dir / f"{TEXTBOOK}_index.faiss"))
+        assert saved is not None
+        assert saved["chunks"] == 20
+
+
+def test_coordinator_suggest_on_split_shards(tmp_path):
+    shard_dirs = split_book(tmp_path)
+
+    async def run():
+        async with coordinator(shard_dirs) as service:
+            return await service.handle_request({"op": "suggest", "textbook": TEXTBOOK, "text": "what is opportunity c"})
+
+    response = asyncio.run(run())
+    assert "error" not in response, response
+    completions = [suggestion["completion"] for suggestion in response["suggestions"]]
+    assert "opportunity cost" in completions
+    assert response["suggestions"][0]["text"].startswith("what is opportunity c")
+
+
+def test_split_parts_have_neighbor_graphs(tmp_path):
+    from related_chunks import graph_path_for, load_graph
+
+    for shard_dir in split_book(tmp_path):
+        graph = load_graph(graph_path_for(shard_dir / f"{TEXTBOOK}_index.faiss"))
+        assert graph is not None
+        assert graph["neighbors"].shape == (20, 4)
+        # Local positions within the part
+        assert graph["neighbors"].max() < 20
+
+
+def test_coordinator_related_on_split_shards(tmp_path):
+    shard_dirs = split_book(tmp_path)
+
+    async def run():
+        async with coordinator(shard_dirs) as service:
+            return [
+                await service.handle_request({"op": "related", "textbook": TEXTBOOK, "chunk_id": chunk_id, "top_k": 3})
+                for chunk_id in ("chunk_0005", "chunk_0030")
+            ]
+
+    first_part, second_part = asyncio.run(run())
+    for response, part in ((first_part, range(0, 20)), (second_part, range(20, 40))):
+        assert "error" not in response, response
+        chunk_ids = [result["chunk_id"] for result in response["results"]]
+        assert len(chunk_ids) == 3
+        # Related passages come from the part holding the chunk
+        assert all(int(chunk_id.split("_")[1]) in part for chunk_id in chunk_ids)
+    assert first_part["chunk_id"] == "chunk_0005"
@@ -0,0 +1,23 @@
+"""Fitting excerpts into the prompt token budget."""
+
+from token_budget import TokenCounter, fit_excerpts
+
+
+def test_boilerplate_only_excerpts_fall_back_to_the_top_one():
+    chunks = [
+        "Copyright 2020 Example Press. All rights reserved.",
+        "No part of this book may be reproduced without permission. ISBN 978-0-00-000000-0.",
+    ]
+    result = fit_excerpts(chunks, 2000, TokenCounter())
+    assert result["chunks"] == [' '.join(chunks[0].split())]
+    assert result["report"]["excerpts_used"] == 1
+    assert result["report"]["excerpts_dropped"] == 1
+
+
+def test_fallback_is_truncated_to_the_budget():
+    counter = TokenCounter()
+    chunk = "Copyright notice. " + "All rights reserved by the publisher of this economics textbook. " * 20
+    result = fit_excerpts([chunk], 30, counter)
+    assert len(result["chunks"]) == 1
+    assert 0 < counter.count(result["chunks"][0]) <= 30
+    assert result["report"]["excerpts_trimmed"] == 1
@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+"""
+Lazy Textbook Loading with a Memory Budget
+
+With search_service.py --lazy a textbook's index and chunk store are loaded
+on its first request instead of at startup. TextbookCache keeps an estimate
+of each loaded book's memory and counts its requests; whenever the loaded
+books exceed --memory_budget_mb the least valuable ones are evicted:
+
+    lru   least recently requested first
+    lfu   fewest requests first, ties broken by recency; counts survive
+          eviction, so a popular book comes back with its history
+
+Books named with --preload are loaded at startup and never evicted. Books
+with requests queued or running are not evicted either, nor are books of
+the unified library: they share the library index, which stays loaded
+anyway. The encoder is shared by every book and not counted.
+
+Usage:
+    python search_service.py --lazy --preload computer_networks intro_ml economics --memory_budget_mb 512
+    python textbook_cache.py --indices_dir indices      (memory of each textbook, to size the budget)
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Callable, Optional
+
+from index_manifest import INDEX_TYPE_METRICS, read_index_header
+from metrics import get_metrics_hook
+from textbook_catalog import is_library_textbook, library_files, load_config, textbook_files
+
+MB = 1024 * 1024
+
+# Seconds before a textbook that failed to load is tried again
+LOAD_RETRY_INTERVAL = 30.0
+
+EVICTION_POLICIES = ['lru', 'lfu']
+
+
+def deep_sizeof(obj: Any) -> int:
+    """Approximate bytes held by an object graph of containers and scalars."""
+    seen = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+    return total
+
+
+def searcher_memory(searcher) -> int:
+    """
+    Estimated bytes a searcher frees when dropped: its FAISS index (taken as
+    the index file size, which matches the in-memory size of flat and IVF
+    indices) plus its chunk metadata, related-passages graph and query
+    suggestions. Library books only free the graph and suggestions.
+    """
+    lookup_bytes = sum(array.nbytes for array in (searcher.related_graph or {}).values())
+    if searcher.suggestions is not None:
+        lookup_bytes += searcher.suggestions.nbytes
+    if searcher.library_mode:
+        return lookup_bytes
+    try:
+        index_bytes = os.path.getsize(searcher.index_path)
+    except OSError:
+        index_bytes = 0
+    return index_bytes + deep_sizeof(searcher.metadata) + lookup_bytes
+
+
+class TextbookCache:
+    """
+    Loads textbooks into a BatchScheduler on demand and evicts them to stay
+    within a memory budget.
+
+    Callers bracket each search with acquire() and release(); a book is only
+    evicted while nobody holds it.
+    """
+
+    def __init__(
+        self,
+        scheduler,
+        available: List[str],
+        load: Callable[[str], Any],
+        indices_dir: str = "indices",
+        budget_mb: float = 0,
+        policy: str = 'lru',
+        pinned: Optional[List[str]] = None
+    ):
+        """
+        Args:
+            scheduler: BatchScheduler whose searchers are managed
+            available: Textbook IDs that may be loaded
+            load: Loads one textbook's searcher, or returns None if it fails
+            indices_dir: Directory containing FAISS indices and metadata
+            budget_mb: Memory budget for loaded books; 0 never evicts
+            policy: 'lru' or 'lfu'
+            pinned: Textbooks never evicted (preloaded by the caller)
+        """
+        if policy not in EVICTION_POLICIES:
+            raise ValueError(f"Unknown eviction policy: {policy}")
+        self.scheduler = scheduler
+        self.available = set(available)
+        self.load = load
+        self.indices_dir = indices_dir
+        self.budget = budget_mb * MB
+        self.policy = policy
+        self.pinned = set(pinned or [])
+        self.metrics_hook = get_metrics_hook()
+        # One book at a time, so concurrent first requests for two books
+        # using the same model do not both load the encoder
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='textbook-load')
+
+        self.books: Dict[str, Dict[str, Any]] = {}
+        self.holders: Dict[str, int] = {}
+        self.loading: Dict[str, asyncio.Task] = {}
+        self.failed_at: Dict[str, float] = {}
+        self._sizes: Dict[str, Any] = {}
+
+        self.counters = {
+            'loads': 0,
+            'load_errors': 0,
+            'evictions': 0,
+            'total_load_ms': 0.0
+        }
+
+    async def acquire(self, textbook_id: str, timings: Optional[Dict[str, float]] = None):
+        """
+        Make sure a textbook is loaded and hold it until release().
+
+        If the request had to wait for the book to load, timings (if given)
+        gets the wait as 'lazy_load'.
+        """
+        if textbook_id not in self.available:
+            raise ValueError(f"Unknown textbook: {textbook_id}")
+
+        book = self._book(textbook_id)
+        book['requests'] += 1
+        book['last_used'] = time.monotonic()
+        self.holders[textbook_id] = self.holders.get(textbook_id, 0) + 1
+
+        try:
+            if textbook_id not in self.scheduler.searchers:
+                started = time.perf_counter()
+                task = self.loading.get(textbook_id)
+                if task is None:
+                    failed_at = self.failed_at.get(textbook_id)
+                    if failed_at and time.monotonic() - failed_at < LOAD_RETRY_INTERVAL:
+                        raise ValueError(f"Textbook failed to load: {textbook_id}")
+                    task = asyncio.get_running_loop().create_task(self._load(textbook_id))
+                    self.loading[textbook_id] = task
+                # Callers that give up must not cancel the load for the others
+                await asyncio.shield(task)
+                if timings is not None:
+                    timings['lazy_load'] = round((time.perf_counter() - started) * 1000, 3)
+        except BaseException:
+            self.release(textbook_id)
+            raise
+
+    def release(self, textbook_id: str):
+        """Stop holding a textbook; evicts if the budget is exceeded."""
+        self.holders[textbook_id] -= 1
+        if not self.holders[textbook_id]:
+            del self.holders[textbook_id]
+        if self.budget and self.resident_bytes() > self.budget:
+            self.evict()
+
+    async def _load(self, textbook_id: str):
+        started = time.perf_counter()
+        try:
+            searcher = await asyncio.get_running_loop().run_in_executor(self.executor, self._load_sized, textbook_id)
+        except Exception as e:
+            print(f"WARNING: Loading '{textbook_id}' failed: {str(e)}", file=sys.stderr)
+            searcher = None
+        finally:
+            del self.loading[textbook_id]
+        load_ms = round((time.perf_counter() - started) * 1000, 3)
+
+        if searcher is None:
+            self.failed_at[textbook_id] = time.monotonic()
+            self.counters['load_errors'] += 1
+            raise ValueError(f"Textbook failed to load: {textbook_id}")
+        self.failed_at.pop(textbook_id, None)
+
+        self.scheduler.replace_searcher(textbook_id, searcher)
+        book = self._book(textbook_id)
+        book['loads'] += 1
+        book['last_load_ms'] = load_ms
+        self.counters['loads'] += 1
+        self.counters['total_load_ms'] += load_ms
+        size = self.size(textbook_id)
+        print(f"SUCCESS: Loaded '{textbook_id}' on demand in {load_ms:.0f} ms ({size / MB:.1f} MB)", file=sys.stderr)
+        if self.budget and size > self.budget and book['loads'] == 1:
+            print(f"WARNING: '{textbook_id}' alone exceeds the memory budget; "
+                  f"it is evicted after every request", file=sys.stderr)
+        self.evict()
+
+    def _load_sized(self, textbook_id: str):
+        """Load in the loader thread and estimate the size there, off the event loop."""
+        searcher = self.load(textbook_id)
+        if searcher is not None:
+            self._sizes[textbook_id] = (weakref.ref(searcher), searcher_memory(searcher))
+        return searcher
+
+    def _book(self, textbook_id: str) -> Dict[str, Any]:
+        return self.books.setdefault(textbook_id, {
+            'requests': 0,
+            'last_used': 0.0,
+            'loads': 0,
+            'evictions': 0,
+            'last_load_ms': None
+        })
+
+    def size(self, textbook_id: str) -> int:
+        """Estimated bytes of a loaded textbook (re-estimated after a reload swaps it)."""
+        searcher = self.scheduler.searchers[textbook_id]
+        ref, size = self._sizes.get(textbook_id, (None, 0))
+        if ref is None or ref() is not searcher:
+            size = searcher_memory(searcher)
+            self._sizes[textbook_id] = (weakref.ref(searcher), size)
+        return size
+
+    def resident_bytes(self) -> int:
+        """Estimated bytes of all loaded textbooks."""
+        return sum(self.size(textbook_id) for textbook_id in self.scheduler.searchers)
+
+    def evictable(self, textbook_id: str) -> bool:
+        """True if a loaded textbook may be evicted now."""
+        return (
+            textbook_id not in self.pinned
+            and textbook_id not in self.holders
+            and not self.scheduler.searchers[textbook_id].library_mode
+        )
+
+    def evict(self) -> List[str]:
+        """
+        Evict the least valuable evictable textbooks until the loaded ones
+        fit the budget.
+
+        Returns:
+            Evicted textbook IDs
+        """
+        if not self.budget:
+            return []
+
+        resident = self.resident_bytes()
+        candidates = [textbook_id for textbook_id in self.scheduler.searchers if self.evictable(textbook_id)]
+        if self.policy == 'lfu':
+            candidates.sort(key=lambda textbook_id: (self.books[textbook_id]['requests'],
+                                                     self.books[textbook_id]['last_used']))
+        else:
+            candidates.sort(key=lambda textbook_id: self.books[textbook_id]['last_used'])
+
+        evicted = []
+        for textbook_id in candidates:
+            if resident <= self.budget:
+                break
+            size = self.size(textbook_id)
+            started = time.perf_counter()
+            # A batch already running keeps its own reference; the book is
+            # freed when it finishes
+            self.scheduler.remove_searcher(textbook_id)
+            self._sizes.pop(textbook_id, None)
+            self.metrics_hook.observe(textbook_id, {'evict': round((time.perf_counter() - started) * 1000, 3)})
+            resident -= size
+            self.books[textbook_id]['evictions'] += 1
+            self.counters['evictions'] += 1
+            evicted.append(textbook_id)
+            print(f"INFO: Evicted '{textbook_id}' ({size / MB:.1f} MB, {self.policy})", file=sys.stderr)
+        return evicted
+
+    def describe(self, textbook_id: str) -> Dict[str, Any]:
+        """Name, model, metric, dimension and size of a textbook without loading it."""
+        config = load_config(self.indices_dir, textbook_id) or {}
+        if is_library_textbook(self.indices_dir, textbook_id):
+            index_path = library_files(self.indices_dir)["index"]
+        else:
+            index_path = textbook_files(self.indices_dir, textbook_id)["index"]
+        try:
+            header = read_index_header(index_path)
+        except (OSError, ValueError):
+            header = {}
+        return {
+            "name": config.get('textbook_name', textbook_id),
+            "model_name": config.get('model_name'),
+            "metric": header.get("metric", INDEX_TYPE_METRICS.get(config.get('index_type'), "l2")),
+            "dimension": header.get("dimension"),
+            "chunks": config.get('total_chunks', header.get("vector_count")),
+            "version": None
+        }
+
+    def metrics(self) -> Dict[str, Any]:
+        """Budget, residency and per-book load/eviction statistics."""
+        counters = dict(self.counters)
+        counters['avg_load_ms'] = round(counters.pop('total_load_ms') / max(1, counters['loads']), 3)
+        books = {}
+        for textbook_id, book in sorted(self.books.items()):
+            loaded = textbook_id in self.scheduler.searchers
+            books[textbook_id] = {
+                'loaded': loaded,
+                'mb': round(self.size(textbook_id) / MB, 1) if loaded else 0.0,
+                'requests': book['requests'],
+                'loads': book['loads'],
+                'evictions': book['evictions'],
+                'last_load_ms': book['last_load_ms']
+            }
+        return {
+            'policy': self.policy,
+            'budget_mb': round(self.budget / MB, 1),
+            'resident_mb': round(self.resident_bytes() / MB, 1),
+            'loaded': sorted(self.scheduler.searchers),
+            'pinned': sorted(self.pinned),
+            **counters,
+            'books': books
+        }
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load each textbook once and report its estimated memory, to size --memory_budget_mb",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python textbook_cache.py
+  python textbook_cache.py --indices_dir indices --textbooks intro_ml economics
+        """
+    )
+
+    parser.add_argument('--textbooks', nargs='+', help='Textbook IDs (default: every complete index)')
+    parser.add_argument(
+        '--indices_dir',
+        default='indices',
+        help='Directory containing FAISS indices and metadata (default: indices)'
+    )
+
+    args = parser.parse_args()
+
+    try:
+        from search_faiss import MultiTextbookSearcher
+        from textbook_catalog import list_textbooks
+
+        textbook_ids = args.textbooks or [tb['id'] for tb in list_textbooks(args.indices_dir)]
+        model = None
+        total = 0
+        for textbook_id in textbook_ids:
+            searcher = MultiTextbookSearcher(textbook_id, json_mode=True, indices_dir=args.indices_dir, model=model)
+            # The first book also loads the shared encoder; leave that out
+            load_ms = sum(ms for stage, ms in searcher.load_timings.items() if stage != 'load_model')
+            model = searcher.model
+            size = searcher_memory(searcher)
+            total += size
+            shared = "  (library: shared index, never evicted)" if searcher.library_mode else ""
+            print(f"{textbook_id:<24} {size / MB:>8.1f} MB  {len(searcher.metadata):>7} chunks  "
+                  f"{load_ms:>8.0f} ms{shared}")
+            del searcher
+        print(f"{'total':<24} {total / MB:>8.1f} MB")
+        return 0
+
+    except SystemExit:
+        return 1
+    except Exception as e:
+        print(f"ERROR: {str(e)}")
+        return 1
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+Textbook Catalog for Textbook Chatbot
+
+Lists and validates the textbooks in an indices directory by scanning file
+names and config JSON only. Nothing here imports faiss, numpy or
+sentence-transformers, so catalog commands start in tens of milliseconds.
+
+Textbooks are stored either as separate <id>_index.faiss/<id>_metadata.pkl
+files or as books of the unified library (library.json, library.faiss,
+library.pkl; see library_index.py). Separate files take precedence.
+
+Separate files may be published as versions (see index_versions.py): each
+version lives in <id>.versions/<version>/ and <id>_current.json points at
+the one being served. Without a pointer the files are read from the
+indices directory itself.
+
+Validation also checks each index against its integrity manifest (see
+index_manifest.py) from the FAISS header and file fingerprints, without
+deserializing the index or metadata.
+
+Usage:
+    python textbook_catalog.py --list
+    python textbook_catalog.py --list --json
+    python textbook_catalog.py --validate --json
+    python textbook_catalog.py --validate --textbook intro_ml economics
+    python textbook_catalog.py --validate --deep
+"""
+
+import argparse
+import json
+from pathlib import Path
+from typing import List, Dict, Any, Tuple, Optional
+
+from index_manifest import check_config, check_files, load_manifest, manifest_path_for, read_index_header
+
+# Unified multi-book index files
+LIBRARY_MANIFEST = "library.json"
+LIBRARY_INDEX = "library.faiss"
+LIBRARY_METADATA = "library.pkl"
+
+
+# Versioned index layout
+VERSIONS_SUFFIX = ".versions"
+VERSION_POINTER_SUFFIX = "_current.json"
+
+
+def version_pointer_path(indices_dir: str, textbook_id: str) -> Path:
+    """Path of the file naming a textbook's published version."""
+    return Path(indices_dir) / f"{textbook_id}{VERSION_POINTER_SUFFIX}"
+
+
+def current_version(indices_dir: str, textbook_id: str) -> Optional[Dict[str, Any]]:
+    """The published version pointer of a textbook, or None if unversioned."""
+    try:
+        with open(version_pointer_path(indices_dir, textbook_id), 'r', encoding='utf-8') as f:
+            pointer = json.load(f)
+        return pointer if isinstance(pointer, dict) and 'version' in pointer and 'path' in pointer else None
+    except (OSError, ValueError):
+        return None
+
+
+def textbook_files(indices_dir: str, textbook_id: str) -> Dict[str, Path]:
+    """Paths of the config, FAISS index and metadata files for a textbook."""
+    indices_path = Path(indices_dir)
+    pointer = current_version(indices_dir, textbook_id)
+    if pointer:
+        indices_path = indices_path / pointer['path']
+    return {
+        "config": indices_path / f"{textbook_id}_config.json",
+        "index": indices_path / f"{textbook_id}_index.faiss",
+        "metadata": indices_path / f"{textbook_id}_metadata.pkl"
+    }
+
+
+def load_config(indices_dir: str, textbook_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Load a textbook's config JSON, or None if missing or invalid.
+
+    Textbooks without a config file get their entry from the unified library
+    manifest, if they are in it.
+    """
+    config_path = textbook_files(indices_dir, textbook_id)["config"]
+    if not config_path.exists():
+        manifest = load_library_manifest(indices_dir)
+        book = manifest["books"].get(textbook_id) if manifest else None
+        return dict(book) if isinstance(book, dict) else None
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        return config if isinstance(config, dict) else None
+    except (OSError, ValueError):
+        return None
+
+
+def library_files(indices_dir: str) -> Dict[str, Path]:
+    """Paths of the unified library manifest, FAISS index and chunk store."""
+    indices_path = Path(indices_dir)
+    return {
+        "manifest": indices_path / LIBRARY_MANIFEST,
+        "index": indices_path / LIBRARY_INDEX,
+        "metadata": indices_path / LIBRARY_METADATA
+    }
+
+
+def load_library_manifest(indices_dir: str) -> Optional[Dict[str, Any]]:
+    """Load the unified library manifest, or None if there is no library."""
+    try:
+        with open(library_files(indices_dir)["manifest"], 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        return manifest if isinstance(manifest, dict) and isinstance(manifest.get("books"), dict) else None
+    except (OSError, ValueError):
+        return None
+
+
+def is_library_textbook(indices_dir: str, textbook_id: str) -> bool:
+    """True if a textbook is served from the unified library (no separate config file)."""
+    if textbook_files(indices_dir, textbook_id)["config"].exists():
+        return False
+    manifest = load_library_manifest(indices_dir)
+    return manifest is not None and textbook_id in manifest["books"]
+
+
+def configured_textbook_ids(indices_dir: str) -> List[str]:
+    """IDs of every textbook with a config file or library entry, complete or not."""
+    indices_path = Path(indices_dir)
+    if not indices_path.exists():
+        return []
+    textbook_ids = {
+        config_file.name[:-len("_config.json")]
+        for config_file in indices_path.glob("*_config.json")
+    }
+    textbook_ids.update(
+        pointer_file.name[:-len(VERSION_POINTER_SUFFIX)]
+        for pointer_file in indices_path.glob(f"*{VERSION_POINTER_SUFFIX}")
+    )
+    manifest = load_library_manifest(indices_dir)
+    if manifest:
+        textbook_ids.update(manifest["books"])
+    return sorted(textbook_ids)
+
+
+def list_textbooks(indices_dir: str = "indices") -> List[Dict[str, Any]]:
+    """
+    List textbooks that have a valid config plus index and metadata files.
+
+    Returns:
+        Textbook summaries sorted by name
+    """
+    textbooks = []
+
+    for textbook_id in configured_textbook_ids(indices_dir):
+        if is_library_textbook(indices_dir, textbook_id):
+            files = library_files(indices_dir)
+        else:
+            files = textbook_files(indices_dir, textbook_id)
+        if not (files["index"].exists() and files["metadata"].exists()):
+            continue
+
+        config = load_config(indices_dir, textbook_id)
+        if config is None:
+            continue  # Skip invalid config files
+
+        textbooks.append({
+            "id": textbook_id,
+            "name": config.get('textbook_name', textbook_id),
+            "description": config.get('description', 'No description available'),
+            "chunks": config.get('total_chunks', 'Unknown'),
+            "created": config.get('created_at', 'Unknown')
+        })
+
+    return sorted(textbooks, key=lambda x: x['name'])
+
+
+def validate_textbook(indices_dir: str, textbook_id: str, deep: bool = False) -> Dict[str, Any]:
+    """
+    Check that a textbook's files exist and agree with each other.
+
+    Args:
+        indices_dir: Directory containing FAISS indices and metadata
+        textbook_id: Textbook to validate
+        deep: Also compare full SHA-256 hashes with the integrity manifest
+
+    Returns:
+        Dict with 'id', 'valid', 'missing' file names, 'errors' and 'warnings'
+    """
+    library_book = is_library_textbook(indices_dir, textbook_id)
+    if library_book:
+        files = library_files(indices_dir)
+    else:
+        files = textbook_files(indices_dir, textbook_id)
+    missing = [path.name for path in files.values() if not path.exists()]
+    errors = []
+    warnings = []
+
+    config = load_config(indices_dir, textbook_id)
+    if "config" in files and files["config"].exists() and config is None:
+        errors.append(f"Invalid config JSON: {files['config'].name}")
+
+    for kind in ("index", "metadata"):
+        path = files[kind]
+        if path.exists() and path.stat().st_size == 0:
+            errors.append(f"Empty {kind} file: {path.name}")
+
+    if not missing and not errors:
+        integrity_errors, warnings = _check_integrity(indices_dir, textbook_id, files, config, library_book, deep)
+        errors.extend(integrity_errors)
+
+    return {
+        "id": textbook_id,
+        "valid": not missing and not errors,
+        "missing": missing,
+        "errors": errors,
+        "warnings": warnings
+    }
+
+
+def _check_integrity(
+    indices_dir: str,
+    textbook_id: str,
+    files: Dict[str, Path],
+    config: Optional[Dict[str, Any]],
+    library_book: bool,
+    deep: bool
+) -> Tuple[List[str], List[str]]:
+    """Errors and warnings from the integrity manifest and FAISS header."""
+    errors = []
+    warnings = []
+
+    try:
+        header = read_index_header(files["index"])
+    except (OSError, ValueError) as e:
+        return [f"Unreadable FAISS header: {str(e)}"], warnings
+
+    if library_book:
+        library = load_library_manifest(indices_dir)
+        manifest = library.get("integrity")
+        book = library["books"][textbook_id]
+        stored = sum(entry.get("total_chunks", 0) for entry in library["books"].values())
+        if stored != header["vector_count"]:
+            errors.append(f"Library books hold {stored} chunks, index holds {header['vector_count']} vectors")
+        if book.get("id_base", 0) + book.get("total_chunks", 0) > library.get("next_id", 0):
+            errors.append(f"ID range of {textbook_id} lies beyond the library's next_id")
+    else:
+        manifest = load_manifest(manifest_path_for(files["index"]))
+        if config is not None:
+            errors.extend(check_config(config, header["vector_count"], manifest))
+
+    if manifest:
+        errors.extend(check_files(manifest, files["index"], files["metadata"], deep))
+    else:
+        warnings.append("No integrity manifest; create one with index_manifest.py --write")
+
+    return errors, warnings
+
+
+def validate_textbooks(
+    indices_dir: str,
+    textbook_ids: Optional[List[str]] = None,
+    deep: bool = False
+) -> Dict[str, Any]:
+    """Validate the given textbooks, or every configured one."""
+    textbook_ids = textbook_ids or configured_textbook_ids(indices_dir)
+    results = [validate_textbook(indices_dir, textbook_id, deep) for textbook_id in textbook_ids]
+    return {
+        "indices_dir": str(indices_dir),
+        "valid": bool(results) and all(result["valid"] for result in results),
+        "textbooks": results
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="List and validate textbook indices without loading them",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python textbook_catalog.py --list
+  python textbook_catalog.py --list --json
+  python textbook_catalog.py --validate --textbook intro_ml --json
+  python textbook_catalog.py --validate --deep
+        """
+    )
+
+    parser.add_argument('--list', action='store_true', help='List available textbooks')
+    parser.add_argument('--validate', action='store_true', help='Validate textbook index files')
+    parser.add_argument('--deep', action='store_true', help='With --validate, also compare full file hashes')
+    parser.add_argument('--textbook', '-t', nargs='+', help='Textbook IDs to validate (default: all configured)')
+    parser.add_argument('--json', action='store_true', help='Output results in JSON format')
+    parser.add_argument(
+        '--indices_dir',
+        default='indices',
+        help='Directory containing FAISS indices and metadata (default: indices)'
+    )
+
+    args = parser.parse_args()
+
+    if args.validate:
+        report = validate_textbooks(args.indices_dir, args.textbook, args.deep)
+        if args.json:
+            print(json.dumps(report, indent=2))
+        else:
+            for result in report["textbooks"]:
+                status = "OK" if result["valid"] else "INVALID"
+                print(f"{status}: {result['id']}")
+                for name in result["missing"]:
+                    print(f"   missing: {name}")
+                for error in result["errors"]:
+                    print(f"   error: {error}")
+                for warning in result["warnings"]:
+                    print(f"   warning: {warning}")
+        return 0 if report["valid"] else 1
+
+    textbooks = list_textbooks(args.indices_dir)
+    if args.json:
+        print(json.dumps({"textbooks": textbooks}, indent=2))
+    elif not textbooks:
+        print("No textbooks found.")
+        print(f"Make sure you have run the indexing script to create indices in: {args.indices_dir}")
+    else:
+        print("Available textbooks:")
+        print("=" * 50)
+        for tb in textbooks:
+            print(f"ID: {tb['id']}")
+            print(f"Name: {tb['name']}")
+            print(f"Chunks: {tb['chunks']}")
+            print(f"Description: {tb['description']}")
+            print(f"Created: {tb['created']}")
+            print("-" * 30)
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
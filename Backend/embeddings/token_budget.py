@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Prompt token budgeting for LLM answer generation.
+
+Fits ranked textbook excerpts into a token budget before they are placed in
+the prompt: boilerplate lines are stripped, sentences already present in a
+higher-ranked excerpt are dropped (sliding-window chunks overlap heavily),
+and low-ranked excerpts are trimmed or dropped once the budget is used up.
+
+Usage:
+    python token_budget.py --budget 500 "chunk1" "chunk2" "chunk3"
+"""
+
+import argparse
+import glob
+import json
+import os
+import re
+from typing import List, Dict, Any, Optional
+
+# Lines that carry no content for answering questions
+BOILERPLATE_PATTERNS = [
+    re.compile(r'all rights reserved', re.IGNORECASE),
+    re.compile(r'^\s*(©|\(c\)|copyright\b)', re.IGNORECASE),
+    re.compile(r'no part of this (book|publication) may be reproduced', re.IGNORECASE),
+    re.compile(r'printed (in|by) ', re.IGNORECASE),
+    re.compile(r'\bISBN\b'),
+]
+
+SENTENCE_SPLIT = re.compile(r'(?<=[.!?])\s+')
+
+# Excerpts trimmed below this many tokens are dropped instead
+MIN_EXCERPT_TOKENS = 24
+
+
+class TokenCounter:
+    """
+    Counts tokens with a local tokenizer.
+
+    Uses a tokenizer.json (LLM_TOKENIZER_PATH, or the model's copy in the
+    Hugging Face cache) through the lightweight tokenizers package, then a
+    cached transformers tokenizer, otherwise a word/punctuation estimate
+    calibrated to Llama-style BPE. The tokenizer is loaded on the first
+    count(), so creating a counter costs nothing.
+    """
+
+    def __init__(self, model_name: str = 'mistralai/Mistral-7B-Instruct-v0.1'):
+        self.model_name = model_name
+        self.tokenizer = None
+        self._name = 'estimate'
+        self._loaded = False
+
+    @property
+    def name(self) -> str:
+        """Tokenizer used for counting (loads it if not done yet)."""
+        self._ensure_loaded()
+        return self._name
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self._loaded = True
+            self._load()
+
+    def _load(self):
+        path = os.getenv('LLM_TOKENIZER_PATH') or _cached_tokenizer_file(self.model_name)
+        try:
+            if path:
+                from tokenizers import Tokenizer
+                self.tokenizer = Tokenizer.from_file(path)
+                self._name = f"tokenizers:{os.path.basename(path)}"
+                return
+            from transformers import AutoTokenizer
+            hf_tokenizer = AutoTokenizer.from_pretrained(self.model_name, local_files_only=True)
+            self.tokenizer = hf_tokenizer.backend_tokenizer
+            self._name = f"transformers:{self.model_name}"
+        except Exception:
+            self.tokenizer = None
+
+    def count(self, text: str) -> int:
+        """Number of tokens in text."""
+        if not text:
+            return 0
+        self._ensure_loaded()
+        if self.tokenizer is not None:
+            return len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+        # Words average ~1.3 BPE tokens; punctuation is usually its own token
+        words = len(re.findall(r'\w+', text))
+        symbols = len(re.findall(r'[^\w\s]', text))
+        return int(words * 1.3 + symbols + 0.5)
+
+
+def _cached_tokenizer_file(model_name: str) -> Optional[str]:
+    """tokenizer.json of a model in the local Hugging Face hub cache, if downloaded."""
+    hub_cache = os.getenv('HF_HUB_CACHE') or os.path.join(
+        os.getenv('HF_HOME') or os.path.join(os.path.expanduser('~'), '.cache', 'huggingface'), 'hub'
+    )
+    snapshots = os.path.join(hub_cache, f"models--{model_name.replace('/', '--')}", 'snapshots')
+    matches = sorted(glob.glob(os.path.join(snapshots, '*', 'tokenizer.json')), key=os.path.getmtime)
+    return matches[-1] if matches else None
+
+
+def strip_boilerplate(text: str) -> str:
+    """Remove sentences matching known boilerplate patterns."""
+    sentences = SENTENCE_SPLIT.split(text.strip())
+    kept = [s for s in sentences if not any(p.search(s) for p in BOILERPLATE_PATTERNS)]
+    return ' '.join(kept)
+
+
+def _sentence_key(sentence: str) -> str:
+    return re.sub(r'\W+', ' ', sentence.lower()).strip()
+
+
+def _truncate_words(text: str, budget: int, counter: TokenCounter) -> str:
+    """Longest word prefix of text within the token budget."""
+    words = text.split()
+    low, high = 0, len(words)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if counter.count(' '.join(words[:mid])) <= budget:
+            low = mid
+        else:
+            high = mid - 1
+    return ' '.join(words[:low])
+
+
+def fit_excerpts(
+    chunks: List[str],
+    budget: int,
+    counter: Optional[TokenCounter] = None
+) -> Dict[str, Any]:
+    """
+    Fit ranked excerpts into a token budget.
+
+    Args:
+        chunks: Excerpt texts, highest ranked first
+        budget: Maximum total tokens for all excerpts
+        counter: Token counter (a default one is created if omitted)
+
+    Returns:
+        Dict with the fitted 'chunks' and a 'report' of token counts
+    """
+    counter = counter or TokenCounter()
+    tokens_before = sum(counter.count(chunk) for chunk in chunks)
+
+    fitted = []
+    seen = set()
+    used = 0
+    trimmed = 0
+    dropped = 0
+
+    for chunk in chunks:
+        sentences = []
+        keys = []
+        for sentence in SENTENCE_SPLIT.split(strip_boilerplate(chunk)):
+            key = _sentence_key(sentence)
+            if key and key not in seen and key not in keys:
+                sentences.append(sentence)
+                keys.append(key)
+
+        if not sentences:
+            dropped += 1
+            continue
+
+        remaining = budget - used
+        text = ' '.join(sentences)
+        tokens = counter.count(text)
+
+        if tokens > remaining:
+            # Keep whole leading sentences that still fit
+            kept = []
+            kept_tokens = 0
+            for sentence in sentences:
+                sentence_tokens = counter.count(sentence)
+                if kept_tokens + sentence_tokens > remaining:
+                    break
+                kept.append(sentence)
+                kept_tokens += sentence_tokens
+            if kept_tokens < MIN_EXCERPT_TOKENS:
+                if fitted:
+                    dropped += 1
+                    continue
+                # Never send an empty prompt: cut the top excerpt word by word
+                kept = [_truncate_words(text, remaining, counter)]
+            text = ' '.join(kept)
+            tokens = counter.count(text)
+            keys = keys[:len(kept)]
+            trimmed += 1
+
+        fitted.append(text)
+        seen.update(keys)
+        used += tokens
+
+    if not fitted and chunks and chunks[0].strip():
+        # Everything was boilerplate or repeated: the top excerpt as it is
+        # still beats an empty prompt
+        text = _truncate_words(chunks[0], budget, counter)
+        if text:
+            fitted.append(text)
+            used = counter.count(text)
+            dropped -= 1
+            if text != ' '.join(chunks[0].split()):
+                trimmed += 1
+
+    return {
+        "chunks": fitted,
+        "report": {
+            "tokenizer": counter.name,
+            "budget": budget,
+            "excerpt_tokens_before": tokens_before,
+            "excerpt_tokens_after": used,
+            "excerpts_in": len(chunks),
+            "excerpts_used": len(fitted),
+            "excerpts_trimmed": trimmed,
+            "excerpts_dropped": dropped
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit excerpts into a prompt token budget")
+    parser.add_argument('chunks', nargs='+', help='Excerpts, highest ranked first')
+    parser.add_argument('--budget', type=int, default=2000, help='Token budget for excerpts (default: 2000)')
+    args = parser.parse_args()
+
+    result = fit_excerpts(args.chunks, args.budget)
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -7,14 +7,21 @@ generating overlapping chunks with detailed metadata for chatbot training.
 
 Usage:
     python sliding_chunker.py --input textbook.txt --output chunks.json --window_size 3
+    python chunk_text.py --input textbook.txt --profile
 """
 
 import argparse
 import json
 import os
 import re
+import sys
+from bisect import bisect_right
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
+
+# Profiling helpers are shared with the scripts in ../embeddings
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "embeddings"))
+from profiling import add_profile_arguments, start_profile  # noqa: E402
 
 try:
     import nltk
@@ -33,6 +40,34 @@ def ensure_nltk_data():
         nltk.download('punkt', quiet=True)
 
 
+# [[page:N]], [[chapter:N]] and [[section:N.N Title]] markers written by
+# text_extraction.py on their own lines
+MARKER_PATTERN = re.compile(r'\[\[(page|chapter|section):([^\[\]\n]+)\]\]\n?')
+
+
+def strip_markers(text: str) -> Tuple[str, List[Tuple[int, str, str]]]:
+    """
+    Remove page and heading markers from text.
+    
+    Returns:
+        The text without markers and (offset, kind, value) for each marker,
+        where offset is the marker's position in the returned text
+    """
+    markers = []
+    parts = []
+    removed = 0
+    position = 0
+    
+    for match in MARKER_PATTERN.finditer(text):
+        parts.append(text[position:match.start()])
+        removed += match.end() - match.start()
+        markers.append((match.end() - removed, match.group(1), match.group(2).strip()))
+        position = match.end()
+    parts.append(text[position:])
+    
+    return ''.join(parts), markers
+
+
 def clean_sentence(sentence: str) -> str:
     """Clean and normalize a sentence."""
     # Remove extra whitespace and normalize
@@ -84,11 +119,85 @@ def tokenize_sentences(text: str) -> List[str]:
     return cleaned_sentences
 
 
+def tokenize_sentences_with_locations(
+    text: str,
+    markers: Optional[List[Tuple[int, str, str]]] = None
+) -> Tuple[List[str], List[Dict[str, Any]]]:
+    """
+    Tokenize text into sentences and locate each one in the book.
+    
+    Sentences are identical to tokenize_sentences(); each also gets the page
+    range it spans and the chapter and section in effect where it starts,
+    as far as the markers tell.
+    
+    Args:
+        text: Text with markers already removed
+        markers: (offset, kind, value) from strip_markers()
+    
+    Returns:
+        Sentences and a location dict per sentence
+    """
+    print("Tokenizing text into sentences...")
+    
+    markers = markers or []
+    pages = [(offset, int(value)) for offset, kind, value in markers if kind == 'page']
+    page_offsets = [offset for offset, _ in pages]
+    
+    # A section heading also sets the chapter from its leading number
+    headings = []
+    for offset, kind, value in markers:
+        if kind == 'chapter':
+            headings.append((offset, value, None))
+        elif kind == 'section':
+            headings.append((offset, value.split('.')[0], value))
+    heading_offsets = [offset for offset, _, _ in headings]
+    
+    def page_at(offset: int) -> Optional[int]:
+        position = bisect_right(page_offsets, offset) - 1
+        return pages[position][1] if position >= 0 else None
+    
+    cleaned_sentences = []
+    locations = []
+    search_from = 0
+    
+    for sentence in sent_tokenize(text):
+        start = text.find(sentence, search_from)
+        if start == -1:
+            start = search_from
+        else:
+            search_from = start + len(sentence)
+        
+        cleaned = clean_sentence(sentence)
+        # Skip empty sentences or sentences that are too short
+        if not cleaned or len(cleaned.strip()) <= 10:
+            continue
+        
+        location = {}
+        page_start = page_at(start)
+        if page_start is not None:
+            location['page_start'] = page_start
+            location['page_end'] = page_at(start + max(0, len(sentence) - 1))
+        
+        position = bisect_right(heading_offsets, start) - 1
+        if position >= 0:
+            _, chapter, section = headings[position]
+            location['chapter'] = chapter
+            if section:
+                location['section'] = section
+        
+        cleaned_sentences.append(cleaned)
+        locations.append(location)
+    
+    print(f"Found {len(cleaned_sentences)} valid sentences")
+    return cleaned_sentences, locations
+
+
 def create_sliding_window_chunks(
     sentences: List[str], 
     window_size: int, 
     step_size: int = 1,
-    source_file: str = ""
+    source_file: str = "",
+    locations: Optional[List[Dict[str, Any]]] = None
 ) -> List[Dict[str, Any]]:
     """
     Create sliding window chunks from sentences.
@@ -98,6 +207,8 @@ def create_sliding_window_chunks(
         window_size: Number of sentences per chunk
         step_size: Step size for sliding window (default: 1)
         source_file: Name of source file
+        locations: Per-sentence page/chapter/section from
+            tokenize_sentences_with_locations() (optional)
     
     Returns:
         List of chunk dictionaries with metadata
@@ -138,6 +249,7 @@ def create_sliding_window_chunks(
             "text": chunk_text,
             "start_sentence_idx": i,
             "end_sentence_idx": i + window_size - 1,
+            "sentence_offsets": sentence_offsets(window_sentences),
             "sentence_count": window_size,
             "word_count": word_count,
             "char_count": char_count,
@@ -145,6 +257,9 @@ def create_sliding_window_chunks(
             "method": "sliding_window"
         }
         
+        if locations:
+            chunk.update(window_location(locations[i:i + window_size]))
+        
         chunks.append(chunk)
         chunk_index += 1
     
@@ -152,6 +267,29 @@ def create_sliding_window_chunks(
     return chunks
 
 
+def sentence_offsets(window_sentences: List[str]) -> List[int]:
+    """Start of each sentence in ' '.join(window_sentences)."""
+    offsets = []
+    position = 0
+    for sentence in window_sentences:
+        offsets.append(position)
+        position += len(sentence) + 1
+    return offsets
+
+
+def window_location(locations: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Page range of a window, plus the chapter and section where it starts."""
+    result = {}
+    pages = [loc[key] for loc in locations for key in ('page_start', 'page_end') if key in loc]
+    if pages:
+        result['page_start'] = min(pages)
+        result['page_end'] = max(pages)
+    for key in ('chapter', 'section'):
+        if key in locations[0]:
+            result[key] = locations[0][key]
+    return result
+
+
 def save_chunks_json(chunks: List[Dict[str, Any]], output_path: str):
     """Save chunks to JSON file with proper formatting."""
     print(f"Saving {len(chunks)} chunks to {output_path}...")
@@ -230,6 +368,8 @@ Examples:
         help='Step size for sliding window (default: 1)'
     )
     
+    add_profile_arguments(parser)
+    
     args = parser.parse_args()
     
     # Validate arguments
@@ -242,13 +382,16 @@ Examples:
     # Ensure NLTK data is available
     ensure_nltk_data()
     
+    profile = start_profile(args, __file__)
+    
     try:
         # Load input file
         print(f"Processing: {args.input}")
         text_content = load_text_file(args.input)
+        text_content, markers = strip_markers(text_content)
         
-        # Tokenize into sentences
-        sentences = tokenize_sentences(text_content)
+        # Tokenize into sentences, noting page and chapter/section of each
+        sentences, locations = tokenize_sentences_with_locations(text_content, markers)
         
         if not sentences:
             print("Error: No valid sentences found in the input file")
@@ -260,7 +403,8 @@ Examples:
             sentences=sentences,
             window_size=args.window_size,
             step_size=args.step_size,
-            source_file=source_filename
+            source_file=source_filename,
+            locations=locations
         )
         
         if not chunks:
@@ -281,6 +425,9 @@ Examples:
     except Exception as e:
         print(f"❌ Error: {str(e)}")
         return 1
+    
+    finally:
+        profile.stop()
 
 
 if __name__ == "__main__":
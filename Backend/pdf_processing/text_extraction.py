@@ -2,12 +2,87 @@ import PyPDF2
 import fitz  # PyMuPDF - better for complex PDFs
 import re
 import os
+import sys
 from pathlib import Path
 import argparse
 
+# Profiling helpers are shared with the scripts in ../embeddings
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "embeddings"))
+from profiling import add_profile_arguments, start_profile
+
+# Markers written on their own line at the start of every page and before
+# chapter/section headings, so the chunker can record where chunks come from
+MARKER = "[[{}:{}]]"
+MARKER_PATTERN = re.compile(r'\[\[(page|chapter|section):([^\[\]\n]+)\]\]')
+
+CHAPTER_LINE = re.compile(r'^(?:chapter|unit)\s+(\d+|[IVXLC]+)\b', re.IGNORECASE)
+SECTION_NUMBER_LINE = re.compile(r'^[1-9]\d?(?:\.[1-9]\d?){1,3}$')
+SECTION_LINE = re.compile(r'^([1-9]\d?(?:\.[1-9]\d?){1,3})\s+(.+)$')
+PAGE_REFERENCE = re.compile(r'^\d+(?:\s*[–-]\s*\d+)?$')
+MAX_HEADING_WORDS = 12
+# Words that stay lowercase in title-case headings
+TITLE_SMALL_WORDS = {'a', 'an', 'and', 'as', 'at', 'by', 'for', 'from', 'in', 'into',
+                     'of', 'on', 'or', 'the', 'to', 'versus', 'vs', 'with', 'without'}
+
 class PDFTextExtractor:
-    def __init__(self):
+    def __init__(self, markers=True):
         self.extracted_text = ""
+        self.markers = markers
+    
+    def _page_text(self, page_num, text):
+        """Page text, with page and heading markers if enabled"""
+        if not self.markers:
+            return text
+        return MARKER.format('page', page_num + 1) + "\n" + self.mark_headings(text)
+    
+    def _is_heading_title(self, text, following=""):
+        # Contents entries end with, or are followed by, a page number
+        if not text or PAGE_REFERENCE.match(text.split()[-1]) or PAGE_REFERENCE.match(following):
+            return False
+        words = re.findall(r'[A-Za-z][A-Za-z\'-]*', text)
+        title_case = all(w[0].isupper() or w.lower() in TITLE_SMALL_WORDS for w in words)
+        return (text[0].isupper() and not text.endswith('.') and title_case
+                and len(text.split()) <= MAX_HEADING_WORDS and re.search(r'[A-Za-z]{2}', text) is not None)
+    
+    def _following(self, lines, start):
+        """First line from start that is not a lowercase continuation of a title"""
+        for line in lines[start:]:
+            line = line.strip()
+            if line and not line[0].islower():
+                return line
+        return ""
+    
+    def mark_headings(self, text):
+        """Insert chapter/section markers before heading lines of one page"""
+        lines = text.split('\n')
+        marked = []
+        
+        for i, line in enumerate(lines):
+            stripped = line.strip()
+            next_line = lines[i + 1].strip() if i + 1 < len(lines) else ""
+            chapter_match = CHAPTER_LINE.match(stripped)
+            section_match = SECTION_LINE.match(stripped)
+            
+            heading = None
+            if chapter_match and len(stripped.split()) <= MAX_HEADING_WORDS:
+                heading = ('chapter', chapter_match.group(1).upper())
+            elif SECTION_NUMBER_LINE.match(stripped) and self._is_heading_title(next_line, self._following(lines, i + 2)):
+                # Number and title on separate lines: "1.6" / "PROFIT/VOLUME RATIO"
+                heading = ('section', f"{stripped} {next_line}")
+            elif section_match and self._is_heading_title(section_match.group(2), self._following(lines, i + 1)):
+                heading = ('section', stripped)
+            
+            if heading:
+                kind, value = heading
+                number, _, title = value.partition(' ')
+                if kind == 'section' and title.isupper():
+                    words = title.title().split(' ')
+                    title = ' '.join([words[0]] + [w.lower() if w.lower() in TITLE_SMALL_WORDS else w for w in words[1:]])
+                    value = f"{number} {title}"
+                marked.append(MARKER.format(kind, re.sub(r'[\[\]]', '', value)))
+            marked.append(line)
+        
+        return '\n'.join(marked)
     
     def extract_with_pypdf2(self, pdf_path):
         """Extract text using PyPDF2 - good for simple PDFs"""
@@ -18,7 +93,7 @@ class PDFTextExtractor:
                 
                 for page_num in range(len(pdf_reader.pages)):
                     page = pdf_reader.pages[page_num]
-                    text += page.extract_text() + "\n"
+                    text += self._page_text(page_num, page.extract_text()) + "\n"
                 
                 return text
         except Exception as e:
@@ -33,7 +108,7 @@ class PDFTextExtractor:
             
             for page_num in range(len(doc)):
                 page = doc.load_page(page_num)
-                text += page.get_text() + "\n"
+                text += self._page_text(page_num, page.get_text()) + "\n"
             
             doc.close()
             return text
@@ -65,6 +140,11 @@ class PDFTextExtractor:
             if not line:
                 continue
             
+            # Keep page/heading markers for the chunker
+            if MARKER_PATTERN.fullmatch(line):
+                cleaned_lines.append(line)
+                continue
+            
             # Skip lines that are likely headers/footers (very short, all caps, etc.)
             words = line.split()
             if len(words) <= 3 and (line.isupper() or any(char.isdigit() for char in line)):
@@ -126,7 +206,7 @@ class PDFTextExtractor:
         
         for line in lines:
             line = line.strip()
-            if not line:
+            if not line or MARKER_PATTERN.fullmatch(line):
                 unique_lines.append(line)
                 continue
             
@@ -206,6 +286,9 @@ def main():
     parser.add_argument('-o', '--output', help='Output text file path')
     parser.add_argument('-m', '--method', choices=['pypdf2', 'pymupdf', 'both'], 
                        default='both', help='Extraction method to use')
+    parser.add_argument('--no_markers', action='store_true',
+                       help='Do not write [[page:N]]/[[section:...]] markers (chunks then carry no page or heading info)')
+    add_profile_arguments(parser)
     
     args = parser.parse_args()
     
@@ -215,7 +298,8 @@ def main():
         args.output = f"{pdf_name}_cleaned.txt"
     
     # Extract and clean text
-    extractor = PDFTextExtractor()
+    extractor = PDFTextExtractor(markers=not args.no_markers)
+    profile = start_profile(args, __file__)
     try:
         cleaned_text = extractor.extract_and_clean(args.pdf_path, args.output, args.method)
         
@@ -233,6 +317,8 @@ def main():
         
     except Exception as e:
         print(f" Error processing PDF: {e}")
+    finally:
+        profile.stop()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,6 +1,7 @@
 const express = require('express');
 const cors = require('cors');
 const { spawn } = require('child_process');
+const net = require('net');
 const path = require('path');
 const fs = require('fs');
 
@@ -52,6 +53,185 @@ app.use((req, res, next) => {
 // Cache for Python command that works
 let workingPythonCommand = null;
 
+// Optional resident search service (embeddings/search_service.py)
+const SEARCH_SERVICE_HOST = process.env.SEARCH_SERVICE_HOST || '127.0.0.1';
+const SEARCH_SERVICE_PORT = process.env.SEARCH_SERVICE_PORT ? parseInt(process.env.SEARCH_SERVICE_PORT, 10) : null;
+
+/**
+ * Send one JSON-lines request to the resident search service
+ */
+function callSearchService(payload, timeoutMs = 30000) {
+    return new Promise((resolve, reject) => {
+        const socket = net.createConnection({ host: SEARCH_SERVICE_HOST, port: SEARCH_SERVICE_PORT });
+        let buffer = '';
+        let settled = false;
+
+        const settle = (fn, value) => {
+            if (settled) return;
+            settled = true;
+            socket.destroy();
+            fn(value);
+        };
+
+        socket.setTimeout(timeoutMs, () => settle(reject, new Error('Search service timeout')));
+        // The service drops the request rather than answer after we gave up
+        socket.on('connect', () => socket.write(JSON.stringify({ ...payload, deadline_ms: timeoutMs }) + '\n'));
+        socket.on('data', (data) => {
+            buffer += data.toString();
+            const newline = buffer.indexOf('\n');
+            if (newline === -1) return;
+            try {
+                settle(resolve, JSON.parse(buffer.slice(0, newline)));
+            } catch (parseError) {
+                settle(reject, parseError);
+            }
+        });
+        socket.on('error', (error) => settle(reject, error));
+        socket.on('close', () => settle(reject, new Error('Search service closed the connection')));
+    });
+}
+
+// Metadata filters accepted by search_faiss.py (--chapter, --page_min, ...)
+const SEARCH_FILTER_KEYS = ['chapter', 'section', 'source_file', 'page_min', 'page_max'];
+
+/**
+ * Validate the optional `filters` request field; returns an error message or null
+ */
+function validateSearchFilters(filters) {
+    if (filters === undefined || filters === null) {
+        return null;
+    }
+    if (typeof filters !== 'object' || Array.isArray(filters)) {
+        return 'filters must be an object';
+    }
+    for (const [key, value] of Object.entries(filters)) {
+        if (!SEARCH_FILTER_KEYS.includes(key)) {
+            return `Unknown filter "${key}" (expected one of ${SEARCH_FILTER_KEYS.join(', ')})`;
+        }
+        if (key.startsWith('page_') && value !== null && !Number.isInteger(value)) {
+            return `${key} must be an integer`;
+        }
+    }
+    return null;
+}
+
+/**
+ * search_faiss.py arguments for the given filters
+ */
+function searchFilterArgs(filters) {
+    const args = [];
+    for (const [key, value] of Object.entries(filters || {})) {
+        if (value !== null && value !== undefined && value !== '') {
+            args.push(`--${key}`, String(value));
+        }
+    }
+    return args;
+}
+
+// Requests with the same normalized (textbook, query, top_k, filters) that
+// arrive while one of them is being computed share its search and LLM
+// answer instead of repeating them (singleflight). Nothing is kept once the
+// computation finishes.
+const inflightWork = new Map();
+const coalescingStats = {};
+
+/**
+ * Lowercase, collapse whitespace and drop trailing punctuation, like the
+ * answer cache does (answer_cache.normalize_query)
+ */
+function normalizeQuery(query) {
+    return query.trim().toLowerCase().replace(/\s+/g, ' ').replace(/[ ?.!]+$/, '');
+}
+
+/**
+ * Key under which identical requests are coalesced
+ */
+function coalescingKey(textbook, query, topK, filters, ...extra) {
+    const activeFilters = Object.keys(filters || {})
+        .filter((key) => filters[key] !== null && filters[key] !== undefined && filters[key] !== '')
+        .sort()
+        .map((key) => [key, String(filters[key])]);
+    return JSON.stringify([textbook, normalizeQuery(query), topK, activeFilters, ...extra]);
+}
+
+/**
+ * Run compute() unless an identical request is already running it.
+ * Resolves to { value, shared }; shared is true for callers that joined
+ * another request's computation. value is the same object for all callers.
+ */
+function singleflight(kind, key, compute) {
+    const stats = coalescingStats[kind] || (coalescingStats[kind] = { executed: 0, coalesced: 0 });
+    const flightKey = `${kind}\n${key}`;
+    let flight = inflightWork.get(flightKey);
+    const shared = flight !== undefined;
+
+    if (shared) {
+        stats.coalesced += 1;
+    } else {
+        stats.executed += 1;
+        flight = Promise.resolve().then(compute).finally(() => inflightWork.delete(flightKey));
+        inflightWork.set(flightKey, flight);
+    }
+    return flight.then((value) => ({ value, shared }));
+}
+
+/**
+ * Error for a search the service refused under load (admission control);
+ * retrying through a spawned script would only add to the load
+ */
+class SearchOverloadedError extends Error {
+    constructor(response) {
+        super(response.error);
+        this.shed = response.shed;
+        this.retryAfterMs = response.retry_after_ms;
+    }
+}
+
+/**
+ * Reply 503 with a Retry-After hint for a search the service shed
+ */
+function sendOverloaded(res, error) {
+    res.setHeader('Retry-After', String(Math.max(1, Math.ceil((error.retryAfterMs || 1000) / 1000))));
+    return res.status(503).json({
+        error: 'Search Service Overloaded',
+        message: error.message,
+        shed: error.shed,
+        retry_after_ms: error.retryAfterMs
+    });
+}
+
+/**
+ * Search through the resident service if configured; null means fall back
+ * to spawning search_faiss.py
+ */
+async function searchViaService(textbook, query, topK, timings = false, filters = null) {
+    if (!SEARCH_SERVICE_PORT) {
+        return null;
+    }
+
+    try {
+        const { value: result, shared } = await singleflight(
+            'search',
+            coalescingKey(textbook, query, topK, filters, Boolean(timings)),
+            () => callSearchService({ op: 'search', textbook, query, top_k: topK, timings, filters })
+        );
+        if (result.shed) {
+            throw new SearchOverloadedError(result);
+        }
+        if (result.error) {
+            throw new Error(result.error);
+        }
+        // Callers add their own fields to the result, so each gets a copy
+        return shared ? { ...structuredClone(result), coalesced: true } : structuredClone(result);
+    } catch (error) {
+        if (error instanceof SearchOverloadedError) {
+            throw error;
+        }
+        console.log(`[WARNING] Search service unavailable, falling back to script: ${error.message}`);
+        return null;
+    }
+}
+
 /**
  * Find and validate the Python script path
  */
@@ -101,6 +281,24 @@ function validateFaissFiles(scriptDir, textbook = DEFAULT_TEXTBOOK) {
     return { valid: true, missingFiles: [] };
 }
 
+/**
+ * Run textbook_catalog.py next to the search script and parse its JSON output.
+ * The catalog only scans file names and configs, so this takes milliseconds.
+ */
+function runCatalog(pythonCommand, scriptDir, args, timeoutMs = 5000) {
+    return new Promise((resolve) => {
+        const catalogProcess = spawn(pythonCommand, [path.join(scriptDir, 'textbook_catalog.py'), ...args], {
+            cwd: scriptDir,
+            timeout: timeoutMs
+        });
+
+        let stdout = '';
+        catalogProcess.stdout.on('data', (data) => { stdout += data.toString(); });
+        catalogProcess.on('close', () => resolve(extractJsonFromOutput(stdout)));
+        catalogProcess.on('error', () => resolve(null));
+    });
+}
+
 /**
  * Test Python command and cache the working one
  */
@@ -208,7 +406,9 @@ app.post('/search', async (req, res) => {
     };
     
     try {
-        const { query, top_k, textbook } = req.body; // Extract textbook from request body
+        const { query, top_k, textbook, timings, filters } = req.body; // Extract textbook from request body
+        // Per-stage search timings in the response, on request or for every search
+        const includeTimings = Boolean(timings) || process.env.SEARCH_TIMINGS === '1';
         
         // Input validation
         if (!query || typeof query !== 'string' || query.trim().length === 0) {
@@ -250,6 +450,25 @@ app.post('/search', async (req, res) => {
             });
         }
 
+        const filterError = validateSearchFilters(filters);
+        if (filterError) {
+            return res.status(400).json({
+                error: 'Bad Request',
+                message: filterError,
+                example: { query: "What is break-even analysis?", textbook: "economics", filters: { chapter: "1", page_max: 20 } }
+            });
+        }
+
+        const serviceResult = await searchViaService(selectedTextbook, query.trim(), topK, includeTimings, filters);
+        if (serviceResult) {
+            serviceResult.textbook = selectedTextbook;
+            serviceResult.textbook_display_name = getDisplayName(selectedTextbook);
+            serviceResult.query = query.trim();
+
+            console.log(`[${new Date().toISOString()}] Search completed via service in ${Date.now() - startTime}ms`);
+            return res.status(200).json(serviceResult);
+        }
+
         const scriptPath = path.join(__dirname, 'embeddings', 'search_faiss.py');
         
         // Use the selectedTextbook variable instead of hardcoded value
@@ -257,62 +476,72 @@ app.post('/search', async (req, res) => {
             '--textbook', selectedTextbook, // Use the dynamic textbook value
             '--query', query.trim(),
             '--top_k', topK.toString(),
-            '--json'
+            '--json',
+            ...searchFilterArgs(filters)
         ];
+        if (includeTimings) {
+            args.push('--timings');
+        }
 
         console.log(`[DEBUG] Executing: python ${scriptPath} ${args.join(' ')}`);
         console.log(`[DEBUG] Working directory: ${path.dirname(scriptPath)}`);
 
-        const pythonProcess = spawn('python', [scriptPath, ...args], {
-            cwd: path.dirname(scriptPath),
-            env: {
-                ...process.env,
-                PYTHONUNBUFFERED: '1',
-                PYTHONIOENCODING: 'utf-8'
-            },
-            timeout: 30000
-        });
+        // Identical searches running concurrently share one script run; each
+        // parses its own copy of the output
+        const { value: result } = await singleflight(
+            'search_script',
+            coalescingKey(selectedTextbook, query, topK, filters, includeTimings),
+            () => new Promise((resolve, reject) => {
+                const pythonProcess = spawn('python', [scriptPath, ...args], {
+                    cwd: path.dirname(scriptPath),
+                    env: {
+                        ...process.env,
+                        PYTHONUNBUFFERED: '1',
+                        PYTHONIOENCODING: 'utf-8'
+                    },
+                    timeout: 30000
+                });
 
-        let stdout = '';
-        let stderr = '';
+                let stdout = '';
+                let stderr = '';
 
-        pythonProcess.stdout.on('data', (data) => {
-            stdout += data.toString();
-        });
+                pythonProcess.stdout.on('data', (data) => {
+                    stdout += data.toString();
+                });
 
-        pythonProcess.stderr.on('data', (data) => {
-            stderr += data.toString();
-        });
+                pythonProcess.stderr.on('data', (data) => {
+                    stderr += data.toString();
+                });
 
-        const result = await new Promise((resolve, reject) => {
-            pythonProcess.on('close', (code) => {
-                const duration = Date.now() - startTime;
-                if (code === 0) {
-                    resolve({ 
-                        success: true, 
-                        output: stdout, 
-                        stderr: stderr,
-                        duration 
-                    });
-                } else {
+                pythonProcess.on('close', (code) => {
+                    const duration = Date.now() - startTime;
+                    if (code === 0) {
+                        resolve({ 
+                            success: true, 
+                            output: stdout, 
+                            stderr: stderr,
+                            duration 
+                        });
+                    } else {
+                        reject({ 
+                            success: false, 
+                            code, 
+                            stderr: stderr.trim(), 
+                            stdout: stdout.trim(),
+                            duration 
+                        });
+                    }
+                });
+
+                pythonProcess.on('error', (error) => {
                     reject({ 
                         success: false, 
-                        code, 
-                        stderr: stderr.trim(), 
-                        stdout: stdout.trim(),
-                        duration 
+                        error: error.message,
+                        duration: Date.now() - startTime 
                     });
-                }
-            });
-
-            pythonProcess.on('error', (error) => {
-                reject({ 
-                    success: false, 
-                    error: error.message,
-                    duration: Date.now() - startTime 
                 });
-            });
-        });
+            })
+        );
 
         console.log(`[${new Date().toISOString()}] Search completed successfully in ${result.duration}ms`);
         
@@ -323,6 +552,10 @@ app.post('/search', async (req, res) => {
             jsonResult.textbook = selectedTextbook;
             jsonResult.textbook_display_name = getDisplayName(selectedTextbook);
             jsonResult.query = query.trim();
+            if (jsonResult.timings) {
+                // Wall time of the spawned script, including interpreter start-up
+                jsonResult.timings.process = result.duration;
+            }
             
             console.log(`[DEBUG] Successfully parsed JSON with ${jsonResult.total_results || jsonResult.results?.length || 0} results from ${selectedTextbook}`);
             res.status(200).json(jsonResult);
@@ -345,6 +578,10 @@ app.post('/search', async (req, res) => {
         const duration = Date.now() - startTime;
         console.error(`[${new Date().toISOString()}] Search failed after ${duration}ms:`, error);
 
+        if (error instanceof SearchOverloadedError) {
+            return sendOverloaded(res, error);
+        }
+
         res.status(500).json({
             error: 'Search Failed',
             message: error.message || 'An unexpected error occurred during search',
@@ -460,15 +697,29 @@ app.get('/search/validate', async (req, res) => {
         validation.script_found = !!validation.script_path;
 
         if (validation.script_found) {
-            // Check FAISS files
-            const scriptDir = path.dirname(validation.script_path);
-            const faissCheck = validateFaissFiles(scriptDir);
-            validation.faiss_files = faissCheck;
-
             // Check Python
             validation.python_command = await findWorkingPythonCommand();
             validation.python_available = !!validation.python_command;
 
+            // Check FAISS files with the catalog (metadata scan, no model load)
+            const scriptDir = path.dirname(validation.script_path);
+            if (validation.python_available) {
+                const catalog = await runCatalog(
+                    validation.python_command,
+                    scriptDir,
+                    ['--validate', '--json', '--textbook', ...Object.keys(TEXTBOOK_CONFIG)]
+                );
+                validation.textbooks = catalog ? catalog.textbooks : null;
+                validation.faiss_files = catalog ? {
+                    valid: catalog.valid,
+                    missing: catalog.textbooks.flatMap(tb => tb.missing),
+                    errors: catalog.textbooks.flatMap(tb => tb.errors),
+                    warnings: catalog.textbooks.flatMap(tb => tb.warnings || [])
+                } : validateFaissFiles(path.join(scriptDir, 'indices'));
+            } else {
+                validation.faiss_files = validateFaissFiles(path.join(scriptDir, 'indices'));
+            }
+
             // Overall status
             if (validation.script_found && validation.faiss_files.valid && validation.python_available) {
                 validation.overall_status = 'healthy';
@@ -588,6 +839,143 @@ app.get('/search/debug', async (req, res) => {
     }
 });
 
+/**
+ * GET /search/related - Passages related to a search result
+ *
+ * Looks up the neighbors embedding_indexer.py precomputed for the chunk
+ * (related_chunks.py), so no query is encoded or searched:
+ *   /search/related?textbook=economics&chunk_id=chunk_0042&top_k=5
+ */
+app.get('/search/related', async (req, res) => {
+    const startTime = Date.now();
+    const { textbook, chunk_id: chunkId } = req.query;
+    const topK = parseInt(req.query.top_k, 10) > 0 ? parseInt(req.query.top_k, 10) : 5;
+
+    if (!textbook || !chunkId) {
+        return res.status(400).json({
+            error: 'Bad Request',
+            message: 'textbook and chunk_id are required',
+            example: '/search/related?textbook=economics&chunk_id=chunk_0042&top_k=5'
+        });
+    }
+
+    try {
+        let result = null;
+        if (SEARCH_SERVICE_PORT) {
+            try {
+                result = await callSearchService({ op: 'related', textbook, chunk_id: chunkId, top_k: topK }, 5000);
+            } catch (error) {
+                console.log(`[WARNING] Search service unavailable, falling back to script: ${error.message}`);
+            }
+        }
+
+        if (!result) {
+            const scriptPath = path.join(__dirname, 'embeddings', 'search_faiss.py');
+            const output = await new Promise((resolve, reject) => {
+                const pythonProcess = spawn('python', [
+                    scriptPath, '--textbook', textbook, '--related', chunkId, '--top_k', topK.toString(), '--json'
+                ], {
+                    cwd: path.dirname(scriptPath),
+                    env: { ...process.env, PYTHONUNBUFFERED: '1', PYTHONIOENCODING: 'utf-8' },
+                    timeout: 30000
+                });
+                let stdout = '';
+                pythonProcess.stdout.on('data', (data) => {
+                    stdout += data.toString();
+                });
+                // Errors are reported as JSON on stdout with a non-zero exit code
+                pythonProcess.on('close', () => resolve(stdout));
+                pythonProcess.on('error', reject);
+            });
+            result = extractJsonFromOutput(output);
+            if (!result) {
+                throw new Error('The search script did not return valid JSON');
+            }
+        }
+
+        if (result.error) {
+            return res.status(404).json({ error: 'Related Passages Unavailable', message: result.error, textbook, chunk_id: chunkId });
+        }
+        delete result.id;
+        result.duration_ms = Date.now() - startTime;
+        return res.status(200).json(result);
+    } catch (error) {
+        console.error(`[${new Date().toISOString()}] Related lookup failed:`, error);
+        return res.status(500).json({
+            error: 'Related Lookup Failed',
+            message: error.message || 'An unexpected error occurred',
+            textbook,
+            chunk_id: chunkId
+        });
+    }
+});
+
+/**
+ * GET /search/suggest - Autocomplete for the question box
+ *
+ * Completes the last words typed from the book's frequent phrases and
+ * section headings (query_suggestions.py). Answered by the search service
+ * only: spawning the search script per keystroke would be far too slow.
+ *   /search/suggest?textbook=economics&q=what%20is%20opportunity%20c&limit=5
+ */
+app.get('/search/suggest', async (req, res) => {
+    const startTime = Date.now();
+    const { textbook, q: text } = req.query;
+    const limit = parseInt(req.query.limit, 10) > 0 ? parseInt(req.query.limit, 10) : 8;
+
+    if (!textbook || text === undefined) {
+        return res.status(400).json({
+            error: 'Bad Request',
+            message: 'textbook and q are required',
+            example: '/search/suggest?textbook=economics&q=what%20is%20opportunity%20c&limit=5'
+        });
+    }
+    if (!SEARCH_SERVICE_PORT) {
+        return res.status(503).json({
+            error: 'Suggestions Unavailable',
+            message: 'Suggestions require the search service (set SEARCH_SERVICE_PORT)'
+        });
+    }
+
+    try {
+        const result = await callSearchService({ op: 'suggest', textbook, text, limit }, 1000);
+        if (result.error) {
+            return res.status(404).json({ error: 'Suggestions Unavailable', message: result.error, textbook });
+        }
+        delete result.id;
+        result.duration_ms = Date.now() - startTime;
+        return res.status(200).json(result);
+    } catch (error) {
+        console.error(`[${new Date().toISOString()}] Suggestion lookup failed:`, error);
+        return res.status(503).json({
+            error: 'Suggestions Unavailable',
+            message: error.message || 'The search service did not answer',
+            textbook
+        });
+    }
+});
+
+/**
+ * GET /search/stats - Request coalescing counters
+ *
+ * executed counts computations actually run, coalesced the identical
+ * requests that shared one of them instead of running their own.
+ */
+app.get('/search/stats', (req, res) => {
+    const kinds = {};
+    for (const [kind, stats] of Object.entries(coalescingStats)) {
+        kinds[kind] = {
+            ...stats,
+            saved_ratio: Number((stats.coalesced / Math.max(1, stats.executed + stats.coalesced)).toFixed(4))
+        };
+    }
+    res.status(200).json({
+        coalescing: kinds,
+        in_flight: inflightWork.size + answerStreams.size,
+        timestamp: new Date().toISOString()
+    });
+});
+
 // Error handling middleware
 app.use((err, req, res, next) => {
     console.error(`[${new Date().toISOString()}] Unhandled error:`, err);
@@ -610,7 +998,7 @@ app.post('/search/answer', async (req, res) => {
     const startTime = Date.now();
 
     try {
-        const { query, textbook, top_k } = req.body; // Extract top_k from request body
+        const { query, textbook, top_k, stream, filters } = req.body; // Extract top_k from request body
 
         // Input validation
         if (!query || typeof query !== 'string' || query.trim().length === 0) {
@@ -632,6 +1020,14 @@ app.post('/search/answer', async (req, res) => {
         const selectedTextbook = textbookMapping[textbook?.toLowerCase()] || textbook || 'intro_ml';
         const topK = top_k && Number.isInteger(top_k) && top_k > 0 ? top_k : 3;
 
+        const filterError = validateSearchFilters(filters);
+        if (filterError) {
+            return res.status(400).json({
+                error: 'Bad Request',
+                message: filterError
+            });
+        }
+
         console.log(`[${new Date().toISOString()}] LLM Answer request for ${selectedTextbook}: "${query.substring(0, 50)}..."`);
 
         // Find script path and validate
@@ -659,51 +1055,60 @@ app.post('/search/answer', async (req, res) => {
             '--textbook', selectedTextbook,
             '--query', query.trim(),
             '--top_k', String(topK),
-            '--json'
+            '--json',
+            ...searchFilterArgs(filters)
         ];
 
         console.log(`[DEBUG] Search args: ${pythonCommand} ${searchArgs.join(' ')}`);
 
-        const searchResult = await new Promise((resolve, reject) => {
-            let isResolved = false;
-            const pythonProcess = spawn(pythonCommand, searchArgs, {
-                cwd: path.dirname(scriptPath),
-                env: {
-                    ...process.env,
-                    PYTHONUNBUFFERED: '1',
-                    PYTHONIOENCODING: 'utf-8'
-                },
-                timeout: 45000
-            });
-
-            let stdout = '';
-            let stderr = '';
+        let searchJsonResult = await searchViaService(selectedTextbook, query.trim(), topK, false, filters);
+
+        if (!searchJsonResult) {
+            const { value: searchResult } = await singleflight(
+                'search_script',
+                coalescingKey(selectedTextbook, query, topK, filters, false),
+                () => new Promise((resolve, reject) => {
+                    let isResolved = false;
+                    const pythonProcess = spawn(pythonCommand, searchArgs, {
+                        cwd: path.dirname(scriptPath),
+                        env: {
+                            ...process.env,
+                            PYTHONUNBUFFERED: '1',
+                            PYTHONIOENCODING: 'utf-8'
+                        },
+                        timeout: 45000
+                    });
 
-            pythonProcess.stdout.on('data', (data) => { stdout += data.toString(); });
-            pythonProcess.stderr.on('data', (data) => { stderr += data.toString(); });
+                    let stdout = '';
+                    let stderr = '';
 
-            pythonProcess.on('close', (code) => {
-                if (isResolved) return;
-                isResolved = true;
-                code === 0 ? resolve({ success: true, output: stdout, stderr }) : reject({ success: false, code, stderr: stderr.trim(), stdout: stdout.trim() });
-            });
+                    pythonProcess.stdout.on('data', (data) => { stdout += data.toString(); });
+                    pythonProcess.stderr.on('data', (data) => { stderr += data.toString(); });
 
-            pythonProcess.on('error', (error) => {
-                if (isResolved) return;
-                isResolved = true;
-                reject({ success: false, error: error.message });
-            });
+                    pythonProcess.on('close', (code) => {
+                        if (isResolved) return;
+                        isResolved = true;
+                        code === 0 ? resolve({ success: true, output: stdout, stderr }) : reject({ success: false, code, stderr: stderr.trim(), stdout: stdout.trim() });
+                    });
 
-            setTimeout(() => {
-                if (!isResolved) {
-                    isResolved = true;
-                    pythonProcess.kill('SIGTERM');
-                    reject({ success: false, error: 'Search timeout' });
-                }
-            }, 30000);
-        });
+                    pythonProcess.on('error', (error) => {
+                        if (isResolved) return;
+                        isResolved = true;
+                        reject({ success: false, error: error.message });
+                    });
 
-        const searchJsonResult = extractJsonFromOutput(searchResult.output);
+                    setTimeout(() => {
+                        if (!isResolved) {
+                            isResolved = true;
+                            pythonProcess.kill('SIGTERM');
+                            reject({ success: false, error: 'Search timeout' });
+                        }
+                    }, 30000);
+                })
+            );
+
+            searchJsonResult = extractJsonFromOutput(searchResult.output);
+        }
 
         if (!searchJsonResult || !searchJsonResult.results || searchJsonResult.results.length === 0) {
             return res.status(404).json({
@@ -729,77 +1134,97 @@ app.post('/search/answer', async (req, res) => {
             });
         }
 
-        const llmArgs = [llmScriptPath, query.trim()];
+        // '--' ends the options, so a query starting with '--' is not taken for one
+        const llmArgs = [llmScriptPath, '--textbook', selectedTextbook, '--', query.trim()];
         searchResults.forEach(chunk => {
             llmArgs.push(chunk.content || '');
         });
 
         console.log(`[DEBUG] Calling LLM script with ${searchResults.length} chunks`);
 
-        const llmResult = await new Promise((resolve, reject) => {
-            let isResolved = false;
-            const llmProcess = spawn(pythonCommand, llmArgs, {
-                cwd: __dirname,
-                env: {
-                    ...process.env,
-                    PYTHONUNBUFFERED: '1',
-                    PYTHONIOENCODING: 'utf-8'
-                },
-                timeout: 120000
+        // Identical questions asked while this answer is being generated
+        // share it instead of calling the LLM again
+        const answerKey = coalescingKey(selectedTextbook, query, topK, filters);
+
+        if (stream === true) {
+            return streamLlmAnswer(res, pythonCommand, llmArgs, {
+                key: answerKey,
+                query: query.trim(),
+                textbook: selectedTextbook,
+                searchResults,
+                searchDuration,
+                startTime
             });
+        }
 
-            let stdout = '';
-            let stderr = '';
+        const { value: llmResult, shared: answerShared } = await singleflight(
+            'answer',
+            answerKey,
+            () => new Promise((resolve, reject) => {
+                let isResolved = false;
+                const llmProcess = spawn(pythonCommand, llmArgs, {
+                    cwd: __dirname,
+                    env: {
+                        ...process.env,
+                        PYTHONUNBUFFERED: '1',
+                        PYTHONIOENCODING: 'utf-8'
+                    },
+                    timeout: 120000
+                });
 
-            llmProcess.stdout.on('data', (data) => { stdout += data.toString(); });
-            llmProcess.stderr.on('data', (data) => { stderr += data.toString(); });
+                let stdout = '';
+                let stderr = '';
 
-            llmProcess.on('close', (code) => {
-                if (isResolved) return;
-                isResolved = true;
-                if (code === 0) {
-                    try {
-                        const result = JSON.parse(stdout.trim());
-                        resolve(result);
-                    } catch (parseError) {
+                llmProcess.stdout.on('data', (data) => { stdout += data.toString(); });
+                llmProcess.stderr.on('data', (data) => { stderr += data.toString(); });
+
+                llmProcess.on('close', (code) => {
+                    if (isResolved) return;
+                    isResolved = true;
+                    if (code === 0) {
+                        try {
+                            const result = JSON.parse(stdout.trim());
+                            resolve(result);
+                        } catch (parseError) {
+                            reject({
+                                error: 'LLM Parse Error',
+                                message: 'Failed to parse LLM response',
+                                details: parseError.message,
+                                raw_output: stdout.substring(0, 500)
+                            });
+                        }
+                    } else {
                         reject({
-                            error: 'LLM Parse Error',
-                            message: 'Failed to parse LLM response',
-                            details: parseError.message,
-                            raw_output: stdout.substring(0, 500)
+                            error: 'LLM Processing Failed',
+                            message: `LLM script failed with exit code ${code}`,
+                            stderr: stderr.trim(),
+                            stdout: stdout.trim()
                         });
                     }
-                } else {
-                    reject({
-                        error: 'LLM Processing Failed',
-                        message: `LLM script failed with exit code ${code}`,
-                        stderr: stderr.trim(),
-                        stdout: stdout.trim()
-                    });
-                }
-            });
-
-            llmProcess.on('error', (error) => {
-                if (isResolved) return;
-                isResolved = true;
-                reject({
-                    error: 'LLM Process Error',
-                    message: 'Failed to start LLM process',
-                    details: error.message
                 });
-            });
 
-            setTimeout(() => {
-                if (!isResolved) {
+                llmProcess.on('error', (error) => {
+                    if (isResolved) return;
                     isResolved = true;
-                    llmProcess.kill('SIGTERM');
                     reject({
-                        error: 'LLM Timeout',
-                        message: 'LLM processing timed out after 2 minutes'
+                        error: 'LLM Process Error',
+                        message: 'Failed to start LLM process',
+                        details: error.message
                     });
-                }
-            }, 120000);
-        });
+                });
+
+                setTimeout(() => {
+                    if (!isResolved) {
+                        isResolved = true;
+                        llmProcess.kill('SIGTERM');
+                        reject({
+                            error: 'LLM Timeout',
+                            message: 'LLM processing timed out after 2 minutes'
+                        });
+                    }
+                }, 120000);
+            })
+        );
 
         const llmDuration = Date.now() - llmStartTime;
         const totalDuration = Date.now() - startTime;
@@ -811,6 +1236,9 @@ app.post('/search/answer', async (req, res) => {
             answer: llmResult.answer || llmResult.response || 'No answer generated',
             api_used: llmResult.api_used || 'Unknown',
             model_used: llmResult.model_used || null,
+            cached: llmResult.cached || false,
+            coalesced: answerShared,
+            prompt: llmResult.prompt || null,
             chunks_processed: searchResults.length,
             search_results: searchResults.map((chunk, index) => ({
                 rank: index + 1,
@@ -838,6 +1266,10 @@ app.post('/search/answer', async (req, res) => {
         const duration = Date.now() - startTime;
         console.error(`[${new Date().toISOString()}] LLM Answer failed after ${duration}ms:`, error);
 
+        if (error instanceof SearchOverloadedError) {
+            return sendOverloaded(res, error);
+        }
+
         let statusCode = 500;
         let errorMessage = 'Failed to generate LLM answer';
 
@@ -872,6 +1304,193 @@ app.post('/search/answer', async (req, res) => {
     }
 });
 
+// `llm_answer.py --stream` runs shared by identical concurrent requests
+const answerStreams = new Map();
+
+/**
+ * Start an `llm_answer.py --stream` process, or join the one already
+ * streaming the same answer. Its events are broadcast to every subscriber;
+ * a subscriber that joins late first receives the events it missed. The
+ * process is stopped once no subscriber is left.
+ */
+function joinAnswerStream(key, pythonCommand, llmArgs) {
+    const stats = coalescingStats.answer_stream || (coalescingStats.answer_stream = { executed: 0, coalesced: 0 });
+    const existing = answerStreams.get(key);
+    if (existing) {
+        stats.coalesced += 1;
+        return { stream: existing, shared: true };
+    }
+    stats.executed += 1;
+
+    const stream = { events: [], listeners: new Set(), finished: false };
+    answerStreams.set(key, stream);
+
+    const [llmScriptPath, ...answerArgs] = llmArgs;
+    const llmProcess = spawn(pythonCommand, [llmScriptPath, '--stream', ...answerArgs], {
+        cwd: __dirname,
+        env: {
+            ...process.env,
+            PYTHONUNBUFFERED: '1',
+            PYTHONIOENCODING: 'utf-8'
+        }
+    });
+
+    const close = () => {
+        stream.finished = true;
+        clearTimeout(timer);
+        if (answerStreams.get(key) === stream) {
+            answerStreams.delete(key);
+        }
+    };
+
+    const publish = (event) => {
+        if (stream.finished) return;
+        stream.events.push(event);
+        if (event.type === 'done' || event.type === 'error') {
+            close();
+        }
+        stream.listeners.forEach((listener) => listener(event));
+    };
+
+    const timer = setTimeout(() => {
+        llmProcess.kill('SIGTERM');
+        publish({ type: 'error', error: 'LLM Timeout', message: 'LLM processing timed out after 2 minutes' });
+    }, 120000);
+
+    let buffer = '';
+    llmProcess.stdout.on('data', (data) => {
+        buffer += data.toString();
+        let newline;
+        while ((newline = buffer.indexOf('\n')) !== -1) {
+            const line = buffer.slice(0, newline).trim();
+            buffer = buffer.slice(newline + 1);
+            if (!line) continue;
+
+            let event;
+            try {
+                event = JSON.parse(line);
+            } catch (parseError) {
+                continue;
+            }
+            publish(event.type ? event : { type: 'error', ...event });
+        }
+    });
+
+    llmProcess.on('close', (code) => {
+        publish({
+            type: 'error',
+            error: 'LLM Processing Failed',
+            message: `LLM script exited with code ${code} before finishing`
+        });
+    });
+
+    llmProcess.on('error', (error) => {
+        publish({ type: 'error', error: 'LLM Process Error', message: error.message });
+    });
+
+    stream.subscribe = (listener) => {
+        stream.events.forEach(listener);
+        if (stream.finished) {
+            return () => {};
+        }
+        stream.listeners.add(listener);
+        return () => {
+            stream.listeners.delete(listener);
+            // Stop generating once every client has gone away
+            if (stream.listeners.size === 0 && !stream.finished) {
+                close();
+                llmProcess.kill('SIGTERM');
+            }
+        };
+    };
+
+    return { stream, shared: false };
+}
+
+/**
+ * Stream an LLM answer as newline-delimited JSON.
+ *
+ * The first line carries the search results, then the JSON lines printed by
+ * `llm_answer.py --stream` are forwarded as they arrive (start, delta...,
+ * done or error). The final "done" line is extended with timing information.
+ * Identical questions streamed at the same time share one LLM call (see
+ * joinAnswerStream); their "done" line carries coalesced: true.
+ */
+function streamLlmAnswer(res, pythonCommand, llmArgs, context) {
+    const { key, query, textbook, searchResults, searchDuration, startTime } = context;
+    const llmStartTime = Date.now();
+
+    res.status(200);
+    res.setHeader('Content-Type', 'application/x-ndjson; charset=utf-8');
+    res.setHeader('Cache-Control', 'no-cache');
+    res.setHeader('X-Accel-Buffering', 'no');
+    res.flushHeaders();
+
+    const writeLine = (event) => res.write(JSON.stringify(event) + '\n');
+
+    writeLine({
+        type: 'search',
+        query,
+        textbook,
+        textbook_name: getTextbookDisplayName(textbook),
+        chunks_processed: searchResults.length,
+        search_results: searchResults.map((chunk, index) => ({
+            rank: index + 1,
+            chunk_id: chunk.chunk_id || `chunk_${index + 1}`,
+            score: chunk.score || null,
+            preview: chunk.content ? chunk.content.substring(0, 150) + '...' : 'No content',
+            word_count: chunk.content ? chunk.content.split(' ').length : 0
+        })),
+        timing: { search_duration: searchDuration }
+    });
+
+    const { stream, shared } = joinAnswerStream(key, pythonCommand, llmArgs);
+    let finished = false;
+    let firstDeltaAt = null;
+
+    const finish = (event) => {
+        if (finished) return;
+        finished = true;
+        writeLine(event);
+        res.end();
+    };
+
+    const unsubscribe = stream.subscribe((event) => {
+        if (finished) return;
+
+        if (event.type === 'delta' && firstDeltaAt === null) {
+            firstDeltaAt = Date.now();
+        }
+
+        if (event.type === 'done') {
+            const totalDuration = Date.now() - startTime;
+            console.log(`[${new Date().toISOString()}] LLM Answer streamed in ${totalDuration}ms`);
+            finish({
+                ...event,
+                ...(shared ? { coalesced: true } : {}),
+                timing: {
+                    search_duration: searchDuration,
+                    llm_duration: Date.now() - llmStartTime,
+                    time_to_first_token: firstDeltaAt === null ? null : firstDeltaAt - llmStartTime,
+                    total_duration: totalDuration
+                }
+            });
+        } else if (event.type === 'error') {
+            finish(event);
+        } else {
+            writeLine(event);
+        }
+    });
+
+    // Stop listening if the client goes away
+    res.on('close', () => {
+        if (!finished) {
+            finished = true;
+            unsubscribe();
+        }
+    });
+}
+
 // Helper function for textbook display names
 function getTextbookDisplayName(textbookId) {
     const displayNames = {
@@ -893,6 +1512,7 @@ const server = app.listen(PORT, '0.0.0.0', () => {
     console.log(`🧪 Test endpoint: GET http://localhost:${PORT}/search/test`);
     console.log(`🔍 Validation: GET http://localhost:${PORT}/search/validate`);
     console.log(`🔧 Debug endpoint: GET http://localhost:${PORT}/search/debug`);
+    console.log(`📊 Coalescing stats: GET http://localhost:${PORT}/search/stats`);
     console.log(`🌐 CORS enabled for localhost:3000 and localhost:3001`);
     
     // Run initial validation
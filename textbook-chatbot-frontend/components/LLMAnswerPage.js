@@ -109,19 +109,56 @@ const getCurrentAnswerSuggestions = () => {
         },
         body: JSON.stringify({
           query: searchQuery.trim(),
-          textbook: textbook  // Add textbook parameter
+          textbook: textbook,  // Add textbook parameter
+          stream: true
         }),
       });
 
-      // ... rest of the function remains the same
-
       if (!response.ok) {
         const errorData = await response.json();
         throw new Error(errorData.message || errorData.error || `HTTP ${response.status}: ${response.statusText}`);
       }
 
-      const data = await response.json();
-      setAnswer(data);
+      // The answer arrives as newline-delimited JSON events: search results
+      // first, then answer deltas, then a final "done" event with timings.
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      let streamed = null;
+
+      const handleEvent = (event) => {
+        if (event.type === 'search') {
+          streamed = { ...event, answer: '' };
+        } else if (event.type === 'start') {
+          streamed = { ...streamed, api_used: event.api_used, model_used: event.model_used };
+        } else if (event.type === 'delta') {
+          streamed = { ...streamed, answer: (streamed?.answer || '') + event.content };
+          setLoading(false);
+        } else if (event.type === 'done') {
+          streamed = {
+            ...streamed,
+            answer: event.answer,
+            api_used: event.api_used,
+            model_used: event.model_used,
+            timing: { ...streamed?.timing, ...event.timing }
+          };
+        } else if (event.type === 'error') {
+          throw new Error(event.message || event.error || 'Answer generation failed');
+        }
+        setAnswer(streamed);
+      };
+
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let newline;
+        while ((newline = buffer.indexOf('\n')) !== -1) {
+          const line = buffer.slice(0, newline).trim();
+          buffer = buffer.slice(newline + 1);
+          if (line) handleEvent(JSON.parse(line));
+        }
+      }
 
     } catch (err) {
       console.error('Answer generation error:', err);